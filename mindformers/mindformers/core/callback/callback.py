@@ -114,6 +114,9 @@ class MFLossMonitor(Callback):
         initial_epoch (int): The beginning epoch. Default: 0.
         global_batch_size (int): The total batch size. Default: 0.
         device_num (int): The number of device in use. Default: 0.
+        seq_length (int): The sequence length of the samples, the tokens/s/p are also printed if set. Default: 0.
+        pad_fraction (float): The fraction of the padding in the samples, excluded from the tokens/s/p, measured by
+            CausalLanguageModelDataset with eod_reset. Default: 0.0.
     Examples:
         >>> from mindformers.core.callback import MFLossMonitor
         >>> lr = [0.01, 0.008, 0.006, 0.005, 0.002]
@@ -128,7 +131,9 @@ class MFLossMonitor(Callback):
                  origin_epochs: int = None,
                  dataset_size: int = None,
                  initial_epoch: int = 0,
-                 global_batch_size: int = 0):
+                 global_batch_size: int = 0,
+                 seq_length: int = 0,
+                 pad_fraction: float = 0.0):
         super(MFLossMonitor, self).__init__()
         self.per_print_times = per_print_times
         self.learning_rate = deepcopy(learning_rate)
@@ -145,6 +150,8 @@ class MFLossMonitor(Callback):
         self.initial_epoch = initial_epoch
         self.global_batch_size = global_batch_size
         self.device_num = int(os.getenv('RANK_SIZE', '1'))
+        self.seq_length = seq_length
+        self.pad_fraction = pad_fraction
 
     def epoch_begin(self, run_context):
         """
@@ -330,6 +337,9 @@ class MFLossMonitor(Callback):
             show_str = ('|%%-%ds|' % 50) % (int(50 * percent / 100) * "█")
             logger.info("  %4.1f%% %s %.2f samples/s/p  %s }", percent, show_str, throughput,
                         datetime.timedelta(seconds=int(time_remain)))
+        if self.seq_length:
+            logger.info("  %.1f tokens/s/p, pad fraction: %.2f%%",
+                        throughput * self.seq_length * (1 - self.pad_fraction), self.pad_fraction * 100)
 
     def dump_info_to_modelarts(self, ma_step_num, ma_loss):
         """dump modelarts info to display evaluation result page"""
@@ -15,7 +15,9 @@
 """MindFormers Metric."""
 from .build_metric import build_metric
 from .metric import *
+from .molecule_metric import *
 
 
 __all__ = []
 __all__.extend(metric.__all__)
+__all__.extend(molecule_metric.__all__)
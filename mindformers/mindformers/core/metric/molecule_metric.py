@@ -0,0 +1,325 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Metrics of the text2smiles and smiles2text generation, such as the LPM-24 tasks."""
+import re
+import multiprocessing
+
+import numpy as np
+from rouge_chinese import Rouge
+from nltk.translate.bleu_score import corpus_bleu
+from nltk.translate.meteor_score import meteor_score
+
+import mindspore.nn as nn
+from mindformers.tools.register import MindFormerRegister, MindFormerModuleType
+from mindformers.tools.logger import logger
+
+try:
+    from rdkit import Chem, DataStructs, RDLogger
+    from rdkit.Chem import AllChem, MACCSkeys
+    RDLogger.DisableLog("rdApp.*")
+except ImportError:
+    Chem = None
+
+__all__ = ['SmilesGenerationMetric', 'CaptionGenerationMetric']
+
+# the SMILES tokens: bracket atoms, two letter halogens, atoms, bonds, branches and ring bonds
+SMILES_PATTERN = re.compile(r"(\[[^\]]+]|Br?|Cl?|N|O|S|P|F|I|b|c|n|o|s|p|\(|\)|\.|=|#|-|\+|\\|/|:|~|@|\?|>|\*|\$|"
+                            r"%[0-9]{2}|[0-9])")
+# the {|X|} tokens of the SciMind tokenizer
+WRAPPED_TOKEN_PATTERN = re.compile(r"\{\|(.*?)\|\}")
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def unwrap_smiles(text):
+    """The SMILES of a generated text, without the {|X|} wrappers of the tokens and the spaces."""
+    return "".join(WRAPPED_TOKEN_PATTERN.sub(r"\1", text).split())
+
+
+def tokenize_smiles(smiles):
+    """Split a SMILES into atoms, bonds, branches and ring bonds."""
+    return SMILES_PATTERN.findall(smiles)
+
+
+def is_valid_smiles(smiles):
+    """Whether the SMILES is a molecule, parsed by RDKit if installed, else checked by its tokens, branches and
+    ring bonds."""
+    if Chem is not None:
+        return bool(smiles) and Chem.MolFromSmiles(smiles) is not None
+    tokens = tokenize_smiles(smiles)
+    if not tokens or "".join(tokens) != smiles:
+        return False
+    depth = 0
+    open_rings = set()
+    for token in tokens:
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+            if depth < 0:
+                return False
+        elif token[0] == "%" or token.isdigit():
+            open_rings ^= {token}
+    return depth == 0 and not open_rings
+
+
+def levenshtein(sources, targets, chunk_size=256):
+    """
+    The edit distances of the pairs of sequences, such as strings or token lists.
+
+    The pairs are sorted by length and computed in chunks: the dynamic programming runs over the rows of the source
+    sequences for the whole chunk at once, the insertions along a row are a cumulative minimum.
+
+    Args:
+        sources (list): The source sequences.
+        targets (list): The target sequences.
+        chunk_size (int): The number of pairs computed at once. Default 256.
+
+    Returns:
+        np.ndarray, the distance of every pair.
+    """
+    vocab = {}
+    sources = [np.array([vocab.setdefault(item, len(vocab)) for item in source], np.int64) for source in sources]
+    targets = [np.array([vocab.setdefault(item, len(vocab)) for item in target], np.int64) for target in targets]
+    distances = np.zeros(len(sources), np.int64)
+    order = np.argsort([max(len(source), len(target)) for source, target in zip(sources, targets)], kind="stable")
+    for start in range(0, len(order), chunk_size):
+        indices = order[start:start + chunk_size]
+        source_length = np.array([len(sources[i]) for i in indices])
+        target_length = np.array([len(targets[i]) for i in indices])
+        source_codes = np.full((len(indices), max(source_length.max(), 1)), -1)
+        target_codes = np.full((len(indices), target_length.max()), -2)
+        for row, i in enumerate(indices):
+            source_codes[row, :source_length[row]] = sources[i]
+            target_codes[row, :target_length[row]] = targets[i]
+        columns = np.arange(target_codes.shape[1] + 1)
+        # row[b, j]: the distance of the first i source items and the first j target items
+        row = np.broadcast_to(columns, (len(indices), len(columns))).copy()
+        best = np.empty_like(row)
+        for i in range(source_codes.shape[1]):
+            # deletion and substitution, the insertions are added by the cumulative minimum
+            best[:, 0] = i + 1
+            np.minimum(row[:, 1:] + 1, row[:, :-1] + (target_codes != source_codes[:, i:i + 1]), out=best[:, 1:])
+            new_row = np.minimum.accumulate(best - columns, axis=1) + columns
+            active = i < source_length
+            row[active] = new_row[active]
+        distances[indices] = row[np.arange(len(indices)), target_length]
+    return distances
+
+
+def ngram_fingerprint_similarity(preds, labels, max_n=3):
+    """The Tanimoto similarity of the sets of the SMILES token n-grams of every pair, a fingerprint of the
+    substructures in the SMILES strings which does not need RDKit."""
+    scores = []
+    for pred, label in zip(preds, labels):
+        fingerprints = []
+        for tokens in (tokenize_smiles(pred), tokenize_smiles(label)):
+            fingerprints.append({tuple(tokens[i:i + n]) for n in range(1, max_n + 1)
+                                 for i in range(len(tokens) - n + 1)})
+        union = len(fingerprints[0] | fingerprints[1])
+        scores.append(len(fingerprints[0] & fingerprints[1]) / union if union else 0.0)
+    return scores
+
+
+def _rdkit_scores(pairs):
+    """The canonical exact match and the MACCS, RDK and Morgan fingerprint similarities of the SMILES pairs, None
+    for the pairs with an invalid molecule."""
+    scores = []
+    for pred, label in pairs:
+        pred_mol = Chem.MolFromSmiles(pred) if pred else None
+        label_mol = Chem.MolFromSmiles(label) if label else None
+        if pred_mol is None or label_mol is None:
+            scores.append(None)
+            continue
+        exact = Chem.MolToSmiles(pred_mol) == Chem.MolToSmiles(label_mol)
+        scores.append((float(exact),
+                       DataStructs.FingerprintSimilarity(MACCSkeys.GenMACCSKeys(pred_mol),
+                                                         MACCSkeys.GenMACCSKeys(label_mol)),
+                       DataStructs.FingerprintSimilarity(Chem.RDKFingerprint(pred_mol),
+                                                         Chem.RDKFingerprint(label_mol)),
+                       DataStructs.TanimotoSimilarity(AllChem.GetMorganFingerprint(pred_mol, 2),
+                                                      AllChem.GetMorganFingerprint(label_mol, 2))))
+    return scores
+
+
+def _meteor_scores(pairs):
+    """The METEOR scores of the tokenized caption pairs."""
+    return [meteor_score([label], pred) for pred, label in pairs]
+
+
+class _PoolMixin:
+    """Map a function over the chunks of the samples in a process pool created on first use."""
+    def _map(self, func, items):
+        if not self.num_workers or len(items) < 2 * self.chunk_size:
+            return func(items)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.num_workers)
+        chunks = [items[start:start + self.chunk_size] for start in range(0, len(items), self.chunk_size)]
+        return [score for scores in self._pool.map(func, chunks) for score in scores]
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+@MindFormerRegister.register(MindFormerModuleType.METRIC)
+class SmilesGenerationMetric(nn.Metric, _PoolMixin):
+    r"""
+    Compute the scores of the generated SMILES against the label SMILES, for the text2smiles task.
+
+    The scores are the exact match, the character and SMILES token level Levenshtein distances, the SMILES token
+    BLEU, the validity and the token n-gram fingerprint similarity. With RDKit, the exact match compares the
+    canonical SMILES, and the MACCS, RDK and Morgan fingerprint similarities are computed for the valid molecules.
+
+    Args:
+        num_workers (int): The processes computing the RDKit scores, 0 computes them in the caller. Default 0.
+        chunk_size (int): The number of samples of a task of the processes. Default 64.
+
+    Examples:
+        >>> from mindformers.core.metric import SmilesGenerationMetric
+        >>> metric = SmilesGenerationMetric()
+        >>> metric.clear()
+        >>> metric.update(["CCO", "c1ccccc1"], ["CCO", "c1ccncc1"])
+        >>> result = metric.eval()
+        >>> result["exact_match"], result["levenshtein"]
+        (0.5, 0.5)
+    """
+    def __init__(self, num_workers=0, chunk_size=64):
+        super(SmilesGenerationMetric, self).__init__()
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self._pool = None
+        self.clear()
+
+    def clear(self):
+        """Clearing the internal evaluation result."""
+        self.num_samples = 0
+        self.score_dict = {"exact_match": [], "levenshtein": [], "token_levenshtein": [], "validity": [],
+                           "ngram_fts": []}
+        self.rdkit_scores = []
+        self.pred_tokens = []
+        self.label_tokens = []
+
+    def update(self, *inputs):
+        """Update the scores with a batch of generated SMILES and label SMILES"""
+        preds = [unwrap_smiles(pred) for pred in inputs[0]]
+        labels = [unwrap_smiles(label) for label in inputs[1]]
+        pred_tokens = [tokenize_smiles(pred) for pred in preds]
+        label_tokens = [tokenize_smiles(label) for label in labels]
+        self.num_samples += len(preds)
+        self.score_dict["levenshtein"].extend(levenshtein(preds, labels).tolist())
+        self.score_dict["token_levenshtein"].extend(levenshtein(pred_tokens, label_tokens).tolist())
+        self.score_dict["validity"].extend(float(is_valid_smiles(pred)) for pred in preds)
+        self.score_dict["ngram_fts"].extend(ngram_fingerprint_similarity(preds, labels))
+        if Chem is None:
+            self.score_dict["exact_match"].extend(float(pred == label) for pred, label in zip(preds, labels))
+        else:
+            rdkit_scores = self._map(_rdkit_scores, list(zip(preds, labels)))
+            self.score_dict["exact_match"].extend(scores[0] if scores else 0.0 for scores in rdkit_scores)
+            self.rdkit_scores.extend(scores[1:] for scores in rdkit_scores if scores)
+        self.pred_tokens.extend(pred_tokens)
+        self.label_tokens.extend([tokens] for tokens in label_tokens)
+
+    def eval(self):
+        """Compute final result"""
+        self._close_pool()
+        result = {key: float(np.mean(scores)) if scores else 0.0 for key, scores in self.score_dict.items()}
+        result["bleu"] = float(corpus_bleu(self.label_tokens, self.pred_tokens)) if self.num_samples else 0.0
+        if Chem is not None:
+            fingerprint_scores = np.array(self.rdkit_scores).reshape(-1, 3)
+            for key, scores in zip(("maccs_fts", "rdk_fts", "morgan_fts"), fingerprint_scores.T):
+                result[key] = float(np.mean(scores)) if scores.size else 0.0
+        logger.info("metric: SmilesGenerationMetric, %s samples\n%s", self.num_samples,
+                    "\n".join(f"{key}: {value:.4f}" for key, value in result.items()))
+        return result
+
+
+@MindFormerRegister.register(MindFormerModuleType.METRIC)
+class CaptionGenerationMetric(nn.Metric, _PoolMixin):
+    r"""
+    Compute the scores of the generated captions against the label captions, for the smiles2text task.
+
+    The captions are lowercased and split into words and punctuations. The scores are the corpus BLEU-2 and BLEU-4,
+    the ROUGE-1, ROUGE-2 and ROUGE-L F scores and METEOR, which needs the wordnet data of nltk. The empty captions
+    score 0.
+
+    Args:
+        num_workers (int): The processes computing METEOR, 0 computes it in the caller. Default 0.
+        chunk_size (int): The number of samples of a task of the processes. Default 64.
+
+    Examples:
+        >>> from mindformers.core.metric import CaptionGenerationMetric
+        >>> metric = CaptionGenerationMetric()
+        >>> metric.clear()
+        >>> metric.update(["The molecule is an alcohol."], ["The molecule is a primary alcohol."])
+        >>> result = metric.eval()
+    """
+    def __init__(self, num_workers=0, chunk_size=64):
+        super(CaptionGenerationMetric, self).__init__()
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self._pool = None
+        self.rouge = Rouge()
+        self.use_meteor = True
+        self.clear()
+
+    def clear(self):
+        """Clearing the internal evaluation result."""
+        self.num_samples = 0
+        self.score_dict = {"rouge-1": [], "rouge-2": [], "rouge-l": [], "meteor": []}
+        self.pred_tokens = []
+        self.label_tokens = []
+
+    def update(self, *inputs):
+        """Update the scores with a batch of generated captions and label captions"""
+        pred_tokens = [WORD_PATTERN.findall(pred.lower()) for pred in inputs[0]]
+        label_tokens = [WORD_PATTERN.findall(label.lower()) for label in inputs[1]]
+        self.num_samples += len(pred_tokens)
+        self.pred_tokens.extend(pred_tokens)
+        self.label_tokens.extend([tokens] for tokens in label_tokens)
+
+        rouge_scores = {key: np.zeros(len(pred_tokens)) for key in ("rouge-1", "rouge-2", "rouge-l")}
+        scored = [i for i, (pred, label) in enumerate(zip(pred_tokens, label_tokens)) if pred and label]
+        if scored:
+            # one call of the Rouge object for the batch
+            scores = self.rouge.get_scores([" ".join(pred_tokens[i]) for i in scored],
+                                           [" ".join(label_tokens[i]) for i in scored], avg=False)
+            for i, score in zip(scored, scores):
+                for key in rouge_scores:
+                    rouge_scores[key][i] = score[key]["f"]
+        for key, scores in rouge_scores.items():
+            self.score_dict[key].extend(scores.tolist())
+
+        if self.use_meteor:
+            try:
+                self.score_dict["meteor"].extend(self._map(_meteor_scores, list(zip(pred_tokens, label_tokens))))
+            except LookupError:
+                logger.warning("METEOR is skipped, please download the wordnet data of nltk.")
+                self.use_meteor = False
+
+    def eval(self):
+        """Compute final result"""
+        self._close_pool()
+        result = {}
+        for key, weights in (("bleu-2", (0.5, 0.5)), ("bleu-4", (0.25, 0.25, 0.25, 0.25))):
+            result[key] = float(corpus_bleu(self.label_tokens, self.pred_tokens, weights=weights)) \
+                if self.num_samples else 0.0
+        for key, scores in self.score_dict.items():
+            if key != "meteor" or self.use_meteor:
+                result[key] = float(np.mean(scores)) if scores else 0.0
+        logger.info("metric: CaptionGenerationMetric, %s samples\n%s", self.num_samples,
+                    "\n".join(f"{key}: {value:.4f}" for key, value in result.items()))
+        return result
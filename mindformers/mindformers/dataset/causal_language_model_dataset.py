@@ -27,6 +27,25 @@ from .dataloader import build_dataset_loader
 from .base_dataset import BaseDataset
 
 
+def get_eod_position_ids(input_ids, eod_token_id):
+    """
+    Generate the position_ids of the input tokens restarting after every <EOD>
+
+    Args:
+        input_ids: the input token ids of shape (bs, seq_length + 1)
+        eod_token_id: the id for <EOD>
+    Returns:
+        position_ids: the position ids of the seq_length input tokens, int32
+    """
+    seq_length = input_ids.shape[1] - 1
+    index = np.arange(seq_length, dtype=np.int32)
+    # the first token of every document, the one after an <EOD> or the first one
+    is_start = np.zeros((input_ids.shape[0], seq_length), dtype=np.bool_)
+    is_start[:, 1:] = input_ids[:, :seq_length - 1] == eod_token_id
+    start = np.maximum.accumulate(np.where(is_start, index, 0), axis=1)
+    return index - start
+
+
 def get_input_data_batch_slice_map(input_ids, eod_token_id, dis, rank_id: int = 0):
     """
     Generate position_id and attention_mask according to input_ids considering eod reset
@@ -42,31 +61,61 @@ def get_input_data_batch_slice_map(input_ids, eod_token_id, dis, rank_id: int =
         batch_attention_mask: the attention mask considering eod reset
     """
     rank = int(rank_id)
-    input_ids = input_ids[rank*dis: (rank + 1)*dis]
-    seq_length = input_ids.shape[1] - 1
-    # Initialize position_ids and attention_mask
-    batch_input_ids = input_ids
-    batch_position_ids = np.ones((dis, seq_length))
-    batch_attention_mask = np.ones((dis, seq_length, seq_length))
-
-    # Loop through batches
-    for bs_i in range(len(input_ids)):
-        # Get normal position_ids and attention_mask
-        local_ids = input_ids[bs_i]
-        batch_attention_mask[bs_i] = np.tril(np.ones(shape=(seq_length, seq_length)))
-        batch_position_ids[bs_i] = np.arange(seq_length)
-        # Find the index of <EOS>
-        eod_index = batch_position_ids[bs_i, local_ids[:-1] == eod_token_id].astype(np.int32)
-        prev_index = 0
-        for i in range(eod_index.size):
-            # Reset position_ids and attention_mask considering <EOS>
-            index = eod_index[i]
-            batch_attention_mask[bs_i, (index + 1):, :(index + 1)] = 0
-            batch_position_ids[bs_i, (index + 1):] -= (index + 1 - prev_index)
-            prev_index = index + 1
+    batch_input_ids = input_ids[rank*dis: (rank + 1)*dis]
+    batch_position_ids = get_eod_position_ids(batch_input_ids, eod_token_id)
+    seq_length = batch_position_ids.shape[1]
+    index = np.arange(seq_length)
+    # a token attends to the previous tokens of its document, from the one at position 0
+    key_index = index.reshape(1, 1, -1)
+    query_start = (index - batch_position_ids)[:, :, None]
+    batch_attention_mask = ((key_index <= index.reshape(1, -1, 1)) & (key_index >= query_start)).astype(np.float32)
     return batch_input_ids, batch_position_ids, batch_attention_mask
 
 
+def get_compact_data_batch_slice_map(*columns, input_columns, output_columns, eod_token_id, dis, rank_id: int = 0):
+    """
+    Generate position_ids according to input_ids considering eod reset, without the attention mask. The documents
+    restart their positions at 0, so the model builds the attention mask of the documents from the position ids.
+
+    Args:
+        columns: the columns, named by input_columns, with the position_ids of the packed sequences if any
+        input_columns: the column names
+        output_columns: the names of the returned columns, position_ids or any of input_columns
+        eod_token_id: the id for <EOD>, giving the position_ids if they are not in input_columns
+        dis: the slice value for each rank
+        rank_id: the current rank id
+    Returns:
+        The output_columns, the position_ids are of shape (bs, seq_length)
+    """
+    rank = int(rank_id)
+    batch = {name: column[rank*dis: (rank + 1)*dis] for name, column in zip(input_columns, columns)}
+    if "position_ids" not in batch:
+        batch["position_ids"] = get_eod_position_ids(batch["input_ids"], eod_token_id)
+    return tuple(batch[name] for name in output_columns)
+
+
+def get_pad_fraction(dataset, pad_token_id, num_batches=16):
+    """
+    Measure the fraction of the pad tokens in the input ids of the first batches of the dataset.
+
+    Args:
+        dataset: the batched dataset with the input_ids column of shape (bs, seq_length + 1)
+        pad_token_id: the id for the padding
+        num_batches: the number of the batches measured
+    Returns:
+        The pad fraction of the seq_length input tokens, 0.0 if the dataset is empty
+    """
+    num_tokens = 0
+    num_pad_tokens = 0
+    for index, batch in enumerate(dataset.create_dict_iterator(num_epochs=1, output_numpy=True)):
+        if index == num_batches:
+            break
+        input_ids = batch["input_ids"][:, :-1]
+        num_tokens += input_ids.size
+        num_pad_tokens += int((input_ids == pad_token_id).sum())
+    return num_pad_tokens / num_tokens if num_tokens else 0.0
+
+
 @MindFormerRegister.register(MindFormerModuleType.DATASET)
 class CausalLanguageModelDataset(BaseDataset):
     """
@@ -128,10 +177,23 @@ class CausalLanguageModelDataset(BaseDataset):
             dataset = dataset.batch(dataset_config.batch_size,
                                     drop_remainder=dataset_config.drop_remainder,
                                     output_columns=dataset_config.input_columns)
-            map_func = lambda input_ids: get_input_data_batch_slice_map(input_ids,
-                                                                        eod_token_id=dataset_config.eod_token_id,
-                                                                        rank_id=rank_id,
-                                                                        dis=dis)
+            # the padding of the packed sequences is excluded from the tokens/s/p of MFLossMonitor
+            pad_token_id = dataset_config.pad_token_id if dataset_config.pad_token_id is not None else 0
+            pad_fraction = get_pad_fraction(dataset, pad_token_id)
+            if "attention_mask" not in dataset_config.output_columns:
+                # the model builds the attention mask from the position ids of shape (bs, seq_length)
+                map_func = lambda *columns: get_compact_data_batch_slice_map(
+                    *columns, input_columns=dataset_config.input_columns,
+                    output_columns=dataset_config.output_columns, eod_token_id=dataset_config.eod_token_id,
+                    rank_id=rank_id, dis=dis)
+            elif "position_ids" in dataset_config.input_columns:
+                raise ValueError("The model builds the attention mask of the packed sequences from their "
+                                 "position_ids, 'attention_mask' should not be in output_columns.")
+            else:
+                map_func = lambda input_ids: get_input_data_batch_slice_map(input_ids,
+                                                                            eod_token_id=dataset_config.eod_token_id,
+                                                                            rank_id=rank_id,
+                                                                            dis=dis)
             dataset = get_dataset_map(dataset, map_func,
                                       input_columns=dataset_config.input_columns,
                                       output_columns=dataset_config.output_columns)
@@ -151,6 +213,8 @@ class CausalLanguageModelDataset(BaseDataset):
                                           input_columns=input_arg)
 
         dataset = dataset.repeat(dataset_config.repeat)
+        if dataset_config.eod_reset:
+            dataset.pad_fraction = pad_fraction
 
         return dataset
 
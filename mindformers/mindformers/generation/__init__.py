@@ -13,13 +13,27 @@
 # limitations under the License.
 # ============================================================================
 """ Mindformers generation."""
+from .beam_search import *
+from .block_manager import *
+from .continuous_batching import *
 from .generation_config import *
 from .logits_process import *
+from .modality import *
+from .prefix_cache import *
+from .sampler import *
+from .speculative import *
 from .streamers import *
 from .text_generator import *
 
 __all__ = []
+__all__.extend(beam_search.__all__)
+__all__.extend(block_manager.__all__)
+__all__.extend(continuous_batching.__all__)
 __all__.extend(generation_config.__all__)
 __all__.extend(logits_process.__all__)
+__all__.extend(modality.__all__)
+__all__.extend(prefix_cache.__all__)
+__all__.extend(sampler.__all__)
+__all__.extend(speculative.__all__)
 __all__.extend(streamers.__all__)
 __all__.extend(text_generator.__all__)
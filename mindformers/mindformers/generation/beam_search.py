@@ -0,0 +1,116 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Beam search of the text generation."""
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import numpy as np
+from mindspore import nn
+from mindspore.ops import operations as P
+
+__all__ = ["BeamHypotheses", "KVCacheReorder", "log_softmax"]
+
+
+def log_softmax(logits):
+    """The log probabilities of the [bs, vocab_size] logits."""
+    logits = np.asarray(logits, dtype=np.float32)
+    logits = logits - np.max(logits, axis=-1, keepdims=True)
+    return logits - np.log(np.sum(np.exp(logits), axis=-1, keepdims=True))
+
+
+class BeamHypotheses:
+    """
+    The finished hypotheses of an example of beam search.
+
+    A hypothesis is scored by the sum of the log probabilities of its generated tokens divided by
+    `length ** length_penalty`, only the `num_beams` best are kept.
+
+    Args:
+        num_beams (int): The number of hypotheses kept.
+        length_penalty (float): The exponent of the length in the score, > 0 promotes the longer sequences and < 0
+            the shorter ones. Default 1.0.
+    """
+    def __init__(self, num_beams: int, length_penalty: float = 1.0):
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+        self.beams: List[Tuple[float, np.ndarray]] = []
+        self.worst_score = float("inf")
+
+    def __len__(self):
+        return len(self.beams)
+
+    def score(self, sum_logprobs, length):
+        """The score of a hypothesis of `length` generated tokens."""
+        return sum_logprobs / (max(length, 1) ** self.length_penalty)
+
+    def add(self, token_ids, sum_logprobs):
+        """Add a hypothesis with a copy of the generated `token_ids` if it is one of the best."""
+        score = self.score(sum_logprobs, len(token_ids))
+        if len(self) >= self.num_beams and score <= self.worst_score:
+            return
+        self.beams.append((score, np.array(token_ids, np.int32)))
+        if len(self) > self.num_beams:
+            self.beams.remove(min(self.beams, key=lambda beam: beam[0]))
+        self.worst_score = min(beam[0] for beam in self.beams)
+
+    def is_done(self, best_sum_logprobs, length):
+        """Whether the best live beam, with `length` generated tokens, can not get in the hypotheses any more."""
+        if len(self) < self.num_beams:
+            return False
+        return self.worst_score >= self.score(best_sum_logprobs, length)
+
+    def nbest(self, num: int, dedupe_key: Optional[Callable[[np.ndarray], Hashable]] = None):
+        """
+        The `num` best (score, token ids) in the order of the scores.
+
+        With `dedupe_key`, such as the SMILES string decoded from the token ids, a hypothesis with the key of a
+        better one is only returned if there are not `num` hypotheses with different keys.
+        """
+        ranked = sorted(self.beams, key=lambda beam: beam[0], reverse=True)
+        if dedupe_key is None:
+            return ranked[:num]
+        picked = []
+        duplicates = []
+        keys = set()
+        for beam in ranked:
+            key = dedupe_key(beam[1])
+            if key in keys:
+                duplicates.append(beam)
+                continue
+            keys.add(key)
+            picked.append(beam)
+        return (picked + duplicates)[:num]
+
+
+class KVCacheReorder(nn.Cell):
+    """
+    Gather the rows of the dense kv caches on device, so that every beam continues from the cache of the beam it
+    is picked from without recomputing it.
+
+    The caches are the inputs of the graph instead of the parameters of the cell, so that they keep their names
+    in the model.
+
+    Inputs:
+        - **beam_index** (Tensor) - The int32 row of the cache every row is gathered from, with shape [bs].
+        - **caches** (Parameter) - The key and value caches with shape [bs, ...].
+    """
+    def __init__(self):
+        super().__init__()
+        self.gather = P.Gather()
+        self.assign = P.Assign()
+
+    def construct(self, beam_index, *caches):
+        for cache in caches:
+            self.assign(cache, self.gather(cache, beam_index, 0))
+        return beam_index
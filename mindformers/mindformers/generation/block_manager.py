@@ -0,0 +1,181 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Block tables of the paged kv cache."""
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+__all__ = ["BlockManager"]
+
+# the reserved block, written by the padding tokens and the idle rows, read by the unused block table entries
+NULL_BLOCK = 0
+
+
+class BlockManager:
+    """
+    Allocate the blocks of the paged kv cache on demand and build the block tables and slot mappings of the model.
+
+    The slot of the token at `position` of a sequence is `table[position // block_size] * block_size +
+    position % block_size`. The block tables are padded with the reserved block 0 to the smallest power of two
+    columns that holds the longest sequence, so the decode step only reads the used blocks.
+
+    The blocks are reference counted, so a sequence can start with the blocks of a cached prefix, see `PrefixCache`.
+    `prefix_lengths` keeps the number of cached tokens every sequence starts with, only the rest is prefilled.
+
+    Args:
+        num_blocks (int): The number of blocks in the cache, including the reserved block 0.
+        block_size (int): The number of tokens in a block.
+        batch_size (int): The number of sequences (batch rows) of the model.
+        seq_length (int): The maximum length of a sequence, a multiple of `block_size`.
+
+    Examples:
+        >>> block_manager = BlockManager(num_blocks=9, block_size=16, batch_size=2, seq_length=64)
+        >>> block_manager.allocate(0, 20)
+        True
+        >>> block_manager.block_tables()
+        array([[1, 2],
+               [0, 0]], dtype=int32)
+    """
+    def __init__(self, num_blocks: int, block_size: int, batch_size: int, seq_length: int):
+        if num_blocks < 2:
+            raise ValueError(f"The paged kv cache needs at least 2 blocks, but got {num_blocks}.")
+        if seq_length % block_size != 0:
+            raise ValueError(f"The seq_length {seq_length} should be a multiple of block_size {block_size}.")
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.max_blocks_per_seq = seq_length // block_size
+        # popped from the end, so the low blocks are used first
+        self.free_blocks: List[int] = list(range(num_blocks - 1, NULL_BLOCK, -1))
+        self.ref_counts = np.zeros(num_blocks, dtype=np.int32)
+        self.tables: List[List[int]] = [[] for _ in range(batch_size)]
+        self.prefix_lengths = np.zeros(batch_size, dtype=np.int32)
+        # called with the number of missing blocks when out of blocks, e.g. `PrefixCache.evict`
+        self.reclaim: Optional[Callable[[int], int]] = None
+
+    @property
+    def num_free_blocks(self):
+        """The number of blocks not used by any sequence."""
+        return len(self.free_blocks)
+
+    def blocks_needed(self, num_tokens):
+        """The number of blocks to hold `num_tokens` tokens."""
+        return -(-num_tokens // self.block_size)
+
+    def can_allocate(self, num_tokens, batch_index=None):
+        """Whether there are enough free blocks to hold `num_tokens` tokens in a new or the given sequence."""
+        used = len(self.tables[batch_index]) if batch_index is not None else 0
+        return self.blocks_needed(num_tokens) - used <= self.num_free_blocks
+
+    def ensure(self, batch_index, num_tokens):
+        """Grow the block table of `batch_index` to hold `num_tokens` tokens, return False if out of blocks."""
+        needed = self.blocks_needed(num_tokens)
+        if needed > self.max_blocks_per_seq:
+            raise ValueError(f"The {num_tokens} tokens exceed the {self.max_blocks_per_seq} blocks of a sequence.")
+        table = self.tables[batch_index]
+        missing = needed - len(table) - self.num_free_blocks
+        if missing > 0 and self.reclaim is not None:
+            self.reclaim(missing)
+        if needed - len(table) > self.num_free_blocks:
+            return False
+        while len(table) < needed:
+            block = self.free_blocks.pop()
+            self.ref_counts[block] = 1
+            table.append(block)
+        return True
+
+    def allocate(self, batch_index, num_tokens, prefix_blocks: Sequence[int] = ()):
+        """
+        Free the blocks of `batch_index`, then allocate blocks for a new sequence of `num_tokens` tokens, which
+        starts with the full blocks `prefix_blocks` of a cached prefix.
+        """
+        self.free(batch_index)
+        self.tables[batch_index] = list(prefix_blocks)
+        self.ref_counts[list(prefix_blocks)] += 1
+        self.prefix_lengths[batch_index] = len(prefix_blocks) * self.block_size
+        if self.ensure(batch_index, num_tokens):
+            return True
+        self.free(batch_index)
+        return False
+
+    def free(self, batch_index):
+        """Release the blocks of `batch_index`, the blocks not used by others go back to the pool."""
+        for block in reversed(self.tables[batch_index]):
+            self.release(block)
+        self.tables[batch_index] = []
+        self.prefix_lengths[batch_index] = 0
+
+    def retain(self, block):
+        """Add a reference to a used block."""
+        self.ref_counts[block] += 1
+
+    def release(self, block):
+        """Remove a reference to a block, return it to the pool if it is not used any more."""
+        self.ref_counts[block] -= 1
+        if self.ref_counts[block] == 0:
+            self.free_blocks.append(block)
+
+    def block_tables(self):
+        """The [batch_size, num_table_blocks] int32 block tables, padded with the reserved block."""
+        used = max(max(len(table) for table in self.tables), 1)
+        width = min(1 << (used - 1).bit_length(), self.max_blocks_per_seq)
+        block_tables = np.full((self.batch_size, width), NULL_BLOCK, dtype=np.int32)
+        for batch_index, table in enumerate(self.tables):
+            block_tables[batch_index, :len(table)] = table
+        return block_tables
+
+    def slot_mapping(self, positions):
+        """
+        The int32 cache slots of the tokens at `positions`.
+
+        Args:
+            positions (numpy.ndarray): The token positions with shape [batch_size] or [batch_size, seq_length].
+                The negative positions and the positions not allocated are mapped to the reserved block.
+
+        Returns:
+            numpy.ndarray, the flattened slots with shape [batch_size] or [batch_size * seq_length].
+        """
+        positions = np.asarray(positions).reshape(self.batch_size, -1)
+        slots = np.full(positions.shape, NULL_BLOCK * self.block_size, dtype=np.int32)
+        for batch_index, table in enumerate(self.tables):
+            if not table:
+                continue
+            position = positions[batch_index]
+            valid = (position >= 0) & (position < len(table) * self.block_size)
+            blocks = np.asarray(table, dtype=np.int32)[position[valid] // self.block_size]
+            slots[batch_index, valid] = blocks * self.block_size + position[valid] % self.block_size
+        return slots.reshape(-1)
+
+    def prefill_positions(self, valid_length, seq_length):
+        """
+        The [batch_size, seq_length] positions of the prefilled tokens, which follow the cached prefixes. The padding
+        positions are -1.
+        """
+        prefix_lengths = self.prefix_lengths.reshape(-1, 1)
+        positions = np.tile(np.arange(seq_length), (self.batch_size, 1)) + prefix_lengths
+        positions[positions >= np.asarray(valid_length).reshape(-1, 1)] = -1
+        return positions
+
+    def prefill_slot_mapping(self, valid_length, seq_length):
+        """The [batch_size * seq_length] slots of padded prompts, the padding positions go to the reserved block."""
+        return self.slot_mapping(self.prefill_positions(valid_length, seq_length))
+
+    def skip_prefixes(self, inputs):
+        """Shift the [batch_size, seq_length] prompt inputs left by the cached prefix lengths, padded with 0."""
+        inputs = np.asarray(inputs)
+        outputs = np.zeros_like(inputs)
+        for batch_index, prefix_length in enumerate(self.prefix_lengths):
+            outputs[batch_index, :inputs.shape[1] - prefix_length] = inputs[batch_index, prefix_length:]
+        return outputs
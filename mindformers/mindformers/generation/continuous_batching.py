@@ -0,0 +1,476 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Continuous batching for the incremental (`use_past`) inference.
+
+The batch rows of the kv cache are used as slots. Between two decode steps, finished requests leave their slots
+and waiting requests are prefilled into the free slots, the other slots keep their cache because they are prefilled
+with `batch_valid_length` 0. Every slot tracks its own valid length, so the decode step serves requests of
+different lengths together.
+
+With a paged kv cache the slots only hold cache blocks while they are used, so the model can be built with more
+slots than dense caches would fit. Requests are admitted while there are free blocks, and when a decode step runs
+out of blocks the latest admitted request is preempted and later prefilled again with its generated tokens.
+"""
+import collections
+import queue
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from mindspore.common.tensor import Tensor
+import mindspore.common.dtype as mstype
+
+from mindformers.generation.block_manager import BlockManager
+from mindformers.generation.prefix_cache import PrefixCache
+from mindformers.generation.logits_process import (CandidateLogitsWarper, LogitsProcessorList,
+                                                   RepetitionPenaltyLogitsProcessor)
+from mindformers.generation.modality import ModalityTracker
+from mindformers.generation.streamers import BaseStreamer
+from mindformers.generation.utils import softmax
+from mindformers.tools import logger
+
+__all__ = ["GenerationRequest", "ModelRunner", "LiteModelRunner", "ContinuousBatchingEngine"]
+
+
+class GenerationRequest:
+    """
+    A request submitted to `ContinuousBatchingEngine`, also the handle to wait for its result.
+
+    Args:
+        input_ids (list): The prompt token ids.
+        max_new_tokens (int): The maximum numbers of tokens to generate.
+        do_sample (bool): Whether to sample or use greedy decoding. Default False.
+        top_k (int): The number of highest probability tokens kept for sampling. Default 0, means disabled.
+        top_p (float): The cumulative probability kept for sampling. Default 1.0.
+        temperature (float): The value used to modulate the next token probabilities. Default 1.0.
+        repetition_penalty (float): The repetition penalty, 1.0 means no penalty. Default 1.0.
+        streamer (BaseStreamer): The streamer that receives the generated tokens. Default None.
+        seed (int): The seed of the random generator of the request, so that its samples do not depend on the other
+            requests of the batch. Default None, means a seed drawn from `np.random`, so that `np.random.seed` still
+            fixes the samples.
+    """
+    def __init__(self,
+                 input_ids: List[int],
+                 max_new_tokens: int,
+                 do_sample: bool = False,
+                 top_k: int = 0,
+                 top_p: float = 1.0,
+                 temperature: float = 1.0,
+                 repetition_penalty: float = 1.0,
+                 streamer: Optional[BaseStreamer] = None,
+                 seed: Optional[int] = None):
+        self.input_ids = [int(token) for token in input_ids]
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.streamer = streamer
+        self.logits_processor = LogitsProcessorList()
+        if repetition_penalty != 1.0:
+            self.logits_processor.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+        self.logits_warper = None
+        if do_sample and (temperature != 1.0 or top_k or top_p < 1.0):
+            self.logits_warper = CandidateLogitsWarper(temperature, int(top_k), top_p)
+        if seed is None:
+            seed = int(np.random.randint(np.iinfo(np.int32).max))
+        self.generator = np.random.default_rng(seed)
+
+        self.output_ids = None
+        self.error = None
+        self.submit_time = None
+        self.first_token_time = None
+        self.finish_time = None
+        self.num_preemptions = 0
+        self._done = threading.Event()
+
+    def done(self):
+        """Whether the request is finished."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the request, return the prompt and the generated token ids."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("The generation request is not finished in time.")
+        if self.error is not None:
+            raise self.error
+        return self.output_ids
+
+    def finish(self, output_ids=None, error=None):
+        """Set the result of the request and wake up the waiters."""
+        self.output_ids = output_ids
+        self.error = error
+        self.finish_time = time.time()
+        if self.streamer is not None:
+            self.streamer.end()
+        self._done.set()
+
+
+class ModelRunner:
+    """
+    Run the prefill and decode steps of a MindSpore model built with `use_past`. The batch size of the model is the
+    number of slots.
+
+    Args:
+        model: The model, such as LlamaForCausalLM, whose inputs are (input_ids, molecular_mask).
+    """
+    def __init__(self, model):
+        if model.config.is_sample_acceleration:
+            raise ValueError("ModelRunner samples every request on the host with its own sampling arguments, "
+                             "please build the model with is_sample_acceleration=False.")
+        self.model = model
+        self.model.set_train(False)
+        self.batch_size = model.config.batch_size
+        self.seq_length = model.config.seq_length
+        self.block_manager = model._get_block_manager(self.batch_size) \
+            if hasattr(model, "_get_block_manager") else None
+        self.prefix_cache = getattr(model, "prefix_cache", None) if self.block_manager is not None else None
+
+    def _run(self, input_ids, molecular_mask, current_index, valid_length, is_first_iteration, **kwargs):
+        self.model.add_flags_recursive(is_first_iteration=is_first_iteration)
+        res = self.model(input_ids=Tensor(input_ids, mstype.int32),
+                         molecular_mask=Tensor(molecular_mask, mstype.int32),
+                         input_position=Tensor(current_index, mstype.int32),
+                         init_reset=Tensor([True], mstype.bool_),
+                         batch_valid_length=Tensor([valid_length], mstype.int32),
+                         **kwargs)
+        logits = res[0] if isinstance(res, tuple) else res
+        return logits.asnumpy().reshape(self.batch_size, -1)
+
+    def prefill(self, input_ids, molecular_mask, valid_length):
+        """Prefill the rows with valid_length > 0, return the last logits of every row with shape [bs, vocab]."""
+        current_index = np.maximum(valid_length - 1, 0) + np.arange(self.batch_size) * self.seq_length
+        kwargs = {}
+        if self.block_manager is not None:
+            # the blocks of the prefilled rows are allocated by the engine, the other rows write nothing
+            positions = self.block_manager.prefill_positions(valid_length, self.seq_length)
+            kwargs["slot_mapping"] = Tensor(self.block_manager.slot_mapping(positions), mstype.int32)
+        if self.prefix_cache is None:
+            return self._run(input_ids, molecular_mask, current_index, valid_length, True, **kwargs)
+
+        # only the tokens after the cached prefixes of the prefilled rows are computed
+        prefix_length = np.where(valid_length > 0, self.block_manager.prefix_lengths, 0).astype(np.int32)
+        kwargs["block_tables"] = Tensor(self.block_manager.block_tables(), mstype.int32)
+        kwargs["prefix_length"] = Tensor(prefix_length, mstype.int32)
+        logits = self._run(self.block_manager.skip_prefixes(input_ids),
+                           self.block_manager.skip_prefixes(molecular_mask),
+                           current_index - prefix_length, valid_length, True, **kwargs)
+        for row in np.flatnonzero(valid_length):
+            self.prefix_cache.insert(input_ids[row, :valid_length[row]], self.block_manager.tables[row])
+        return logits
+
+    def decode(self, input_ids, molecular_mask, valid_length):
+        """Decode one token for every row, input_ids is [bs, 1], return the logits with shape [bs, vocab]."""
+        current_index = valid_length - 1 + np.arange(self.batch_size) * self.seq_length
+        kwargs = {}
+        if self.block_manager is not None:
+            kwargs["block_tables"] = Tensor(self.block_manager.block_tables(), mstype.int32)
+            kwargs["slot_mapping"] = Tensor(self.block_manager.slot_mapping(valid_length - 1), mstype.int32)
+        return self._run(input_ids, molecular_mask, current_index, valid_length, False, **kwargs)
+
+
+class LiteModelRunner:
+    """
+    Run the prefill and decode steps of the exported MindSpore Lite models of `TextGeneratorInfer`.
+
+    Args:
+        infer (TextGeneratorInfer): The infer task with the prefill and the increment models.
+        batch_size (int): The batch size the models are exported with.
+    """
+    def __init__(self, infer, batch_size):
+        if not (infer.full_model and infer.cache_model):
+            raise ValueError("Continuous batching needs both the prefill and the increment model.")
+        self.infer = infer
+        self.batch_size = batch_size
+        self.seq_length = infer.seq_length
+        self._input_ids = np.zeros((batch_size, self.seq_length), np.int32)
+
+    def _run(self, model, input_ids, molecular_mask, current_index, valid_length, is_first_iteration):
+        lite_inputs = self.infer.get_predict_inputs(model, input_ids, current_index.astype(np.int32),
+                                                    valid_length.astype(np.int32), np.array([True]),
+                                                    is_first_iteration, molecular_mask=molecular_mask)
+        logits = model.predict(lite_inputs)[0].get_data_to_numpy()
+        return logits.reshape(self.batch_size, -1, logits.shape[-1])
+
+    def prefill(self, input_ids, molecular_mask, valid_length):
+        """Prefill the rows with valid_length > 0, return the last logits of every row with shape [bs, vocab]."""
+        self._input_ids = input_ids.copy()
+        current_index = np.maximum(valid_length - 1, 0) + np.arange(self.batch_size) * self.seq_length
+        logits = self._run(self.infer.full_model, input_ids, molecular_mask, current_index, valid_length, True)
+        if logits.shape[1] > 1:
+            logits = logits[np.arange(self.batch_size), np.maximum(valid_length - 1, 0)]
+        return logits.reshape(self.batch_size, -1)
+
+    def decode(self, input_ids, molecular_mask, valid_length):
+        """Decode one token for every row, input_ids is [bs, 1], return the logits with shape [bs, vocab]."""
+        # the lite inputs slice the current tokens out of the full [bs, seq_length] ids
+        current_index = valid_length - 1 + np.arange(self.batch_size) * self.seq_length
+        self._input_ids[np.arange(self.batch_size), valid_length - 1] = input_ids[:, 0]
+        logits = self._run(self.infer.cache_model, self._input_ids, molecular_mask, current_index, valid_length,
+                           False)
+        return logits.reshape(self.batch_size, -1)
+
+
+class ContinuousBatchingEngine:
+    """
+    Continuous batching scheduler with a request queue.
+
+    Requests are submitted from any thread by `submit`. `step` admits the waiting requests into the free slots,
+    runs one decode step for all the active slots and retires the finished requests. `start` runs the steps in a
+    background thread. If the runner has a `block_manager`, the cache blocks of the slots are allocated on demand,
+    and if it has a `prefix_cache`, the requests start from the cached blocks of their longest cached prefix.
+
+    Args:
+        runner (ModelRunner, LiteModelRunner): Runs the prefill and decode steps.
+        eos_token_id (int): The end of sequence token id. Default 2.
+        pad_token_id (int): The padding token id. Default 0.
+        modality_ranges (list): The molecular token id ranges, see `ModalityTracker`. Default None.
+
+    Examples:
+        >>> engine = ContinuousBatchingEngine(ModelRunner(model), eos_token_id=2)
+        >>> engine.start()
+        >>> request = engine.submit([1, 2, 3], max_new_tokens=64)
+        >>> output_ids = request.result()
+        >>> engine.stop()
+    """
+    def __init__(self, runner, eos_token_id=2, pad_token_id=0, modality_ranges=None):
+        self.runner = runner
+        self.num_slots = runner.batch_size
+        self.seq_length = runner.seq_length
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = pad_token_id
+        self.modality = ModalityTracker(modality_ranges)
+
+        self.input_ids = np.full((self.num_slots, self.seq_length), pad_token_id, np.int32)
+        self.molecular_mask = np.zeros((self.num_slots, self.seq_length), np.int32)
+        self.valid_length = np.zeros(self.num_slots, np.int32)
+        self.max_length = np.zeros(self.num_slots, np.int32)
+        self.slots: List[Optional[GenerationRequest]] = [None] * self.num_slots
+        self.waiting = queue.Queue()
+        # the requests taken from the queue but not admitted yet, the preempted requests go to the front
+        self.pending = collections.deque()
+        self.block_manager: Optional[BlockManager] = getattr(runner, "block_manager", None)
+        self.prefix_cache: Optional[PrefixCache] = getattr(runner, "prefix_cache", None)
+        self.admit_order = np.zeros(self.num_slots, np.int64)
+        self._admitted = 0
+
+        self.generated_tokens = 0
+        self.steps = 0
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def submit(self, input_ids, max_new_tokens, **kwargs):
+        """
+        Put a request into the queue.
+
+        Args:
+            input_ids (list): The prompt token ids.
+            max_new_tokens (int): The maximum numbers of tokens to generate.
+            kwargs: The sampling arguments and the streamer of `GenerationRequest`.
+
+        Returns:
+            GenerationRequest, the handle of the request.
+        """
+        request = input_ids if isinstance(input_ids, GenerationRequest) else \
+            GenerationRequest(input_ids, max_new_tokens, **kwargs)
+        request.submit_time = time.time()
+        self.waiting.put(request)
+        return request
+
+    def has_work(self):
+        """Whether there are active or waiting requests."""
+        return bool(self.pending) or not self.waiting.empty() or any(request is not None for request in self.slots)
+
+    def _next_request(self):
+        """The first pending request, None if there is no request."""
+        if not self.pending:
+            try:
+                self.pending.append(self.waiting.get_nowait())
+            except queue.Empty:
+                return None
+        return self.pending[0]
+
+    def _admit(self):
+        """Move the waiting requests into the free slots, return the admitted slot ids."""
+        admitted = []
+        free_slots = [slot for slot, request in enumerate(self.slots) if request is None]
+        while free_slots:
+            request = self._next_request()
+            if request is None:
+                break
+            length = len(request.input_ids)
+            if not 0 < length < self.seq_length:
+                self.pending.popleft()
+                request.finish(error=ValueError(
+                    f"The prompt length {length} should be in range (0, {self.seq_length})."))
+                continue
+            slot = free_slots[0]
+            prefix_blocks = self.prefix_cache.match(request.input_ids) if self.prefix_cache is not None else ()
+            if self.block_manager is not None and not self.block_manager.allocate(slot, length, prefix_blocks):
+                if len(free_slots) < self.num_slots:
+                    # wait for the blocks of the running requests, in arrival order
+                    break
+                self.pending.popleft()
+                request.finish(error=ValueError(f"The prompt length {length} exceeds the paged kv cache."))
+                continue
+            self.pending.popleft()
+            free_slots.pop(0)
+            self.slots[slot] = request
+            self.admit_order[slot] = self._admitted
+            self._admitted += 1
+            self.input_ids[slot] = self.pad_token_id
+            self.input_ids[slot, :length] = request.input_ids
+            self.molecular_mask[slot] = self.modality.is_molecular(self.input_ids[slot])
+            request.logits_processor.reset(self.input_ids[slot:slot + 1])
+            self.valid_length[slot] = length
+            self.max_length[slot] = min(length + request.max_new_tokens, self.seq_length)
+            if request.streamer is not None and not request.num_preemptions:
+                request.streamer.put(np.array(request.input_ids))
+            admitted.append(slot)
+        return admitted
+
+    def _release(self, slot):
+        """Free a slot and its cache blocks."""
+        self.slots[slot] = None
+        if self.block_manager is not None:
+            self.block_manager.free(slot)
+
+    def _preempt(self, slot):
+        """Move the request of a slot back to the front of the pending requests, with its generated tokens."""
+        request = self.slots[slot]
+        request.input_ids = self.input_ids[slot, :self.valid_length[slot]].tolist()
+        request.max_new_tokens = int(self.max_length[slot] - self.valid_length[slot])
+        request.num_preemptions += 1
+        self.pending.appendleft(request)
+        self._release(slot)
+
+    def _reserve(self, active):
+        """Allocate the blocks for the tokens decoded this step, preempt the latest requests if out of blocks."""
+        for slot in sorted(active, key=lambda slot: self.admit_order[slot]):
+            while self.slots[slot] is not None and not self.block_manager.ensure(slot, self.valid_length[slot]):
+                running = [index for index, request in enumerate(self.slots) if request is not None]
+                if len(running) == 1:
+                    self.slots[slot].finish(error=RuntimeError(
+                        f"The {self.valid_length[slot]} tokens of the request exceed the paged kv cache."))
+                    self._release(slot)
+                    break
+                self._preempt(max(running, key=lambda index: self.admit_order[index]))
+        return [slot for slot in active if self.slots[slot] is not None]
+
+    def _sample(self, slot, logits):
+        """Sample the next token of a slot."""
+        request = self.slots[slot]
+        scores = logits[None, :]
+        if request.logits_processor:
+            scores = request.logits_processor(self.input_ids[slot:slot + 1], scores,
+                                              valid_length=self.valid_length[slot:slot + 1])
+        if not request.do_sample:
+            return int(np.argmax(scores[0]))
+        if request.logits_warper is None:
+            return int(request.generator.choice(scores.shape[-1], p=softmax(scores[0])))
+        # sample from the top candidates only
+        scores, token_ids = request.logits_warper.candidates(scores)
+        return int(token_ids[0, request.generator.choice(scores.shape[-1], p=softmax(scores[0]))])
+
+    def _update(self, slots, logits):
+        """Append the sampled tokens, retire the finished requests, return the [bs, 1] next tokens."""
+        next_tokens = np.full((self.num_slots, 1), self.pad_token_id, np.int32)
+        now = time.time()
+        for slot in slots:
+            request = self.slots[slot]
+            token = self._sample(slot, logits[slot])
+            position = self.valid_length[slot]
+            self.input_ids[slot, position] = token
+            self.molecular_mask[slot, position] = self.modality.is_molecular(token)
+            self.valid_length[slot] += 1
+            next_tokens[slot, 0] = token
+            self.generated_tokens += 1
+            if request.first_token_time is None:
+                request.first_token_time = now
+            if request.streamer is not None:
+                request.streamer.put(np.array([token]))
+            if token == self.eos_token_id or self.valid_length[slot] >= self.max_length[slot]:
+                request.finish(output_ids=self.input_ids[slot, :self.valid_length[slot]].copy())
+                self._release(slot)
+        return next_tokens
+
+    def step(self):
+        """
+        Admit the waiting requests, then decode one token for the active requests.
+
+        Returns:
+            int, the number of active slots after this step.
+        """
+        admitted = self._admit()
+        if admitted:
+            # only the admitted rows are prefilled, the others keep their cache with valid length 0
+            valid_length = np.zeros(self.num_slots, np.int32)
+            valid_length[admitted] = self.valid_length[admitted]
+            logits = self.runner.prefill(self.input_ids, self.molecular_mask, valid_length)
+            self._update(admitted, logits)
+
+        active = [slot for slot, request in enumerate(self.slots) if request is not None and slot not in admitted]
+        if active and self.block_manager is not None:
+            active = self._reserve(active)
+        if active:
+            next_tokens = np.full((self.num_slots, 1), self.pad_token_id, np.int32)
+            # the idle rows and the rows admitted this step decode at the last position, which no request reads:
+            # the dense kv cache adds the decoded key, so an admitted row must not decode its last token twice.
+            # The cache of the idle rows is rebuilt on admission.
+            valid_length = np.full(self.num_slots, self.seq_length, np.int32)
+            valid_length[active] = self.valid_length[active]
+            rows = np.arange(self.num_slots)
+            next_tokens[:, 0] = self.input_ids[rows, valid_length - 1]
+            molecular_mask = self.molecular_mask[rows, valid_length - 1].reshape(-1, 1)
+            logits = self.runner.decode(next_tokens, molecular_mask, valid_length)
+            self._update(active, logits)
+        self.steps += 1
+        return sum(request is not None for request in self.slots)
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            if not self.has_work():
+                time.sleep(0.001)
+                continue
+            try:
+                self.step()
+            # pylint: disable=W0703
+            except Exception as e:
+                logger.error("Continuous batching step failed: %s", repr(e))
+                for slot, request in enumerate(self.slots):
+                    if request is not None:
+                        request.finish(error=e)
+                        self._release(slot)
+
+    def start(self):
+        """Run the steps in a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.prefix_cache is not None:
+            logger.info("Prefix cache: %s", self.prefix_cache.stats())
+
+    def run_until_complete(self):
+        """Run the steps in the current thread until all the submitted requests are finished."""
+        while self.has_work():
+            self.step()
@@ -40,6 +40,28 @@ class GenerationConfig:
         use_past (`bool`, *optional*, defaults to `False`):
             Whether the model should use the past last key/values attentions
             (if applicable to the model) to speed up decoding.
+        num_beams (`int`, *optional*, defaults to 1):
+            Number of beams for beam search. 1 means no beam search. The beams of an example are rows of the batch,
+            the batch size of the model should be the number of the examples times `num_beams`. The tokens are not
+            sampled by beam search.
+        num_return_sequences (`int`, *optional*, defaults to 1):
+            The number of the best sequences of beam search returned for every example, at most `num_beams`.
+        length_penalty (`float`, *optional*, defaults to 1.0):
+            The exponent of the number of generated tokens the log probability of a beam search sequence is
+            divided by. > 0 promotes the longer sequences and < 0 the shorter ones.
+        dedupe_key (`Callable`, *optional*):
+            A function of the generated token ids of a beam search sequence, such as the SMILES string decoded
+            from them. The sequences with the key of a better one are only returned if there are not
+            `num_return_sequences` different ones.
+        num_draft_tokens (`int`, *optional*, defaults to 4):
+            The number of the tokens proposed by the draft model of speculative decoding every step, which are
+            verified at once by the model.
+        prompt_lookup_num_tokens (`int`, *optional*):
+            The max number of the tokens proposed by speculative decoding without a draft model every step, which
+            follow the longest suffix of a sequence found in its prompt or its generated tokens, such as the SMILES
+            fragments and the substructure names copied from the prompt. None disables it.
+        max_matching_ngram_size (`int`, *optional*, defaults to 3):
+            The max length of the suffixes looked up by `prompt_lookup_num_tokens`.
 
         > Parameters for manipulation of the model output logits
 
@@ -71,6 +93,13 @@ class GenerationConfig:
             The id of the *end-of-sequence* token. Optionally, use a list to
             set multiple *end-of-sequence* tokens.
 
+        > Parameters for the molecular modality
+
+        modality_ranges (`List[List[int]]`, *optional*):
+            The `[start, end)` token id ranges of the molecular vocabularies, such as the added SMILES, protein and
+            nucleic acid tokens. `end` can be None for an unbounded range. If None, the token ids from 32000 on are
+            molecular.
+
         > Wild card
 
         generation_kwargs:
@@ -88,6 +117,15 @@ class GenerationConfig:
         self.do_sample = kwargs.pop("do_sample", False)
         # incremental infer
         self.use_past = kwargs.pop("use_past", False)
+        # beam search
+        self.num_beams = kwargs.pop("num_beams", 1)
+        self.num_return_sequences = kwargs.pop("num_return_sequences", 1)
+        self.length_penalty = kwargs.pop("length_penalty", 1.0)
+        self.dedupe_key = kwargs.pop("dedupe_key", None)
+        # speculative decoding
+        self.num_draft_tokens = kwargs.pop("num_draft_tokens", 4)
+        self.prompt_lookup_num_tokens = kwargs.pop("prompt_lookup_num_tokens", None)
+        self.max_matching_ngram_size = kwargs.pop("max_matching_ngram_size", 3)
         # logits processors
         self.temperature = kwargs.pop("temperature", 1.0)
         self.top_k = kwargs.pop("top_k", 50)
@@ -101,6 +139,9 @@ class GenerationConfig:
         self.bos_token_id = kwargs.pop("bos_token_id", None)
         self.eos_token_id = kwargs.pop("eos_token_id", None)
 
+        # molecular token id ranges
+        self.modality_ranges = kwargs.pop("modality_ranges", None)
+
         # interface.
         self._from_model_config = kwargs.pop("_from_model_config", False)
         # Additional attributes without default values
@@ -14,12 +14,15 @@
 # ============================================================================
 """Logits Processor for generation."""
 import inspect
+from typing import Dict
+
 import numpy as np
 
 from .utils import log_softmax, softmax, topk
 
 __all__ = ["LogitsProcessor", "LogitsWarper", "LogitsProcessorList", "RepetitionPenaltyLogitsProcessor",
-           "LogitNormalization", "TemperatureLogitsWarper", "TopKLogitsWarper", "TopPLogitsWarper"]
+           "LogitNormalization", "TemperatureLogitsWarper", "TopKLogitsWarper", "TopPLogitsWarper",
+           "CandidateLogitsWarper", "SmilesGrammarLogitsProcessor"]
 
 
 class LogitsProcessor:
@@ -54,16 +57,32 @@ class LogitsProcessorList(list):
         for processor in self:
             function_args = inspect.signature(processor.__call__).parameters
             if len(function_args) > 2:
-                if not all(arg in kwargs for arg in list(function_args.keys())[2:]):
+                extra_args = list(function_args.values())[2:]
+                if not all(arg.name in kwargs for arg in extra_args if arg.default is inspect.Parameter.empty):
                     raise ValueError(
                         f"Make sure that all the required parameters: {list(function_args.keys())} for "
                         f"{processor.__class__} are passed to the logits processor."
                     )
-                scores = processor(input_ids, scores, **kwargs)
+                scores = processor(input_ids, scores, **{arg.name: kwargs[arg.name] for arg in extra_args
+                                                         if arg.name in kwargs})
             else:
                 scores = processor(input_ids, scores)
         return scores
 
+    def reset(self, input_ids):
+        """Reset the states kept for the rows of the batch by the stateful processors before a new generation of
+        `input_ids`."""
+        for processor in self:
+            if hasattr(processor, "reset"):
+                processor.reset(input_ids)
+
+    def reorder(self, beam_index):
+        """Reorder the states kept for the rows of the batch by the stateful processors, row `i` continues the row
+        `beam_index[i]`."""
+        for processor in self:
+            if hasattr(processor, "reorder"):
+                processor.reorder(beam_index)
+
 
 class TemperatureLogitsWarper(LogitsWarper):
     r"""
@@ -107,16 +126,23 @@ class RepetitionPenaltyLogitsProcessor(LogitsProcessor):
 
         self.penalty = repetition_penalty
 
-    def __call__(self, input_ids, scores):
-        score = np.take_along_axis(scores, input_ids, axis=1)
+    def __call__(self, input_ids, scores, valid_length=None):
+        """
+        Penalize the scores of the tokens of `input_ids`. If `valid_length` is given, only the first `valid_length`
+        tokens of every row are read, not the padding after them.
+        """
+        if valid_length is None:
+            rows = np.arange(input_ids.shape[0])[:, None]
+            tokens = input_ids
+        else:
+            rows, positions = np.nonzero(np.arange(input_ids.shape[1]) < np.reshape(valid_length, (-1, 1)))
+            tokens = input_ids[rows, positions]
+        # a repeated token is gathered before any update, so it is penalized once
+        score = scores[rows, tokens]
 
         # if score < 0 then repetition penalty has to be multiplied to reduce the previous token probability
-        negative_index = score < 0
-        positive_index = ~negative_index
-        score[negative_index] = score[negative_index] * self.penalty
-        score[positive_index] = score[positive_index] / self.penalty
-
-        np.put_along_axis(scores, input_ids, score, axis=1)
+        score = np.where(score < 0, score * self.penalty, score / self.penalty)
+        scores[rows, tokens] = score
         return scores
 
 
@@ -206,6 +232,95 @@ class TopKLogitsWarper(LogitsWarper):
         return scores
 
 
+class CandidateLogitsWarper(LogitsWarper):
+    r"""
+    [`LogitsWarper`] that performs temperature, top-k and top-p together on the highest scores only.
+
+    A single partial sort of the vocabulary gives the `max(top_k, candidate_token_num)` candidates of every row,
+    then temperature, top-k and top-p are applied to the compact `[bs, K]` candidate scores, which are sampled
+    from directly with their token ids. The kept tokens and their probabilities are the same as with
+    [`TemperatureLogitsWarper`], [`TopKLogitsWarper`] and [`TopPLogitsWarper`] one after the other.
+
+    Args:
+        temperature (`float`, *optional*, defaults to 1.0):
+            The value used to module the logits distribution.
+        top_k (`int`, *optional*, defaults to 0):
+            The number of highest probability vocabulary tokens to keep, 0 means no top-k.
+        top_p (`float`, *optional*, defaults to 1.0):
+            If set to < 1, only the smallest set of most probable tokens with probabilities
+            that add up to `top_p` or higher are kept for generation.
+        filter_value (`float`, *optional*, defaults to `-50000`):
+            All filtered values will be set to this float value.
+        min_tokens_to_keep (`int`, *optional*, defaults to 1):
+            Minimum number of tokens that cannot be filtered.
+        candidate_token_num (`int`, *optional*, defaults to 200):
+            Number of candidate tokens to calculate top_p, as in [`TopPLogitsWarper`].
+    """
+
+    def __init__(self, temperature: float = 1.0, top_k: int = 0, top_p: float = 1.0, filter_value: float = -50000,
+                 min_tokens_to_keep: int = 1, candidate_token_num: int = 200):
+        temperature = float(temperature)
+        if temperature <= 0:
+            raise ValueError(
+                f"`temperature` has to be a strictly positive float, but is {temperature}"
+            )
+        if not isinstance(top_k, int) or top_k < 0:
+            raise ValueError(f"`top_k` has to be a non-negative integer, but is {top_k}")
+        top_p = float(top_p)
+        if top_p < 0 or top_p > 1.0:
+            raise ValueError(f"`top_p` has to be a float > 0 and < 1, but is {top_p}")
+        if not isinstance(min_tokens_to_keep, int) or (min_tokens_to_keep < 0):
+            raise ValueError(
+                f"`min_tokens_to_keep` has to be a non-negative integer, but is {min_tokens_to_keep}"
+            )
+
+        self.temperature = temperature
+        self.top_k = max(top_k, min_tokens_to_keep) if top_k else 0
+        self.top_p = top_p
+        self.filter_value = float(filter_value)
+        self.min_tokens_to_keep = min_tokens_to_keep
+        self.candidate_token_num = candidate_token_num if top_p < 1.0 else 0
+        self.num_candidates = max(self.top_k, self.candidate_token_num)
+
+    def candidates(self, scores):
+        """
+        Get the warped scores of the candidates of every row, sorted from the highest, and their token ids.
+
+        Args:
+            scores (np.ndarray): The scores with shape [bs, vocab_size].
+
+        Returns:
+            A tuple of the candidate scores and the token ids, both with shape [bs, K].
+        """
+        num_candidates = min(self.num_candidates or scores.shape[-1], scores.shape[-1])
+        if num_candidates < scores.shape[-1]:
+            token_ids = np.argpartition(-scores, num_candidates - 1, axis=-1)[:, :num_candidates]
+        else:
+            token_ids = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+        candidate_scores = np.take_along_axis(scores, token_ids, axis=-1)
+        order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+        token_ids = np.take_along_axis(token_ids, order, axis=-1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=-1) / self.temperature
+
+        if self.top_k:
+            # ties with the k-th score are kept
+            candidate_scores[candidate_scores < candidate_scores[:, self.top_k - 1:self.top_k]] = self.filter_value
+        if self.top_p < 1.0:
+            cumulative_probs = np.cumsum(softmax(candidate_scores[:, :self.candidate_token_num], axis=-1), axis=-1)
+            # keep the tokens under top_p and the first one over it
+            indices_to_keep = np.zeros(candidate_scores.shape, np.bool_)
+            indices_to_keep[:, 1:cumulative_probs.shape[-1]] = cumulative_probs[:, :-1] < self.top_p
+            indices_to_keep[:, :max(self.min_tokens_to_keep, 1)] = True
+            candidate_scores[~indices_to_keep] = self.filter_value
+        return candidate_scores, token_ids
+
+    def __call__(self, input_ids, scores):
+        candidate_scores, token_ids = self.candidates(scores)
+        warped_scores = np.full_like(scores, self.filter_value)
+        np.put_along_axis(warped_scores, token_ids, candidate_scores, axis=-1)
+        return warped_scores
+
+
 class LogitNormalization(LogitsProcessor, LogitsWarper):
     r"""
     [`LogitsWarper`] and [`LogitsProcessor`] for normalizing the scores using log-softmax. It's important to normalize
@@ -217,3 +332,253 @@ class LogitNormalization(LogitsProcessor, LogitsWarper):
     def __call__(self, input_ids, scores):
         scores = log_softmax(scores, axis=-1)
         return scores
+
+
+# SMILES parser states: the kind of the last character
+_START, _DOT, _ATOM, _ATOM_C, _ATOM_B, _BOND, _BRANCH_BOND, _BRANCH_OPEN, _BRANCH_CLOSE, _RING, _PERCENT, \
+    _PERCENT_DIGIT, _BRACKET_OPEN, _BRACKET = range(14)
+# SMILES token classes
+_ORGANIC, _C_CHAR, _B_CHAR, _AROMATIC, _L_CHAR, _R_CHAR, _LETTER, _DIGIT, _OPEN, _CLOSE, _OPEN_BRACKET, \
+    _CLOSE_BRACKET, _BOND_CHAR, _MINUS, _DOT_CHAR, _PERCENT_CHAR, _PLUS, _AT = range(18)
+_ATOM_STARTS = {_ORGANIC: _ATOM, _C_CHAR: _ATOM_C, _B_CHAR: _ATOM_B, _AROMATIC: _ATOM, _OPEN_BRACKET: _BRACKET_OPEN}
+_AFTER_ATOM = {**_ATOM_STARTS, _DIGIT: _RING, _PERCENT_CHAR: _PERCENT, _BOND_CHAR: _BOND, _MINUS: _BOND,
+               _OPEN: _BRANCH_OPEN, _CLOSE: _BRANCH_CLOSE, _DOT_CHAR: _DOT}
+_BRACKET_SYMBOLS = {_ORGANIC: _BRACKET, _C_CHAR: _BRACKET, _B_CHAR: _BRACKET, _AROMATIC: _BRACKET, _L_CHAR: _BRACKET,
+                    _R_CHAR: _BRACKET, _LETTER: _BRACKET}
+_TRANSITIONS = {
+    _START: _ATOM_STARTS,
+    _DOT: _ATOM_STARTS,
+    _ATOM: _AFTER_ATOM,
+    # Cl and Br
+    _ATOM_C: {**_AFTER_ATOM, _L_CHAR: _ATOM},
+    _ATOM_B: {**_AFTER_ATOM, _R_CHAR: _ATOM},
+    _RING: _AFTER_ATOM,
+    _BOND: {**_ATOM_STARTS, _DIGIT: _RING, _PERCENT_CHAR: _PERCENT},
+    _BRANCH_BOND: _ATOM_STARTS,
+    _BRANCH_OPEN: {**_ATOM_STARTS, _BOND_CHAR: _BRANCH_BOND, _MINUS: _BRANCH_BOND, _DOT_CHAR: _DOT},
+    _BRANCH_CLOSE: {**_ATOM_STARTS, _BOND_CHAR: _BOND, _MINUS: _BOND, _OPEN: _BRANCH_OPEN, _CLOSE: _BRANCH_CLOSE,
+                    _DOT_CHAR: _DOT},
+    _PERCENT: {_DIGIT: _PERCENT_DIGIT},
+    _PERCENT_DIGIT: {_DIGIT: _RING},
+    # the isotope digits, then the element symbol
+    _BRACKET_OPEN: {**_BRACKET_SYMBOLS, _DIGIT: _BRACKET_OPEN},
+    _BRACKET: {**_BRACKET_SYMBOLS, _DIGIT: _BRACKET, _AT: _BRACKET, _PLUS: _BRACKET, _MINUS: _BRACKET,
+               _CLOSE_BRACKET: _ATOM},
+}
+# the states after which a digit opens or closes a ring bond
+_RING_BOND_KINDS = [_ATOM, _ATOM_C, _ATOM_B, _RING, _BOND]
+_COMPLETE_KINDS = [_START, _ATOM, _ATOM_C, _ATOM_B, _RING, _BRANCH_CLOSE]
+_NUM_RING_LABELS = 100
+
+
+def _smiles_char_class(char):
+    """The class of a SMILES character, None if it is not a SMILES character."""
+    classes = {"(": _OPEN, ")": _CLOSE, "[": _OPEN_BRACKET, "]": _CLOSE_BRACKET, "-": _MINUS, ".": _DOT_CHAR,
+               "%": _PERCENT_CHAR, "+": _PLUS, "@": _AT}
+    if char in classes:
+        return classes[char]
+    if char in "=#/\\:$":
+        return _BOND_CHAR
+    if char.isdigit():
+        return _DIGIT
+    if char == "C":
+        return _C_CHAR
+    if char == "B":
+        return _B_CHAR
+    if char in "NOPSFI":
+        return _ORGANIC
+    if char in "bcnops":
+        return _AROMATIC
+    if char == "l":
+        return _L_CHAR
+    if char == "r":
+        return _R_CHAR
+    if char.isalpha():
+        return _LETTER
+    return None
+
+
+class SmilesGrammarLogitsProcessor(LogitsProcessor):
+    r"""
+    [`LogitsProcessor`] that masks the SMILES tokens which would make the generated SMILES invalid, e.g. unbalanced
+    parentheses, a ring bond digit without an atom, a ring bond closed on the atom it is opened on, or an element
+    symbol out of a bracket atom.
+
+    The SMILES vocabulary is the single character tokens of `smiles_alphabet.txt`, such as `{|C|}` and `{|(|}`.
+    The parser state of every sequence (the kind of the last character, the branch depth, the open ring bond labels
+    and the ones opened on the last atom, and whether it is inside a `[...]` atom) is updated with the tokens appended since the last call only, and the
+    allowed SMILES tokens of every state are precomputed, so the masking is a table lookup over the batch. The other
+    tokens are not masked, a sequence generating one of them starts a new SMILES.
+
+    The generation calls `reset` with the prompts before the first step and `reorder` when the beams are reordered,
+    `input_ids` is updated in place in between. A processor called before any `reset` resets itself.
+
+    Args:
+        smiles_vocab (`Dict[str, int]`):
+            The SMILES tokens and their ids, e.g. `{"{|C|}": 32000, "{|1|}": 32001}`.
+        eos_token_id (`int`, *optional*):
+            If set, the eos token is masked until the ring bonds and branches of the SMILES are closed.
+        pad_token_id (`int`, *optional*, defaults to 0):
+            The padding token id of `input_ids`.
+        filter_value (`float`, *optional*, defaults to `-50000`):
+            All filtered values will be set to this float value.
+
+    Examples:
+        >>> processor = SmilesGrammarLogitsProcessor.from_alphabet_file("smiles_alphabet.txt", start_id=32000,
+        ...                                                             eos_token_id=2)
+        >>> model.generate(input_ids, logits_processor=LogitsProcessorList([processor]))
+    """
+
+    def __init__(self, smiles_vocab: Dict[str, int], eos_token_id: int = None, pad_token_id: int = 0,
+                 filter_value: float = -50000):
+        token_ids, classes, digits = [], [], []
+        for token, token_id in smiles_vocab.items():
+            if not (token.startswith("{|") and token.endswith("|}") and len(token) == 5):
+                continue
+            char_class = _smiles_char_class(token[2])
+            if char_class is None:
+                continue
+            token_ids.append(token_id)
+            classes.append(char_class)
+            digits.append(int(token[2]) if char_class == _DIGIT else 0)
+        if not token_ids:
+            raise ValueError("`smiles_vocab` should contain the SMILES tokens like '{|C|}'.")
+
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = pad_token_id
+        self.filter_value = float(filter_value)
+        self.token_ids = np.array(token_ids, dtype=np.int64)
+        self.token_classes = np.array(classes, dtype=np.int64)
+        self.token_digits = np.array(digits, dtype=np.int64)
+        # token id -> index in token_ids, -1 for the other tokens
+        self.token_index = np.full(self.token_ids.max() + 1, -1, dtype=np.int64)
+        self.token_index[self.token_ids] = np.arange(len(token_ids))
+        self.close_tokens = self.token_classes == _CLOSE
+        self.digit_tokens = self.token_classes == _DIGIT
+
+        num_kinds = len(_TRANSITIONS)
+        self.transitions = np.full((num_kinds, _AT + 1), -1, dtype=np.int64)
+        for kind, transitions in _TRANSITIONS.items():
+            for char_class, next_kind in transitions.items():
+                self.transitions[kind, char_class] = next_kind
+        # allowed[kind]: the bitmap of the SMILES tokens allowed after a state
+        self.allowed = self.transitions[:, self.token_classes] >= 0
+        self.ring_bond_kinds = np.isin(np.arange(num_kinds), _RING_BOND_KINDS)
+        self.atom_start_classes = np.isin(np.arange(_AT + 1), list(_ATOM_STARTS))
+        self.complete_kinds = np.isin(np.arange(num_kinds), _COMPLETE_KINDS)
+
+        self.lengths = None
+        self.kinds = None
+        self.depths = None
+        self.open_rings = None
+        self.atom_rings = None
+        self.num_rings = None
+        self.ring_tens = None
+
+    @classmethod
+    def from_alphabet_file(cls, path: str, start_id: int = 32000, **kwargs):
+        """
+        Build the processor from a SMILES alphabet file like `smiles_alphabet.txt`, whose tokens are added to the
+        tokenizer in order from `start_id`.
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            tokens = [line.strip() for line in file if line.strip()]
+        return cls({token: start_id + index for index, token in enumerate(tokens)}, **kwargs)
+
+    def reset(self, input_ids):
+        """Start the SMILES of all the sequences after the current tokens of `input_ids`."""
+        batch_size = input_ids.shape[0]
+        self.lengths = np.count_nonzero(input_ids != self.pad_token_id, axis=-1)
+        self.kinds = np.zeros(batch_size, dtype=np.int64)
+        self.depths = np.zeros(batch_size, dtype=np.int64)
+        self.open_rings = np.zeros((batch_size, _NUM_RING_LABELS), dtype=np.bool_)
+        self.atom_rings = np.zeros((batch_size, _NUM_RING_LABELS), dtype=np.bool_)
+        self.num_rings = np.zeros(batch_size, dtype=np.int64)
+        self.ring_tens = np.zeros(batch_size, dtype=np.int64)
+
+    def reorder(self, beam_index):
+        """Reorder the parser states of the sequences, row `i` continues the sequence of the row `beam_index[i]`."""
+        if self.kinds is None:
+            return
+        self.lengths = self.lengths[beam_index]
+        self.kinds = self.kinds[beam_index]
+        self.depths = self.depths[beam_index]
+        self.open_rings = self.open_rings[beam_index]
+        self.atom_rings = self.atom_rings[beam_index]
+        self.num_rings = self.num_rings[beam_index]
+        self.ring_tens = self.ring_tens[beam_index]
+
+    def _restart(self, rows):
+        self.kinds[rows] = _START
+        self.depths[rows] = 0
+        self.open_rings[rows] = False
+        self.atom_rings[rows] = False
+        self.num_rings[rows] = 0
+
+    def _advance(self, rows, tokens):
+        """Update the parser states of `rows` with one new token each."""
+        index = np.full(tokens.shape, -1, dtype=np.int64)
+        known = tokens < len(self.token_index)
+        index[known] = self.token_index[tokens[known]]
+        is_smiles = index >= 0
+        self._restart(rows[~is_smiles])
+        rows, index = rows[is_smiles], index[is_smiles]
+        kinds, classes, digits = self.kinds[rows], self.token_classes[index], self.token_digits[index]
+        next_kinds = self.transitions[kinds, classes]
+
+        is_digit = classes == _DIGIT
+        ring_bond = is_digit & self.ring_bond_kinds[kinds]
+        labels = np.where(kinds == _PERCENT_DIGIT, self.ring_tens[rows] * 10 + digits, digits)
+        ring_bond |= is_digit & (kinds == _PERCENT_DIGIT)
+        ring_rows, ring_labels = rows[ring_bond], labels[ring_bond]
+        # a ring bond closed on the atom it is opened on is against the grammar
+        next_kinds[ring_bond] = np.where(self.atom_rings[ring_rows, ring_labels], -1, next_kinds[ring_bond])
+        self.num_rings[ring_rows] += np.where(self.open_rings[ring_rows, ring_labels], -1, 1)
+        self.open_rings[ring_rows, ring_labels] ^= True
+        self.atom_rings[ring_rows, ring_labels] = self.open_rings[ring_rows, ring_labels]
+        percent = is_digit & (kinds == _PERCENT)
+        self.ring_tens[rows[percent]] = digits[percent]
+        outside = kinds < _BRACKET_OPEN
+        self.depths[rows] += (outside & (classes == _OPEN)).astype(np.int64) - (outside & (classes == _CLOSE))
+        # a new atom starts without ring bonds
+        self.atom_rings[rows[outside & self.atom_start_classes[classes]]] = False
+        self.kinds[rows] = next_kinds
+        # a token forced against the grammar starts a new SMILES
+        self._restart(rows[next_kinds < 0])
+
+    def _consume(self, input_ids):
+        """Read the tokens appended to `input_ids` since the last call."""
+        rows = np.arange(input_ids.shape[0])
+        seq_length = input_ids.shape[1]
+        while True:
+            tokens = input_ids[rows, np.minimum(self.lengths, seq_length - 1)]
+            new = (self.lengths < seq_length) & (tokens != self.pad_token_id)
+            if not new.any():
+                return
+            self._advance(rows[new], tokens[new].astype(np.int64))
+            self.lengths[new] += 1
+
+    def __call__(self, input_ids, scores):
+        input_ids = np.asarray(input_ids)
+        if self.kinds is None:
+            self.reset(input_ids)
+        elif len(self.kinds) != input_ids.shape[0]:
+            raise ValueError(f"The batch size {input_ids.shape[0]} of input_ids is not the one {len(self.kinds)} of "
+                             "the parser states, `reset` should be called before a new generation.")
+        else:
+            self._consume(input_ids)
+
+        allowed = self.allowed[self.kinds]
+        allowed[:, self.close_tokens] &= (self.depths > 0)[:, None]
+        # the ring bond labels opened on the last atom cannot be closed on it
+        digits = self.token_digits[self.digit_tokens]
+        is_percent_digit = (self.kinds == _PERCENT_DIGIT)[:, None]
+        labels = np.where(is_percent_digit, self.ring_tens[:, None] * 10 + digits, digits)
+        same_atom = np.take_along_axis(self.atom_rings, labels, axis=-1)
+        same_atom &= self.ring_bond_kinds[self.kinds][:, None] | is_percent_digit
+        allowed[:, self.digit_tokens] &= ~same_atom
+        scores[:, self.token_ids] = np.where(allowed, scores[:, self.token_ids], self.filter_value)
+        if self.eos_token_id is not None:
+            complete = self.complete_kinds[self.kinds] & (self.depths == 0) & (self.num_rings == 0)
+            scores[~complete, self.eos_token_id] = self.filter_value
+        return scores
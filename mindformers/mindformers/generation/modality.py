@@ -0,0 +1,71 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Modality tracking of the generated tokens."""
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+__all__ = ["ModalityTracker"]
+
+# the SMILES tokens added after the 32000 tokens of the llama vocabulary
+DEFAULT_MODALITY_RANGES = [[32000, None]]
+
+
+class ModalityTracker:
+    """
+    Track the molecular mask of the sequences during generation.
+
+    The mask of the prompts is computed once by `prefill`, then `append` sets one flag per sampled token, so the
+    full `[bs, seq_length]` mask is never recomputed.
+
+    Args:
+        modality_ranges (list): The `[start, end)` token id ranges of the molecular vocabularies, e.g. SMILES,
+            protein and nucleic acid tokens. `end` can be None for an unbounded range.
+            Default None, means `[[32000, None]]`.
+    """
+    def __init__(self, modality_ranges: Optional[Sequence[Sequence[Optional[int]]]] = None):
+        modality_ranges = DEFAULT_MODALITY_RANGES if modality_ranges is None else modality_ranges
+        self.modality_ranges: List[list] = []
+        for modality_range in modality_ranges:
+            start, end = modality_range
+            if end is not None and end <= start:
+                raise ValueError(f"The modality range should be [start, end) with end > start, "
+                                 f"but got {modality_range}.")
+            self.modality_ranges.append([start, end])
+        self.mask = None
+        self.last_mask = None
+
+    def is_molecular(self, token_ids):
+        """Get the int32 molecular flags of `token_ids`, with the same shape."""
+        token_ids = np.asarray(token_ids)
+        flags = np.zeros(token_ids.shape, dtype=np.bool_)
+        for start, end in self.modality_ranges:
+            in_range = token_ids >= start
+            if end is not None:
+                in_range &= token_ids < end
+            flags |= in_range
+        return flags.astype(np.int32)
+
+    def prefill(self, input_ids):
+        """Compute the molecular mask of the padded prompts with shape [bs, seq_length]."""
+        self.mask = self.is_molecular(input_ids)
+        self.last_mask = np.zeros((self.mask.shape[0], 1), dtype=np.int32)
+        return self.mask
+
+    def append(self, batch_index, position, token_id):
+        """Set the flag of the token sampled for `batch_index` at `position`, or of the arrays of them."""
+        flag = self.is_molecular(token_id)
+        self.mask[batch_index, position] = flag
+        self.last_mask[batch_index, 0] = flag
@@ -0,0 +1,151 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Shared prefix cache of the paged kv cache."""
+from collections import OrderedDict
+
+from mindformers.generation.block_manager import BlockManager
+
+__all__ = ["PrefixCache"]
+
+
+class PrefixCache:
+    """
+    Keep the paged kv cache blocks of the prefilled prompts, so that the prompts starting with the same tokens, such
+    as the instruction template of a conversation, skip the prefill of the shared prefix.
+
+    Every full block of a prompt is keyed by the hash of all the token ids up to the end of the block, and keeps its
+    token ids and the hash of the previous block to check a matched block against a hash collision. The cached
+    blocks hold a reference in the `BlockManager`, the least recently used ones not used by any sequence are
+    released when the cache exceeds `max_bytes` or the block manager is out of blocks.
+
+    Args:
+        block_manager (BlockManager): The block manager of the paged kv cache.
+        max_bytes (int): The byte budget of the cached blocks.
+        block_bytes (int): The bytes of the key and value of a block over all layers.
+
+    Examples:
+        >>> prefix_cache = PrefixCache(block_manager, max_bytes=64 * 1024 * 1024, block_bytes=block_bytes)
+        >>> block_manager.allocate(0, len(input_ids), prefix_cache.match(input_ids))
+        >>> # prefill the tokens after block_manager.prefix_lengths[0]
+        >>> prefix_cache.insert(input_ids, block_manager.tables[0])
+    """
+    def __init__(self, block_manager: BlockManager, max_bytes: int, block_bytes: int):
+        self.block_manager = block_manager
+        self.block_size = block_manager.block_size
+        self.max_blocks = max_bytes // block_bytes
+        self.block_bytes = block_bytes
+        # prefix hash -> (block id, (previous prefix hash, block token ids)), in least recently used order
+        self.blocks = OrderedDict()
+        block_manager.reclaim = self.evict
+
+        self.num_queries = 0
+        self.num_hits = 0
+        self.query_tokens = 0
+        self.saved_prefill_tokens = 0
+
+    def _hashes(self, input_ids, num_blocks):
+        """The prefix hashes of the first `num_blocks` full blocks and their keys of the previous hash and tokens."""
+        hashes = []
+        prefix_hash = None
+        for block_index in range(num_blocks):
+            block = tuple(int(token) for token in input_ids[block_index * self.block_size:
+                                                            (block_index + 1) * self.block_size])
+            key = (prefix_hash, block)
+            prefix_hash = hash(key)
+            hashes.append((prefix_hash, key))
+        return hashes
+
+    def match(self, input_ids):
+        """
+        Get the cached blocks of the longest cached prefix of a prompt, at least the last token is left to prefill.
+
+        Args:
+            input_ids (list): The prompt token ids.
+
+        Returns:
+            list, the block ids of the prefix.
+        """
+        self.num_queries += 1
+        self.query_tokens += len(input_ids)
+        matched = []
+        for prefix_hash, key in self._hashes(input_ids, (len(input_ids) - 1) // self.block_size):
+            block, block_key = self.blocks.get(prefix_hash, (None, None))
+            # the previous blocks are checked already, a block with other tokens is a hash collision
+            if block is None or block_key != key:
+                break
+            self.blocks.move_to_end(prefix_hash)
+            matched.append(block)
+        if matched:
+            self.num_hits += 1
+            self.saved_prefill_tokens += len(matched) * self.block_size
+        return matched
+
+    def insert(self, input_ids, table):
+        """
+        Cache the full blocks of a prefilled prompt.
+
+        Args:
+            input_ids (list): The prompt token ids.
+            table (list): The block table of the prompt.
+        """
+        if not self.max_blocks:
+            return
+        for (prefix_hash, key), block in zip(self._hashes(input_ids, len(input_ids) // self.block_size), table):
+            if prefix_hash in self.blocks:
+                if self.blocks[prefix_hash][1] != key:
+                    # the hash of another prefix, the next blocks could not be matched
+                    break
+                self.blocks.move_to_end(prefix_hash)
+                continue
+            self.blocks[prefix_hash] = (block, key)
+            self.block_manager.retain(block)
+        self.evict(len(self.blocks) - self.max_blocks)
+
+    def evict(self, num_blocks):
+        """
+        Release up to `num_blocks` least recently used blocks which are not used by any sequence.
+
+        Returns:
+            int, the number of released blocks.
+        """
+        evicted = []
+        for prefix_hash, (block, _) in self.blocks.items():
+            if len(evicted) >= num_blocks:
+                break
+            if self.block_manager.ref_counts[block] == 1:
+                evicted.append(prefix_hash)
+        for prefix_hash in evicted:
+            self.block_manager.release(self.blocks.pop(prefix_hash)[0])
+        return len(evicted)
+
+    def clear(self):
+        """Release all the cached blocks not used by any sequence."""
+        self.evict(len(self.blocks))
+
+    @property
+    def hit_rate(self):
+        """The ratio of the prompts starting with a cached prefix."""
+        return self.num_hits / self.num_queries if self.num_queries else 0.
+
+    @property
+    def cached_bytes(self):
+        """The bytes of the cached blocks."""
+        return len(self.blocks) * self.block_bytes
+
+    def stats(self):
+        """The counters of the cache."""
+        return {"queries": self.num_queries, "hits": self.num_hits, "hit_rate": self.hit_rate,
+                "query_tokens": self.query_tokens, "saved_prefill_tokens": self.saved_prefill_tokens,
+                "cached_blocks": len(self.blocks), "cached_bytes": self.cached_bytes}
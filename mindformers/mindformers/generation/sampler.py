@@ -0,0 +1,102 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Vectorized next token sampling for a batch."""
+from typing import Optional
+
+import numpy as np
+
+__all__ = ["BatchSampler"]
+
+
+class BatchSampler:
+    """
+    Sample the next tokens of all the rows of a batch at once.
+
+    Greedy search takes the argmax of every row. Multinomial sampling draws a single uniform number per row from
+    the random generator of the row, and picks the token where the cumulative probability of the row goes over it
+    (inverse CDF). The tokens of a row then depend on its own generator only, not on the other rows of the batch.
+    The cumulative probabilities are computed for blocks of `block_size` tokens, then for the tokens of the one
+    block holding the sample, so that the whole vocabulary is only read by the vectorized exp and block sums.
+
+    Args:
+        batch_size (int): The number of rows.
+        seed (int): The seed of the random generators, the generator of row `i` is seeded with `[seed, i]`.
+            Default None, means a seed drawn from `np.random`, so that `np.random.seed` still fixes the samples.
+
+    Examples:
+        >>> import numpy as np
+        >>> from mindformers.generation import BatchSampler
+        >>> sampler = BatchSampler(batch_size=2, seed=0)
+        >>> scores = np.array([[0., 5., 1.], [3., 0., -np.inf]], np.float32)
+        >>> sampler.sample(scores, do_sample=False).tolist()
+        [1, 0]
+    """
+    block_size = 256
+
+    def __init__(self, batch_size: int, seed: Optional[int] = None):
+        if seed is None:
+            seed = int(np.random.randint(np.iinfo(np.int32).max))
+        self.generators = [np.random.default_rng([seed, row]) for row in range(batch_size)]
+
+    def sample(self, scores, do_sample: bool, rows=None, token_ids=None):
+        """
+        Sample the next token of the rows.
+
+        Args:
+            scores (np.ndarray): The processed scores with shape [bs, vocab_size], or [bs, K] for candidates.
+            do_sample (bool): Multinomial sampling from the softmax of the scores, else greedy search.
+            rows (np.ndarray): The indices of the rows to sample. Default None, means all the rows.
+            token_ids (np.ndarray): The token ids of the scores with the same shape, e.g. the candidates of an
+                in-graph top k. Default None, means the scores are indexed by token id.
+
+        Returns:
+            np.ndarray, the int32 token ids of the rows with shape [len(rows)].
+        """
+        if rows is not None and len(rows) < scores.shape[0]:
+            scores = scores[rows]
+            token_ids = token_ids[rows] if token_ids is not None else None
+        if do_sample:
+            generators = self.generators if rows is None else [self.generators[row] for row in rows]
+            index = self._inverse_cdf(scores, generators)
+        else:
+            index = np.argmax(scores, axis=-1)
+        if token_ids is not None:
+            return np.take_along_axis(token_ids, index[:, None], axis=-1)[:, 0].astype(np.int32)
+        return index.astype(np.int32)
+
+    def _inverse_cdf(self, scores, generators):
+        """the index of the token sampled from the softmax of every row of scores."""
+        num_rows, vocab_size = scores.shape
+        num_blocks = -(-vocab_size // self.block_size)
+        # the unnormalized probabilities, padded with zeros to whole blocks
+        weights = np.zeros((num_rows, num_blocks * self.block_size), np.float32)
+        probs = weights[:, :vocab_size]
+        np.subtract(scores, scores.max(axis=-1, keepdims=True), out=probs)
+        np.exp(probs, out=probs)
+        weights = weights.reshape(num_rows, num_blocks, self.block_size)
+        block_cdf = np.cumsum(weights.sum(axis=-1).astype(np.float64), axis=-1)
+        index = np.empty(num_rows, np.int64)
+        for row, generator in enumerate(generators):
+            uniform = min(generator.random() * block_cdf[row, -1], np.nextafter(block_cdf[row, -1], 0))
+            # the first block and token whose cumulative probability is over the uniform number have a nonzero one
+            block = min(int(np.searchsorted(block_cdf[row], uniform, side="right")), num_blocks - 1)
+            if block:
+                uniform -= block_cdf[row, block - 1]
+            token = int(np.searchsorted(np.cumsum(weights[row, block], dtype=np.float64), uniform, side="right"))
+            if token >= self.block_size:
+                # rounding put the uniform number at the end of the block
+                token = int(np.flatnonzero(weights[row, block])[-1])
+            index[row] = block * self.block_size + token
+        return index
@@ -0,0 +1,172 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Speculative decoding of the text generation."""
+import numpy as np
+import mindspore.common.dtype as mstype
+from mindspore.common.tensor import Tensor
+
+from mindformers.generation.modality import ModalityTracker
+
+__all__ = ["DraftModelProposer", "PromptLookupProposer", "SpeculativeStats"]
+
+
+class SpeculativeStats:
+    """The counters of the draft tokens proposed to and accepted by speculative decoding."""
+    def __init__(self):
+        self.steps = 0
+        self.proposed_tokens = 0
+        self.accepted_tokens = 0
+        self.generated_tokens = 0
+
+    def update(self, num_proposed, num_accepted, num_generated):
+        """Count the draft tokens of a verification step and the tokens it generates."""
+        self.steps += 1
+        self.proposed_tokens += int(num_proposed)
+        self.accepted_tokens += int(num_accepted)
+        self.generated_tokens += int(num_generated)
+
+    def stats(self):
+        """The acceptance rate of the draft tokens and the tokens generated per verification step."""
+        return {
+            "steps": self.steps,
+            "proposed_tokens": self.proposed_tokens,
+            "accepted_tokens": self.accepted_tokens,
+            "acceptance_rate": self.accepted_tokens / max(self.proposed_tokens, 1),
+            "tokens_per_step": self.generated_tokens / max(self.steps, 1),
+        }
+
+
+class DraftModelProposer:
+    """
+    Propose the next tokens of a batch with a small draft model, such as a Llama of a few layers with the vocabulary
+    of the generating model, by greedy decoding.
+
+    The draft model keeps its own kv cache. Every proposal feeds the last two tokens of the sequences at once, so
+    that the cache of a sequence catches up whatever number of its tokens are accepted, then decodes the other
+    tokens one by one. The cache of the rejected tokens is overwritten by the next proposal.
+
+    Args:
+        draft_model: The draft model with `use_past`, the batch size and the seq_length of the generating model.
+        num_tokens (int): The number of the tokens proposed for every sequence. Default 4.
+        modality_ranges (list): The token id ranges of the molecular vocabularies, the molecular mask of the draft
+            model is computed with them. Default None, see `ModalityTracker`.
+    """
+    def __init__(self, draft_model, num_tokens=4, modality_ranges=None):
+        if not draft_model.config.use_past:
+            raise ValueError("The draft model should be built with use_past.")
+        self.draft_model = draft_model
+        self.num_tokens = num_tokens
+        self.modality_tracker = ModalityTracker(modality_ranges)
+
+    def prefill(self, input_ids, valid_length):
+        """Prefill the draft kv cache with the padded prompts, of the `valid_length` tokens."""
+        model = self.draft_model
+        batch_size, seq_length = input_ids.shape
+        if model.config.batch_size != batch_size or model.config.seq_length != seq_length:
+            raise ValueError(f"The batch size and the seq_length of the draft model ({model.config.batch_size}, "
+                             f"{model.config.seq_length}) should be the ones of the generating model "
+                             f"({batch_size}, {seq_length}).")
+        model.set_train(False)
+        model.is_first_iteration = True
+        model_inputs = model.prepare_inputs_for_generation(input_ids)
+        model_inputs["molecular_mask"] = Tensor(self.modality_tracker.prefill(input_ids), mstype.int32)
+        current_index = valid_length - 1 + np.arange(batch_size) * seq_length
+        model._incremental_infer(model_inputs, current_index.tolist(), valid_length) # pylint: disable=W0212
+
+    def propose(self, input_ids, valid_length):
+        """
+        The [bs, num_tokens] tokens following the `valid_length` tokens of every sequence, and the number of the
+        proposed tokens of every sequence, which is `num_tokens`.
+        """
+        model = self.draft_model
+        batch_size = input_ids.shape[0]
+        rows = np.arange(batch_size)
+        proposals = np.zeros((batch_size, self.num_tokens), dtype=np.int32)
+        # the last token was not fed yet, the one before it may have been rejected last time
+        tokens = np.stack([input_ids[rows, valid_length - 2], input_ids[rows, valid_length - 1]], axis=1)
+        for i in range(self.num_tokens):
+            # pylint: disable=W0212
+            logits = model._multi_token_infer(tokens, valid_length + i, self.modality_tracker)
+            proposals[:, i] = np.argmax(logits[:, -1], axis=-1)
+            tokens = proposals[:, i:i + 1]
+        return proposals, np.full(batch_size, self.num_tokens)
+
+
+class PromptLookupProposer:
+    """
+    Propose the next tokens of a batch by copying them from the sequences, without a draft model.
+
+    The captions and the SMILES generated from a prompt often copy the spans of the prompt, such as the names of the
+    substructures and the SMILES fragments, or repeat the spans generated before. The longest suffix of at most
+    `max_ngram_size` tokens of a sequence which is also in its prompt or in its generated tokens is looked up, and
+    the tokens following it are proposed. The n-grams of the prompt are indexed by `prefill` at their first
+    occurrence, the n-grams of the generated tokens are indexed as they are generated at their last occurrence.
+
+    Args:
+        num_tokens (int): The max number of the tokens proposed for every sequence. Default 4.
+        max_ngram_size (int): The max length of the looked up suffixes. Default 3.
+    """
+    def __init__(self, num_tokens=4, max_ngram_size=3):
+        if max_ngram_size < 1:
+            raise ValueError(f"max_ngram_size should be positive, but get {max_ngram_size}.")
+        self.num_tokens = num_tokens
+        self.max_ngram_size = max_ngram_size
+        self.prompt_index = []
+        self.output_index = []
+        self.indexed_length = None
+
+    def _add_ngrams(self, index, tokens, end, first):
+        """Index the n-grams of `tokens` ending before `end` with the position after them."""
+        for ngram_size in range(1, min(self.max_ngram_size, end) + 1):
+            key = tuple(tokens[end - ngram_size:end])
+            if not first or key not in index:
+                index[key] = end
+
+    def prefill(self, input_ids, valid_length):
+        """Index the n-grams of the prompts of the `valid_length` tokens."""
+        self.prompt_index = [{} for _ in range(input_ids.shape[0])]
+        self.output_index = [{} for _ in range(input_ids.shape[0])]
+        self.indexed_length = np.asarray(valid_length).copy()
+        for row, length in enumerate(self.indexed_length):
+            tokens = input_ids[row, :length].tolist()
+            for end in range(1, length + 1):
+                self._add_ngrams(self.prompt_index[row], tokens, end, first=True)
+
+    def propose(self, input_ids, valid_length):
+        """
+        The [bs, num_tokens] tokens following the `valid_length` tokens of every sequence, padded with 0, and the
+        number of the proposed tokens of every sequence.
+        """
+        batch_size = input_ids.shape[0]
+        proposals = np.zeros((batch_size, self.num_tokens), dtype=np.int32)
+        num_proposed = np.zeros(batch_size, dtype=np.int64)
+        for row in range(batch_size):
+            length = int(valid_length[row])
+            tokens = input_ids[row, :length].tolist()
+            # the generated n-grams with a following token
+            for end in range(self.indexed_length[row] + 1, length):
+                self._add_ngrams(self.output_index[row], tokens, end, first=False)
+            self.indexed_length[row] = max(self.indexed_length[row], length - 1)
+            for ngram_size in range(min(self.max_ngram_size, length), 0, -1):
+                key = tuple(tokens[length - ngram_size:])
+                start = self.prompt_index[row].get(key, length)
+                if start >= length:
+                    start = self.output_index[row].get(key, length)
+                if start < length:
+                    continuation = tokens[start:start + self.num_tokens]
+                    proposals[row, :len(continuation)] = continuation
+                    num_proposed[row] = len(continuation)
+                    break
+        return proposals, num_proposed
@@ -23,7 +23,7 @@ except ImportError:
     import mindspore._checkparam as Validator
 from mindformers.models.base_tokenizer import BaseTokenizer
 
-__all__ = ['BaseStreamer', 'TextStreamer', 'TextIteratorStreamer']
+__all__ = ['BaseStreamer', 'IncrementalDetokenizer', 'TextStreamer', 'TextIteratorStreamer']
 
 
 class BaseStreamer:
@@ -40,9 +40,75 @@ class BaseStreamer:
         raise NotImplementedError()
 
 
+class IncrementalDetokenizer:
+    """
+    Decode the tokens of one sequence as they are generated, in O(1) per token.
+
+    Only a small window of the latest tokens is decoded: the tokens already printed whose text may still join the
+    next ones, such as the bytes of a character or the leading space of a word, and the tokens not printed yet. The
+    text of the new tokens is the suffix added to the text of the printed tokens in the window, it is printed once it
+    is stable, i.e. it does not end with an incomplete character, and the window moves past the printed tokens.
+
+    Args:
+        tokenizer (`BaseTokenizer`):
+            The tokenized used to decode the tokens.
+        decode_kwargs (`dict`, *optional*):
+            Additional keyword arguments to pass to the tokenizer's `decode` method.
+
+    Examples:
+        >>> from mindformers import LlamaTokenizer
+        >>> from mindformers.generation import IncrementalDetokenizer
+        >>> tokenizer = LlamaTokenizer.from_pretrained("llama_7b")
+        >>> detokenizer = IncrementalDetokenizer(tokenizer)
+        >>> text = "".join(detokenizer.put([token]) for token in tokenizer("Hello world")["input_ids"][1:])
+        >>> text + detokenizer.end()
+        'Hello world'
+    """
+
+    def __init__(self, tokenizer: BaseTokenizer, **decode_kwargs):
+        self.tokenizer = tokenizer
+        self.decode_kwargs = decode_kwargs
+        # the window of tokens, tokens[:read_offset] are printed
+        self.tokens = []
+        self.read_offset = 0
+
+    def _decode(self, token_ids):
+        return self.tokenizer.decode(token_ids, **self.decode_kwargs) if token_ids else ""
+
+    def put(self, token_ids):
+        """Add the new token ids, return the new stable text."""
+        self.tokens.extend(token_ids)
+        if self.read_offset == len(self.tokens):
+            return ""
+        prefix_text = self._decode(self.tokens[:self.read_offset])
+        text = self._decode(self.tokens)
+        # wait for the next tokens if the text is not complete, or if it changes the printed text
+        if len(text) <= len(prefix_text) or text.endswith("\ufffd") or not text.startswith(prefix_text):
+            return ""
+        # the window keeps the last printed tokens only
+        self.tokens = self.tokens[self.read_offset:]
+        self.read_offset = len(self.tokens)
+        return text[len(prefix_text):]
+
+    def end(self):
+        """Return the text of the tokens not printed yet and reset."""
+        text = ""
+        if self.read_offset < len(self.tokens):
+            prefix_text = self._decode(self.tokens[:self.read_offset])
+            text = self._decode(self.tokens)[len(prefix_text):]
+        self.tokens = []
+        self.read_offset = 0
+        return text
+
+
 class TextStreamer(BaseStreamer):
     """
-    Simple text streamer that prints the token(s) to stdout as soon as entire words are formed.
+    Simple text streamer that prints the token(s) to stdout as soon as their text is stable.
+
+    The tokens are decoded by an `IncrementalDetokenizer` per sequence, so every step decodes a few tokens whatever
+    the length of the output. `put` also takes the tokens of a batch, a `[batch_size, n]` array or a list of the
+    1-D arrays of the sequences, an empty array for the sequences without new tokens; the text of a batch is then
+    the list of the new text of every sequence.
 
     <Tip warning={true}>
 
@@ -82,60 +148,38 @@ class TextStreamer(BaseStreamer):
         self.decode_kwargs = decode_kwargs
 
         # variables used in the streaming process
-        self.token_cache = []
-        self.print_len = 0
+        self.detokenizers = []
         self.next_tokens_are_prompt = True
 
     def put(self, value):
         """
-        Receives tokens, decodes them, and prints them to stdout as soon as they form entire words.
+        Receives tokens, decodes them, and prints them to stdout as soon as their text is stable.
         """
-        if len(value.shape) > 1 and value.shape[0] > 1:
-            raise ValueError("TextStreamer only supports batch size 1")
-        if len(value.shape) > 1:
-            value = value[0]
+        rows = [value] if not isinstance(value, (list, tuple)) and len(value.shape) == 1 else list(value)
+        while len(self.detokenizers) < len(rows):
+            self.detokenizers.append(IncrementalDetokenizer(self.tokenizer, **self.decode_kwargs))
 
         if self.skip_prompt and self.next_tokens_are_prompt:
             self.next_tokens_are_prompt = False
             return
 
-        # Add the new token to the cache and decodes the entire thing.
-        self.token_cache.extend(value.tolist())
-        text = self.tokenizer.decode(self.token_cache, **self.decode_kwargs)
-
-        # After the symbol for a new line, we flush the cache.
-        if text.endswith("\n"):
-            printable_text = text[self.print_len :]
-            self.token_cache = []
-            self.print_len = 0
-        # If the last token is a CJK character, we print the characters.
-        elif text and self._is_chinese_char(ord(text[-1])):
-            printable_text = text[self.print_len :]
-            self.print_len += len(printable_text)
-        # Otherwise, prints until the last space char (simple heuristic to avoid printing incomplete words,
-        # which may change with the subsequent token -- there are probably smarter ways to do this!)
-        else:
-            printable_text = text[self.print_len : text.rfind(" ") + 1]
-            self.print_len += len(printable_text)
-
-        self.on_finalized_text(printable_text)
+        texts = [detokenizer.put([int(token) for token in row]) for detokenizer, row in zip(self.detokenizers, rows)]
+        self.on_finalized_text(texts[0] if len(self.detokenizers) == 1 else texts)
 
     def end(self):
         """Flushes any remaining cache and prints a newline to stdout."""
-        # Flush the cache, if it exists
-        if self.token_cache:
-            text = self.tokenizer.decode(self.token_cache, **self.decode_kwargs)
-            printable_text = text[self.print_len :]
-            self.token_cache = []
-            self.print_len = 0
-        else:
-            printable_text = ""
-
+        texts = [detokenizer.end() for detokenizer in self.detokenizers]
         self.next_tokens_are_prompt = True
-        self.on_finalized_text(printable_text, stream_end=True)
+        self.on_finalized_text(texts[0] if len(texts) == 1 else (texts or ""), stream_end=True)
+        self.detokenizers = []
 
-    def on_finalized_text(self, text: str, stream_end: bool = False):
-        """Prints the new text to stdout. If the stream is ending, also prints a newline."""
+    def on_finalized_text(self, text, stream_end: bool = False):
+        """
+        Prints the new text to stdout. If the stream is ending, also prints a newline. The new text of a batch is
+        printed as a line per sequence with new text.
+        """
+        if isinstance(text, list):
+            text = "".join(f"[{row}] {row_text}\n" for row, row_text in enumerate(text) if row_text)
         print(text, flush=True, end="" if not stream_end else None)
 
     def _is_chinese_char(self, cp):
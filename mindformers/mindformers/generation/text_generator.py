@@ -19,25 +19,31 @@ For text generation
 import copy
 import time
 from typing import Optional, List, Union
-from mindspore import ops
 import numpy as np
 from mindspore.ops import functional as F
 from mindspore.ops import operations as P
 import mindspore.common.dtype as mstype
 from mindspore.common.tensor import Tensor
 
+from mindformers.generation.beam_search import BeamHypotheses, KVCacheReorder, log_softmax
+from mindformers.generation.block_manager import BlockManager
 from mindformers.generation.generation_config import GenerationConfig
-from mindformers.generation.logits_process import (LogitNormalization, LogitsProcessorList,
-                                                   RepetitionPenaltyLogitsProcessor,
-                                                   TemperatureLogitsWarper, TopKLogitsWarper,
-                                                   TopPLogitsWarper)
+from mindformers.generation.logits_process import (CandidateLogitsWarper, LogitNormalization, LogitsProcessorList,
+                                                   RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper)
+from mindformers.generation.modality import ModalityTracker
+from mindformers.generation.prefix_cache import PrefixCache
+from mindformers.generation.sampler import BatchSampler
+from mindformers.generation.speculative import DraftModelProposer, PromptLookupProposer, SpeculativeStats
 from mindformers.generation.streamers import BaseStreamer
-from mindformers.generation.utils import softmax
+from mindformers.generation.utils import get_valid_length
 from mindformers.tools import logger
 np.set_printoptions(threshold=np.inf)
 
 __all__ = ["GeneratorMixin"]
 
+# the score of the beams not continued
+_NO_BEAM = -1e9
+
 
 class GeneratorMixin:
     """Generator For the nlp models"""
@@ -69,37 +75,28 @@ class GeneratorMixin:
         """
         return
 
+    # pylint: disable=W0613
+    def prepare_incremental_inputs(self, next_tokens, **kwargs):
+        """
+        prepare inputs for non-first iterations of incremental infer from the tokens sampled last step.
+        If the incremental inputs of your model only depend on the new tokens, implement this method in your model
+        so that only the `[bs, 1]` tokens are sent to device every step, else return None and the full inputs
+        are sliced by `slice_incremental_inputs`.
+
+        Args:
+            next_tokens(numpy.ndarray): The tokens sampled last step with shape [bs, 1].
+        """
+        return None
+
     def slice_incremental_inputs(self, model_inputs: dict, current_index):
         """used for non-first iterations, slice the inputs to length 1."""
-        input_ids = model_inputs.pop("input_ids")
-        # print('before input_ids:', input_ids)
-        if isinstance(input_ids, Tensor):
-            input_ids = input_ids.asnumpy()
-        inputs_tmp = []
-        for i, index_value in enumerate(current_index):
-            current_index_tmp = (
-                int(index_value) - i * input_ids.shape[1]
-            )  # multibatch
-            # use numpy to slice array to avoid complie ascend slice op
-            inputs_tmp.append(input_ids[i][current_index_tmp : current_index_tmp + 1])
-        inputs_tmp = np.array(inputs_tmp, dtype=np.int32)
-        model_inputs["input_ids"] = Tensor(inputs_tmp, mstype.int32)
-        # print('after input_ids:', model_inputs["input_ids"])
-        molecular_mask = model_inputs.pop("molecular_mask")
-        # print('before:', molecular_mask)
-        if isinstance(molecular_mask, Tensor):
-            molecular_mask = molecular_mask.asnumpy()
-        molecular_mask_tmp = []
-        for i, index_value in enumerate(current_index):
-            current_index_tmp = (
-                int(index_value) - i * molecular_mask.shape[1]
-            )  # multibatch
-            # use numpy to slice array to avoid complie ascend slice op
-            molecular_mask_tmp.append(molecular_mask[i][current_index_tmp : current_index_tmp + 1])
-        molecular_mask_tmp = np.array(molecular_mask_tmp, dtype=np.int32)
-
-        model_inputs["molecular_mask"] = Tensor(molecular_mask_tmp, mstype.int32)
-        # print('after:', model_inputs["molecular_mask"])
+        index = Tensor(current_index, mstype.int32)
+        for name in ("input_ids", "molecular_mask"):
+            value = model_inputs.pop(name)
+            if not isinstance(value, Tensor):
+                value = Tensor(value, mstype.int32)
+            # gather on device, current_index is the flattened position of the last token of every example
+            model_inputs[name] = P.Gather()(value.reshape(-1), index, 0).reshape(-1, 1)
 
     def process_logits(self, logits, current_index=None, keep_all=False):
         """Process the logits"""
@@ -160,13 +157,15 @@ class GeneratorMixin:
         warpers = LogitsProcessorList()
 
         # all samplers can be found in `generation_utils_samplers.py`
-        if generation_config.temperature is not None and generation_config.temperature != 1.0:
-            warpers.append(TemperatureLogitsWarper(generation_config.temperature))
-        min_tokens_to_keep = 1
-        if generation_config.top_k is not None and generation_config.top_k != 0:
-            warpers.append(TopKLogitsWarper(top_k=generation_config.top_k, min_tokens_to_keep=min_tokens_to_keep))
-        if generation_config.top_p is not None and generation_config.top_p < 1.0:
-            warpers.append(TopPLogitsWarper(top_p=generation_config.top_p, min_tokens_to_keep=min_tokens_to_keep))
+        temperature = generation_config.temperature if generation_config.temperature is not None else 1.0
+        top_k = generation_config.top_k or 0
+        top_p = generation_config.top_p if generation_config.top_p is not None else 1.0
+        if top_k or top_p < 1.0:
+            # temperature, top k and top p are applied to the candidates of a single partial sort
+            warpers.append(CandidateLogitsWarper(temperature=temperature, top_k=top_k, top_p=top_p,
+                                                 min_tokens_to_keep=1))
+        elif temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(temperature))
         # `LogitNormalization` should always be the last logit processor, when present
         if generation_config.renormalize_logits is True:
             warpers.append(LogitNormalization())
@@ -207,8 +206,64 @@ class GeneratorMixin:
         )
         return input_ids
 
-    def _incremental_infer(self, model_inputs: dict, current_index, valid_length_each_example):
+    def _get_block_manager(self, batch_size):
+        """
+        The block manager of the paged kv cache, None if the model keeps a dense kv cache. It is kept by the model
+        with the prefix cache, so that the cached prefixes are shared by the following generations.
+        """
+        if not getattr(self.config, "use_paged_kv_cache", False):
+            return None
+        block_manager = getattr(self, "_block_manager", None)
+        if block_manager is not None and block_manager.batch_size == batch_size:
+            return block_manager
+        num_blocks = self.config.kv_num_blocks
+        if num_blocks is None:
+            num_blocks = self.config.batch_size * self.config.seq_length // self.config.kv_block_size + 1
+        block_manager = BlockManager(num_blocks, self.config.kv_block_size, batch_size, self.config.seq_length)
+        if getattr(self.config, "prefix_cache_bytes", 0):
+            n_kv_heads = self.config.n_kv_heads or self.config.num_heads
+            head_dim = self.config.hidden_size // self.config.num_heads
+            item_size = np.dtype(mstype.dtype_to_nptype(self.config.compute_dtype)).itemsize
+            block_bytes = 2 * self.config.num_layers * self.config.kv_block_size * n_kv_heads * head_dim * item_size
+            self.prefix_cache = PrefixCache(block_manager, self.config.prefix_cache_bytes, block_bytes)
+        self._block_manager = block_manager
+        return block_manager
+
+    def _paged_inputs(self, block_manager: BlockManager, model_inputs: dict, input_ids, valid_length_each_example):
+        """Allocate the cache blocks of this step, add the block tables and slot mapping to the model inputs."""
+        prefix_cache = getattr(self, "prefix_cache", None)
+        for i, valid_length in enumerate(valid_length_each_example):
+            if self.is_first_iteration:
+                prefix_blocks = prefix_cache.match(input_ids[i, :valid_length]) if prefix_cache is not None else ()
+                allocated = block_manager.allocate(i, valid_length, prefix_blocks)
+            else:
+                allocated = block_manager.ensure(i, valid_length)
+            if not allocated:
+                raise RuntimeError(f"The paged kv cache is out of blocks at sequence {i} with {valid_length} tokens, "
+                                   f"please increase kv_num_blocks.")
+        if not self.is_first_iteration:
+            model_inputs["block_tables"] = Tensor(block_manager.block_tables(), mstype.int32)
+            model_inputs["slot_mapping"] = Tensor(
+                block_manager.slot_mapping(np.asarray(valid_length_each_example) - 1), mstype.int32)
+            return
+        model_inputs["slot_mapping"] = Tensor(
+            block_manager.prefill_slot_mapping(valid_length_each_example, self.config.seq_length), mstype.int32)
+        if prefix_cache is not None:
+            # only the tokens after the cached prefixes are prefilled, attending to the prefix blocks
+            for name in ("input_ids", "molecular_mask"):
+                value = model_inputs[name]
+                value = value.asnumpy() if isinstance(value, Tensor) else value
+                model_inputs[name] = Tensor(block_manager.skip_prefixes(value), mstype.int32)
+            model_inputs["block_tables"] = Tensor(block_manager.block_tables(), mstype.int32)
+            model_inputs["prefix_length"] = Tensor(block_manager.prefix_lengths, mstype.int32)
+
+    def _incremental_infer(self, model_inputs: dict, current_index, valid_length_each_example, block_manager=None,
+                           input_ids=None):
         """model forward for incremental infer."""
+        if block_manager is not None:
+            self._paged_inputs(block_manager, model_inputs, input_ids, valid_length_each_example)
+            if self.is_first_iteration:
+                current_index = np.asarray(current_index) - block_manager.prefix_lengths
         # Claim the first graph
         if self.is_first_iteration:
             self.add_flags_recursive(is_first_iteration=True)
@@ -219,12 +274,16 @@ class GeneratorMixin:
             res = self(
                 **model_inputs,
             )
+            if block_manager is not None and getattr(self, "prefix_cache", None) is not None:
+                for i, valid_length in enumerate(valid_length_each_example):
+                    self.prefix_cache.insert(input_ids[i, :valid_length], block_manager.tables[i])
             # first iter done, go to other iters
             self.is_first_iteration = False
         else:
             self.add_flags_recursive(is_first_iteration=False)
-            # slice model inputs for incremental infer
-            self.slice_incremental_inputs(model_inputs, current_index)
+            # slice model inputs for incremental infer, unless they are built from the sampled tokens already
+            if model_inputs["input_ids"].shape[-1] == self.config.seq_length:
+                self.slice_incremental_inputs(model_inputs, current_index)
             model_inputs["input_position"] = Tensor(current_index, mstype.int32)
             model_inputs["init_reset"] = Tensor([True], mstype.bool_)  # init_reset (1,) bool True
             model_inputs["batch_valid_length"] = Tensor([valid_length_each_example], mstype.int32)
@@ -235,6 +294,50 @@ class GeneratorMixin:
 
         return res
 
+    def _decoder_forward(self, input_ids, next_tokens, modality_tracker: ModalityTracker, current_index,
+                         valid_length_each_example, generation_config: GenerationConfig,
+                         block_manager: Optional[BlockManager], model_kwargs: dict):
+        """
+        The forward of a decoder only model generating the next tokens of the batch.
+
+        Returns:
+            res: the outputs of the model.
+            need_gather_logits: whether the logits of every position are returned, to be gathered by current_index.
+        """
+        model_kwargs["current_index"] = current_index
+        model_inputs = None
+        if generation_config.use_past and not self.is_first_iteration:
+            model_inputs = self.prepare_incremental_inputs(next_tokens, **model_kwargs)
+        if model_inputs is None:
+            # model prepare input dict
+            model_inputs = self.prepare_inputs_for_generation( # pylint: disable=E1111
+                input_ids, **model_kwargs
+            )
+        if model_inputs["input_ids"].shape[-1] == 1:
+            molecular_mask = modality_tracker.last_mask
+        else:
+            molecular_mask = modality_tracker.mask
+        model_inputs["molecular_mask"] = Tensor(molecular_mask, mstype.int32)
+        # incremental generate
+        if generation_config.use_past:
+            # when first iteration, gather last logits; others keep all logits.
+            need_gather_logits = self.is_first_iteration
+            # incremental generate
+            res = self._incremental_infer(
+                model_inputs=model_inputs,
+                current_index=current_index,
+                valid_length_each_example=valid_length_each_example,
+                block_manager=block_manager,
+                input_ids=input_ids,
+            )
+            return res, need_gather_logits
+        # auto-aggressive generate
+        if self.config.is_sample_acceleration:
+            # the last logits are gathered in graph
+            model_inputs["input_position"] = Tensor(current_index, mstype.int32)
+        res = self(**model_inputs)  # pylint: disable=E1102
+        return res, True
+
     def _forward(self,
                  origin_inputs,
                  generation_config: GenerationConfig,
@@ -260,26 +363,23 @@ class GeneratorMixin:
         if generation_config.pad_token_id is None:
             generation_config.pad_token_id = 0
 
-        if streamer is not None:
-            streamer.put(origin_inputs[0])
-
         batch_size = origin_inputs.shape[0]
         is_encoder_decoder = self.config.is_encoder_decoder
         logger.debug("The input shape is: %s", origin_inputs.shape)
-        valid_length_each_example = []
-        for i in range(batch_size):
-            # As the nonzero returns the index and we need length
-            valid_length_each_example.append(
-                np.max(np.argwhere(origin_inputs[i] != generation_config.pad_token_id))
-                + 1
-            )
-        valid_length_each_example = np.array(valid_length_each_example)
+        valid_length_each_example = get_valid_length(origin_inputs, generation_config.pad_token_id)
         logger.debug("Get the valid for each example is: %s", valid_length_each_example)
 
+        if streamer is not None:
+            # a batch is streamed as the list of the tokens of every example
+            streamer.put(origin_inputs[0] if batch_size == 1 else
+                         [origin_inputs[i, :valid_length_each_example[i]] for i in range(batch_size)])
+
         # Prepare `max_length` depending on other stopping criteria.
         input_ids_length = np.max(valid_length_each_example)
         if generation_config.max_new_tokens is not None:
-            generation_config.max_length = generation_config.max_new_tokens + input_ids_length
+            # max_new_tokens of every example, or the same for all
+            generation_config.max_length = int(np.max(valid_length_each_example +
+                                                      np.asarray(generation_config.max_new_tokens)))
 
         if generation_config.max_length > self.config.seq_length:
             logger.warning("max_length %s can not exceeds model seq_length %s, set max_length = seq_length.",
@@ -321,10 +421,25 @@ class GeneratorMixin:
                 input_ids,
                 target_mask,
             ) = self._prepare_model_inputs_for_decoder(input_ids, input_mask)
-            valid_length_each_example = [1 for _ in range(batch_size)]
+            valid_length_each_example = np.ones(batch_size, dtype=np.int64)
         # A single loop generates one token, loop until reaching target
         # model_origin_max_length or generating eod token
-        is_finished = [False] * batch_size
+        if is_encoder_decoder or np.ndim(generation_config.max_new_tokens) == 0:
+            max_length_each_example = np.full(batch_size, generation_config.max_length)
+        else:
+            max_length_each_example = np.minimum(valid_length_each_example + generation_config.max_new_tokens,
+                                                 generation_config.max_length)
+        is_finished = valid_length_each_example >= max_length_each_example
+        # the next tokens of the batch are sampled at once, from a random generator per example
+        sampler = BatchSampler(batch_size)
+
+        if self.config.is_sample_acceleration:
+            # the logits are post processed in the model graph with the sampling config of the model
+            if logits_processor:
+                logger.warning("The logits processors are skipped with is_sample_acceleration.")
+            if generation_config.do_sample != self.config.do_sample:
+                logger.warning("do_sample %s is different from the model config with is_sample_acceleration, "
+                               "the tokens are sampled by the model config.", generation_config.do_sample)
 
         # update model kwargs once, before go into generate loop.
         self.update_model_kwargs_before_generate(input_ids, model_kwargs)
@@ -334,6 +449,15 @@ class GeneratorMixin:
             self.is_first_iteration = True
         need_gather_logits = True
 
+        # the tokens sampled last step, fed alone to the non-first iterations of incremental infer
+        next_tokens = np.zeros((batch_size, 1), dtype=np.int32)
+        # the molecular mask of the prompts is computed once, then extended by one flag per sampled token
+        modality_tracker = ModalityTracker(generation_config.modality_ranges)
+        modality_tracker.prefill(input_ids)
+        logits_processor.reset(input_ids)
+        # the blocks of the paged kv cache are allocated as the sequences grow
+        block_manager = self._get_block_manager(batch_size) if generation_config.use_past else None
+
         origin_len = np.sum(valid_length_each_example)
         prepare_time = time.time() - prepare_time
         logger.debug("forward prepare time: %s s", prepare_time)
@@ -357,28 +481,9 @@ class GeneratorMixin:
                     decoder_attention_mask=Tensor(target_mask, mstype.float32),
                 )
             else:
-                model_kwargs["current_index"] = current_index
-                # model prepare input dict
-                model_inputs = self.prepare_inputs_for_generation( # pylint: disable=E1111
-                    input_ids, **model_kwargs
-                )
-                one = Tensor(1, mstype.int32)
-                zero = Tensor(0, mstype.int32)
-                molecular_mask = ops.where(model_inputs["input_ids"] >= 32000, one, zero)
-                model_inputs["molecular_mask"] = molecular_mask
-                # incremental generate
-                if generation_config.use_past:
-                    # when first iteration, gather last logits; others keep all logits.
-                    need_gather_logits = self.is_first_iteration
-                    # incremental generate
-                    res = self._incremental_infer(
-                        model_inputs=model_inputs,
-                        current_index=current_index,
-                        valid_length_each_example=valid_length_each_example,
-                    )
-                # auto-aggressive generate
-                else:
-                    res = self(**model_inputs)  # pylint: disable=E1102
+                res, need_gather_logits = self._decoder_forward(input_ids, next_tokens, modality_tracker,
+                                                                current_index, valid_length_each_example,
+                                                                generation_config, block_manager, model_kwargs)
             forward_time = time.time() - forward_time
 
             sample_time = time.time()
@@ -394,9 +499,15 @@ class GeneratorMixin:
                 if need_gather_logits and logits.shape[0] > len(current_index):
                     logits = logits[current_index]
                 # post process logits, without changing logits shape and order
-                probs = logits_processor(input_ids, logits)
-                probs = logits_warper(input_ids, probs)
-                p_args = np.tile(np.arange(logits.shape[-1]), (batch_size, 1))
+                probs = logits_processor(input_ids, logits, valid_length=valid_length_each_example)
+                if logits_warper and isinstance(logits_warper[0], CandidateLogitsWarper):
+                    # the [bs, K] candidates and their token ids are sampled from
+                    probs, p_args = logits_warper[0].candidates(probs)
+                    probs = LogitsProcessorList(logits_warper[1:])(input_ids, probs)
+                else:
+                    probs = logits_warper(input_ids, probs)
+                    # the probs are indexed by token id
+                    p_args = None
             else:
                 probs, p_args = res
                 if isinstance(probs, Tensor):
@@ -406,36 +517,25 @@ class GeneratorMixin:
             sample_time = time.time() - sample_time
 
             update_time = time.time()
-            # Random select a token as final output for this round
-            for i in range(batch_size):
-                if is_finished[i]:
-                    continue
-                if generation_config.do_sample:
-                    # multinomial sample
-                    p_norm = softmax(probs[i])
-                    target_index = np.random.choice(len(probs[i]), p=p_norm)
-                else:
-                    # greedy
-                    target_index = np.argmax(probs[i])
-
-                # get target token id
-                target = p_args[i][target_index]
-                input_ids[i, valid_length_each_example[i]] = target
-
-                if streamer is not None:
-                    streamer.put(np.asarray([target]))
-
-                if is_encoder_decoder:
-                    target_mask[i][valid_length_each_example[i]] = int(1)
+            # select a token as final output of every unfinished example for this round
+            rows = np.flatnonzero(~is_finished)
+            targets = sampler.sample(probs, generation_config.do_sample, rows, p_args)
+            positions = valid_length_each_example[rows]
+            input_ids[rows, positions] = targets
+            next_tokens[rows, 0] = targets
+            modality_tracker.append(rows, positions, targets)
+            if is_encoder_decoder:
+                target_mask[rows, positions] = 1
+            valid_length_each_example[rows] += 1
+            input_mask[rows, positions] = 1
 
-                valid_length_each_example[i] += int(1)
-                input_mask[i][valid_length_each_example[i] - 1] = 1
+            # Stop judgment
+            is_finished[rows] = np.isin(targets, generation_config.eos_token_id) | \
+                (valid_length_each_example[rows] >= max_length_each_example[rows])
 
-                # Stop judgment
-                if p_args[i][target_index] == generation_config.eos_token_id \
-                    or valid_length_each_example[i] == generation_config.max_length:
-                    is_finished[i] = True
-                    continue
+            if streamer is not None:
+                streamer.put(np.asarray(targets) if batch_size == 1 else
+                             [targets[rows == i] for i in range(batch_size)])
             update_time = time.time() - update_time
             logger.debug("forward time: %s s; sample time: %s s; update time: %s s; total count: %s s",
                          forward_time, sample_time, update_time, forward_time + sample_time + update_time)
@@ -448,6 +548,12 @@ class GeneratorMixin:
             )
         logger.debug("The output is: %s", output_ids)
 
+        if block_manager is not None:
+            for i in range(batch_size):
+                block_manager.free(i)
+            if getattr(self, "prefix_cache", None) is not None:
+                logger.debug("prefix cache: %s", self.prefix_cache.stats())
+
         if streamer is not None:
             streamer.end()
 
@@ -458,12 +564,350 @@ class GeneratorMixin:
 
         return output_ids
 
+    def _get_max_length_each_example(self, generation_config: GenerationConfig, valid_length_each_example):
+        """Set the max length of the generation config from the prompts of a decoder only model, return the max
+        length of every example."""
+        if generation_config.max_new_tokens is not None:
+            generation_config.max_length = int(np.max(valid_length_each_example +
+                                                      np.asarray(generation_config.max_new_tokens)))
+        if generation_config.max_length > self.config.seq_length:
+            logger.warning("max_length %s can not exceeds model seq_length %s, set max_length = seq_length.",
+                           generation_config.max_length, self.config.seq_length)
+            generation_config.max_length = self.config.seq_length
+        if np.max(valid_length_each_example) >= generation_config.max_length:
+            raise ValueError(
+                f"the input_ids length {np.max(valid_length_each_example)} exceeds the max length config "
+                f"{generation_config.max_length}. check your inputs and set max_length larger than your inputs length."
+            )
+        if np.ndim(generation_config.max_new_tokens) == 0:
+            return np.full(len(valid_length_each_example), generation_config.max_length)
+        return np.minimum(valid_length_each_example + generation_config.max_new_tokens, generation_config.max_length)
+
+    def _reorder_kv_cache(self, beam_index):
+        """Gather the rows of the dense kv cache from the rows of `beam_index` on device."""
+        if getattr(self, "_kv_caches", None) is None:
+            self._kv_caches = [param for param in self.get_parameters()
+                               if param.name.endswith(("key_past", "value_past"))]
+            # the cell keeps no parameter, the caches are its inputs
+            self.kv_cache_reorder = KVCacheReorder()
+        self.kv_cache_reorder(Tensor(beam_index, mstype.int32), *self._kv_caches)
+
+    def _beam_search(self,
+                     origin_inputs,
+                     generation_config: GenerationConfig,
+                     logits_processor: Optional[LogitsProcessorList] = None,
+                     streamer: BaseStreamer = None,
+                     **model_kwargs):
+        """
+        Beam search given the model and origin inputs.
+
+        The `num_beams` beams of an example are consecutive rows of the batch, so the prompts of all the beams are
+        prefilled by one forward. The prompt of an example is prefilled for each of its beams: the graph of the model
+        with the kv cache has the static batch size of all the beams, so prefilling the distinct prompts once and
+        gathering their cache rows for the beams would not save the compute of the other rows. Every step the `2 * num_beams` best continuations of an example are picked from the
+        log probabilities accumulated by its beams, the ones ending with the eos token are kept as hypotheses and the
+        others are the beams of the next step. The rows of the kv cache are gathered on device from the beams they
+        continue instead of being recomputed. The beams are the best continuations, sampling them is not supported.
+
+        Args:
+            origin_inputs(numpy.ndarray): The padded prompts with shape [bs, seq].
+            generation_config(GenerationConfig): The controlling config for text generation.
+            model_kwargs: dict of model input kwargs, when be passed to model construct
+                during the generation forward.
+
+        Returns:
+            outputs: the ids of the `num_return_sequences` best sequences of every example, the ones of an example
+                are consecutive.
+        """
+        total_time = time.time()
+        if generation_config.pad_token_id is None:
+            generation_config.pad_token_id = 0
+        if streamer is not None:
+            raise ValueError("The streamer is not supported by beam search, whose beams are reordered every step.")
+        if self.config.is_encoder_decoder or self.config.is_sample_acceleration:
+            raise ValueError("Beam search needs the logits of a decoder only model, it is not supported by the "
+                             "encoder decoder models or with is_sample_acceleration.")
+        if getattr(self.config, "use_paged_kv_cache", False):
+            raise ValueError("Beam search reorders the rows of the dense kv cache, it is not supported with "
+                             "use_paged_kv_cache.")
+        if generation_config.do_sample:
+            raise ValueError("Beam search picks the best continuations of the beams, it is not supported with "
+                             "do_sample, please set `do_sample` to False.")
+        num_beams = generation_config.num_beams
+        num_return_sequences = generation_config.num_return_sequences
+        if num_return_sequences > num_beams:
+            raise ValueError(f"num_return_sequences {num_return_sequences} should not be larger than num_beams "
+                             f"{num_beams}.")
+
+        batch_size = origin_inputs.shape[0]
+        num_rows = batch_size * num_beams
+        if generation_config.use_past and num_rows != self.config.batch_size:
+            raise ValueError(f"The batch size of the model {self.config.batch_size} should be the number of the "
+                             f"examples {batch_size} times num_beams {num_beams} for the kv cache.")
+        prompt_length = get_valid_length(origin_inputs, generation_config.pad_token_id)
+        max_length_each_example = self._get_max_length_each_example(generation_config, prompt_length)
+
+        # every prompt is repeated for its beams, the first step continues the first beam of an example only
+        input_ids = self._pad_inputs_using_max_length(
+            origin_inputs=np.repeat(origin_inputs, num_beams, axis=0), pad_token_id=generation_config.pad_token_id
+        )
+        valid_length_each_example = np.repeat(prompt_length, num_beams)
+        # the log probabilities accumulated by the beams, the first step continues the first beam only
+        beam_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+        beam_scores[:, 1:] = _NO_BEAM
+        hypotheses = [BeamHypotheses(num_beams, generation_config.length_penalty) for _ in range(batch_size)]
+        is_done = prompt_length >= max_length_each_example
+
+        self.update_model_kwargs_before_generate(input_ids, model_kwargs)
+        if generation_config.use_past:
+            self.is_first_iteration = True
+        next_tokens = np.zeros((num_rows, 1), dtype=np.int32)
+        modality_tracker = ModalityTracker(generation_config.modality_ranges)
+        modality_tracker.prefill(input_ids)
+        logits_processor.reset(input_ids)
+        seq_length = input_ids.shape[1]
+        num_candidates = 2 * num_beams
+
+        while not is_done.all():
+            current_index = valid_length_each_example - 1 + np.arange(num_rows) * seq_length
+            res, need_gather_logits = self._decoder_forward(input_ids, next_tokens, modality_tracker,
+                                                            current_index.tolist(), valid_length_each_example,
+                                                            generation_config, None, model_kwargs)
+            logits = res[0] if isinstance(res, tuple) else res
+            if isinstance(logits, Tensor):
+                logits = logits.asnumpy()
+            logits = np.reshape(logits, (-1, logits.shape[-1]))
+            if need_gather_logits and logits.shape[0] > num_rows:
+                logits = logits[current_index]
+            logits = logits_processor(input_ids, logits, valid_length=valid_length_each_example)
+            vocab_size = logits.shape[-1]
+
+            # the best continuations of every example over all its beams, from the best
+            scores = (beam_scores.reshape(-1, 1) + log_softmax(logits)).reshape(batch_size, -1)
+            candidates = np.argpartition(-scores, num_candidates - 1, axis=-1)[:, :num_candidates]
+            candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+            order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+            candidates = np.take_along_axis(candidates, order, axis=-1)
+            candidate_scores = np.take_along_axis(candidate_scores, order, axis=-1)
+            candidate_rows = candidates // vocab_size + np.arange(batch_size)[:, None] * num_beams
+            candidate_tokens = candidates % vocab_size
+            candidate_is_eos = np.isin(candidate_tokens, generation_config.eos_token_id)
+
+            beam_index = np.arange(num_rows)
+            new_tokens = np.full(num_rows, generation_config.pad_token_id, dtype=np.int32)
+            examples = np.flatnonzero(~is_done)
+            for i in examples:
+                start = prompt_length[i]
+                end = valid_length_each_example[i * num_beams]
+                num_picked = 0
+                for rank in range(num_candidates):
+                    row = candidate_rows[i, rank]
+                    if candidate_is_eos[i, rank]:
+                        # only the eos tokens as good as the beams end a hypothesis
+                        if rank < num_beams:
+                            hypotheses[i].add(np.append(input_ids[row, start:end], candidate_tokens[i, rank]),
+                                              candidate_scores[i, rank])
+                        continue
+                    beam_index[i * num_beams + num_picked] = row
+                    new_tokens[i * num_beams + num_picked] = candidate_tokens[i, rank]
+                    beam_scores[i, num_picked] = candidate_scores[i, rank]
+                    num_picked += 1
+                    if num_picked == num_beams:
+                        break
+                beam_scores[i, num_picked:] = _NO_BEAM
+
+            # every beam continues the row it is picked from
+            rows = (examples[:, None] * num_beams + np.arange(num_beams)).reshape(-1)
+            positions = valid_length_each_example[rows]
+            # the buffer of input_ids is reordered in place, the stateful logits processors reorder their states
+            input_ids[:] = input_ids[beam_index]
+            logits_processor.reorder(beam_index)
+            modality_tracker.mask = modality_tracker.mask[beam_index]
+            input_ids[rows, positions] = new_tokens[rows]
+            modality_tracker.append(rows, positions, new_tokens[rows])
+            next_tokens[:, 0] = new_tokens
+            if generation_config.use_past and np.any(beam_index != np.arange(num_rows)):
+                self._reorder_kv_cache(beam_index)
+            valid_length_each_example[rows] += 1
+
+            for i in examples:
+                start = prompt_length[i]
+                end = valid_length_each_example[i * num_beams]
+                if end >= max_length_each_example[i]:
+                    for beam in np.flatnonzero(beam_scores[i] > _NO_BEAM):
+                        hypotheses[i].add(input_ids[i * num_beams + beam, start:end], beam_scores[i, beam])
+                    is_done[i] = True
+                else:
+                    is_done[i] = hypotheses[i].is_done(beam_scores[i].max(), end - start)
+
+        output_ids = []
+        for i in range(batch_size):
+            for _, token_ids in hypotheses[i].nbest(num_return_sequences, generation_config.dedupe_key):
+                output_ids.append(np.concatenate([origin_inputs[i, :prompt_length[i]], token_ids]).astype(np.int32))
+        logger.debug("The output is: %s", output_ids)
+
+        total_time = time.time() - total_time
+        logger.info("total time: %s s; candidates: %s; beam search speed: %s candidates/s",
+                    total_time, len(output_ids), len(output_ids) / total_time)
+        return output_ids
+
+    def _multi_token_infer(self, tokens, valid_length_each_example, modality_tracker: ModalityTracker):
+        """
+        Forward the [bs, k] tokens ending at the `valid_length_each_example` tokens of every sequence at once with
+        the kv cache, such as the tokens verified by speculative decoding. Return their [bs, k, vocab_size] logits.
+        """
+        model_inputs = self.prepare_incremental_inputs(tokens)
+        if model_inputs is None:
+            raise ValueError(f"{type(self).__name__} should implement prepare_incremental_inputs to forward several "
+                             f"tokens with the kv cache.")
+        model_inputs["molecular_mask"] = Tensor(modality_tracker.is_molecular(tokens), mstype.int32)
+        current_index = np.asarray(valid_length_each_example) - 1 + np.arange(tokens.shape[0]) * self.config.seq_length
+        res = self._incremental_infer(model_inputs, current_index.tolist(), valid_length_each_example)
+        logits = res[0] if isinstance(res, tuple) else res
+        if isinstance(logits, Tensor):
+            logits = logits.asnumpy()
+        return np.reshape(logits, (tokens.shape[0], tokens.shape[1], -1))
+
+    def _speculative_forward(self,
+                             origin_inputs,
+                             generation_config: GenerationConfig,
+                             proposer,
+                             logits_processor: Optional[LogitsProcessorList] = None,
+                             streamer: BaseStreamer = None,
+                             **model_kwargs):
+        """
+        Greedy text generation with speculative decoding.
+
+        The prompts are prefilled and the first tokens are generated as by `_forward`. Then every step the proposer
+        drafts at most `num_tokens` tokens of every sequence, the last generated token and the drafts are verified
+        by one incremental forward, and the drafts equal to the greedy tokens are accepted with the greedy token
+        after them. A step without drafts decodes one token. The outputs are the ones of greedy decoding.
+
+        Args:
+            origin_inputs(numpy.ndarray): The padded prompts with shape [bs, seq].
+            generation_config(GenerationConfig): The controlling config for text generation.
+            proposer: The proposer of the draft tokens, such as `DraftModelProposer` and `PromptLookupProposer`,
+                with `num_tokens`, `prefill(input_ids, valid_length)` and `propose(input_ids, valid_length)`
+                returning the [bs, num_tokens] drafts and the number of the drafts of every sequence.
+            streamer: Streamer object that will be used to stream the generated sequences.
+            model_kwargs: dict of model input kwargs, when be passed to model construct
+                during the generation forward.
+
+        Returns:
+            outputs: the ids for the generated text
+        """
+        total_time = time.time()
+        if generation_config.pad_token_id is None:
+            generation_config.pad_token_id = 0
+        if not generation_config.use_past:
+            raise ValueError("Speculative decoding verifies the draft tokens with the kv cache, please set use_past.")
+        if self.config.is_encoder_decoder or self.config.is_sample_acceleration or \
+                getattr(self.config, "use_paged_kv_cache", False):
+            raise ValueError("Speculative decoding needs the logits of a decoder only model with the dense kv cache, "
+                             "it is not supported by the encoder decoder models, with is_sample_acceleration or "
+                             "use_paged_kv_cache.")
+
+        batch_size = origin_inputs.shape[0]
+        valid_length_each_example = get_valid_length(origin_inputs, generation_config.pad_token_id)
+        if streamer is not None:
+            streamer.put(origin_inputs[0] if batch_size == 1 else
+                         [origin_inputs[i, :valid_length_each_example[i]] for i in range(batch_size)])
+        max_length_each_example = self._get_max_length_each_example(generation_config, valid_length_each_example)
+        input_ids = self._pad_inputs_using_max_length(
+            origin_inputs=origin_inputs, pad_token_id=generation_config.pad_token_id
+        )
+        seq_length = input_ids.shape[1]
+        is_finished = valid_length_each_example >= max_length_each_example
+
+        self.update_model_kwargs_before_generate(input_ids, model_kwargs)
+        self.is_first_iteration = True
+        next_tokens = np.zeros((batch_size, 1), dtype=np.int32)
+        modality_tracker = ModalityTracker(generation_config.modality_ranges)
+        modality_tracker.prefill(input_ids)
+        logits_processor.reset(input_ids)
+        proposer.prefill(input_ids, valid_length_each_example.copy())
+        num_tokens = proposer.num_tokens
+        self.speculative_stats = SpeculativeStats()
+        origin_len = np.sum(valid_length_each_example)
+
+        while np.sum(is_finished) != batch_size:
+            rows = np.flatnonzero(~is_finished)
+            # the drafts follow the first generated token, they should fit in the sequences with it
+            speculate = not self.is_first_iteration and \
+                np.max(valid_length_each_example[rows]) + num_tokens <= seq_length
+            if speculate:
+                # the finished sequences keep positions in the sequences, their outputs are not used
+                draft_length = np.where(is_finished, np.minimum(valid_length_each_example, seq_length - num_tokens),
+                                        valid_length_each_example)
+                drafts, num_drafts = proposer.propose(input_ids, draft_length)
+                speculate = np.any(num_drafts[rows] > 0)
+            if speculate:
+                logits = self._multi_token_infer(np.concatenate([next_tokens, drafts], axis=1),
+                                                 draft_length + num_tokens, modality_tracker)
+            else:
+                current_index = [valid_length_each_example[i] - 1 + i * seq_length for i in range(batch_size)]
+                res, need_gather_logits = self._decoder_forward(input_ids, next_tokens, modality_tracker,
+                                                                current_index, valid_length_each_example,
+                                                                generation_config, None, model_kwargs)
+                logits = res[0] if isinstance(res, tuple) else res
+                if isinstance(logits, Tensor):
+                    logits = logits.asnumpy()
+                logits = np.reshape(logits, (-1, logits.shape[-1]))
+                if need_gather_logits and logits.shape[0] > batch_size:
+                    logits = logits[current_index]
+                logits = np.reshape(logits, (batch_size, 1, -1))
+                drafts = np.zeros((batch_size, 0), dtype=np.int32)
+                num_drafts = np.zeros(batch_size, dtype=np.int64)
+
+            # append the greedy tokens after the verified tokens while they are the drafts, until the eos token or
+            # the max length, the logits processors only see the appended tokens
+            last_length = valid_length_each_example.copy()
+            num_accepted = np.zeros(batch_size, dtype=np.int64)
+            accepting = ~is_finished
+            for i in range(logits.shape[1]):
+                step_rows = np.flatnonzero(accepting)
+                if step_rows.size == 0:
+                    break
+                scores = logits_processor(input_ids, logits[:, i], valid_length=valid_length_each_example)
+                targets = np.argmax(scores[step_rows], axis=-1).astype(np.int32)
+                positions = valid_length_each_example[step_rows]
+                input_ids[step_rows, positions] = targets
+                next_tokens[step_rows, 0] = targets
+                modality_tracker.append(step_rows, positions, targets)
+                valid_length_each_example[step_rows] += 1
+                is_finished[step_rows] = np.isin(targets, generation_config.eos_token_id) | \
+                    (valid_length_each_example[step_rows] >= max_length_each_example[step_rows])
+                if streamer is not None:
+                    streamer.put(np.asarray(targets) if batch_size == 1 else
+                                 [targets[step_rows == j] for j in range(batch_size)])
+                if i == drafts.shape[1]:
+                    break
+                accepting[step_rows] = (drafts[step_rows, i] == targets) & (num_drafts[step_rows] > i)
+                num_accepted[step_rows] += accepting[step_rows]
+                accepting &= ~is_finished
+            if speculate:
+                self.speculative_stats.update(np.sum(num_drafts[rows]), np.sum(num_accepted[rows]),
+                                              np.sum(valid_length_each_example - last_length))
+
+        output_ids = [input_ids[i, :int(valid_length_each_example[i])].astype(np.int32) for i in range(batch_size)]
+        logger.debug("The output is: %s", output_ids)
+        if streamer is not None:
+            streamer.end()
+
+        generate_len = np.sum(valid_length_each_example) - origin_len
+        total_time = time.time() - total_time
+        logger.info("total time: %s s; generated tokens: %s tokens; generate speed: %s tokens/s; speculative "
+                    "decoding: %s", total_time, generate_len, generate_len / total_time,
+                    self.speculative_stats.stats())
+        return output_ids
+
     def generate(self,
                  input_ids: Optional[Union[List[int], List[List[int]]]],
                  generation_config: Optional[GenerationConfig] = None,
                  logits_processor: Optional[LogitsProcessorList] = None,
                  streamer: Optional[BaseStreamer] = None,
                  seed: Optional[int] = None,
+                 draft_model=None,
                  **kwargs):
         """
         Generate the words according to the given the input ids.
@@ -490,6 +934,10 @@ class GeneratorMixin:
                 generation config an error is thrown. This feature is intended for advanced users.
             streamer: The streamer that generator uses.
             seed: Random seed used in sample.
+            draft_model: The small model proposing the tokens verified at once by speculative decoding, such as a
+                Llama of a few layers with the vocabulary, the batch size and the seq_length of this model, built
+                with use_past. The tokens are the greedy ones, do_sample should be False and use_past is needed.
+                Default None.
             kwargs:
                 Specific parametrization of `generate_config` and/or additional model-specific kwargs that will be
                 forwarded to the `forward` function of the model. Supported `generate_config` keywords can be
@@ -497,8 +945,8 @@ class GeneratorMixin:
 
                 max_length(int): The maximum length the generated tokens can have. Corresponds to the length of
                     the input prompt + `max_new_tokens`. Its effect is overridden by `max_new_tokens`, if also set.
-                max_new_tokens (int): The maximum numbers of tokens to generate, ignoring the number of
-                    tokens in the prompt.
+                max_new_tokens (Union[int, List[int]]): The maximum numbers of tokens to generate, ignoring the
+                    number of tokens in the prompt. A list gives the maximum numbers of every example.
                 do_sample(bool): Whether to do sampling on the candidate ids.
                     If set True it will be enabled, and set it to be False to disable the sampling,
                     equivalent to topk 1.
@@ -516,6 +964,20 @@ class GeneratorMixin:
                 repetition_penalty(float): The penalty factor of the frequency that generated words. The If set 1,
                     the repetition_penalty will not be enabled. If set None, it follows the setting in the
                     configureation in the model. Default None.
+                num_beams(int): The number of beams of beam search, 1 means no beam search. The batch size of the
+                    model with use_past should be the number of the examples times num_beams, do_sample should be
+                    False. Default 1.
+                num_return_sequences(int): The number of the best beam search sequences returned for every
+                    example, the ones of an example are consecutive in the outputs. Default 1.
+                dedupe_key(Callable): A function of the generated token ids, such as the SMILES string decoded from
+                    them, the beam search sequences with the key of a better one are returned last. Default None.
+                num_draft_tokens(int): The number of the tokens proposed by `draft_model` every step. Default 4.
+                prompt_lookup_num_tokens(int): The max number of the tokens copied from the prompt or the
+                    generated tokens after the suffix of a sequence and verified at once every step, the tokens are
+                    the greedy ones, do_sample should be False and use_past is needed. Default None, which
+                    disables it.
+                max_matching_ngram_size(int): The max length of the suffixes looked up by
+                    `prompt_lookup_num_tokens`. Default 3.
 
         Examples:
             >>> from mindformers import T5ForConditionalGeneration, T5Tokenizer
@@ -579,14 +1041,41 @@ class GeneratorMixin:
         # new_ids = np.load("/home/ma-user/work/r0.8_fangxt/mindformers/mindformers/tools/dataset_preprocess/llama/input_ids.npy")
         # input_ids = np.array([new_ids])
         # print("input_ids", input_ids)
-        output_ids = self._forward(
-            origin_inputs=input_ids,
-            generation_config=generation_config,
-            logits_processor=logits_processor,
-            logits_warper=logits_warper,
-            streamer=streamer,
-            **model_kwargs,
-        )
+        if (draft_model is not None or generation_config.prompt_lookup_num_tokens) and generation_config.do_sample:
+            raise ValueError("The speculative decoding with `draft_model` or `prompt_lookup_num_tokens` only accepts "
+                             "the greedy tokens, please set `do_sample` to False.")
+        if draft_model is not None or generation_config.prompt_lookup_num_tokens:
+            if draft_model is not None:
+                proposer = DraftModelProposer(draft_model, generation_config.num_draft_tokens,
+                                              generation_config.modality_ranges)
+            else:
+                proposer = PromptLookupProposer(generation_config.prompt_lookup_num_tokens,
+                                                generation_config.max_matching_ngram_size)
+            output_ids = self._speculative_forward(
+                origin_inputs=input_ids,
+                generation_config=generation_config,
+                proposer=proposer,
+                logits_processor=logits_processor,
+                streamer=streamer,
+                **model_kwargs,
+            )
+        elif generation_config.num_beams > 1:
+            output_ids = self._beam_search(
+                origin_inputs=input_ids,
+                generation_config=generation_config,
+                logits_processor=logits_processor,
+                streamer=streamer,
+                **model_kwargs,
+            )
+        else:
+            output_ids = self._forward(
+                origin_inputs=input_ids,
+                generation_config=generation_config,
+                logits_processor=logits_processor,
+                logits_warper=logits_warper,
+                streamer=streamer,
+                **model_kwargs,
+            )
         print("output_ids", output_ids)
         # set to original phase
         self.set_train(origin_phase == "train")
@@ -47,6 +47,15 @@ def softmax(x, axis=None):
     return exp_x_shifted / np.sum(exp_x_shifted, axis=axis, keepdims=True)
 
 
+def get_valid_length(input_ids, pad_token_id):
+    """the valid length of every example of the padded input_ids, the index of its last token which is not
+    pad_token_id plus 1."""
+    not_pad = np.asarray(input_ids) != pad_token_id
+    if not not_pad.any(axis=-1).all():
+        raise ValueError(f"Every example should have a token which is not the pad token {pad_token_id}.")
+    return not_pad.shape[-1] - np.argmax(not_pad[:, ::-1], axis=-1)
+
+
 def topk(x, top_k, axis=-1, largest=True, sort=True):
     """numpy implemented topk sample."""
     # safety check
@@ -26,6 +26,7 @@ from mindformers.models import BaseTokenizer
 from mindformers.generation import GenerationConfig, LogitsProcessorList
 from mindformers.generation.logits_process import RepetitionPenaltyLogitsProcessor, LogitNormalization, \
     TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+from mindformers.generation.modality import ModalityTracker
 from mindformers.generation.streamers import BaseStreamer
 from mindformers.generation.utils import softmax
 
@@ -71,6 +72,30 @@ class CommonInputsOfInfer(BaseInputsOfInfer):
         return lite_inputs
 
 
+class SciMindInputsOfInfer(BaseInputsOfInfer):
+    """
+    infer inputs of the SciMind llama models, whose second input is the molecular mask of the input tokens.
+
+    The mask of the prompts is computed at the first iteration, then only the mask of the current tokens, unless
+    `molecular_mask` is given, such as the mask kept by the continuous batching engine.
+    """
+    # pylint: disable=W0221
+    def get_inputs(self, model: Model, input_ids=None, current_index=None, valid_length=None,
+                   init_reset=None, is_first_iteration=True, molecular_mask=None, modality_ranges=None, **kwargs):
+        if not is_first_iteration:
+            rows = np.arange(input_ids.shape[0])
+            positions = np.asarray(current_index) - rows * input_ids.shape[1]  # multibatch
+            # use numpy to slice array to avoid complie ascend slice op
+            input_ids = input_ids[rows, positions].reshape(-1, 1).astype(np.int32)
+            if molecular_mask is not None and np.shape(molecular_mask)[1] != 1:
+                molecular_mask = np.asarray(molecular_mask)[rows, positions].reshape(-1, 1)
+        if molecular_mask is None:
+            molecular_mask = ModalityTracker(modality_ranges).is_molecular(input_ids)
+        inputs = [input_ids, np.asarray(molecular_mask, np.int32), current_index, init_reset, valid_length]
+        lite_inputs = self.get_lite_tensor_list(inputs, model)
+        return lite_inputs
+
+
 class GLMInputsOfInfer(BaseInputsOfInfer):
     """
     glm infer inputs.
@@ -158,7 +183,8 @@ class InputOfInfer:
     """
     MAPPING = {
         "bloom": CommonInputsOfInfer,
-        "llama": CommonInputsOfInfer,
+        "llama": SciMindInputsOfInfer,
+        "scimind": SciMindInputsOfInfer,
         "glm2": CommonInputsOfInfer,
         "glm": GLMInputsOfInfer,
         "common": CommonInputsOfInfer
@@ -366,6 +392,8 @@ class TextGeneratorInfer(BaseInfer):
         is_first_iteration = True
         is_finished = [False] * batch_size
         use_past = self.full_model and self.cache_model
+        origin_length = np.sum(valid_length)
+        step_times = []
 
         while np.sum(is_finished) != batch_size:
             start_time = time.time()
@@ -431,19 +459,37 @@ class TextGeneratorInfer(BaseInfer):
                     continue
 
             is_first_iteration = not use_past
-            print(f"one token takes {time.time() - start_time} s")
+            step_times.append(time.time() - start_time)
+            logger.debug("step %s takes %s s", len(step_times), step_times[-1])
 
         # Return valid outputs out of padded outputs
         output_ids = []
         for i in range(batch_size):
             output_ids.append(input_ids[i, : int(valid_length[i])].astype(np.int32))
         logger.debug("The output is: %s", output_ids)
+        self.timing_metrics = self._get_timing_metrics(step_times, int(np.sum(valid_length) - origin_length))
+        logger.info("generate timing: %s", self.timing_metrics)
 
         if streamer:
             streamer.end()
 
         return output_ids
 
+    @staticmethod
+    def _get_timing_metrics(step_times, generated_tokens):
+        """The time of the first step, which prefills the prompts, and the time per step of the next steps."""
+        decode_times = step_times[1:]
+        total_time = sum(step_times)
+        return {
+            "prefill_time": step_times[0] if step_times else 0.0,
+            "decode_steps": len(decode_times),
+            "decode_time": sum(decode_times),
+            "time_per_decode_step": sum(decode_times) / max(len(decode_times), 1),
+            "total_time": total_time,
+            "generated_tokens": generated_tokens,
+            "tokens_per_second": generated_tokens / total_time if total_time else 0.0,
+        }
+
     def _inc_infer(self, input_ids, current_index, valid_length, is_first_iteration, **kwargs):
         """kvcache infer"""
         if is_first_iteration:
@@ -975,6 +975,69 @@ class Trie:
         return tokens
 
 
+class TokenMatcher:
+    """
+    Split texts on the added tokens with a regular expression alternation of the tokens, compiled once when the
+    tokens change. The alternation is ordered by decreasing length, so at the leftmost match position the longest
+    token wins, which gives the same splits as `Trie.split` in one pass of the compiled regex engine.
+
+    When a token contains another token, the greedy scan of `Trie.split` can skip matches, so such token sets are
+    split by a `Trie` to keep the splits unchanged.
+
+    Example:
+
+    ```python
+    >>> matcher = TokenMatcher(["[CLS]", "extra_id_1", "extra_id_100"])
+    >>> matcher.split("[CLS] This is a extra_id_100")
+    ["[CLS]", " This is a ", "extra_id_100"]
+    >>> matcher.split_batch(["{|C|}{|O|}", "CO"])
+    [["{|C|}{|O|}"], ["CO"]]
+    ```
+    """
+
+    def __init__(self, words: Sequence[str] = ()):
+        self.words = set()
+        self._pattern = None
+        self._trie = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        """Add a token, adding an empty or the same token twice is a no-op."""
+        if word and word not in self.words:
+            self.words.add(word)
+            self._pattern = None
+            self._trie = None
+
+    def _compile(self):
+        """Compile the alternation with a capturing group, or build the fallback trie."""
+        words = sorted(self.words, key=lambda word: (-len(word), word))
+        # a longer word is never contained in a shorter one
+        if any(word in longer for i, word in enumerate(words) for longer in words[:i]):
+            self._trie = Trie()
+            for word in words:
+                self._trie.add(word)
+        else:
+            self._pattern = re.compile("(" + "|".join(re.escape(word) for word in words) + ")")
+
+    def split(self, text: str) -> List[str]:
+        """
+        Split `text` along the boundaries of the tokens found, the longest token first. Empty pieces are dropped.
+        """
+        return self.split_batch([text])[0]
+
+    def split_batch(self, texts: Sequence[str]) -> List[List[str]]:
+        """Split every text of `texts`."""
+        if not self.words:
+            return [[text] if text else [] for text in texts]
+        if self._pattern is None and self._trie is None:
+            self._compile()
+        if self._trie is not None:
+            return [self._trie.split(text) for text in texts]
+        split = self._pattern.split
+        return [[piece for piece in split(text) if piece] for text in texts]
+
+
 ENCODE_KWARGS_DOCSTRING = r"""
             add_special_tokens (`bool`, *optional*, defaults to `True`):
                 Whether or not to encode the sequences with the special tokens relative to their model.
@@ -3706,7 +3769,7 @@ class Tokenizer(BaseTokenizer):
         self.added_tokens_encoder: Dict[str, int] = {}
         self.added_tokens_decoder: Dict[int, str] = {}
         self.unique_no_split_tokens: List[str] = []
-        self.tokens_trie = Trie()
+        self.tokens_trie = TokenMatcher()
 
         self._decode_use_source_tokenizer = False
 
@@ -3802,7 +3865,7 @@ class Tokenizer(BaseTokenizer):
         return len(tokens_to_add)
 
     def _create_trie(self, unique_no_split_tokens):
-        trie = Trie()
+        trie = TokenMatcher()
         for token in unique_no_split_tokens:
             if hasattr(self, "do_lower_case") and self.do_lower_case and token not in self.all_special_tokens:
                 trie.add(token.lower())
@@ -3851,11 +3914,27 @@ class Tokenizer(BaseTokenizer):
         Returns:
             `List[str]`: The list of tokens.
         """
-        # Simple mapping string => AddedToken for special tokens with specific tokenization behaviors
-        all_special_tokens_extended = {
-            str(t): t for t in self.all_special_tokens_extended if isinstance(t, AddedToken)
-        }
+        return self._tokenize_with_added_tokens(self._prepare_text(text, **kwargs), self._added_tokens_strip())
+
+    def tokenize_batch(self, texts: List[TextInput], **kwargs) -> List[List[str]]:
+        """
+        Converts a batch of strings in sequences of tokens, the same as `tokenize` on every string, with the added
+        tokens handling prepared once for the batch.
 
+        Args:
+            texts (`List[str]`):
+                The sequences to be encoded.
+            **kwargs (additional keyword arguments):
+                Passed along to the model-specific `prepare_for_tokenization` preprocessing method.
+
+        Returns:
+            `List[List[str]]`: The list of tokens of every sequence.
+        """
+        strip = self._added_tokens_strip()
+        return [self._tokenize_with_added_tokens(self._prepare_text(text, **kwargs), strip) for text in texts]
+
+    def _prepare_text(self, text, **kwargs):
+        """Model specific preparation, then lower case the text except the added tokens if `do_lower_case`."""
         text, kwargs = self.prepare_for_tokenization(text, **kwargs)
 
         if kwargs:
@@ -3869,36 +3948,48 @@ class Tokenizer(BaseTokenizer):
             ]
             pattern = r"(" + r"|".join(escaped_special_toks) + r")|" + r"(.+?)"
             text = re.sub(pattern, lambda m: m.groups()[0] or m.groups()[1].lower(), text)
+        return text
+
+    def _added_tokens_strip(self):
+        """
+        The (lstrip, rstrip) of every no split token: whether the white spaces on its left and right are stripped.
+        """
+        # Simple mapping string => AddedToken for special tokens with specific tokenization behaviors
+        all_special_tokens_extended = {
+            str(t): t for t in self.all_special_tokens_extended if isinstance(t, AddedToken)
+        }
+        strip = {}
+        for token in self.unique_no_split_tokens:
+            tok_extended = all_special_tokens_extended.get(token, None)
+            if isinstance(tok_extended, AddedToken):
+                strip[token] = (tok_extended.lstrip, tok_extended.rstrip)
+            else:
+                # We strip left and right by default
+                strip[token] = (True, True)
+        return strip
 
-        no_split_token = set(self.unique_no_split_tokens)
+    def _tokenize_with_added_tokens(self, text, strip):
+        """Split the text on the no split tokens, strip their neighbours, then tokenize the other pieces."""
         tokens = self.tokens_trie.split(text)
         # ["This is something", "<special_token_1>", "  else"]
+        last = len(tokens) - 1
         for i, token in enumerate(tokens):
-            if token in no_split_token:
-                tok_extended = all_special_tokens_extended.get(token, None)
-                left = tokens[i - 1] if i > 0 else None
-                right = tokens[i + 1] if i < len(tokens) - 1 else None
-                if isinstance(tok_extended, AddedToken):
-                    if tok_extended.rstrip and right:
-                        # A bit counter-intuitive but we strip the left of the string
-                        # since tok_extended.rstrip means the special token is eating all white spaces on its right
-                        tokens[i + 1] = right.lstrip()
-                    # Strip white spaces on the left
-                    if tok_extended.lstrip and left:
-                        tokens[i - 1] = left.rstrip()  # Opposite here
-                else:
-                    # We strip left and right by default
-                    if right:
-                        tokens[i + 1] = right.lstrip()
-                    if left:
-                        tokens[i - 1] = left.rstrip()
+            token_strip = strip.get(token)
+            if token_strip is None:
+                continue
+            # A bit counter-intuitive but we strip the left of the right string
+            # since rstrip means the special token is eating all white spaces on its right
+            if token_strip[1] and i < last and tokens[i + 1]:
+                tokens[i + 1] = tokens[i + 1].lstrip()
+            if token_strip[0] and i > 0 and tokens[i - 1]:
+                tokens[i - 1] = tokens[i - 1].rstrip()
         # ["This is something", "<special_token_1>", "else"]
         tokenized_text = []
         for token in tokens:
             # Need to skip eventual empty (fully stripped) tokens
             if not token:
                 continue
-            if token in no_split_token:
+            if token in strip:
                 tokenized_text.append(token)
             else:
                 tokenized_text.extend(self._tokenize(token))
@@ -0,0 +1,232 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Packed expert pattern store of the LLaMA feed forward experts.
+
+All layers are kept in one file: a magic, the length of a json header and the packed body. When the experts of
+every layer are contiguous neuron ranges in expert order, the body holds the int32 (start, end) range of every expert
+("block" encoding, written after `permute_experts.py`). Otherwise when every hidden neuron belongs to exactly one
+expert the body holds one uint8 expert label per neuron ("label" encoding), else it holds the bit-packed bool patterns
+("bitmask" encoding). The body is memory-mapped and a layer is only decoded when it is requested.
+
+How to run this:
+python expert_patterns.py --param_dir ../param --output ../param/expert_patterns.bin
+"""
+import os
+import re
+import json
+import time
+import struct
+import argparse
+
+import numpy as np
+from mindspore import load_checkpoint
+
+__all__ = ['ExpertPatternStore', 'save_expert_patterns', 'get_expert_blocks', 'load_checkpoint_patterns',
+           'save_random_expert_patterns']
+
+MAGIC = b"SMEP"
+VERSION = 1
+_ALIGNMENT = 64
+_BODY_DTYPE = {"block": np.int32, "label": np.uint8, "bitmask": np.uint8}
+
+
+def _is_partition(patterns):
+    return patterns.shape[0] <= 256 and bool(np.all(patterns.sum(axis=0) == 1))
+
+
+def get_expert_blocks(patterns):
+    """
+    Get the (start, end) neuron range of every expert if the experts are contiguous ranges in expert order.
+
+    Args:
+        patterns (numpy.ndarray): The bool expert patterns with shape [expert_num, hidden_dim].
+
+    Returns:
+        A list of (start, end) tuples, or None if the experts are not contiguous.
+    """
+    patterns = np.asarray(patterns).astype(np.bool_)
+    if not np.all(patterns.sum(axis=0) == 1):
+        return None
+    sizes = patterns.sum(axis=-1)
+    ends = np.cumsum(sizes)
+    blocks = [(int(end - size), int(end)) for size, end in zip(sizes, ends)]
+    for pattern, (start, end) in zip(patterns, blocks):
+        if not pattern[start:end].all():
+            return None
+    return blocks
+
+
+def save_expert_patterns(patterns_list, path):
+    """
+    Pack the bool expert patterns of all layers into one file.
+
+    Args:
+        patterns_list (list[numpy.ndarray]): The bool patterns of every layer with shape [expert_num, hidden_dim].
+        path (str): The output file.
+    """
+    patterns_list = [np.asarray(patterns).astype(np.bool_) for patterns in patterns_list]
+    expert_num, hidden_dim = patterns_list[0].shape
+    for patterns in patterns_list:
+        if patterns.shape != (expert_num, hidden_dim):
+            raise ValueError(f"The expert patterns of all layers should have the shape {(expert_num, hidden_dim)}, "
+                             f"but got {patterns.shape}.")
+    blocks_list = [get_expert_blocks(patterns) for patterns in patterns_list]
+    if all(blocks is not None for blocks in blocks_list):
+        encoding = "block"
+        body = np.array(blocks_list, dtype=np.int32)
+    elif all(_is_partition(patterns) for patterns in patterns_list):
+        encoding = "label"
+        body = np.stack([patterns.argmax(axis=0) for patterns in patterns_list]).astype(np.uint8)
+    else:
+        encoding = "bitmask"
+        body = np.stack([np.packbits(patterns, axis=-1) for patterns in patterns_list])
+    header = json.dumps({"version": VERSION,
+                         "num_layers": len(patterns_list),
+                         "expert_num": expert_num,
+                         "hidden_dim": hidden_dim,
+                         "encoding": encoding,
+                         "shape": list(body.shape)}).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % _ALIGNMENT)
+    with open(path, "wb") as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack("<I", len(header)))
+        fp.write(header)
+        fp.write(body.tobytes())
+
+
+class ExpertPatternStore:
+    """
+    Memory-mapped reader of the file written by `save_expert_patterns`.
+
+    Args:
+        path (str): The packed expert pattern file.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as fp:
+            if fp.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{path}' is not a packed expert pattern file.")
+            header_len = struct.unpack("<I", fp.read(4))[0]
+            header = json.loads(fp.read(header_len).decode("utf-8"))
+        if header["version"] != VERSION:
+            raise ValueError(f"Unsupported expert pattern file version {header['version']}, expected {VERSION}.")
+        self.path = path
+        self.num_layers = header["num_layers"]
+        self.expert_num = header["expert_num"]
+        self.hidden_dim = header["hidden_dim"]
+        self.encoding = header["encoding"]
+        self._body = np.memmap(path, dtype=_BODY_DTYPE[self.encoding], mode="r",
+                               offset=len(MAGIC) + 4 + header_len, shape=tuple(header["shape"]))
+
+    def _check_layer(self, layer_id):
+        if not 0 <= layer_id < self.num_layers:
+            raise ValueError(f"The layer_id should be in range [0, {self.num_layers}), but got {layer_id}.")
+
+    def get_blocks(self, layer_id):
+        """Get the (start, end) neuron range of every expert, None if the experts are not contiguous."""
+        self._check_layer(layer_id)
+        if self.encoding != "block":
+            return None
+        return [(int(start), int(end)) for start, end in self._body[layer_id]]
+
+    def get_labels(self, layer_id):
+        """Get the expert label of every hidden neuron with shape [hidden_dim], None for the bitmask encoding."""
+        self._check_layer(layer_id)
+        if self.encoding == "block":
+            return np.repeat(np.arange(self.expert_num, dtype=np.int32), np.diff(self._body[layer_id], axis=-1)[:, 0])
+        if self.encoding != "label":
+            return None
+        return np.asarray(self._body[layer_id], dtype=np.int32)
+
+    def get_patterns(self, layer_id):
+        """Get the bool expert patterns with shape [expert_num, hidden_dim]."""
+        self._check_layer(layer_id)
+        if self.encoding == "block":
+            return self.get_labels(layer_id)[None, :] == np.arange(self.expert_num, dtype=np.int32)[:, None]
+        if self.encoding == "label":
+            return self._body[layer_id][None, :] == np.arange(self.expert_num, dtype=np.uint8)[:, None]
+        return np.unpackbits(self._body[layer_id], axis=-1, count=self.hidden_dim).astype(np.bool_)
+
+
+def load_checkpoint_patterns(ckpt_file):
+    """
+    Load the expert patterns saved with the feed forward weights of a llama checkpoint.
+
+    Args:
+        ckpt_file (str): The checkpoint file.
+
+    Returns:
+        A dict of the bool expert patterns with shape [expert_num, hidden_dim] by layer id, empty if the checkpoint
+        has no expert patterns.
+    """
+    params = load_checkpoint(ckpt_file, choice_func=lambda name: name.endswith("feed_forward.patterns"))
+    return {int(re.search(r"layers\.(\d+)\.", name).group(1)): param.asnumpy() > 0 for name, param in params.items()}
+
+
+def save_random_expert_patterns(path, num_layers, hidden_size, multiple_of, ffn_dim_multiplier=None, expert_num=16,
+                                seed=0):
+    """
+    Split the feed forward neurons of every llama layer into `expert_num` random disjoint experts with the same size
+    and pack them into `path`, for the models with random weights.
+
+    Args:
+        path (str): The packed expert pattern file.
+        num_layers (int): Number of layers.
+        hidden_size (int): The hidden size of the model, the feed forward hidden dim is computed as in
+            `LlamaFeedForward`.
+        multiple_of (int): The multiple of the feed forward hidden dim.
+        ffn_dim_multiplier (int): The multiplier of the feed forward hidden dim. Default None.
+        expert_num (int): Number of experts. Default 16.
+        seed (int): The seed of the random patterns, the global numpy random state is not used. Default 0.
+
+    Returns:
+        The path.
+    """
+    hidden_dim = 4 * hidden_size
+    if ffn_dim_multiplier is not None:
+        hidden_dim = int((ffn_dim_multiplier + 0.01) * hidden_dim)
+    hidden_dim = int(2 * hidden_dim / 3)
+    hidden_dim = multiple_of * ((hidden_dim + multiple_of - 1) // multiple_of)
+    if hidden_dim % expert_num != 0:
+        raise ValueError(f"The hidden_dim {hidden_dim} should be a multiple of the expert_num {expert_num}.")
+    random_state = np.random.RandomState(seed)
+    save_expert_patterns([random_state.permutation(np.arange(hidden_dim) % expert_num)[None, :] ==
+                          np.arange(expert_num)[:, None] for _ in range(num_layers)], path)
+    return path
+
+
+def main(args):
+    """pack patterns_{layer}.npy of the param directory."""
+    start = time.time()
+    num_layers = len([name for name in os.listdir(args.param_dir)
+                      if name.startswith("patterns_") and name.endswith(".npy")])
+    patterns_list = [np.load(os.path.join(args.param_dir, f"patterns_{layer_id}.npy"))
+                     for layer_id in range(num_layers)]
+    save_expert_patterns(patterns_list, args.output)
+    store = ExpertPatternStore(args.output)
+    for layer_id, patterns in enumerate(patterns_list):
+        if not np.array_equal(store.get_patterns(layer_id), patterns.astype(np.bool_)):
+            raise RuntimeError(f"The packed expert patterns of layer {layer_id} do not match the source.")
+    print(f"Packed {num_layers} layers with {store.encoding} encoding into '{args.output}' "
+          f"({os.path.getsize(args.output)} bytes) in {time.time() - start:.3f}s.", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--param_dir', default='../param', type=str,
+                        help='The directory of patterns_{layer}.npy. Default: ../param.')
+    parser.add_argument('--output', default='expert_patterns.bin', type=str,
+                        help='The packed expert pattern file. Default: expert_patterns.bin.')
+    main(parser.parse_args())
@@ -0,0 +1,247 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Distill and evaluate the expert router of LlamaFeedForward.
+
+The router predicts the expert scores `silu(xW1) * xW3 @ patterns^T` from the feed forward input `x`, so that the
+experts can be selected before the expensive projections. It is fitted by ridge regression on the scores computed
+from the checkpoint weights and the expert patterns (`patterns_{layer}.npy` or the neuron labels in `param_split`).
+The inputs `x` are the outputs of the `ffn_norm` of every layer, captured by running the model on the calibration
+sequences of a MindRecord dataset with the `input_ids` and `molecular_mask` columns, such as the training dataset.
+
+How to run this:
+python expert_router.py --mode capture --config run_llama_7b.yaml --checkpoint scimind.ckpt \
+    --calibration_file smiles_alpaca.mindrecord0 --ffn_input_dir ./ffn_inputs
+python expert_router.py --mode fit --checkpoint scimind.ckpt --param_dir ../param --ffn_input_dir ./ffn_inputs \
+    --output_checkpoint scimind_router.ckpt
+python expert_router.py --mode eval --checkpoint scimind_router.ckpt --param_dir ../param --ffn_input_dir ./ffn_inputs
+"""
+import os
+import pickle
+import zipfile
+import argparse
+
+import numpy as np
+import mindspore as ms
+import mindspore.dataset as ds
+from mindspore import nn, Tensor
+
+from mindformers.models import build_model
+from mindformers.models.llama.expert_patterns import ExpertPatternStore
+from mindformers.tools.register import MindFormerConfig
+
+W1_NAME = "model.layers.{}.feed_forward.w1.weight"
+W3_NAME = "model.layers.{}.feed_forward.w3.weight"
+ROUTER_NAME = "model.layers.{}.feed_forward.router.weight"
+LABELS_NAME = "model.layers.{}.mlp.up_proj.weight"
+
+
+def load_neuron_labels(path):
+    """Load the expert label of every hidden neuron saved by `torch.save` in `param_split`."""
+    with zipfile.ZipFile(path) as archive:
+        data_name = [name for name in archive.namelist() if name.endswith("data.pkl")][0]
+        labels = pickle.loads(archive.read(data_name))
+    return np.asarray(labels, dtype=np.int64)
+
+
+def load_patterns(param_dir, layer_id):
+    """Load the bool expert patterns with shape [expert_num, hidden_dim] of one layer."""
+    if os.path.isfile(param_dir):
+        return ExpertPatternStore(param_dir).get_patterns(layer_id)
+    pattern_path = os.path.join(param_dir, f"patterns_{layer_id}.npy")
+    if os.path.exists(pattern_path):
+        return np.load(pattern_path).astype(np.bool_)
+    labels = load_neuron_labels(os.path.join(param_dir, "param_split", LABELS_NAME.format(layer_id)))
+    return np.stack([labels == expert_id for expert_id in range(labels.max() + 1)])
+
+
+class _FFNInputRecorder(nn.Cell):
+    """Record the outputs of a `ffn_norm` in PyNative mode, which are the inputs of the feed forward."""
+    def __init__(self, norm):
+        super().__init__()
+        self.norm = norm
+        self.outputs = []
+
+    def construct(self, x):
+        output = self.norm(x)
+        self.outputs.append(output.asnumpy())
+        return output
+
+
+def capture_ffn_inputs(model, input_ids, molecular_mask, pad_token_id=0):
+    """
+    Run a LlamaForCausalLM without the kv cache on the token ids [n, seq_length] and their molecular mask in PyNative
+    mode, return the feed forward inputs of the non pad tokens of every layer, each with shape [num_tokens, dim].
+    """
+    if ms.get_context("mode") != ms.PYNATIVE_MODE:
+        raise ValueError("The feed forward inputs are recorded in PyNative mode only.")
+    input_ids, molecular_mask = np.asarray(input_ids, np.int32), np.asarray(molecular_mask, np.float32)
+    batch_size = model.config.batch_size
+    layers = model.model.layers
+    recorders = [_FFNInputRecorder(layer.ffn_norm) for layer in layers]
+    is_token = []
+    model.set_train(False)
+    try:
+        for layer, recorder in zip(layers, recorders):
+            layer.ffn_norm = recorder
+        for start in range(0, len(input_ids), batch_size):
+            # the last batch is completed with pad rows
+            batch_ids = np.full((batch_size, input_ids.shape[1]), pad_token_id, np.int32)
+            batch_mask = np.zeros((batch_size, input_ids.shape[1]), np.float32)
+            batch_ids[:len(input_ids) - start] = input_ids[start:start + batch_size]
+            batch_mask[:len(input_ids) - start] = molecular_mask[start:start + batch_size]
+            model(Tensor(batch_ids), Tensor(batch_mask))
+            is_token.append(batch_ids != pad_token_id)
+    finally:
+        for layer, recorder in zip(layers, recorders):
+            layer.ffn_norm = recorder.norm
+    is_token = np.concatenate(is_token)
+    return [np.concatenate(recorder.outputs).reshape(is_token.shape + (-1,))[is_token].astype(np.float32)
+            for recorder in recorders]
+
+
+def load_calibration_data(path, seq_length, num_sequences):
+    """Load the first token ids [n, seq_length] and molecular masks of a MindRecord dataset."""
+    dataset = ds.MindDataset(path, columns_list=["input_ids", "molecular_mask"], shuffle=False)
+    input_ids, molecular_mask = [], []
+    for item in dataset.create_dict_iterator(num_epochs=1, output_numpy=True):
+        input_ids.append(item["input_ids"][:seq_length])
+        molecular_mask.append(item["molecular_mask"][:seq_length])
+        if len(input_ids) == num_sequences:
+            break
+    return np.stack(input_ids), np.stack(molecular_mask)
+
+
+def load_ffn_inputs(ffn_input_dir, layer_id, dim):
+    """Load the captured feed forward inputs of one layer."""
+    input_path = os.path.join(ffn_input_dir, f"ffn_input_{layer_id}.npy") if ffn_input_dir else ""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"The feed forward inputs '{input_path}' of layer {layer_id} are not found, "
+                                f"please capture them with `--mode capture` first.")
+    return np.load(input_path).reshape(-1, dim).astype(np.float32)
+
+
+def teacher_score(x, w1, w3, patterns):
+    """The expert scores used by the dense routing."""
+    gate = x @ w1.T
+    gate = gate / (1 + np.exp(-gate))
+    hidden_states = gate * (x @ w3.T)
+    return hidden_states @ patterns.T.astype(np.float32)
+
+
+def fit_router(x, score, ridge):
+    """Ridge regression from the inputs to the expert scores, return the router weight [expert_num, dim]."""
+    gram = x.T @ x
+    gram[np.diag_indices_from(gram)] += ridge * len(x)
+    return np.linalg.solve(gram, x.T @ score).T
+
+
+def topk_agreement(router_score, score, k):
+    """Average ratio of the teacher top-k experts that are also selected by the router."""
+    router_topk = np.argsort(-router_score, axis=-1)[:, :k]
+    teacher_topk = np.argsort(-score, axis=-1)[:, :k]
+    hits = (router_topk[:, :, None] == teacher_topk[:, None, :]).any(-1).sum(-1)
+    return float(np.mean(hits / k))
+
+
+def flops_reduction(dim, hidden_dim, expert_num, k):
+    """
+    Estimated FLOP reduction per token of the routed sparse feed forward against the dense routing, counting the
+    matrix multiplications only and assuming the selected experts have `hidden_dim / expert_num` neurons each.
+    """
+    dense_flops = 6 * dim * hidden_dim + 2 * hidden_dim * expert_num
+    routed_flops = 2 * dim * expert_num + 6 * dim * hidden_dim * k / expert_num
+    return 1 - routed_flops / dense_flops
+
+
+def capture(args):
+    """capture the feed forward inputs of all layers on the calibration sequences."""
+    ms.set_context(mode=ms.PYNATIVE_MODE)
+    config = MindFormerConfig(args.config)
+    model_config = config.model.model_config
+    model_config.checkpoint_name_or_path = args.checkpoint
+    model_config.use_past = False
+    model = build_model(config.model)
+    input_ids, molecular_mask = load_calibration_data(args.calibration_file, model_config.seq_length,
+                                                      args.num_sequences)
+    ffn_inputs = capture_ffn_inputs(model, input_ids, molecular_mask, model_config.pad_token_id or 0)
+    os.makedirs(args.ffn_input_dir, exist_ok=True)
+    for layer_id, ffn_input in enumerate(ffn_inputs):
+        np.save(os.path.join(args.ffn_input_dir, f"ffn_input_{layer_id}.npy"), ffn_input)
+    print(f"The feed forward inputs of {ffn_inputs[0].shape[0]} tokens are saved in '{args.ffn_input_dir}'.",
+          flush=True)
+
+
+def main(args):
+    """fit or evaluate the routers of all layers."""
+    if args.mode == "capture":
+        capture(args)
+        return
+    params = ms.load_checkpoint(args.checkpoint)
+    num_layers = len([name for name in params if name.endswith(".feed_forward.w1.weight")])
+    routers = []
+    for layer_id in range(num_layers):
+        w1 = params[W1_NAME.format(layer_id)].asnumpy().astype(np.float32)
+        w3 = params[W3_NAME.format(layer_id)].asnumpy().astype(np.float32)
+        hidden_dim, dim = w1.shape
+        patterns = load_patterns(args.param_dir, layer_id)
+        expert_num = patterns.shape[0]
+        x = load_ffn_inputs(args.ffn_input_dir, layer_id, dim)
+        score = teacher_score(x, w1, w3, patterns)
+
+        if args.mode == "fit":
+            split = int(len(x) * (1 - args.eval_ratio))
+            router = fit_router(x[:split], score[:split], args.ridge)
+            x, score = x[split:], score[split:]
+            routers.append({'name': ROUTER_NAME.format(layer_id), 'data': ms.Tensor(router, ms.float16)})
+        else:
+            router = params[ROUTER_NAME.format(layer_id)].asnumpy().astype(np.float32)
+        router_score = x @ router.T
+        print(f"layer {layer_id}: "
+              f"agreement top{args.k_molecular} {topk_agreement(router_score, score, args.k_molecular):.4f}, "
+              f"top{args.k_text} {topk_agreement(router_score, score, args.k_text):.4f}; "
+              f"estimated flops reduction molecular "
+              f"{flops_reduction(dim, hidden_dim, expert_num, args.k_molecular):.2%}, "
+              f"text {flops_reduction(dim, hidden_dim, expert_num, args.k_text):.2%}", flush=True)
+
+    if args.mode == "fit":
+        ckpt_list = [{'name': name, 'data': value} for name, value in params.items()] + routers
+        ms.save_checkpoint(ckpt_list, args.output_checkpoint)
+        print(f"Router checkpoint is saved in '{args.output_checkpoint}'.", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='fit', type=str, choices=['capture', 'fit', 'eval'],
+                        help='Capture the feed forward inputs, fit the routers or evaluate the routers in the '
+                             'checkpoint. Default: fit.')
+    parser.add_argument('--config', default=None, type=str, help='The yaml config of the model for capture mode.')
+    parser.add_argument('--calibration_file', default=None, type=str,
+                        help='The MindRecord dataset of the calibration sequences for capture mode.')
+    parser.add_argument('--num_sequences', default=64, type=int,
+                        help='Number of the calibration sequences for capture mode. Default: 64.')
+    parser.add_argument('--checkpoint', required=True, type=str, help='The mindspore checkpoint of the model.')
+    parser.add_argument('--param_dir', default='../param', type=str,
+                        help='The packed expert pattern file, or the directory of patterns_{layer}.npy '
+                             'or param_split. Default: ../param.')
+    parser.add_argument('--ffn_input_dir', required=True, type=str,
+                        help='The directory of the captured feed forward inputs ffn_input_{layer}.npy.')
+    parser.add_argument('--output_checkpoint', default='router.ckpt', type=str,
+                        help='The checkpoint with the fitted routers. Default: router.ckpt.')
+    parser.add_argument('--eval_ratio', default=0.1, type=float, help='Held out ratio for fit mode. Default: 0.1.')
+    parser.add_argument('--ridge', default=1e-3, type=float, help='Ridge regularization factor. Default: 1e-3.')
+    parser.add_argument('--k_molecular', default=2, type=int, help='Experts of molecular tokens. Default: 2.')
+    parser.add_argument('--k_text', default=14, type=int, help='Experts of text tokens. Default: 14.')
+    main(parser.parse_args())
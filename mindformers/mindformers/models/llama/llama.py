@@ -13,6 +13,8 @@
 # limitations under the License.
 # ============================================================================
 """LLaMA models' APIs."""
+import os
+
 import numpy as np
 import mindspore.common.dtype as mstype
 
@@ -39,8 +41,9 @@ from mindformers.modules.transformer.op_parallel_config import _check_config
 from mindformers.modules.transformer.transformer import AttentionMask
 from mindformers.tools.register.register import MindFormerModuleType, MindFormerRegister
 
+from .expert_patterns import ExpertPatternStore, load_checkpoint_patterns
 from .llama_config import LlamaConfig
-from .llama_layer import LlamaEmbedding, LlamaRMSNorm, precompute_freqs_cis
+from .llama_layer import LlamaEmbedding, LlamaRMSNorm, LlamaSampleHead, precompute_freqs_cis
 from .llama_transformer import LLamaDecodeLayer
 from ..utils import cell_reuse
 from ...tools.logger import logger
@@ -116,6 +119,8 @@ class LlamaModel(BaseModel):
         self.pad_token_id = config.pad_token_id
         self.is_first_iteration = True
         self.use_past = config.use_past
+        self.use_paged_kv_cache = config.use_past and config.use_paged_kv_cache
+        self.kv_block_size = config.kv_block_size
         self.use_flash_attention = config.use_flash_attention and FLASHATTENTION_VALID
         if self.use_flash_attention:
             logger.info("Enable flash attention.")
@@ -137,10 +142,26 @@ class LlamaModel(BaseModel):
         self.expand_dims = P.ExpandDims()
         self.not_equal = P.NotEqual()
         self.gather = P.Gather()
+        # the attention mask of the packed documents from their position ids
+        seq_index = np.arange(config.seq_length)
+        self.query_index = Tensor(seq_index.reshape(1, -1, 1), mstype.int32)
+        self.key_index = Tensor(seq_index.reshape(1, 1, -1), mstype.int32)
+        self.lower_triangle_mask = Tensor(np.tril(np.ones((1, config.seq_length, config.seq_length))), mstype.bool_)
+        self.sub_position = P.Sub()
+        self.ge_start = P.GreaterEqual()
+        self.logical_and = P.LogicalAnd()
+        self.gather_freqs = P.Gather()
 
         self.tok_embeddings = LlamaEmbedding(
             config.vocab_size, config.hidden_size, param_init_type=config.param_init_type)
         self.layers = nn.CellList()
+        if config.expert_patterns_path:
+            expert_patterns = ExpertPatternStore(config.expert_patterns_path)
+        elif config.checkpoint_name_or_path and os.path.isfile(config.checkpoint_name_or_path):
+            # the checkpoint carries the expert patterns it was trained with
+            expert_patterns = load_checkpoint_patterns(config.checkpoint_name_or_path)
+        else:
+            expert_patterns = None
         for layer_id in range(config.num_layers):
             layer = LLamaDecodeLayer(config.batch_size,
                                      config.seq_length,
@@ -160,6 +181,13 @@ class LlamaModel(BaseModel):
                                      use_flash_attention=config.use_flash_attention,
                                      compute_in_2d=config.compute_in_2d,
                                      use_past_shard=config.use_past_shard,
+                                     use_sparse_ffn=config.use_sparse_ffn,
+                                     use_expert_router=config.use_expert_router,
+                                     expert_patterns=expert_patterns,
+                                     exclusive_expert_routing=config.exclusive_expert_routing,
+                                     use_paged_kv_cache=config.use_paged_kv_cache,
+                                     kv_block_size=config.kv_block_size,
+                                     kv_num_blocks=config.kv_num_blocks,
                                      parallel_config=config.parallel_config)
             layer_compute_dtype(layer, layer_id, config.offset, config.parallel_config,
                                 config.num_layers, select_recompute=config.parallel_config.recompute.select_recompute)
@@ -186,6 +214,9 @@ class LlamaModel(BaseModel):
             self.expand_dims.shard(((dp, 1, 1),))
             self.not_equal.shard(((dp, 1), ()))
             self.gather.shard(((dp, 1), (1,)))
+            self.sub_position.shard(((1, 1, 1), (dp, 1, 1)))
+            self.ge_start.shard(((1, 1, 1), (dp, 1, 1)))
+            self.logical_and.shard(((dp, 1, 1), (1, 1, 1)))
             if config.compute_in_2d:
                 self.norm_out.shard((dp, 1))
             else:
@@ -197,26 +228,78 @@ class LlamaModel(BaseModel):
             self.gather_past = P.Gather()
             self.expand_dims = P.ExpandDims()
             self.le_past = P.LessEqual()
+            self.add_position_past = P.Add()
+        if self.use_paged_kv_cache:
+            self.seq_range = Tensor(np.arange(config.seq_length).reshape(1, -1), mstype.int32)
+            self.max_position = Tensor(config.seq_length - 1, mstype.int32)
+            self.add_position = P.Add()
+            self.min_position = P.Minimum()
+
+    def get_position_attention_mask(self, position_ids):
+        """
+        The causal attention mask of the documents packed in the sequences: every token attends to the previous
+        tokens of its document, which starts at the previous token of position 0.
+
+        Args:
+            position_ids(Tensor): the position ids of the tokens restarting at 0 in every document with datatype
+                int32, Tensor of shape :math:`(batch_size, seq_length)`.
+
+        Returns:
+            Tensor of shape :math:`(batch_size, seq_length, seq_length)`, 1 if the query attends to the key.
+        """
+        bs, seq_len = position_ids.shape
+        # query_start: [bs, seq, 1], the index of the first token of the document of every query
+        query_start = self.sub_position(self.query_index, self.reshape(position_ids, (bs, seq_len, 1)))
+        mask = self.logical_and(self.ge_start(self.key_index, query_start), self.lower_triangle_mask)
+        return self.cast(mask, self.dtype)
 
     # pylint: disable=W0613
-    def construct(self, tokens: Tensor, molecular_mask:Tensor, input_position=None, init_reset=True, batch_valid_length=None):
+    def construct(self, tokens: Tensor, molecular_mask:Tensor, input_position=None, init_reset=True, batch_valid_length=None,
+                  block_tables=None, slot_mapping=None, prefix_length=None):
         """
         Forward of llama model.
 
         Args:
             tokens: the tokenized inputs with datatype int32
-            input_position(Tensor): current position, used by model.predict.
+            input_position(Tensor): current position, used by model.predict. In training, the position ids of the
+                tokens of the packed documents with eod_reset, Tensor of shape :math:`(batch_size, seq_length)`,
+                the attention mask of the documents is built from them.
             init_reset(bool, optional): A bool tensor with shape [1], used to clear the past key parameter and
                 past value parameter used in the incremental prediction. Default True.
             batch_valid_length(Tensor): the past calculated the index with datatype int32, used for incremental
                 prediction. Tensor of shape :math:`(batch_size,)`. Default None.
+            block_tables(Tensor): the cache blocks of every sequence with datatype int32, used by the paged kv cache.
+                Tensor of shape :math:`(batch_size, num_table_blocks)`. Default None.
+            slot_mapping(Tensor): the cache slot of every input token with datatype int32, used by the paged kv
+                cache. Tensor of shape :math:`(batch_size * seq_length,)`. Default None.
+            prefix_length(Tensor): the number of cached prefix tokens of every prompt with datatype int32, the tokens
+                are the rest of the prompts. Used by the first iteration of the paged kv cache with block_tables.
+                Tensor of shape :math:`(batch_size,)`. Default None.
 
         Returns:
             output: Tensor, the output of llama decoderlayer
         """
         # preprocess
         bs, seq_len = tokens.shape
-        if self.is_first_iteration:
+        if self.is_first_iteration and self.use_paged_kv_cache and prefix_length is not None:
+            # the prompts follow the cached prefixes, they attend to the prefix blocks of the block tables
+            positions = self.add_position(self.reshape(prefix_length, (-1, 1)), self.seq_range)
+            freqs_positions = self.reshape(self.min_position(positions, self.max_position), (-1,))
+            freqs_cis = (self.reshape(self.gather_past(self.freqs_cos, freqs_positions, 0), (bs, 1, seq_len, -1)),
+                         self.reshape(self.gather_past(self.freqs_sin, freqs_positions, 0), (bs, 1, seq_len, -1)),
+                         self.swap_mask)
+            key_range = self.range[:, :, :block_tables.shape[1] * self.kv_block_size]
+            mask = self.cast(self.le_past(key_range, self.reshape(positions, (bs, seq_len, 1))), self.dtype)
+            # mask: [bs, seq, num_table_blocks * block_size]
+        elif self.training and input_position is not None:
+            # the documents packed with eod_reset restart their positions at 0
+            freqs_positions = self.reshape(input_position, (-1,))
+            freqs_cis = (self.reshape(self.gather_freqs(self.freqs_cos, freqs_positions, 0), (bs, 1, seq_len, -1)),
+                         self.reshape(self.gather_freqs(self.freqs_sin, freqs_positions, 0), (bs, 1, seq_len, -1)),
+                         self.swap_mask)
+            mask = self.get_position_attention_mask(input_position)
+            # mask: [bs, seq, seq]
+        elif self.is_first_iteration:
             freqs_cis = (self.tile(self.reshape(self.freqs_cos, (1, 1, seq_len, -1)), (bs, 1, 1, 1)),
                          self.tile(self.reshape(self.freqs_sin, (1, 1, seq_len, -1)), (bs, 1, 1, 1)),
                          self.swap_mask)
@@ -224,13 +307,21 @@ class LlamaModel(BaseModel):
             mask = self.get_attention_mask(input_mask)
             # mask: [bs, seq, seq]
         else:
-            cur_pos = batch_valid_length - 1
-            valid_length = self.reshape(cur_pos, (-1, 1, 1))
+            # the tokens are the last ones of batch_valid_length, a single one but for the tokens verified at once
+            # by speculative decoding
+            cur_pos = self.add_position_past(self.reshape(batch_valid_length - seq_len, (-1, 1)),
+                                             self.range[0, :, :seq_len])
+            valid_length = self.reshape(cur_pos, (bs, seq_len, 1))
+            cur_pos = self.reshape(cur_pos, (-1,))
             freqs_cis = (self.reshape(self.gather_past(self.freqs_cos, cur_pos, 0), (bs, 1, seq_len, -1)),
                          self.reshape(self.gather_past(self.freqs_sin, cur_pos, 0), (bs, 1, seq_len, -1)),
                          self.swap_mask)
-            mask = self.cast(self.le_past(self.range, valid_length), self.dtype)
-            # mask: [bs, 1, 1]
+            key_range = self.range
+            if self.use_paged_kv_cache:
+                # the keys are the blocks of the block tables
+                key_range = self.range[:, :, :block_tables.shape[1] * self.kv_block_size]
+            mask = self.cast(self.le_past(key_range, valid_length), self.dtype)
+            # mask: [bs, 1/k, seq]
         mask = self.sub(self.one, self.cast(mask, self.dtype))
         if not self.use_flash_attention:
             mask = self.expand_dims(mask, 1)
@@ -241,7 +332,8 @@ class LlamaModel(BaseModel):
         # h: [bs, seq/1, hidden_dim]
         for i in range(self.num_layers):
             h, _ = self.layers[i](h, freqs_cis, molecular_mask, mask,
-                                  init_reset=init_reset, batch_valid_length=batch_valid_length)
+                                  init_reset=init_reset, batch_valid_length=batch_valid_length,
+                                  block_tables=block_tables, slot_mapping=slot_mapping)
         output = self.norm_out(h)
         return output
 
@@ -288,9 +380,6 @@ class LlamaForCausalLM(BaseModel):
         self.ones = P.Ones()
         self.gather = P.Gather()
         self.model = LlamaModel(config=config)
-        # for i in range(31):
-        #     patterns = np.load(f"/home/ma-user/modelarts/user-job-dir/mindformers/param/patterns_{i}.npy")
-        #     self.model.layers[i].feed_forward.patterns = Tensor(patterns, dtype=mstype.float16)
         self.lm_head = Linear(in_channels=config.hidden_size,
                               out_channels=config.vocab_size,
                               has_bias=False,
@@ -298,6 +387,10 @@ class LlamaForCausalLM(BaseModel):
                               param_init_type=config.param_init_type,
                               weight_init="normal") # meta default: xavier_normal
         self.loss = CrossEntropyLoss(parallel_config=config.parallel_config)
+        self.is_sample_acceleration = config.is_sample_acceleration
+        if self.is_sample_acceleration:
+            # only the candidates or the greedy tokens of the last logits are returned to the host
+            self.sample_head = LlamaSampleHead(config.do_sample, config.temperature, config.top_k, config.top_p)
 
         dp = config.parallel_config.data_parallel
         mp = config.parallel_config.model_parallel
@@ -322,16 +415,24 @@ class LlamaForCausalLM(BaseModel):
             "input_ids": Tensor(input_ids, mstype.int32)
         }
 
+    def prepare_incremental_inputs(self, next_tokens, **kwargs):
+        return {
+            "input_ids": Tensor(next_tokens, mstype.int32)
+        }
+
     # pylint: disable=W0613
     def construct(self, input_ids, molecular_mask, labels=None, input_position=None, position_ids=None, attention_mask=None,
-                  input_embeds=None, init_reset=True, batch_valid_length=None):
+                  input_embeds=None, init_reset=True, batch_valid_length=None, block_tables=None, slot_mapping=None,
+                  prefix_length=None):
         r"""
         LlamaForCausalLM forward.
 
         Args:
             input_ids(Tensor): the tokenized inputs with datatype int32, Tensor of shape :math:`(batch, seq\_length)`.
             labels(Tensor): the tokenized labels with datatype int32, Tensor of shape :math:`(batch, seq\_length)`.
-            input_position(Tensor): current position, used by model.predict.
+            input_position(Tensor): current position, used by model.predict. In training, the position ids of
+                the tokens with eod_reset, Tensor of shape :math:`(batch, seq\_length - 1)`, which restart at 0 in
+                every document packed in the sequences, so a token only attends to its document.
             position_ids(Tensor): Reserved param, not used.
             attention_mask(Tensor): Reserved param, not used.
             input_embeds(Tensor): Reserved param, not used.
@@ -339,9 +440,13 @@ class LlamaForCausalLM(BaseModel):
                 past value parameter used in the incremental prediction. Default True.
             batch_valid_length(Tensor): the past calculated the index with datatype int32, used for incremental
                 prediction. Tensor of shape :math:`(batch_size,)`. Default None.
+            block_tables(Tensor): the cache blocks of every sequence, used by the paged kv cache. Default None.
+            slot_mapping(Tensor): the cache slot of every input token, used by the paged kv cache. Default None.
+            prefix_length(Tensor): the cached prefix length of every prompt, used by the paged kv cache. Default None.
 
         Returns:
-            Tensor: The loss or (logits, tokens, input_mask) of the network.
+            Tensor: The loss or (logits, tokens, input_mask) of the network, or the (scores, token_ids) of the
+            candidates with `is_sample_acceleration`.
         """
         bsz, seqlen = input_ids.shape
         if self.use_past:
@@ -354,7 +459,8 @@ class LlamaForCausalLM(BaseModel):
         else:
             tokens = input_ids
 
-        output = self.model(tokens, molecular_mask, input_position, init_reset, batch_valid_length)
+        output = self.model(tokens, molecular_mask, input_position, init_reset, batch_valid_length,
+                            block_tables, slot_mapping, prefix_length)
         logits = self.lm_head(output)
 
         input_mask = self.cast(self.not_equal(tokens, self.pad_token_id), mstype.float32)
@@ -369,6 +475,11 @@ class LlamaForCausalLM(BaseModel):
 
         logits = self.cast(logits, mstype.float32)
         if not self.training:
+            if self.is_sample_acceleration:
+                logits = logits.view(-1, self.vocab_size)
+                if (not self.use_past or self.is_first_iteration) and input_position is not None:
+                    logits = self.gather(logits, input_position, 0)
+                return self.sample_head(logits)
             logits = self.reshape(logits, (bsz, seqlen, -1))
             # makes cast effective to avoid allgather issue in Mindspore1.10
             input_mask = self.add(input_mask, 1)
@@ -71,6 +71,22 @@ class LlamaConfig(BaseConfig):
         use_flash_attention(bool): Whether enable flash attention ops, default False.
         offset(int): Offset of transformer layer when set pipeline stage number.
         use_past_shard(bool): The configuration of kvcache parallel shard, default False.
+        use_sparse_ffn(bool): Whether compute the feed forward only over the neuron blocks of the selected experts,
+            default False.
+        use_expert_router(bool): Whether select the experts from the feed forward input with a distilled linear
+            router instead of the dense hidden states, default False.
+        expert_patterns_path(str): The packed expert pattern file written by `expert_patterns.py`. If None, the
+            expert patterns are loaded from the checkpoint file of `checkpoint_name_or_path`, which should have been
+            saved with them, default None.
+        exclusive_expert_routing(bool): Whether molecular tokens keep only their molecular experts and text tokens
+            only their text experts, instead of the union with the experts of the other modality, default False.
+        use_paged_kv_cache(bool): Whether keep the incremental inference kv cache in fixed size blocks allocated on
+            demand, instead of a `seq_length` buffer per sequence, default False.
+        kv_block_size(int): The number of tokens in a block of the paged kv cache, default 16.
+        kv_num_blocks(int): The number of blocks of the paged kv cache. If None, the cache holds `batch_size`
+            sequences of `seq_length`, default None.
+        prefix_cache_bytes(int): The byte budget of the shared prefix cache of the paged kv cache, which keeps the
+            blocks of the prefilled prompts for the prompts starting with the same tokens. 0 disables it, default 0.
         checkpoint_name_or_path (Optional[str]):
             checkpoint path or name used to load to the network.
         repetition_penalty (`float`, *optional*, defaults to 1.0):
@@ -86,6 +102,11 @@ class LlamaConfig(BaseConfig):
             that add up to `top_p` or higher are kept for generation.
         do_sample (`bool`, *optional*, defaults to `False`):
             Whether or not to use sampling ; use greedy decoding otherwise.
+        temperature (`float`, *optional*, defaults to 1.0):
+            The value used to module the next token probabilities.
+        is_sample_acceleration(`bool`, *optional*, defaults to `False`):
+            When it is used for network inference, temperature, top-k and top-p of the config are completed in
+            construct, which returns the `[bs, K]` candidates, or the greedy token ids without sampling.
 
         Returns:
             Class, LlamaConfig.
@@ -121,12 +142,22 @@ class LlamaConfig(BaseConfig):
                  use_flash_attention: bool = False,
                  offset: int = 0,
                  use_past_shard: bool = False,
+                 use_sparse_ffn: bool = False,
+                 use_expert_router: bool = False,
+                 expert_patterns_path: str = None,
+                 exclusive_expert_routing: bool = False,
+                 use_paged_kv_cache: bool = False,
+                 kv_block_size: int = 16,
+                 kv_num_blocks: Optional[int] = None,
+                 prefix_cache_bytes: int = 0,
                  checkpoint_name_or_path: str = "",
                  repetition_penalty: float = 1.0,
                  max_decode_length: int = 1024,
                  top_k: int = 5,
                  top_p: float = 1.0,
                  do_sample: bool = True,
+                 temperature: float = 1.0,
+                 is_sample_acceleration: bool = False,
                  **kwargs):
         super(LlamaConfig, self).__init__(**kwargs)
         self.batch_size = batch_size
@@ -157,8 +188,18 @@ class LlamaConfig(BaseConfig):
         self.use_flash_attention = use_flash_attention
         self.offset = offset
         self.use_past_shard = use_past_shard
+        self.use_sparse_ffn = use_sparse_ffn
+        self.use_expert_router = use_expert_router
+        self.expert_patterns_path = expert_patterns_path
+        self.exclusive_expert_routing = exclusive_expert_routing
+        self.use_paged_kv_cache = use_paged_kv_cache
+        self.kv_block_size = kv_block_size
+        self.kv_num_blocks = kv_num_blocks
+        self.prefix_cache_bytes = prefix_cache_bytes
         self.repetition_penalty = repetition_penalty
         self.max_decode_length = max_decode_length
         self.top_k = top_k
         self.top_p = top_p
         self.do_sample = do_sample
+        self.temperature = temperature
+        self.is_sample_acceleration = is_sample_acceleration
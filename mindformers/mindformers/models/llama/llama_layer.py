@@ -38,6 +38,8 @@ from mindformers.modules.layers import Linear, _check_input_dtype, _args_type_va
 
 from mindformers.tools.logger import _LogActionOnce
 
+from .expert_patterns import ExpertPatternStore, get_expert_blocks
+
 
 class SeqExtendMethod(Enum):
     """Stores the acceptable string identifiers for seq length extend method"""
@@ -278,14 +280,36 @@ class LlamaRMSNorm(nn.Cell):
 
 class LlamaFeedForward(Cell):
     r"""
-    LLaMA FeedForward.
+    LLaMA FeedForward with expert partitioned hidden neurons.
 
     .. math::
             (xW_1 * xW_3)W_2
 
+    The hidden neurons are split into experts by `patterns`. Every token keeps the neurons of the union of the
+    `k_molecular` experts with the highest molecular scores and the `k_text` experts with the highest text scores,
+    the scores of a molecular token being zero for the text experts and the other way round.
+
+        Args:
+            use_sparse_ffn (bool): Whether compute only over the neuron blocks of the selected experts instead of
+                masking the dense hidden states. The result is the same as the masked path, but the expert blocks are
+                dispatched with dynamic shapes, so it is meant for PyNative mode. The experts are scored from the
+                dense hidden states, so only `w2` is sparse unless `use_expert_router` is set. Default False.
+            patterns (numpy.ndarray): Bool expert patterns with shape [expert_num, hidden_dim]. If None, the patterns
+                of `layer_id` are read from `expert_patterns`. When the patterns are contiguous neuron ranges in
+                expert order (see `permute_experts.py`), the experts are sliced instead of gathered. Default None.
+            expert_patterns (Union[ExpertPatternStore, dict]): The packed expert patterns of all layers, or the
+                patterns by layer id loaded from a checkpoint by `load_checkpoint_patterns`. Default None.
+            use_expert_router (bool): Whether score the experts from the input `x` with a lightweight linear router
+                instead of the dense hidden states, so that the sparse path can skip `w1`/`w3` of the unselected
+                experts as well. The router is distilled by `expert_router.py`. Default False.
+            exclusive_expert_routing (bool): Whether molecular tokens keep only their `k_molecular` experts and text
+                tokens only their `k_text` experts, instead of the union with the top experts of the zero scores of
+                the other modality. It changes the outputs of the checkpoints trained with the union. Default False.
+
         Inputs:
             - **x** (Tensor) - should be `[batch, seq_length, hidden_size] or [batch * seq_length, hidden_size]`.
               Float tensor.
+            - **molecular_mask** (Tensor) - Int tensor with shape `[batch, seq_length]`, 1 for molecular tokens.
 
         Outputs:
             Tensor, the output of this layer after mapping. The shape is `[batch, seq_length, hidden_size] or
@@ -294,6 +318,9 @@ class LlamaFeedForward(Cell):
         Raises:
             ValueError: `hidden_dim` is not a multiple of the model parallel way.
             ValueError: `dim` is not a multiple of the model parallel way.
+            ValueError: Neither `patterns` nor `expert_patterns` gives the expert patterns of `layer_id`.
+            ValueError: The expert patterns do not have `hidden_dim` neurons.
+            ValueError: `use_sparse_ffn` is set but the experts do not split the neurons into equal disjoint blocks.
     """
 
     @_LogActionOnce(m_logger=logger, key='FeedForward',
@@ -312,9 +339,14 @@ class LlamaFeedForward(Cell):
                  ffn_dim_multiplier=None,
                  compute_dtype=mstype.float16,
                  param_init_type=mstype.float32,
-                 layer_id=None):
+                 layer_id=None,
+                 use_sparse_ffn=False,
+                 patterns=None,
+                 use_expert_router=False,
+                 expert_patterns=None,
+                 exclusive_expert_routing=False):
         super().__init__()
-        
+
         if hidden_act is None or not (isinstance(hidden_act, str) or issubclass(hidden_act, nn.Cell)):
             raise TypeError(f"For FeedForward cell, the hidden_act should str type or nn.Cell type, "
                             f"but got {hidden_act}.")
@@ -350,127 +382,180 @@ class LlamaFeedForward(Cell):
                          has_bias=False,
                          compute_dtype=compute_dtype,
                          param_init_type=param_init_type)
-        
+
         self.mul2 = P.Mul()
         self.matmul = P.MatMul()
+        self.matmul_t = P.MatMul(transpose_b=True)
         self.reshape = P.Reshape()
         self.transpose = P.Transpose()
         self.topk = P.TopK()
         self.gather = P.Gather()
         self.add = P.Add()
-        
-        patterns = np.load(f"/home/ma-user/work/Scimind/param/patterns_{layer_id}.npy")
-        self.patterns = Tensor(patterns, dtype=mstype.float16)
-        # self.patterns = None
-        
+        self.one_hot = P.OneHot()
+        self.select = P.Select()
+
+        if patterns is None and isinstance(expert_patterns, ExpertPatternStore):
+            patterns = expert_patterns.get_patterns(layer_id)
+        elif patterns is None and expert_patterns is not None:
+            patterns = expert_patterns.get(layer_id)
+        if patterns is None:
+            raise ValueError(f"For 'FeedForward', the expert patterns of the layer {layer_id} are not found. Set "
+                             f"'expert_patterns_path' to the packed expert pattern file written by "
+                             f"'expert_patterns.py' (e.g. param/expert_patterns.bin), or load a checkpoint saved "
+                             f"with its expert patterns.")
+        if patterns.shape[-1] != hidden_dim:
+            raise ValueError(f"For 'FeedForward', the expert patterns of the layer {layer_id} should have "
+                             f"{hidden_dim} neurons, but got the shape {patterns.shape}.")
+        # experts permuted into contiguous neuron ranges by `permute_experts.py` are sliced instead of gathered
+        self.expert_blocks = get_expert_blocks(patterns)
+        self.expert_block_size = None
+        if self.expert_blocks is not None and len({end - start for start, end in self.expert_blocks}) == 1:
+            self.expert_block_size = self.expert_blocks[0][1] - self.expert_blocks[0][0]
+        # the patterns are saved with the weights, so that the checkpoint carries its own expert split
+        self.patterns = Parameter(Tensor(patterns, dtype=compute_dtype), name="patterns", requires_grad=False)
+        self.expert_num = patterns.shape[0]
+        self.on_value = Tensor(1, mstype.int32)
+        self.off_value = Tensor(0, mstype.int32)
+
         self.k_molecular = 2
         self.k_text = 14
-        logger.info("&&&&_&&&" * 200)
-
-    # def construct(self, x, molecular_mask):
-    #     """Forward process of the FeedForward"""
-    #     _check_input_dtype(F.dtype(x), "x", [mstype.float32, mstype.float16, mstype.bfloat16], self.cls_name)
-    #     x = self.cast(x, self.dtype)
-    #     # print(x.shape)
-    #     gate = self.w1(x) # dp,1 -> dp, mp
-    #     hidden = self.w3(x) # dp,1 -> dp, mp
-    #     hidden_states = self.mul(hidden, gate) # dp,mp -> dp, mp
-        
-    #     # [1, 4096, 11008] [1, 1, 11008]
-        
-    #     molecular_mask = self.cast(molecular_mask, mstype.bool_)
-    #     new_molecular_mask = ops.unsqueeze(molecular_mask.copy(), -1)
-        
-    #     other1 = ops.ones(new_molecular_mask.shape, mstype.int32)
-    #     new_reversal_mask = ops.bitwise_xor(new_molecular_mask, other1)
-    #     # new_reversal_mask = new_molecular_mask ^ 1
-
-    #     molecular_mask = self.reshape(molecular_mask, (-1, 1))
-    #     # reversal_mask = molecular_mask ^ 1
-    #     other2 = ops.ones(molecular_mask.shape, mstype.int32)
-    #     reversal_mask = ops.bitwise_xor(molecular_mask, other2)
-    #     # reversal_mask = molecular_mask
-    #     # if self.patterns is not None:
-            
-    #     k_molecular = self.k_molecular
-    #     k_text = self.k_text
-    #     bsz, seq_len, hidden_size = hidden_states.shape
-
-    #     # hidden_states_relu = hidden_states.copy()
-    #     hidden_states_relu = hidden_states
-    #     hidden_states_relu = ops.stop_gradient(hidden_states_relu)
-    #     hidden_states_relu = self.reshape(hidden_states_relu, (-1, hidden_size))
-    #     score = self.matmul(hidden_states_relu, self.transpose(self.patterns, (1, 0)))
-
-    #     molecular_score = self.mul2(score, molecular_mask)
-    #     text_score = self.mul2(score, reversal_mask)
-    #     labels_topk_molecular = self.topk(molecular_score, k_molecular)[1]
-    #     labels_topk_molecular = self.reshape(labels_topk_molecular, (bsz, seq_len, k_molecular))
-
-    #     labels_topk_text = self.topk(text_score, k_text)[1]
-    #     labels_topk_text = self.reshape(labels_topk_text, (bsz, seq_len, k_text))
-
-    #     patterns = self.cast(self.patterns, mstype.int32)
-    #     cur_mask_molecular = self.gather(patterns, labels_topk_molecular, 0).sum(-2)
-    #     cur_mask_text = self.gather(patterns, labels_topk_text, 0).sum(-2)
-
-    #     cur_mask = self.add(self.mul2(cur_mask_molecular, new_molecular_mask), self.mul2(cur_mask_text, new_reversal_mask))
-    #     cur_mask = cur_mask > 0
-    #     cur_mask = self.cast(cur_mask, hidden_states.dtype)
-    #     hidden_states_new = self.mul(hidden_states, cur_mask)
-    #     output = self.w2(hidden_states_new)
-    #     return output
+        self.exclusive_expert_routing = exclusive_expert_routing
+
+        self.use_expert_router = use_expert_router
+        if self.use_expert_router:
+            self.router = Linear(in_channels=dim,
+                                 out_channels=self.expert_num,
+                                 has_bias=False,
+                                 compute_dtype=compute_dtype,
+                                 param_init_type=param_init_type)
+
+        self.use_sparse_ffn = use_sparse_ffn
+        if self.use_sparse_ffn:
+            self.expert_index = Parameter(Tensor(self._get_expert_index(patterns), mstype.int32),
+                                          name="expert_index", requires_grad=False)
+            self.nonzero = P.NonZero()
+            self.scatter_add = P.TensorScatterAdd()
+
+    @staticmethod
+    def _get_expert_index(patterns):
+        """Get the neuron ids of every expert with shape [expert_num, hidden_dim // expert_num]."""
+        patterns = np.asarray(patterns).astype(np.bool_)
+        expert_size = patterns.sum(axis=-1)
+        if np.any(patterns.sum(axis=0) != 1) or np.any(expert_size != expert_size[0]):
+            raise ValueError("For 'FeedForward', 'use_sparse_ffn' requires the expert patterns to split the hidden "
+                             "neurons into disjoint blocks with the same size.")
+        return np.stack([np.flatnonzero(pattern) for pattern in patterns])
+
+    def _score(self, hidden_states):
+        """Score the experts by the sum of their hidden neurons, return the score with shape [bs * seq, expert_num]."""
+        hidden_size = hidden_states.shape[-1]
+        hidden_states = ops.stop_gradient(hidden_states)
+        hidden_states = self.reshape(hidden_states, (-1, hidden_size))
+        patterns = self.cast(self.patterns, hidden_states.dtype)
+        return self.matmul(hidden_states, self.transpose(patterns, (1, 0)))
+
+    def _route(self, score, molecular_mask):
+        """Select the experts of every token, return the bool selection with shape [bs * seq, expert_num]."""
+        # [bs * seq, 1]
+        molecular_mask = self.reshape(self.cast(molecular_mask, mstype.bool_), (-1, 1))
+        reversal_mask = ~molecular_mask
+
+        molecular_score = self.mul2(score, molecular_mask)
+        text_score = self.mul2(score, reversal_mask)
+        labels_topk_molecular = self.topk(molecular_score, self.k_molecular)[1]
+        labels_topk_text = self.topk(text_score, self.k_text)[1]
+
+        # [bs * seq, k, expert_num] -> [bs * seq, expert_num]
+        selected_molecular = self.one_hot(labels_topk_molecular, self.expert_num,
+                                          self.on_value, self.off_value).sum(-2) > 0
+        selected_text = self.one_hot(labels_topk_text, self.expert_num,
+                                     self.on_value, self.off_value).sum(-2) > 0
+        if self.exclusive_expert_routing:
+            # molecular tokens keep k_molecular experts, text tokens keep k_text experts
+            molecular_mask = ops.broadcast_to(molecular_mask, selected_molecular.shape)
+            return self.select(molecular_mask, selected_molecular, selected_text)
+        return ops.logical_or(selected_molecular, selected_text)
+
+    def _masked_ffn(self, hidden_states, selection):
+        """Zero the neurons of the unselected experts then project back, dense compute."""
+        hidden_size = hidden_states.shape[-1]
+        if self.expert_block_size is not None:
+            # contiguous experts with the same size: [bs * seq, expert_num, 1] -> [bs * seq, hidden_dim]
+            cur_mask = ops.broadcast_to(self.reshape(selection, selection.shape + (1,)),
+                                        selection.shape + (self.expert_block_size,))
+        else:
+            # [bs * seq, expert_num] x [expert_num, hidden_dim] -> [bs * seq, hidden_dim]
+            cur_mask = self.matmul(self.cast(selection, self.patterns.dtype), self.patterns) > 0
+        cur_mask = self.reshape(self.cast(cur_mask, hidden_states.dtype), hidden_states.shape[:-1] + (hidden_size,))
+        hidden_states_new = self.mul(hidden_states, cur_mask)
+        return self.w2(hidden_states_new)
+
+    def _sparse_ffn(self, x, selection, hidden_states=None):
+        """
+        Compute only the neuron blocks of the selected experts, grouped by expert. The dense `hidden_states` are
+        reused if given, so that only `w2` is sparse, otherwise `w1`/`w3` are computed over the selected blocks as
+        well.
+        """
+        ori_shape = x.shape[:-1] + (self.dim,)
+        x = self.reshape(x, (-1, self.dim))
+        if hidden_states is not None:
+            hidden_states = self.reshape(hidden_states, (-1, hidden_states.shape[-1]))
+        else:
+            w1_weight = self.cast(self.w1.weight, self.dtype)
+            w3_weight = self.cast(self.w3.weight, self.dtype)
+        w2_weight = self.cast(self.w2.weight, self.dtype)
+        output = ops.zeros((x.shape[0], self.dim), self.dtype)
+        for expert_id in range(self.expert_num):
+            # [n_tokens_of_expert, 1]
+            token_index = self.nonzero(selection[:, expert_id])
+            if token_index.shape[0] == 0:
+                continue
+            if self.expert_blocks is not None:
+                start, end = self.expert_blocks[expert_id]
+                expert_w2 = w2_weight[:, start:end]
+            else:
+                neuron_index = self.expert_index[expert_id]
+                expert_w2 = self.gather(w2_weight, neuron_index, 1)
+            # [n_tokens_of_expert, expert_size]
+            if hidden_states is not None:
+                expert_hidden = self.gather(hidden_states, token_index[:, 0], 0)
+                if self.expert_blocks is not None:
+                    expert_hidden = expert_hidden[:, start:end]
+                else:
+                    expert_hidden = self.gather(expert_hidden, neuron_index, 1)
+            else:
+                if self.expert_blocks is not None:
+                    expert_w1, expert_w3 = w1_weight[start:end], w3_weight[start:end]
+                else:
+                    expert_w1 = self.gather(w1_weight, neuron_index, 0)
+                    expert_w3 = self.gather(w3_weight, neuron_index, 0)
+                expert_x = self.gather(x, token_index[:, 0], 0)
+                expert_gate = self.w1.activation(self.matmul_t(expert_x, expert_w1))
+                expert_hidden = self.mul(self.matmul_t(expert_x, expert_w3), expert_gate)
+            expert_output = self.matmul_t(self.cast(expert_hidden, self.dtype), expert_w2)
+            output = self.scatter_add(output, token_index, expert_output)
+        return self.reshape(output, ori_shape)
 
     def construct(self, x, molecular_mask):
         """Forward process of the FeedForward"""
         _check_input_dtype(F.dtype(x), "x", [mstype.float32, mstype.float16, mstype.bfloat16], self.cls_name)
         x = self.cast(x, self.dtype)
+        if self.use_expert_router:
+            # route before the expensive projections
+            score = self.reshape(self.router(x), (-1, self.expert_num))
+            selection = self._route(score, molecular_mask)
+            if self.use_sparse_ffn:
+                return self._sparse_ffn(x, selection)
         # [bs, seq, hidden_dim] or [bs * seq, hidden_dim]
-        # origin code
-        # gate = self.w1(x) # dp,1 -> dp, mp
-        # hidden = self.w3(x) # dp,1 -> dp, mp
-        # hidden = self.mul(hidden, gate) # dp,mp -> dp, mp
-        # output = self.w2(hidden) # dp,mp -> dp, 1
-
         gate = self.w1(x) # dp,1 -> dp, mp
         hidden = self.w3(x) # dp,1 -> dp, mp
         hidden_states = self.mul(hidden, gate) # dp,mp -> dp, mp
-        
-        # [1, 4096, 11008] [1, 1, 11009]
-        
-        molecular_mask = self.cast(molecular_mask, mstype.bool_)
-        molecular_mask = self.reshape(molecular_mask, (-1, 1))
-        reversal_mask = ~molecular_mask
-        # if self.patterns is not None:
-            
-        k_molecular = self.k_molecular
-        k_text = self.k_text
-        bsz, seq_len, hidden_size = hidden_states.shape
-
-        # hidden_states_relu = hidden_states.copy()
-        hidden_states_relu = hidden_states
-        hidden_states_relu = ops.stop_gradient(hidden_states_relu)
-        hidden_states_relu = self.reshape(hidden_states_relu, (-1, hidden_size))
-        score = self.matmul(hidden_states_relu, self.transpose(self.patterns, (1, 0)))
-
-        molecular_score = self.mul2(score, molecular_mask)
-        text_score = self.mul2(score, reversal_mask)
-        labels_topk_molecular = self.topk(molecular_score, k_molecular)[1]
-        labels_topk_molecular = self.reshape(labels_topk_molecular, (bsz, seq_len, k_molecular))
-
-        labels_topk_text = self.topk(text_score, k_text)[1]
-        labels_topk_text = self.reshape(labels_topk_text, (bsz, seq_len, k_text))
-
-        patterns = self.cast(self.patterns, mstype.int32)
-        cur_mask_molecular = self.gather(patterns, labels_topk_molecular, 0).sum(-2)
-        cur_mask_text = self.gather(patterns, labels_topk_text, 0).sum(-2)
-        cur_mask = self.add(cur_mask_molecular, cur_mask_text)
-        cur_mask = cur_mask > 0
-        cur_mask = self.cast(cur_mask, hidden_states.dtype)
-        hidden_states_new = self.mul(hidden_states, cur_mask)
 
-        output = self.w2(hidden_states_new)
-        return output
+        if not self.use_expert_router:
+            selection = self._route(self._score(hidden_states), molecular_mask)
+        if self.use_sparse_ffn:
+            return self._sparse_ffn(x, selection, hidden_states)
+        return self._masked_ffn(hidden_states, selection)
 
     def shard(self, parallel_config):
         """sharding for feedforward"""
@@ -488,4 +573,72 @@ class LlamaFeedForward(Cell):
         self.w1.activation.shard(((dp, mp),))
         self.w2.shard(((dp, mp), (1, mp)))
         self.w3.shard(((dp, 1), (mp, 1)))
-        self.mul.shard(((dp, mp), (dp, mp)))
\ No newline at end of file
+        self.mul.shard(((dp, mp), (dp, mp)))
+        if self.use_expert_router:
+            self.router.shard(((dp, 1), (1, 1)))
+
+
+class LlamaSampleHead(Cell):
+    r"""
+    The in-graph post process of the last logits for the sample acceleration of text generation.
+
+    Greedy search returns the argmax token of every row, sampling returns the `max(top_k, candidate_token_num)`
+    highest candidates after temperature, top-k and top-p, so that only `[bs, K]` values leave the device and the
+    host samples from their softmax. The filtering is the same as `CandidateLogitsWarper`.
+
+    Args:
+        do_sample (bool): Whether to sample, else greedy search.
+        temperature (float): The value used to module the logits distribution. Default 1.0.
+        top_k (int): The number of highest probability tokens kept, 0 means no top-k. Default 0.
+        top_p (float): The cumulative probability kept, 1.0 means no top-p. Default 1.0.
+        candidate_token_num (int): The number of candidates of top-p. Default 200.
+        filter_value (float): The value of the filtered candidates. Default -50000.
+
+    Inputs:
+        - **logits** (Tensor) - Tensor of shape :math:`(batch, vocab\_size)`.
+
+    Outputs:
+        Tuple of 2 Tensor, the float32 candidate scores and the int32 token ids with shape :math:`(batch, K)`,
+        K is 1 for greedy search, with the scores of the greedy tokens set to 1.
+    """
+    def __init__(self, do_sample, temperature=1.0, top_k=0, top_p=1.0, candidate_token_num=200,
+                 filter_value=-50000.):
+        super(LlamaSampleHead, self).__init__()
+        self.do_sample = do_sample
+        self.temperature = float(temperature)
+        self.top_k = top_k
+        self.top_p = float(top_p)
+        self.candidate_token_num = candidate_token_num if self.top_p < 1.0 else 0
+        self.num_candidates = max(top_k, self.candidate_token_num)
+        self.filter_value = filter_value
+        self.argmax = P.Argmax(-1, output_type=mstype.int32)
+        self.topk = P.TopK(sorted=True)
+        self.softmax = P.Softmax(-1)
+        self.cumsum = P.CumSum(exclusive=True)
+        self.select = P.Select()
+        self.less = P.Less()
+        self.concat = P.Concat(-1)
+        self.ones_like = P.OnesLike()
+        self.cast = P.Cast()
+
+    def construct(self, logits):
+        """Forward of the sample head."""
+        logits = self.cast(logits, mstype.float32)
+        if not self.do_sample:
+            token_ids = self.argmax(logits).reshape(-1, 1)
+            return self.ones_like(self.cast(token_ids, mstype.float32)), token_ids
+        num_candidates = self.num_candidates if self.num_candidates else logits.shape[-1]
+        scores, token_ids = self.topk(logits / self.temperature, num_candidates)
+        filtered = F.fill(mstype.float32, scores.shape, self.filter_value)
+        if self.top_k:
+            # ties with the k-th score are kept
+            scores = self.select(self.less(scores, scores[:, self.top_k - 1:self.top_k]), filtered, scores)
+        if self.top_p < 1.0:
+            top_scores = scores[:, :self.candidate_token_num]
+            # keep the tokens under top_p and the first one over it
+            keep = self.less(self.cumsum(self.softmax(top_scores), -1), self.top_p)
+            if num_candidates > self.candidate_token_num:
+                keep = self.concat((keep, F.fill(mstype.bool_, (scores.shape[0], num_candidates -
+                                                                self.candidate_token_num), False)))
+            scores = self.select(keep, scores, filtered)
+        return scores, self.cast(token_ids, mstype.int32)
@@ -68,6 +68,10 @@ class LLamaAttention(nn.Cell):
                 `model.add_flags_recursive(is_first_iteration=True)`, and pass the full inputs. Then, set the
                 is_first_iteration to be False by `model.add_flags_recursive(is_first_iteration=False)`. At this moment,
                 pass the single step's input tensor, and loop it. Default False.
+            - **use_paged_kv_cache** (bool): Whether keep the past key and value in a pool of fixed size blocks
+                indexed by the block table of every sequence, instead of a dense `seq_length` buffer per sequence.
+                Only the new tokens are written and only the blocks in the block tables are read. Default False.
+            - **kv_block_size** (int): The number of tokens in a block of the paged kv cache. Default 16.
             - **parallel_config** (OpParallelConfig): The parallel configure. Default `default_dpmp_config`,
                 an instance of `OpParallelConfig` with default args.
 
@@ -88,6 +92,11 @@ class LLamaAttention(nn.Cell):
                 Default None.
             - **batch_valid_length** (Tensor) - Int32 tensor with shape (batch_size,) the past calculated the index.
                 Used for incremental prediction when the use_past is True. Default None.
+            - **block_tables** (Tensor) - Int32 tensor with shape (batch_size, num_table_blocks), the cache blocks of
+                every sequence. Used by the paged kv cache when is_first_iteration=False, or when the prompts follow
+                cached prefixes. Default None.
+            - **slot_mapping** (Tensor) - Int32 tensor with shape (batch_size * src_seq_length,), the cache slot the
+                key and value of every input token are written to. Used by the paged kv cache. Default None.
 
     Outputs:
             Tuple, a tuple contains(`output`, `layer_present`)
@@ -114,6 +123,8 @@ class LLamaAttention(nn.Cell):
                  use_flash_attention=False,
                  compute_in_2d=False,
                  use_past_shard=False,
+                 use_paged_kv_cache=False,
+                 kv_block_size=16,
                  parallel_config=TransformerOpParallelConfig()):
         super().__init__()
         self.seq_length = seq_length
@@ -127,6 +138,8 @@ class LLamaAttention(nn.Cell):
         self.softmax_dtype = softmax_compute_dtype
         self.is_first_iteration = True
         self.use_past = use_past
+        self.use_paged_kv_cache = use_past and use_paged_kv_cache
+        self.kv_block_size = kv_block_size
         self.compute_in_2d = compute_in_2d
         self.use_flash_attention = use_flash_attention and FLASHATTENTION_VALID
 
@@ -222,12 +235,23 @@ class LLamaAttention(nn.Cell):
             self.equal = P.Equal().shard(((dp, 1, 1), (dp, 1, 1)))
             self.less = P.Less().shard(((dp, 1, 1), (dp, 1, 1)))
             self.mul_past = P.Mul().shard(((dp, 1, 1, 1), (dp, 1, 1, 1)))
+            self.equal_zero = P.Equal().shard(((dp, 1, 1), ()))
+            # operators of the tokens verified at once by speculative decoding
+            self.add_position = P.Add()
+            self.transpose_past = P.Transpose()
+            self.tile_past = P.Tile()
+            self.batch_matmul_past = P.BatchMatMul()
+            self.reduce_sum_past = P.ReduceSum(keep_dims=True)
             if use_past_shard:
                 self.add_past.shard(((dp, mp, 1, 1), (dp, mp, 1, 1)))
                 self.mul_past.shard(((dp, mp, 1, 1), (dp, 1, 1, 1)))
+        if self.use_paged_kv_cache:
+            self.transpose_cache = P.Transpose()
+            self.scatter_cache = P.ScatterUpdate()
+            self.gather_cache = P.Gather()
 
     def construct(self, x: Tensor, freqs_cis: Tuple[Tensor, Tensor], mask=None,
-                  key_past=None, value_past=None, batch_valid_length=None):
+                  key_past=None, value_past=None, batch_valid_length=None, block_tables=None, slot_mapping=None):
         """Forward process of the MultiHeadAttention"""
         ori_dtype = x.dtype
         # [bs, seq/1, hidden_dim] or [bs * seq/1, hidden_dim]
@@ -236,12 +260,11 @@ class LLamaAttention(nn.Cell):
         query = self.cast(self.wq(x), self.dtype)  # dp, 1 -> dp, mp
         key = self.cast(self.wk(x), self.dtype)    # dp, 1 -> dp, mp
         value = self.cast(self.wv(x), self.dtype)  # dp, 1 -> dp, mp
-        query = self.reshape(query, (-1, self._get_seq_length_under_incremental(self.seq_length),
-                                     self.n_head, self.head_dim))
-        key = self.reshape(key, (-1, self._get_seq_length_under_incremental(self.seq_length),
-                                 self.n_kv_head, self.head_dim))
-        value = self.reshape(value, (-1, self._get_seq_length_under_incremental(self.seq_length),
-                                     self.n_kv_head, self.head_dim))
+        # the incremental length is the one of the rotary embedding of the input positions
+        seq_length = self._get_seq_length_under_incremental(self.seq_length, freqs_cis[0].shape[2])
+        query = self.reshape(query, (-1, seq_length, self.n_head, self.head_dim))
+        key = self.reshape(key, (-1, seq_length, self.n_kv_head, self.head_dim))
+        value = self.reshape(value, (-1, seq_length, self.n_kv_head, self.head_dim))
         # [bs, seq/1, n_head/n_kv_head, head_dim]
         query = self.transpose(query, (0, 2, 1, 3))
         key = self.transpose(key, (0, 2, 1, 3))
@@ -251,7 +274,9 @@ class LLamaAttention(nn.Cell):
         # kv cache: [bs, n_kv_head, 1, head_dim] -> [bs, n_kv_head, seq, head_dim]
         key_present = key
         value_present = value
-        if self.use_past:
+        if self.use_paged_kv_cache:
+            key, value = self._paged_cache(key, value, key_past, value_past, block_tables, slot_mapping)
+        elif self.use_past:
             # The first graph with the input size of (bs, seq_length)
             if self.is_first_iteration:
                 # Get the valid input length without padding
@@ -260,18 +285,39 @@ class LLamaAttention(nn.Cell):
                 # Cover the key and value numbers corresponding to the padding position
                 key_present = self.mul_past(key, self.expand_dims(valid_length_vector, 3))
                 value_present = self.mul_past(value, self.expand_dims(valid_length_vector, 3))
-            # The second graph with the inpus size of (bs, 1)
+                # Rows with batch_valid_length 0 are not prefilled and keep their cache, so that new requests
+                # can be prefilled into free rows while the others are decoding
+                keep_past = self.expand_dims(self.cast(self.equal_zero(batch_valid_length.view(-1, 1, 1), 0),
+                                                       self.dtype), 3)
+                key_present = self.add_past(key_present, self.mul_past(key_past, keep_past))
+                value_present = self.add_past(value_present, self.mul_past(value_past, keep_past))
+            # The second graph with the inpus size of (bs, 1), or (bs, k) for the tokens verified at once
             else:
-                # Get the current token position index
-                valid_length = batch_valid_length - 1
-                valid_length = self.reshape(valid_length, (-1, 1, 1))
+                # Get the current token position indices, the last ones of batch_valid_length
+                incremental_length = key.shape[2]
+                valid_length = self.reshape(batch_valid_length - incremental_length, (-1, 1, 1))
+                valid_length = self.add_position(valid_length, self.reshape(self.range[0, :, :incremental_length],
+                                                                            (1, incremental_length, 1)))
+                # [bs, 1/k, seq]
                 valid_length_vector = (self.equal(self.range, valid_length)).astype(self.dtype)
-                # Pad the key and value to seq_length with only the position index not zero
-                current_key = self.mul_past(key, self.expand_dims(valid_length_vector, 3))
-                current_value = self.mul_past(value, self.expand_dims(valid_length_vector, 3))
-                # Concat the previous saved state and current state
-                key = self.add_past(key_past, current_key)
-                value = self.add_past(value_past, current_value)
+                if incremental_length == 1:
+                    # Pad the key and value to seq_length with only the position index not zero
+                    current_key = self.mul_past(key, self.expand_dims(valid_length_vector, 3))
+                    current_value = self.mul_past(value, self.expand_dims(valid_length_vector, 3))
+                    keep_past = self.equal_zero(valid_length_vector, 0)
+                else:
+                    # Scatter the k keys and values to their positions, [bs, n_kv_head, seq, k] x
+                    # [bs, n_kv_head, k, head_dim]
+                    scatter = self.tile_past(self.expand_dims(self.transpose_past(valid_length_vector, (0, 2, 1)), 1),
+                                             (1, self.n_kv_head, 1, 1))
+                    current_key = self.batch_matmul_past(scatter, key)
+                    current_value = self.batch_matmul_past(scatter, value)
+                    keep_past = self.equal_zero(self.reduce_sum_past(valid_length_vector, 1), 0)
+                # The cache at the positions is overwritten, it may be left by the tokens rejected by
+                # speculative decoding
+                keep_past = self.expand_dims(self.cast(keep_past, self.dtype), 3)
+                key = self.add_past(self.mul_past(key_past, keep_past), current_key)
+                value = self.add_past(self.mul_past(value_past, keep_past), current_value)
                 # Update key_present and value_present for state update
                 key_present = key
                 value_present = value
@@ -292,6 +338,29 @@ class LLamaAttention(nn.Cell):
 
         return output, layer_present
 
+    def _paged_cache(self, key, value, key_cache, value_cache, block_tables, slot_mapping):
+        """Write the new key and value into their cache slots, then read the blocks of every sequence."""
+        # [bs, n_kv_head, seq/1, head_dim] -> [bs * seq/1, n_kv_head, head_dim]
+        key_update = self.reshape(self.transpose_cache(key, (0, 2, 1, 3)), (-1, self.n_kv_head, self.head_dim))
+        value_update = self.reshape(self.transpose_cache(value, (0, 2, 1, 3)), (-1, self.n_kv_head, self.head_dim))
+        key_cache = self.scatter_cache(key_cache, slot_mapping, key_update)
+        value_cache = self.scatter_cache(value_cache, slot_mapping, value_update)
+        if self.is_first_iteration and block_tables is None:
+            # the prompts only attend to themselves, the cache is written for the next iterations
+            key = ops.depend(key, key_cache)
+            value = ops.depend(value, value_cache)
+            return key, value
+        bs, num_table_blocks = block_tables.shape
+        block_shape = (-1, self.kv_block_size, self.n_kv_head, self.head_dim)
+        seq_shape = (bs, num_table_blocks * self.kv_block_size, self.n_kv_head, self.head_dim)
+        # [bs, num_table_blocks, block_size, n_kv_head, head_dim] -> [bs, n_kv_head, num_table_blocks * block_size,
+        # head_dim]
+        key = self.gather_cache(self.reshape(key_cache, block_shape), block_tables, 0)
+        key = self.transpose_cache(self.reshape(key, seq_shape), (0, 2, 1, 3))
+        value = self.gather_cache(self.reshape(value_cache, block_shape), block_tables, 0)
+        value = self.transpose_cache(self.reshape(value, seq_shape), (0, 2, 1, 3))
+        return key, value
+
     def _repeat_kv(self, x, rep):
         if rep == 1:
             return x
@@ -301,12 +370,13 @@ class LLamaAttention(nn.Cell):
         x = self.reshape(x, (bs, n_kv_head * rep, seqlen, head_dim))
         return x
 
-    def _get_seq_length_under_incremental(self, length):
+    def _get_seq_length_under_incremental(self, length, incremental_length=1):
         r"""Return the length of the tensor.
-            For the incremental prediction, the seq length for the input is 1.
+            For the incremental prediction, the seq length for the input is 1, or the number of the tokens verified
+            at once by speculative decoding.
         """
         if self.use_past and not self.is_first_iteration:
-            return 1
+            return incremental_length
         return length
 
     def _merge_heads(self, x):
@@ -390,6 +460,19 @@ class LLamaDecodeLayer(nn.Cell):
                 `model.add_flags_recursive(is_first_iteration=True)`, and pass the full inputs. Then, set the
                 is_first_iteration to be False by `model.add_flags_recursive(is_first_iteration=False)`.
                 At this moment, pass the single step's input tensor, and loop it. Default False.
+            use_sparse_ffn(bool): Whether compute the feed forward only over the neuron blocks of the selected
+                experts. Default False.
+            use_expert_router(bool): Whether select the experts with a linear router over the feed forward input.
+                Default False.
+            expert_patterns(Union[ExpertPatternStore, dict]): The packed expert patterns of all layers, or the
+                patterns by layer id loaded from a checkpoint. Default None.
+            exclusive_expert_routing(bool): Whether the tokens keep only the experts of their modality instead of
+                the union with the experts of the other modality. Default False.
+            use_paged_kv_cache(bool): Whether keep the past key and value in a pool of fixed size blocks, see
+                `LLamaAttention`. Default False.
+            kv_block_size(int): The number of tokens in a block of the paged kv cache. Default 16.
+            kv_num_blocks(int): The number of blocks in the paged kv cache, block 0 is reserved for the padding
+                tokens. Default None, means enough blocks for `batch_size` sequences of `seq_length`.
             parallel_config(OpParallelConfig, MoEParallelConfig): The parallel configure. When MoE is applied,
                 MoEParallelConfig is effective, otherwise OpParallelConfig is effective. Default `default_dpmp_config`,
                 an instance of `OpParallelConfig` with default args.
@@ -406,6 +489,10 @@ class LLamaDecodeLayer(nn.Cell):
               past value parameter used in the incremental prediction. Only valid when use_past is True. Default True.
             - **batch_valid_length** (Tensor) - Int32 tensor with shape [batch_size] the past calculated the index.
               Used for incremental prediction when the use_past is True. Default None.
+            - **block_tables** (Tensor) - Int32 tensor with shape [batch_size, num_table_blocks], the cache blocks
+              of every sequence. Only used by the paged kv cache. Default None.
+            - **slot_mapping** (Tensor) - Int32 tensor with shape [batch_size * seq_length] or [batch_size], the cache
+              slot of every input token. Only used by the paged kv cache. Default None.
 
         Outputs:
             Tuple, a tuple contains(`output`, `layer_present`).
@@ -438,6 +525,13 @@ class LLamaDecodeLayer(nn.Cell):
                  use_flash_attention=False,
                  compute_in_2d=False,
                  use_past_shard=False,
+                 use_sparse_ffn=False,
+                 use_expert_router=False,
+                 expert_patterns=None,
+                 exclusive_expert_routing=False,
+                 use_paged_kv_cache=False,
+                 kv_block_size=16,
+                 kv_num_blocks=None,
                  parallel_config=TransformerOpParallelConfig()):
         super().__init__()
         if batch_size or use_past:
@@ -455,6 +549,7 @@ class LLamaDecodeLayer(nn.Cell):
         self.dtype = compute_dtype
         self.is_first_iteration = True
         self.use_past = use_past
+        self.use_paged_kv_cache = use_past and use_paged_kv_cache
         self.compute_in_2d = compute_in_2d
         self.key_past = None
         self.value_past = None
@@ -476,6 +571,8 @@ class LLamaDecodeLayer(nn.Cell):
                                         use_flash_attention=use_flash_attention,
                                         compute_in_2d=compute_in_2d,
                                         use_past_shard=use_past_shard,
+                                        use_paged_kv_cache=use_paged_kv_cache,
+                                        kv_block_size=kv_block_size,
                                         parallel_config=parallel_config)
         self.feed_forward = LlamaFeedForward(dim=self.hidden_size,
                                              hidden_dim=4 * self.hidden_size,
@@ -483,7 +580,11 @@ class LLamaDecodeLayer(nn.Cell):
                                              ffn_dim_multiplier=ffn_dim_multiplier,
                                              compute_dtype=compute_dtype,
                                              param_init_type=param_init_type,
-                                             layer_id=layer_id)
+                                             layer_id=layer_id,
+                                             use_sparse_ffn=use_sparse_ffn,
+                                             use_expert_router=use_expert_router,
+                                             expert_patterns=expert_patterns,
+                                             exclusive_expert_routing=exclusive_expert_routing)
 
         dp = parallel_config.data_parallel
         mp = parallel_config.model_parallel
@@ -510,17 +611,28 @@ class LLamaDecodeLayer(nn.Cell):
                 self.ffn_norm.shard((dp, mp, 1))
             self.feed_forward.w2.shard(((dp, mp), (1, mp)), out_strategy_matmul=((dp * mp, 1),))
 
-        if self.use_past:
+        if self.use_paged_kv_cache:
+            if seq_length % kv_block_size != 0:
+                raise ValueError(f"The seq_length {seq_length} should be a multiple of kv_block_size {kv_block_size}.")
+            if kv_num_blocks is None:
+                kv_num_blocks = batch_size * seq_length // kv_block_size + 1
+            # the cache slots are [block_id * block_size + offset], each slot keeps the key or value of one token
+            kv_shape = (kv_num_blocks * kv_block_size, self.n_kv_head, self.head_dim)
+            self.key_past = Parameter(Tensor(np.zeros(kv_shape), self.dtype), name="key_cache")
+            self.value_past = Parameter(Tensor(np.zeros(kv_shape), self.dtype), name="value_cache")
+        elif self.use_past:
             kv_shape = (batch_size, self.n_kv_head, seq_length, self.head_dim)
             self.key_past = Parameter(Tensor(np.zeros(kv_shape), self.dtype), name="key_past")
             self.value_past = Parameter(Tensor(np.zeros(kv_shape), self.dtype), name="value_past")
+            self.cast = P.Cast()
             self.mul_past = P.Mul().shard(((dp, 1, 1, 1), (1,)))
             self.assign_past = P.Assign().shard(((dp, 1, 1, 1), (dp, 1, 1, 1)))
             if use_past_shard:
                 self.mul_past.shard(((dp, mp, 1, 1), (1,)))
                 self.assign_past.shard(((dp, mp, 1, 1), (dp, mp, 1, 1)))
 
-    def construct(self, x, freqs_cis, molecular_mask, mask=None, init_reset=True, batch_valid_length=None):
+    def construct(self, x, freqs_cis, molecular_mask, mask=None, init_reset=True, batch_valid_length=None,
+                  block_tables=None, slot_mapping=None):
         """ Forward of transformer block. """
         self._check_input(x, freqs_cis, mask, init_reset, batch_valid_length)
         # [bs, seq/1, hidden_dim] (first) [bs * seq/1, hidden_dim] (others)
@@ -531,7 +643,7 @@ class LLamaDecodeLayer(nn.Cell):
 
         key_reset = None
         value_reset = None
-        if self.use_past and self.is_first_iteration:
+        if self.use_past and not self.use_paged_kv_cache and self.is_first_iteration:
             # reset states, init_reset True for reuse and False for reset
             self.assign_past(self.key_past, self.mul_past(self.key_past, self.cast(init_reset, self.dtype)))
             self.assign_past(self.value_past, self.mul_past(self.value_past, self.cast(init_reset, self.dtype)))
@@ -541,8 +653,8 @@ class LLamaDecodeLayer(nn.Cell):
             input_x = ops.depend(input_x, key_reset)
             input_x = ops.depend(input_x, value_reset)
         # [bs, seq/1, hidden_dim] or [bs * seq/1, hidden_dim]
-        h, layer_present = self.attention(input_x, freqs_cis, mask,
-                                          self.key_past, self.value_past, batch_valid_length)
+        h, layer_present = self.attention(input_x, freqs_cis, mask, self.key_past, self.value_past,
+                                          batch_valid_length, block_tables, slot_mapping)
         h = self.add(x, h)
         ffn_norm = self.ffn_norm(h)
         # [bs, seq/1, hidden_dim] or [bs * seq/1, hidden_dim]
@@ -550,7 +662,7 @@ class LLamaDecodeLayer(nn.Cell):
 
         value_update = None
         key_update = None
-        if self.use_past:
+        if self.use_past and not self.use_paged_kv_cache:
             # current key and value
             key_present, value_present = layer_present
             # update key and value calculated this step
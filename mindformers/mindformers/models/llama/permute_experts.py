@@ -0,0 +1,96 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Permute the feed forward neurons of a llama checkpoint so that every expert is a contiguous neuron range.
+
+The rows of `w1`/`w3` and the columns of `w2` are reordered by expert, keeping the original order inside an expert,
+so the layer output is unchanged. The permuted patterns are written with the "block" encoding, which makes
+LlamaFeedForward slice the experts instead of gathering them.
+
+How to run this:
+python permute_experts.py --checkpoint scimind.ckpt --expert_patterns_path ../param/expert_patterns.bin \
+    --output_checkpoint scimind_permuted.ckpt --output_patterns ../param/expert_patterns_permuted.bin
+"""
+import argparse
+
+import numpy as np
+import mindspore as ms
+
+from mindformers.models.llama.expert_patterns import ExpertPatternStore, save_expert_patterns
+
+FFN_NAME = "model.layers.{}.feed_forward."
+
+
+def get_permutation(patterns):
+    """The neuron order that groups the neurons by expert, stable inside every expert."""
+    patterns = np.asarray(patterns).astype(np.bool_)
+    if np.any(patterns.sum(axis=0) != 1):
+        raise ValueError("The expert patterns should assign every hidden neuron to exactly one expert.")
+    return np.argsort(patterns.argmax(axis=0), kind="stable")
+
+
+def permute_checkpoint(params, patterns_list):
+    """
+    Permute the feed forward neurons of all layers.
+
+    Args:
+        params (dict): Parameter name to numpy array of the checkpoint.
+        patterns_list (list[numpy.ndarray]): The bool expert patterns of every layer.
+
+    Returns:
+        The permuted parameters dict and the permuted patterns list.
+    """
+    params = dict(params)
+    permuted_patterns = []
+    for layer_id, patterns in enumerate(patterns_list):
+        order = get_permutation(patterns)
+        prefix = FFN_NAME.format(layer_id)
+        params[prefix + "w1.weight"] = params[prefix + "w1.weight"][order]
+        params[prefix + "w3.weight"] = params[prefix + "w3.weight"][order]
+        params[prefix + "w2.weight"] = params[prefix + "w2.weight"][:, order]
+        patterns = np.asarray(patterns).astype(np.bool_)[:, order]
+        if prefix + "patterns" in params:
+            params[prefix + "patterns"] = params[prefix + "patterns"][:, order]
+        if prefix + "expert_index" in params:
+            params[prefix + "expert_index"] = np.stack([np.flatnonzero(pattern) for pattern in patterns]).astype(
+                params[prefix + "expert_index"].dtype)
+        permuted_patterns.append(patterns)
+    return params, permuted_patterns
+
+
+def main(args):
+    """permute the checkpoint and the expert patterns."""
+    print(f"Trying to permute the experts of '{args.checkpoint}'.", flush=True)
+    params = {name: value.asnumpy() for name, value in ms.load_checkpoint(args.checkpoint).items()}
+    store = ExpertPatternStore(args.expert_patterns_path)
+    patterns_list = [store.get_patterns(layer_id) for layer_id in range(store.num_layers)]
+    params, patterns_list = permute_checkpoint(params, patterns_list)
+    ms.save_checkpoint([{'name': name, 'data': ms.Tensor(value)} for name, value in params.items()],
+                       args.output_checkpoint)
+    save_expert_patterns(patterns_list, args.output_patterns)
+    print(f"Permuted checkpoint is saved in '{args.output_checkpoint}', "
+          f"block patterns are saved in '{args.output_patterns}'.", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True, type=str, help='The mindspore checkpoint of the model.')
+    parser.add_argument('--expert_patterns_path', required=True, type=str,
+                        help='The packed expert pattern file of the checkpoint.')
+    parser.add_argument('--output_checkpoint', default='permuted.ckpt', type=str,
+                        help='The permuted checkpoint. Default: permuted.ckpt.')
+    parser.add_argument('--output_patterns', default='expert_patterns_permuted.bin', type=str,
+                        help='The permuted expert patterns with block encoding. Default: expert_patterns_permuted.bin.')
+    main(parser.parse_args())
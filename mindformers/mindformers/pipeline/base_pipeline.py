@@ -16,7 +16,9 @@
 # ============================================================================
 
 """BasePipeline"""
+import collections
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Union
 import numpy as np
 
@@ -46,8 +48,17 @@ class BasePipeline(ABC):
             The tokenizer of model, it could be None if the model do not need tokenizer.
         image_processor (Optional[BaseImageProcessor]):
             The image_processor of model, it could be None if the model do not need image_processor.
+        num_workers (int):
+            The number of the threads of the preprocess and of the postprocess of a list input. If > 0, the next
+            batches are preprocessed and the previous batches are postprocessed while a batch is in forward.
+            Default 0, which runs the batches serially.
+        prefetch_size (int):
+            The max number of the batches preprocessed ahead of the forward, when num_workers > 0. Default 2.
+        max_pending (int):
+            The max number of the forwarded batches waiting for their postprocess, when num_workers > 0. Default 2.
     """
     _support_list = {}
+    _execution_params = {"num_workers": 0, "prefetch_size": 2, "max_pending": 2}
 
     def __init__(self, model: Union[str, BaseModel, Model],
                  tokenizer: Optional[BaseTokenizer] = None,
@@ -65,6 +76,7 @@ class BasePipeline(ABC):
             raise TypeError(f"model should be str or inherited from BaseModel or Model, but got type {type(model)}.")
         self.tokenizer = tokenizer
         self.image_processor = image_processor
+        self.execution_params = self._pop_execution_params(kwargs, self._execution_params)
         self._preprocess_params, self._forward_params, \
         self._postprocess_params = self._sanitize_parameters(**kwargs)
         self.call_count = 0
@@ -86,6 +98,7 @@ class BasePipeline(ABC):
         Returns:
             outputs: The outputs of pipeline, the type of outputs depends on task.
         """
+        execution_params = self._pop_execution_params(kwargs, self.execution_params)
         preprocess_params, forward_params, postprocess_params = self._sanitize_parameters(**kwargs)
         preprocess_params = {**self._preprocess_params, **preprocess_params}
         forward_params = {**self._forward_params, **forward_params}
@@ -118,7 +131,8 @@ class BasePipeline(ABC):
                 outputs.extend(self.run_single(items, preprocess_params,
                                                forward_params, postprocess_params))
         elif is_list:
-            outputs = self.run_multi(inputs, batch_size, preprocess_params, forward_params, postprocess_params)
+            outputs = self.run_multi(inputs, batch_size, preprocess_params, forward_params, postprocess_params,
+                                     **execution_params)
         else:
             outputs = self.run_single(inputs, preprocess_params, forward_params, postprocess_params)
 
@@ -136,6 +150,18 @@ class BasePipeline(ABC):
             raise ValueError('batch_size must be positive!')
         self._batch_size = bs
 
+    @staticmethod
+    def _pop_execution_params(kwargs, defaults):
+        """Pop the parameters of the execution of a list input from kwargs, which are not the ones of the task."""
+        params = {}
+        for key, default in defaults.items():
+            value = kwargs.pop(key, default)
+            if not isinstance(value, int) or value < 0 or (key != "num_workers" and value < 1):
+                raise ValueError(f"{key} should be a {'non-negative' if key == 'num_workers' else 'positive'} "
+                                 f"integer, but got {value}.")
+            params[key] = value
+        return params
+
     @abstractmethod
     def _sanitize_parameters(self, **pipeline_parameters):
         r"""Sanitize Parameters
@@ -175,7 +201,10 @@ class BasePipeline(ABC):
                   batch_size: int,
                   preprocess_params: dict,
                   forward_params: dict,
-                  postprocess_params: dict):
+                  postprocess_params: dict,
+                  num_workers: int = 0,
+                  prefetch_size: int = 2,
+                  max_pending: int = 2):
         r"""Run Multiple Method
         This function is used to run a list input for task.
 
@@ -190,6 +219,13 @@ class BasePipeline(ABC):
                 The parameter dict for model forward process.
             postprocess_params (dict):
                 The parameter dict for postprocess.
+            num_workers (int):
+                The number of the threads of the preprocess and of the postprocess, 0 runs the batches serially.
+                Default 0.
+            prefetch_size (int):
+                The max number of the batches preprocessed ahead of the forward. Default 2.
+            max_pending (int):
+                The max number of the forwarded batches waiting for their postprocess. Default 2.
         """
         if len(inputs) % batch_size != 0:
             raise ValueError(f"When running multi input pipeline, the length of inputs {len(inputs)}"
@@ -199,11 +235,47 @@ class BasePipeline(ABC):
             batch_inputs = [inputs[i:i+batch_size] for i in range(0, len(inputs), batch_size)]
         else:
             batch_inputs = inputs
+        if num_workers > 0:
+            return self._run_overlapped(batch_inputs, preprocess_params, forward_params, postprocess_params,
+                                        num_workers, prefetch_size, max_pending)
         for item in batch_inputs:
             outputs.extend(self.run_single(item, preprocess_params,
                                            forward_params, postprocess_params))
         return outputs
 
+    def _run_overlapped(self, batch_inputs, preprocess_params, forward_params, postprocess_params,
+                        num_workers, prefetch_size, max_pending):
+        """
+        Run the batches with the preprocess of the next batches and the postprocess of the previous batches in
+        thread pools while a batch is in forward, in the calling thread. The graphs run without the GIL, and the
+        tokenizers of the text tasks mostly run in native code. The outputs are in the order of the inputs.
+        """
+        outputs = []
+        batches = iter(batch_inputs)
+        end = object()
+        preprocessed = collections.deque()
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=num_workers) as preprocess_executor, \
+                ThreadPoolExecutor(max_workers=num_workers) as postprocess_executor:
+            def prefetch():
+                while len(preprocessed) < prefetch_size:
+                    item = next(batches, end)
+                    if item is end:
+                        return
+                    preprocessed.append(preprocess_executor.submit(self.preprocess, item, **preprocess_params))
+
+            prefetch()
+            while preprocessed:
+                model_inputs = preprocessed.popleft().result()
+                prefetch()
+                model_outputs = self.forward(model_inputs, **forward_params)
+                pending.append(postprocess_executor.submit(self.postprocess, model_outputs, **postprocess_params))
+                while len(pending) > max_pending:
+                    outputs.extend(pending.popleft().result())
+            for future in pending:
+                outputs.extend(future.result())
+        return outputs
+
     @abstractmethod
     def preprocess(self, inputs: Union[dict, str, np.array, Tensor],
                    **preprocess_params):
@@ -0,0 +1,115 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark beam search against repeated sampling with a tiny LlamaForCausalLM.
+
+`num_candidates` candidates of every prompt of a batch, such as the SMILES candidates of a text2smiles prompt, are
+generated by calling `generate` with sampling `num_candidates` times, prefilling the prompts every time, and by one
+beam search call with `num_candidates` beams, whose beams share one prefill and reorder the rows of the kv cache.
+The candidates/s and the number of different candidates per prompt are reported.
+
+How to run this:
+python mindformers/tools/benchmark/beam_search_benchmark.py --prompt_length 192 --num_candidates 4
+"""
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+
+
+def build_model(args, batch_size):
+    """a tiny llama with the dense kv cache."""
+    patterns_path = save_random_expert_patterns(os.path.join(tempfile.mkdtemp(), "expert_patterns.bin"),
+                                                args.num_layers, args.hidden_size, 16)
+    config = LlamaConfig(batch_size=batch_size, seq_length=args.seq_length, vocab_size=args.vocab_size,
+                         hidden_size=args.hidden_size, num_layers=args.num_layers, num_heads=args.num_heads,
+                         multiple_of=16, use_past=True, compute_dtype="float32", layernorm_compute_type="float32",
+                         softmax_compute_type="float32", rotary_dtype="float32", param_init_type="float32",
+                         expert_patterns_path=patterns_path)
+    return LlamaForCausalLM(config)
+
+
+def distinct(outputs, num_prompts, prompt_length):
+    """the average number of different candidates of a prompt."""
+    candidates = [set() for _ in range(num_prompts)]
+    for i, output in enumerate(outputs):
+        candidates[i % num_prompts].add(tuple(output[prompt_length:]))
+    return np.mean([len(item) for item in candidates])
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=args.device)
+    rng = np.random.RandomState(args.seed)
+    prompts = rng.randint(3, args.vocab_size, (args.batch_size, args.prompt_length)).tolist()
+    num_candidates = args.num_candidates
+    generate_kwargs = dict(max_new_tokens=args.max_new_tokens, eos_token_id=-1)
+
+    sample_model = build_model(args, args.batch_size)
+    # compile the graphs first
+    sample_model.generate(prompts, do_sample=True, top_k=args.top_k, **generate_kwargs)
+    start = time.time()
+    sample_outputs = []
+    for seed in range(num_candidates):
+        sample_outputs.extend(sample_model.generate(prompts, do_sample=True, top_k=args.top_k, seed=seed,
+                                                    **generate_kwargs))
+    sample_cost = time.time() - start
+
+    beam_model = build_model(args, args.batch_size * num_candidates)
+    ms.load_param_into_net(beam_model, {name: ms.Parameter(Tensor(param.asnumpy()), name=name)
+                                        for name, param in sample_model.parameters_and_names()
+                                        if "_past" not in name})
+    beam_kwargs = dict(num_beams=num_candidates, num_return_sequences=num_candidates, do_sample=False,
+                       **generate_kwargs)
+    beam_model.generate(prompts, **beam_kwargs)
+    start = time.time()
+    beam_outputs = beam_model.generate(prompts, **beam_kwargs)
+    beam_cost = time.time() - start
+    # the candidates of a prompt are consecutive, reorder them as the ones of the repeated sampling
+    beam_outputs = [beam_outputs[i * num_candidates + j] for j in range(num_candidates)
+                    for i in range(args.batch_size)]
+
+    total = args.batch_size * num_candidates
+    print(f"{args.batch_size} prompts of {args.prompt_length} tokens, {num_candidates} candidates of "
+          f"{args.max_new_tokens} tokens each: repeated sampling {total / sample_cost:.2f} candidates/s, "
+          f"{distinct(sample_outputs, args.batch_size, args.prompt_length):.2f} different per prompt; beam search "
+          f"{total / beam_cost:.2f} candidates/s, "
+          f"{distinct(beam_outputs, args.batch_size, args.prompt_length):.2f} different per prompt, "
+          f"speedup {sample_cost / beam_cost:.2f}x", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seq_length', default=256, type=int, help='Model seq_length. Default: 256.')
+    parser.add_argument('--vocab_size', default=32000, type=int, help='Vocabulary size. Default: 32000.')
+    parser.add_argument('--batch_size', default=2, type=int, help='Number of prompts. Default: 2.')
+    parser.add_argument('--hidden_size', default=256, type=int, help='Hidden size. Default: 256.')
+    parser.add_argument('--num_layers', default=2, type=int, help='Number of layers. Default: 2.')
+    parser.add_argument('--num_heads', default=4, type=int, help='Number of heads. Default: 4.')
+    parser.add_argument('--prompt_length', default=192, type=int, help='Prompt length. Default: 192.')
+    parser.add_argument('--max_new_tokens', default=32, type=int, help='New tokens per candidate. Default: 32.')
+    parser.add_argument('--num_candidates', default=4, type=int, help='Candidates per prompt. Default: 4.')
+    parser.add_argument('--top_k', default=50, type=int, help='top_k of the sampling. Default: 50.')
+    parser.add_argument('--device', default='CPU', type=str, help='Device target. Default: CPU.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
@@ -0,0 +1,163 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark continuous batching against static batching with a synthetic request trace.
+
+The requests arrive as a poisson process, with random prompt lengths and output lengths in
+[min_new_tokens, max_new_tokens] (the eos token is disabled, so every request generates exactly its output length).
+The static baseline only admits new requests when the whole batch is finished, like `TextGenerator._forward`.
+
+The "llama" runner is a tiny LlamaForCausalLM with use_past on CPU. The "numpy" runner only computes the lm head
+with numpy, its step cost barely depends on the number of active rows, which isolates the scheduling gain.
+
+How to run this:
+python mindformers/tools/benchmark/continuous_batching_benchmark.py --runner llama --batch_size 8 \
+    --num_requests 64 --request_rate 20
+"""
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+import mindspore as ms
+
+from mindformers.generation.continuous_batching import ContinuousBatchingEngine, ModelRunner
+
+
+class NumpyRunner:
+    """the lm head of a random model, the step cost mimics an accelerator with a fixed step time."""
+    def __init__(self, batch_size, seq_length, vocab_size, hidden_size, step_time):
+        self.batch_size = batch_size
+        self.seq_length = seq_length
+        self.step_time = step_time
+        self.embedding = np.random.randn(vocab_size, hidden_size).astype(np.float32)
+        self.lm_head = np.random.randn(hidden_size, vocab_size).astype(np.float32)
+
+    def _run(self, tokens):
+        start = time.time()
+        logits = self.embedding[tokens] @ self.lm_head
+        time.sleep(max(self.step_time - (time.time() - start), 0.))
+        return logits
+
+    def prefill(self, input_ids, molecular_mask, valid_length):
+        _ = molecular_mask
+        return self._run(input_ids[np.arange(self.batch_size), np.maximum(valid_length - 1, 0)])
+
+    def decode(self, input_ids, molecular_mask, valid_length):
+        _ = molecular_mask, valid_length
+        return self._run(input_ids[:, 0])
+
+
+class StaticBatchingEngine(ContinuousBatchingEngine):
+    """the baseline: new requests wait until every slot is free."""
+    def _admit(self):
+        if any(request is not None for request in self.slots):
+            return []
+        return super()._admit()
+
+
+def build_runner(args):
+    """build the runner of the model."""
+    if args.runner == "numpy":
+        return NumpyRunner(args.batch_size, args.seq_length, args.vocab_size, args.hidden_size, args.step_time)
+    # pylint: disable=C0415
+    from mindformers import LlamaConfig, LlamaForCausalLM
+    from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+    patterns_path = save_random_expert_patterns(os.path.join(tempfile.mkdtemp(), "expert_patterns.bin"),
+                                                2, args.hidden_size, 16)
+    config = LlamaConfig(batch_size=args.batch_size, seq_length=args.seq_length, vocab_size=args.vocab_size,
+                         hidden_size=args.hidden_size, num_layers=2, num_heads=4, multiple_of=16, use_past=True,
+                         compute_dtype="float32", layernorm_compute_type="float32", softmax_compute_type="float32",
+                         rotary_dtype="float32", param_init_type="float32",
+                         expert_patterns_path=patterns_path)
+    return ModelRunner(LlamaForCausalLM(config))
+
+
+def build_trace(args):
+    """arrival time, prompt and output length of every request."""
+    rng = np.random.RandomState(args.seed)
+    arrivals = np.cumsum(rng.exponential(1. / args.request_rate, args.num_requests)) if args.request_rate > 0 \
+        else np.zeros(args.num_requests)
+    prompt_lengths = rng.randint(args.min_prompt_length, args.max_prompt_length + 1, args.num_requests)
+    new_tokens = rng.randint(args.min_new_tokens, args.max_new_tokens + 1, args.num_requests)
+    prompts = [rng.randint(3, args.vocab_size, length).tolist() for length in prompt_lengths]
+    return list(zip(arrivals, prompts, new_tokens))
+
+
+def run_trace(engine, trace):
+    """replay the trace in real time, return tokens/s and the latency statistics in seconds."""
+    pending = list(trace)
+    requests = []
+    start = time.time()
+    while pending or engine.has_work():
+        now = time.time() - start
+        while pending and pending[0][0] <= now:
+            arrival, prompt, new_tokens = pending.pop(0)
+            request = engine.submit(prompt, max_new_tokens=int(new_tokens))
+            request.submit_time = start + arrival
+            requests.append(request)
+        if engine.has_work():
+            engine.step()
+        else:
+            time.sleep(min(pending[0][0] - now, 0.01))
+    total_time = time.time() - start
+    latency = np.array([request.finish_time - request.submit_time for request in requests])
+    first_token = np.array([request.first_token_time - request.submit_time for request in requests])
+    return {"tokens/s": engine.generated_tokens / total_time,
+            "latency mean": latency.mean(), "latency p50": np.percentile(latency, 50),
+            "latency p99": np.percentile(latency, 99), "ttft mean": first_token.mean(),
+            "steps": engine.steps}
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=args.device)
+    np.random.seed(args.seed)
+    runner = build_runner(args)
+    trace = build_trace(args)
+    # warm up the prefill and decode graphs
+    warmup = ContinuousBatchingEngine(runner, eos_token_id=-1)
+    warmup.submit(trace[0][1], max_new_tokens=2)
+    warmup.run_until_complete()
+
+    for name, engine_class in (("static", StaticBatchingEngine), ("continuous", ContinuousBatchingEngine)):
+        result = run_trace(engine_class(runner, eos_token_id=-1), trace)
+        print(f"{name:>10} batching: {result['tokens/s']:.1f} tokens/s, latency mean {result['latency mean']:.3f} s,"
+              f" p50 {result['latency p50']:.3f} s, p99 {result['latency p99']:.3f} s, "
+              f"ttft mean {result['ttft mean']:.3f} s, {result['steps']} steps", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runner', default='llama', type=str, choices=['llama', 'numpy'],
+                        help='A tiny llama with use_past or a numpy lm head. Default: llama.')
+    parser.add_argument('--batch_size', default=8, type=int, help='Number of slots. Default: 8.')
+    parser.add_argument('--seq_length', default=640, type=int, help='Model seq_length. Default: 640.')
+    parser.add_argument('--vocab_size', default=32100, type=int, help='Vocabulary size. Default: 32100.')
+    parser.add_argument('--hidden_size', default=64, type=int, help='Hidden size. Default: 64.')
+    parser.add_argument('--step_time', default=0.005, type=float,
+                        help='Step time of the numpy runner in seconds. Default: 0.005.')
+    parser.add_argument('--num_requests', default=64, type=int, help='Number of requests. Default: 64.')
+    parser.add_argument('--request_rate', default=20., type=float,
+                        help='Requests per second, 0 means all requests arrive at once. Default: 20.')
+    parser.add_argument('--min_prompt_length', default=16, type=int, help='Default: 16.')
+    parser.add_argument('--max_prompt_length', default=128, type=int, help='Default: 128.')
+    parser.add_argument('--min_new_tokens', default=20, type=int, help='Default: 20.')
+    parser.add_argument('--max_new_tokens', default=500, type=int, help='Default: 500.')
+    parser.add_argument('--device', default='CPU', type=str, help='Device target. Default: CPU.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Measure the build time and the resident memory of the expert patterns of all layers, loaded from the per layer
+patterns_{layer}.npy files or from the packed expert pattern file. Every mode runs in a fresh process.
+
+How to run this:
+python mindformers/tools/benchmark/expert_patterns_benchmark.py --param_dir ../param \
+    --expert_patterns_path ../param/expert_patterns.bin
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+import mindspore as ms
+
+
+def get_rss_mb():
+    """resident set size of the current process in MB."""
+    with open("/proc/self/status") as fp:
+        for line in fp:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def build_patterns(args):
+    """build the pattern tensors of all layers like the model construction does."""
+    if args.mode == "npy":
+        num_layers = len([name for name in os.listdir(args.param_dir) if name.startswith("patterns_")])
+        return [ms.Tensor(np.load(os.path.join(args.param_dir, f"patterns_{layer_id}.npy")), ms.float16)
+                for layer_id in range(num_layers)]
+    # pylint: disable=C0415
+    from mindformers.models.llama.expert_patterns import ExpertPatternStore
+    store = ExpertPatternStore(args.expert_patterns_path)
+    return [ms.Tensor(store.get_patterns(layer_id), ms.float16) for layer_id in range(store.num_layers)]
+
+
+def main(args):
+    """benchmark main."""
+    if args.mode is None:
+        for mode in ("npy", "packed"):
+            subprocess.run([sys.executable, __file__, "--mode", mode, "--param_dir", args.param_dir,
+                            "--expert_patterns_path", args.expert_patterns_path], check=True)
+        return
+    rss = get_rss_mb()
+    start = time.time()
+    patterns = build_patterns(args)
+    print(f"{args.mode}: {len(patterns)} layers built in {(time.time() - start) * 1000:.1f} ms, "
+          f"rss +{get_rss_mb() - rss:.1f} MB", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default=None, type=str, choices=['npy', 'packed'],
+                        help='Measure only one mode in the current process. Default: both in subprocesses.')
+    parser.add_argument('--param_dir', default='../param', type=str,
+                        help='The directory of patterns_{layer}.npy. Default: ../param.')
+    parser.add_argument('--expert_patterns_path', default='../param/expert_patterns.bin', type=str,
+                        help='The packed expert pattern file. Default: ../param/expert_patterns.bin.')
+    main(parser.parse_args())
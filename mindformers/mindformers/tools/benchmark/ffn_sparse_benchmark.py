@@ -0,0 +1,105 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark the masked and the sparse expert execution of LlamaFeedForward on CPU.
+
+How to run this:
+python mindformers/tools/benchmark/ffn_sparse_benchmark.py --tokens 64 --molecular_ratio 0.1 0.9
+"""
+import argparse
+import time
+
+import numpy as np
+
+import mindspore as ms
+
+from mindformers.models.llama.expert_patterns import ExpertPatternStore
+from mindformers.models.llama.llama_layer import LlamaFeedForward
+
+
+def build_feed_forward(args, patterns, use_sparse_ffn):
+    """build the feed forward layer with random weights."""
+    return LlamaFeedForward(dim=args.hidden_size,
+                            hidden_dim=4 * args.hidden_size,
+                            multiple_of=args.multiple_of,
+                            compute_dtype=ms.float32,
+                            param_init_type=ms.float32,
+                            layer_id=args.layer_id,
+                            use_sparse_ffn=use_sparse_ffn,
+                            patterns=patterns)
+
+
+def get_hidden_dim(hidden_size, multiple_of):
+    """hidden dim of the SwiGLU feed forward."""
+    hidden_dim = int(2 * 4 * hidden_size / 3)
+    return multiple_of * ((hidden_dim + multiple_of - 1) // multiple_of)
+
+
+def random_patterns(hidden_dim, expert_num):
+    """split the hidden neurons into `expert_num` random disjoint blocks."""
+    labels = np.random.permutation(np.arange(hidden_dim) % expert_num)
+    return np.stack([labels == expert_id for expert_id in range(expert_num)])
+
+
+def time_per_token(feed_forward, x, molecular_mask, steps):
+    """average forward time per token in milliseconds."""
+    feed_forward(x, molecular_mask)
+    start = time.time()
+    for _ in range(steps):
+        output = feed_forward(x, molecular_mask)
+    output.asnumpy()
+    return (time.time() - start) * 1000 / steps / x.shape[0] / x.shape[1]
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.PYNATIVE_MODE, device_target="CPU")
+    np.random.seed(args.seed)
+    if args.expert_patterns_path is None:
+        patterns = random_patterns(get_hidden_dim(args.hidden_size, args.multiple_of), args.expert_num)
+    else:
+        patterns = ExpertPatternStore(args.expert_patterns_path).get_patterns(args.layer_id)
+    dense = build_feed_forward(args, patterns, False)
+    sparse = build_feed_forward(args, patterns, True)
+    sparse_params = dict(sparse.parameters_and_names())
+    for name, param in dense.parameters_and_names():
+        sparse_params[name].set_data(param.data)
+
+    x = ms.Tensor(np.random.randn(1, args.tokens, args.hidden_size).astype(np.float32))
+    for ratio in args.molecular_ratio:
+        molecular_mask = ms.Tensor((np.random.rand(1, args.tokens) < ratio).astype(np.int32))
+        max_diff = np.abs(dense(x, molecular_mask).asnumpy() - sparse(x, molecular_mask).asnumpy()).max()
+        dense_time = time_per_token(dense, x, molecular_mask, args.steps)
+        sparse_time = time_per_token(sparse, x, molecular_mask, args.steps)
+        print(f"molecular ratio {ratio:.2f}: masked {dense_time:.3f} ms/token, sparse {sparse_time:.3f} ms/token, "
+              f"speedup {dense_time / sparse_time:.2f}x, max abs diff {max_diff:.3e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hidden_size', default=4096, type=int, help='Hidden size of the model. Default: 4096.')
+    parser.add_argument('--multiple_of', default=256, type=int, help='SwiGLU hidden size multiple. Default: 256.')
+    parser.add_argument('--expert_num', default=16, type=int,
+                        help='Number of random experts, used when expert_patterns_path is not set. Default: 16.')
+    parser.add_argument('--expert_patterns_path', default=None, type=str,
+                        help='Load the packed expert patterns instead of random ones. Default: None.')
+    parser.add_argument('--layer_id', default=0, type=int,
+                        help='The layer of the packed expert patterns. Default: 0.')
+    parser.add_argument('--tokens', default=64, type=int, help='Number of tokens per forward. Default: 64.')
+    parser.add_argument('--molecular_ratio', default=[0.1, 0.9], type=float, nargs='+',
+                        help='Ratio of molecular tokens, 0.1 for text-heavy and 0.9 for SMILES-heavy batches.')
+    parser.add_argument('--steps', default=10, type=int, help='Timed forward steps. Default: 10.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
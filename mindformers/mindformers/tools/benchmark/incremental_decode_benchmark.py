@@ -0,0 +1,119 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark the incremental decode of TextGenerator against seq_length and batch size.
+
+The "prep" mode times only the per step input preparation, slicing the full [bs, seq_length] inputs back on host
+(the previous implementation) against feeding the [bs, 1] sampled tokens. The "generate" mode reports the end to end
+tokens/s of a tiny LlamaForCausalLM with use_past.
+
+How to run this:
+python mindformers/tools/benchmark/incremental_decode_benchmark.py --mode prep --seq_length 512 2048 4096 \
+    --batch_size 1 4 16 64
+"""
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+import mindspore as ms
+from mindspore import ops, Tensor
+
+
+def host_slice_step(input_ids, current_index):
+    """the previous step: full inputs to device, molecular mask, both copied back and sliced per row."""
+    input_ids = Tensor(input_ids, ms.int32)
+    molecular_mask = ops.where(input_ids >= 32000, Tensor(1, ms.int32), Tensor(0, ms.int32))
+    outputs = []
+    for value in (input_ids.asnumpy(), molecular_mask.asnumpy()):
+        rows = [value[i][int(index) - i * value.shape[1]:int(index) - i * value.shape[1] + 1]
+                for i, index in enumerate(current_index)]
+        outputs.append(Tensor(np.array(rows, dtype=np.int32), ms.int32))
+    return outputs
+
+
+def buffer_step(next_tokens):
+    """the current step: only the [bs, 1] sampled tokens go to device."""
+    input_ids = Tensor(next_tokens, ms.int32)
+    molecular_mask = ops.where(input_ids >= 32000, Tensor(1, ms.int32), Tensor(0, ms.int32))
+    return [input_ids, molecular_mask]
+
+
+def bench_prep(args, seq_length, batch_size):
+    """steps per second of the input preparation."""
+    input_ids = np.random.randint(0, 32100, (batch_size, seq_length)).astype(np.int32)
+    current_index = [seq_length // 2 + i * seq_length for i in range(batch_size)]
+    next_tokens = input_ids[:, seq_length // 2:seq_length // 2 + 1].copy()
+    result = []
+    for step in (lambda: host_slice_step(input_ids, current_index), lambda: buffer_step(next_tokens)):
+        step()[1].asnumpy()
+        start = time.time()
+        for _ in range(args.steps):
+            outputs = step()
+        outputs[1].asnumpy()
+        result.append(args.steps / (time.time() - start))
+    return result
+
+
+def bench_generate(args, seq_length, batch_size):
+    """generated tokens per second of a tiny llama."""
+    # pylint: disable=C0415
+    from mindformers import LlamaConfig, LlamaForCausalLM
+    from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+    patterns_path = save_random_expert_patterns(os.path.join(tempfile.mkdtemp(), "expert_patterns.bin"),
+                                                2, 64, 16)
+    config = LlamaConfig(batch_size=batch_size, seq_length=seq_length, vocab_size=32100, hidden_size=64,
+                         num_layers=2, num_heads=4, multiple_of=16, use_past=True, do_sample=False,
+                         compute_dtype="float32", layernorm_compute_type="float32", softmax_compute_type="float32",
+                         rotary_dtype="float32", param_init_type="float32",
+                         expert_patterns_path=patterns_path)
+    model = LlamaForCausalLM(config)
+    inputs = np.random.randint(1, 32100, (batch_size, args.prompt_length)).astype(np.int32)
+    start = time.time()
+    model.generate(inputs, max_new_tokens=args.new_tokens, use_past=True, do_sample=False)
+    return batch_size * args.new_tokens / (time.time() - start)
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.PYNATIVE_MODE if args.mode == "prep" else ms.GRAPH_MODE, device_target=args.device)
+    np.random.seed(args.seed)
+    for seq_length in args.seq_length:
+        for batch_size in args.batch_size:
+            if args.mode == "prep":
+                host_slice, buffer = bench_prep(args, seq_length, batch_size)
+                print(f"seq_length {seq_length}, batch_size {batch_size}: host slice {host_slice:.1f} steps/s, "
+                      f"[bs, 1] buffer {buffer:.1f} steps/s, speedup {buffer / host_slice:.2f}x", flush=True)
+            else:
+                print(f"seq_length {seq_length}, batch_size {batch_size}: "
+                      f"{bench_generate(args, seq_length, batch_size):.1f} tokens/s", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='prep', type=str, choices=['prep', 'generate'],
+                        help='Time the input preparation only or the whole generation. Default: prep.')
+    parser.add_argument('--seq_length', default=[512, 2048, 4096], type=int, nargs='+',
+                        help='Model seq_length. Default: 512 2048 4096.')
+    parser.add_argument('--batch_size', default=[1, 2, 4, 8, 16, 32, 64], type=int, nargs='+',
+                        help='Batch sizes. Default: 1 2 4 8 16 32 64.')
+    parser.add_argument('--steps', default=50, type=int, help='Timed steps in prep mode. Default: 50.')
+    parser.add_argument('--prompt_length', default=16, type=int, help='Prompt length in generate mode. Default: 16.')
+    parser.add_argument('--new_tokens', default=32, type=int, help='New tokens in generate mode. Default: 32.')
+    parser.add_argument('--device', default='CPU', type=str, help='Device target. Default: CPU.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark the dense kv cache against the paged kv cache of a tiny LlamaForCausalLM.
+
+For every seq_length, the decode latency per token is measured with prompts of prompt_length and new_tokens
+generated tokens, and the kv cache memory reserved per sequence is reported: the dense cache reserves seq_length
+tokens for every sequence, the paged cache only the blocks of the tokens generated.
+
+How to run this:
+python mindformers/tools/benchmark/paged_kv_cache_benchmark.py --seq_length 512 2048 4096 --batch_size 4
+"""
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+
+
+def build_model(args, seq_length, use_paged_kv_cache):
+    """a tiny llama with use_past."""
+    patterns_path = save_random_expert_patterns(os.path.join(tempfile.mkdtemp(), "expert_patterns.bin"),
+                                                args.num_layers, args.hidden_size, 16)
+    config = LlamaConfig(batch_size=args.batch_size, seq_length=seq_length, vocab_size=32000,
+                         hidden_size=args.hidden_size, num_layers=args.num_layers, num_heads=args.num_heads,
+                         multiple_of=16, use_past=True, do_sample=False, compute_dtype="float32",
+                         layernorm_compute_type="float32", softmax_compute_type="float32", rotary_dtype="float32",
+                         param_init_type="float32", use_paged_kv_cache=use_paged_kv_cache,
+                         kv_block_size=args.kv_block_size,
+                         expert_patterns_path=patterns_path)
+    return LlamaForCausalLM(config)
+
+
+def cache_bytes_per_sequence(args, seq_length, use_paged_kv_cache):
+    """kv cache bytes reserved for one sequence of all layers, float32."""
+    num_tokens = args.prompt_length + args.new_tokens
+    if use_paged_kv_cache:
+        num_tokens = -(-num_tokens // args.kv_block_size) * args.kv_block_size
+    else:
+        num_tokens = seq_length
+    return 2 * args.num_layers * num_tokens * args.hidden_size * 4
+
+
+def bench(args, seq_length, use_paged_kv_cache, params=None):
+    """ms per generated token."""
+    model = build_model(args, seq_length, use_paged_kv_cache)
+    if params is not None:
+        ms.load_param_into_net(model, params)
+    inputs = np.random.randint(3, 32000, (args.batch_size, args.prompt_length)).astype(np.int32).tolist()
+    # compile the prefill and the decode graphs of all the block table widths
+    model.generate(inputs, max_new_tokens=args.new_tokens, do_sample=False, eos_token_id=-1)
+    start = time.time()
+    model.generate(inputs, max_new_tokens=args.new_tokens, do_sample=False, eos_token_id=-1)
+    cost = (time.time() - start) * 1000 / args.new_tokens
+    return cost, model
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=args.device)
+    for seq_length in args.seq_length:
+        np.random.seed(args.seed)
+        dense_cost, model = bench(args, seq_length, False)
+        params = {name: ms.Parameter(Tensor(param.asnumpy()), name=name)
+                  for name, param in model.parameters_and_names() if "_past" not in name}
+        np.random.seed(args.seed)
+        paged_cost, _ = bench(args, seq_length, True, params)
+        dense_bytes = cache_bytes_per_sequence(args, seq_length, False)
+        paged_bytes = cache_bytes_per_sequence(args, seq_length, True)
+        print(f"seq_length {seq_length}: dense {dense_cost:.2f} ms/token, {dense_bytes / 1024:.0f} KB/sequence; "
+              f"paged {paged_cost:.2f} ms/token, {paged_bytes / 1024:.0f} KB/sequence; "
+              f"{dense_bytes // paged_bytes}x sequences per cache memory", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seq_length', default=[512, 2048, 4096], type=int, nargs='+',
+                        help='Model seq_length. Default: 512 2048 4096.')
+    parser.add_argument('--batch_size', default=4, type=int, help='Batch size. Default: 4.')
+    parser.add_argument('--hidden_size', default=256, type=int, help='Hidden size. Default: 256.')
+    parser.add_argument('--num_layers', default=2, type=int, help='Number of layers. Default: 2.')
+    parser.add_argument('--num_heads', default=4, type=int, help='Number of heads. Default: 4.')
+    parser.add_argument('--kv_block_size', default=16, type=int, help='Tokens per cache block. Default: 16.')
+    parser.add_argument('--prompt_length', default=64, type=int, help='Prompt length. Default: 64.')
+    parser.add_argument('--new_tokens', default=64, type=int, help='Generated tokens. Default: 64.')
+    parser.add_argument('--device', default='CPU', type=str, help='Device target. Default: CPU.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Measure the end to end samples/s of TextGenerationPipeline on a list of prompts, running the batches serially
+(before) and with the tokenization of the next batches and the detokenization of the previous batches overlapped
+with the generation (after).
+
+The prompts are the first `prompt_chars` chars of the SMILES of the eval file written with the {|X|} tokens, as in the
+SciMind datasets, repeated up to `num_prompts`. The shorter SMILES are skipped: a batch is generated up to the longest
+prompt plus `max_new_tokens`, so the prompts of the same length make every batch take `max_new_tokens` steps. The
+model is a tiny random LlamaForCausalLM, so the tokenizer takes a large part of the time, as with the long SMILES and
+captions of a served model. The outputs of both modes are checked to be identical.
+
+How to run this:
+python mindformers/tools/benchmark/pipeline_benchmark.py --vocab_file ../checkpoint_download/llama2/tokenizer.model \
+    --alphabet_file ../smiles_alphabet.txt --input_file ../LPM-24-data/smiles2text_generation/eval-text.txt
+"""
+import os
+import time
+import tempfile
+import argparse
+
+import mindspore as ms
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+from mindformers.models.llama.llama_tokenizer import LlamaTokenizer
+from mindformers.pipeline import TextGenerationPipeline
+
+
+def wrap_smiles(smiles):
+    """write every char of a SMILES with the {|X|} tokens."""
+    return "".join("{|" + char + "|}" for char in smiles)
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=args.device)
+    tokenizer = LlamaTokenizer(vocab_file=args.vocab_file)
+    with open(args.alphabet_file, "r", encoding="utf-8") as file:
+        tokenizer.add_tokens([line.strip() for line in file if line.strip()], special_tokens=True)
+    with open(args.input_file, "r", encoding="utf-8") as file:
+        lines = [line.strip()[:args.prompt_chars] for line in file if len(line.strip()) >= args.prompt_chars]
+    prompts = [wrap_smiles(lines[i % len(lines)]) for i in range(args.num_prompts)]
+
+    patterns_path = save_random_expert_patterns(os.path.join(tempfile.mkdtemp(), "expert_patterns.bin"),
+                                                args.num_layers, args.hidden_size, 16)
+    config = LlamaConfig(batch_size=args.batch_size, seq_length=args.seq_length, vocab_size=len(tokenizer),
+                         hidden_size=args.hidden_size, num_layers=args.num_layers, num_heads=args.num_heads,
+                         multiple_of=16, use_past=True, compute_dtype="float32", layernorm_compute_type="float32",
+                         softmax_compute_type="float32", rotary_dtype="float32", param_init_type="float32",
+                         expert_patterns_path=patterns_path)
+    pipeline = TextGenerationPipeline(LlamaForCausalLM(config), tokenizer, max_new_tokens=args.max_new_tokens,
+                                      do_sample=False)
+    # compile the graphs first
+    pipeline(prompts[:args.batch_size], batch_size=args.batch_size)
+
+    start = time.time()
+    serial_outputs = pipeline(prompts, batch_size=args.batch_size)
+    serial_speed = len(prompts) / (time.time() - start)
+    start = time.time()
+    overlapped_outputs = pipeline(prompts, batch_size=args.batch_size, num_workers=args.num_workers,
+                                  prefetch_size=args.prefetch_size, max_pending=args.max_pending)
+    overlapped_speed = len(prompts) / (time.time() - start)
+    if serial_outputs != overlapped_outputs:
+        raise RuntimeError("The outputs of the serial and the overlapped runs are different.")
+    print(f"{len(prompts)} prompts, batch size {args.batch_size}: serial {serial_speed:.2f} samples/s; "
+          f"overlapped with {args.num_workers} workers {overlapped_speed:.2f} samples/s "
+          f"({overlapped_speed / serial_speed:.2f}x)", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', required=True, type=str, help='The llama tokenizer.model.')
+    parser.add_argument('--alphabet_file', default='smiles_alphabet.txt', type=str,
+                        help='The SMILES tokens, one per line. Default: smiles_alphabet.txt.')
+    parser.add_argument('--input_file', default='LPM-24-data/smiles2text_generation/eval-text.txt', type=str,
+                        help='One SMILES per line. Default: LPM-24-data/smiles2text_generation/eval-text.txt.')
+    parser.add_argument('--num_prompts', default=10000, type=int, help='Number of prompts. Default: 10000.')
+    parser.add_argument('--prompt_chars', default=64, type=int, help='SMILES chars of a prompt. Default: 64.')
+    parser.add_argument('--batch_size', default=16, type=int, help='Batch size. Default: 16.')
+    parser.add_argument('--seq_length', default=128, type=int, help='Model seq_length. Default: 128.')
+    parser.add_argument('--hidden_size', default=64, type=int, help='Hidden size. Default: 64.')
+    parser.add_argument('--num_layers', default=2, type=int, help='Number of layers. Default: 2.')
+    parser.add_argument('--num_heads', default=4, type=int, help='Number of heads. Default: 4.')
+    parser.add_argument('--max_new_tokens', default=8, type=int, help='New tokens per prompt. Default: 8.')
+    parser.add_argument('--num_workers', default=1, type=int, help='Preprocess/postprocess threads. Default: 1.')
+    parser.add_argument('--prefetch_size', default=2, type=int, help='Batches preprocessed ahead. Default: 2.')
+    parser.add_argument('--max_pending', default=2, type=int, help='Batches waiting for postprocess. Default: 2.')
+    parser.add_argument('--device', default='CPU', type=str, help='Device target. Default: CPU.')
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark the shared prefix cache of the paged kv cache with a tiny LlamaForCausalLM.
+
+Batches of prompts starting with the same template_length tokens, such as the instruction template of the
+molecule captioning task, are generated with the paged kv cache with and without the prefix cache. The prefill
+latency, the prefix cache hit rate and the prefill tokens saved are reported.
+
+How to run this:
+python mindformers/tools/benchmark/prefix_cache_benchmark.py --template_length 192 --batches 8
+"""
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+
+
+def build_model(args, prefix_cache_bytes):
+    """a tiny llama with the paged kv cache."""
+    patterns_path = save_random_expert_patterns(os.path.join(tempfile.mkdtemp(), "expert_patterns.bin"),
+                                                args.num_layers, args.hidden_size, 16)
+    config = LlamaConfig(batch_size=args.batch_size, seq_length=args.seq_length, vocab_size=32000,
+                         hidden_size=args.hidden_size, num_layers=args.num_layers, num_heads=args.num_heads,
+                         multiple_of=16, use_past=True, do_sample=False, compute_dtype="float32",
+                         layernorm_compute_type="float32", softmax_compute_type="float32", rotary_dtype="float32",
+                         param_init_type="float32", use_paged_kv_cache=True, kv_block_size=args.kv_block_size,
+                         prefix_cache_bytes=prefix_cache_bytes,
+                         expert_patterns_path=patterns_path)
+    return LlamaForCausalLM(config)
+
+
+def bench(args, prefix_cache_bytes, params=None):
+    """prefill ms per batch, generating one token."""
+    model = build_model(args, prefix_cache_bytes)
+    if params is not None:
+        ms.load_param_into_net(model, params)
+    rng = np.random.RandomState(args.seed)
+    template = rng.randint(3, 32000, args.template_length).tolist()
+    batches = [[template + rng.randint(3, 32000, rng.randint(8, args.query_length)).tolist()
+                for _ in range(args.batch_size)] for _ in range(args.batches + 1)]
+    # the first batch compiles the graphs and fills the cache
+    model.generate(batches[0], max_new_tokens=1, do_sample=False, eos_token_id=-1)
+    start = time.time()
+    for inputs in batches[1:]:
+        model.generate(inputs, max_new_tokens=1, do_sample=False, eos_token_id=-1)
+    cost = (time.time() - start) * 1000 / args.batches
+    return cost, model
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=args.device)
+    base_cost, model = bench(args, 0)
+    params = {name: ms.Parameter(Tensor(param.asnumpy()), name=name)
+              for name, param in model.parameters_and_names() if "_cache" not in name}
+    prefix_cost, prefix_model = bench(args, args.prefix_cache_mb * 1024 * 1024, params)
+    stats = prefix_model.prefix_cache.stats()
+    print(f"template {args.template_length} tokens: paged {base_cost:.2f} ms/batch; prefix cache "
+          f"{prefix_cost:.2f} ms/batch, hit rate {stats['hit_rate']:.2f}, "
+          f"{stats['saved_prefill_tokens'] / stats['query_tokens']:.2%} prefill tokens saved, "
+          f"{stats['cached_bytes'] / 1024:.0f} KB cached", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seq_length', default=512, type=int, help='Model seq_length. Default: 512.')
+    parser.add_argument('--batch_size', default=4, type=int, help='Batch size. Default: 4.')
+    parser.add_argument('--hidden_size', default=256, type=int, help='Hidden size. Default: 256.')
+    parser.add_argument('--num_layers', default=2, type=int, help='Number of layers. Default: 2.')
+    parser.add_argument('--num_heads', default=4, type=int, help='Number of heads. Default: 4.')
+    parser.add_argument('--kv_block_size', default=16, type=int, help='Tokens per cache block. Default: 16.')
+    parser.add_argument('--template_length', default=192, type=int, help='Shared template length. Default: 192.')
+    parser.add_argument('--query_length', default=64, type=int, help='Max tokens after the template. Default: 64.')
+    parser.add_argument('--batches', default=8, type=int, help='Timed batches. Default: 8.')
+    parser.add_argument('--prefix_cache_mb', default=64, type=int, help='Prefix cache budget in MB. Default: 64.')
+    parser.add_argument('--device', default='CPU', type=str, help='Device target. Default: CPU.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Measure the host time of the sampling step of text generation per batch size: the per example loop with
+`softmax`, `np.random.choice` and the `p_args` index array of every step (before), and `BatchSampler` with the
+array updates of the inputs (after).
+
+How to run this:
+python mindformers/tools/benchmark/sampler_benchmark.py --vocab_size 32098 --batch_sizes 1 2 4 8 16 32 64 128
+"""
+import time
+import argparse
+
+import numpy as np
+
+from mindformers.generation import BatchSampler
+from mindformers.generation.utils import softmax
+
+
+def loop_step(probs, do_sample, input_ids, valid_length, is_finished, eos_token_id, max_length):
+    """the per example sampling loop."""
+    batch_size = probs.shape[0]
+    p_args = np.tile(np.arange(probs.shape[-1]), (batch_size, 1))
+    for i in range(batch_size):
+        if is_finished[i]:
+            continue
+        if do_sample:
+            target_index = np.random.choice(len(probs[i]), p=softmax(probs[i]))
+        else:
+            target_index = np.argmax(probs[i])
+        target = p_args[i][target_index]
+        input_ids[i, valid_length[i]] = target
+        valid_length[i] += 1
+        if target == eos_token_id or valid_length[i] == max_length:
+            is_finished[i] = True
+
+
+def batch_step(sampler, probs, do_sample, input_ids, valid_length, is_finished, eos_token_id, max_length):
+    """the vectorized sampling step."""
+    rows = np.flatnonzero(~is_finished)
+    targets = sampler.sample(probs, do_sample, rows)
+    input_ids[rows, valid_length[rows]] = targets
+    valid_length[rows] += 1
+    is_finished[rows] = (targets == eos_token_id) | (valid_length[rows] == max_length)
+
+
+def bench(step, batch_size, args):
+    """ms per step."""
+    rng = np.random.RandomState(args.seed)
+    probs = rng.randn(batch_size, args.vocab_size).astype(np.float32) * 3
+    input_ids = np.zeros((batch_size, args.seq_length), np.int32)
+    valid_length = np.full(batch_size, 16)
+    is_finished = np.zeros(batch_size, np.bool_)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        valid_length[:] = 16
+        is_finished[:] = False
+        step(probs, args.do_sample, input_ids, valid_length, is_finished, -1, args.seq_length)
+    return (time.perf_counter() - start) * 1000 / args.steps
+
+
+def main(args):
+    """benchmark main."""
+    for batch_size in args.batch_sizes:
+        sampler = BatchSampler(batch_size, seed=args.seed)
+        loop_cost = bench(loop_step, batch_size, args)
+        batch_cost = bench(lambda *inputs, sampler=sampler: batch_step(sampler, *inputs), batch_size, args)
+        print(f"bs {batch_size}: loop {loop_cost:.3f} ms/step, BatchSampler {batch_cost:.3f} ms/step "
+              f"({loop_cost / batch_cost:.2f}x)", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_size', default=32098, type=int, help='Vocabulary size. Default: 32098.')
+    parser.add_argument('--seq_length', default=512, type=int, help='Sequence length. Default: 512.')
+    parser.add_argument('--batch_sizes', default=[1, 2, 4, 8, 16, 32, 64, 128], type=int, nargs='+',
+                        help='Batch sizes. Default: 1 2 4 8 16 32 64 128.')
+    parser.add_argument('--steps', default=20, type=int, help='Timed steps. Default: 20.')
+    parser.add_argument('--greedy', dest='do_sample', action='store_false', help='Greedy search instead of sampling.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
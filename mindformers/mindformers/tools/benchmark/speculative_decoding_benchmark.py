@@ -0,0 +1,152 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark speculative decoding with a draft model or with prompt lookup against greedy decoding of a LlamaForCausalLM.
+
+The prompts are the beginnings of the SMILES of the eval file, every char is the {|X|} token of the SMILES alphabet
+added to the vocabulary from `start_id`, as in the SciMind datasets. Without checkpoints the model is random and
+the draft model is its first `draft_num_layers` layers with its embedding, norm and head, so the acceptance rate
+is the one of a self speculative draft of a random model; load the trained model and draft model to measure the
+acceptance rate of the molecules. With `--prompt_lookup_num_tokens` the drafts are copied from the prompts and the
+generated tokens instead. The outputs are checked to be the greedy ones.
+
+How to run this:
+python mindformers/tools/benchmark/speculative_decoding_benchmark.py --alphabet_file ../smiles_alphabet.txt \
+    --input_file ../LPM-24-data/smiles2text_generation/eval-text.txt --num_draft_tokens 4
+python mindformers/tools/benchmark/speculative_decoding_benchmark.py --alphabet_file ../smiles_alphabet.txt \
+    --input_file ../LPM-24-data/smiles2text_generation/eval-text.txt --prompt_lookup_num_tokens 4
+"""
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+
+
+def build_model(args, num_layers, checkpoint):
+    """a llama with the dense kv cache."""
+    # a checkpoint carries the expert patterns it was trained with, a random model gets random ones
+    patterns_path = args.expert_patterns_path
+    if not patterns_path and not checkpoint:
+        patterns_path = save_random_expert_patterns(os.path.join(tempfile.mkdtemp(), "expert_patterns.bin"),
+                                                    num_layers, args.hidden_size, 16)
+    config = LlamaConfig(batch_size=args.batch_size, seq_length=args.seq_length, vocab_size=args.vocab_size,
+                         hidden_size=args.hidden_size, num_layers=num_layers, num_heads=args.num_heads,
+                         multiple_of=16, use_past=True, compute_dtype="float32", layernorm_compute_type="float32",
+                         softmax_compute_type="float32", rotary_dtype="float32", param_init_type="float32",
+                         expert_patterns_path=patterns_path, checkpoint_name_or_path=checkpoint)
+    return LlamaForCausalLM(config)
+
+
+def load_prompts(args):
+    """the first `prompt_length` SMILES tokens of the SMILES of the eval file, padded with 0."""
+    with open(args.alphabet_file, "r", encoding="utf-8") as file:
+        vocab = {line.strip()[2]: args.start_id + index for index, line in enumerate(file) if line.strip()}
+    with open(args.input_file, "r", encoding="utf-8") as file:
+        lines = [line.strip() for line in file if line.strip()][:args.num_prompts]
+    prompts = np.zeros((len(lines), args.prompt_length), np.int32)
+    for i, line in enumerate(lines):
+        token_ids = [vocab[char] for char in line if char in vocab][:args.prompt_length]
+        prompts[i, :len(token_ids)] = token_ids
+    return prompts
+
+
+def main(args):
+    """benchmark main."""
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=args.device)
+    ms.set_seed(args.seed)
+    prompts = load_prompts(args)
+    model = build_model(args, args.num_layers, args.checkpoint)
+    if args.prompt_lookup_num_tokens:
+        speculative_kwargs = dict(prompt_lookup_num_tokens=args.prompt_lookup_num_tokens,
+                                  max_matching_ngram_size=args.max_matching_ngram_size)
+        mode = f"prompt lookup of {args.prompt_lookup_num_tokens} tokens"
+    else:
+        draft_model = build_model(args, args.draft_num_layers, args.draft_checkpoint)
+        if not args.draft_checkpoint:
+            ms.load_param_into_net(draft_model, {name: ms.Parameter(Tensor(param.asnumpy()), name=name)
+                                                 for name, param in model.parameters_and_names()
+                                                 if "_past" not in name})
+        speculative_kwargs = dict(draft_model=draft_model, num_draft_tokens=args.num_draft_tokens)
+        mode = f"{args.num_draft_tokens} draft tokens of a {args.draft_num_layers} layer draft model"
+    generate_kwargs = dict(max_new_tokens=args.max_new_tokens, eos_token_id=args.eos_token_id, do_sample=False)
+    batches = [prompts[i:i + args.batch_size].tolist() for i in range(0, len(prompts), args.batch_size)
+               if i + args.batch_size <= len(prompts)]
+
+    # compile the graphs first
+    model.generate(batches[0], **generate_kwargs)
+    model.generate(batches[0], **speculative_kwargs, **generate_kwargs)
+    greedy_cost, speculative_cost, num_tokens = 0, 0, 0
+    proposed, accepted, steps = 0, 0, 0
+    for batch in batches:
+        start = time.time()
+        expected = model.generate(batch, **generate_kwargs)
+        greedy_cost += time.time() - start
+        start = time.time()
+        outputs = model.generate(batch, **speculative_kwargs, **generate_kwargs)
+        speculative_cost += time.time() - start
+        if [list(output) for output in outputs] != [list(output) for output in expected]:
+            raise RuntimeError("The outputs of speculative decoding are not the greedy ones.")
+        num_tokens += sum(len(output) for output in outputs) - np.count_nonzero(batch)
+        stats = model.speculative_stats.stats()
+        proposed += stats["proposed_tokens"]
+        accepted += stats["accepted_tokens"]
+        steps += stats["steps"]
+
+    print(f"{len(batches) * args.batch_size} prompts of {args.prompt_length} SMILES tokens, {num_tokens} tokens "
+          f"generated: greedy {num_tokens / greedy_cost:.2f} tokens/s; speculative decoding with {mode} "
+          f"{num_tokens / speculative_cost:.2f} tokens/s, acceptance rate {accepted / max(proposed, 1):.2%}, "
+          f"{proposed / max(steps, 1) / args.batch_size:.2f} drafts per verification, "
+          f"speedup {greedy_cost / speculative_cost:.2f}x", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alphabet_file', default='smiles_alphabet.txt', type=str,
+                        help='The SMILES tokens, one per line. Default: smiles_alphabet.txt.')
+    parser.add_argument('--input_file', default='LPM-24-data/smiles2text_generation/eval-text.txt', type=str,
+                        help='One SMILES per line. Default: LPM-24-data/smiles2text_generation/eval-text.txt.')
+    parser.add_argument('--start_id', default=32000, type=int, help='Id of the first SMILES token. Default: 32000.')
+    parser.add_argument('--checkpoint', default=None, type=str, help='Model checkpoint. Default: random.')
+    parser.add_argument('--draft_checkpoint', default=None, type=str,
+                        help='Draft model checkpoint. Default: the first layers of the model.')
+    parser.add_argument('--expert_patterns_path', default=None, type=str,
+                        help='Expert patterns of the feed forward. Default: the ones of the checkpoint.')
+    parser.add_argument('--seq_length', default=128, type=int, help='Model seq_length. Default: 128.')
+    parser.add_argument('--vocab_size', default=32128, type=int, help='Vocabulary size. Default: 32128.')
+    parser.add_argument('--hidden_size', default=256, type=int, help='Hidden size. Default: 256.')
+    parser.add_argument('--num_layers', default=8, type=int, help='Number of layers. Default: 8.')
+    parser.add_argument('--draft_num_layers', default=1, type=int, help='Number of draft layers. Default: 1.')
+    parser.add_argument('--num_heads', default=4, type=int, help='Number of heads. Default: 4.')
+    parser.add_argument('--batch_size', default=4, type=int, help='Batch size. Default: 4.')
+    parser.add_argument('--num_prompts', default=16, type=int, help='Number of SMILES prompts. Default: 16.')
+    parser.add_argument('--prompt_length', default=32, type=int, help='Prompt length. Default: 32.')
+    parser.add_argument('--max_new_tokens', default=64, type=int, help='New tokens per prompt. Default: 64.')
+    parser.add_argument('--num_draft_tokens', default=4, type=int, help='Draft tokens per step. Default: 4.')
+    parser.add_argument('--prompt_lookup_num_tokens', default=None, type=int,
+                        help='Copy the drafts from the sequences instead of the draft model. Default: None.')
+    parser.add_argument('--max_matching_ngram_size', default=3, type=int,
+                        help='Max suffix length of the prompt lookup. Default: 3.')
+    parser.add_argument('--eos_token_id', default=2, type=int, help='Eos token id. Default: 2.')
+    parser.add_argument('--device', default='CPU', type=str, help='Device target. Default: CPU.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed. Default: 0.')
+    main(parser.parse_args())
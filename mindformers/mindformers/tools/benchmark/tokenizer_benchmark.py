@@ -0,0 +1,80 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Measure the chars/s of LlamaTokenizer.tokenize with the SMILES tokens added, splitting on the added tokens with the
+Python Trie (before) and the compiled TokenMatcher (after), and of tokenize_batch.
+
+Every SMILES of the eval file is written with the {|X|} tokens, as in the SciMind datasets. The outputs of all the
+modes are checked to be identical.
+
+How to run this:
+python mindformers/tools/benchmark/tokenizer_benchmark.py --vocab_file ../checkpoint_download/llama2/tokenizer.model \
+    --alphabet_file ../smiles_alphabet_32098.txt --input_file ../LPM-24-data/smiles2text_generation/eval-text.txt
+"""
+import time
+import argparse
+
+from mindformers.models.base_tokenizer import Trie
+from mindformers.models.llama.llama_tokenizer import LlamaTokenizer
+
+
+def wrap_smiles(smiles):
+    """write every char of a SMILES with the {|X|} tokens."""
+    return "".join("{|" + char + "|}" for char in smiles)
+
+
+def bench(texts, tokenize):
+    """chars/s and the outputs."""
+    start = time.perf_counter()
+    outputs = tokenize(texts)
+    cost = time.perf_counter() - start
+    return sum(len(text) for text in texts) / cost, outputs
+
+
+def main(args):
+    """benchmark main."""
+    tokenizer = LlamaTokenizer(vocab_file=args.vocab_file)
+    with open(args.alphabet_file, "r", encoding="utf-8") as file:
+        tokenizer.add_tokens([line.strip() for line in file if line.strip()], special_tokens=True)
+    with open(args.input_file, "r", encoding="utf-8") as file:
+        lines = [line.strip() for line in file if line.strip()][:args.num_lines]
+    texts = lines if args.raw else [wrap_smiles(line) for line in lines]
+
+    matcher = tokenizer.tokens_trie
+    trie = Trie()
+    for token in tokenizer.unique_no_split_tokens:
+        trie.add(token)
+    tokenizer.tokens_trie = trie
+    trie_speed, trie_outputs = bench(texts, lambda texts: [tokenizer.tokenize(text) for text in texts])
+    tokenizer.tokens_trie = matcher
+    matcher_speed, matcher_outputs = bench(texts, lambda texts: [tokenizer.tokenize(text) for text in texts])
+    batch_speed, batch_outputs = bench(texts, tokenizer.tokenize_batch)
+    if not trie_outputs == matcher_outputs == batch_outputs:
+        raise RuntimeError("The tokens of the Trie and the TokenMatcher are different.")
+    print(f"{len(texts)} texts, {sum(len(text) for text in texts)} chars: Trie {trie_speed:.0f} chars/s; "
+          f"TokenMatcher {matcher_speed:.0f} chars/s ({matcher_speed / trie_speed:.2f}x); "
+          f"tokenize_batch {batch_speed:.0f} chars/s ({batch_speed / trie_speed:.2f}x)", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', required=True, type=str, help='The llama tokenizer.model.')
+    parser.add_argument('--alphabet_file', default='smiles_alphabet_32098.txt', type=str,
+                        help='The added tokens, one per line. Default: smiles_alphabet_32098.txt.')
+    parser.add_argument('--input_file', default='LPM-24-data/smiles2text_generation/eval-text.txt', type=str,
+                        help='One SMILES per line. Default: LPM-24-data/smiles2text_generation/eval-text.txt.')
+    parser.add_argument('--num_lines', default=None, type=int, help='Use the first lines only. Default: all.')
+    parser.add_argument('--raw', action='store_true', help='Tokenize the raw SMILES instead of the {|X|} tokens.')
+    main(parser.parse_args())
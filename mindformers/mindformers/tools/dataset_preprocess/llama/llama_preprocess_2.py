@@ -18,8 +18,12 @@ transform wikitext-2, wikitext-103, lambada, openwebtext dataset to mindrecord.
 """
 import argparse
 import json
+import multiprocessing
 import os
 import re
+import resource
+import threading
+import time
 import numpy as np
 
 np.set_printoptions(threshold=np.inf)
@@ -87,6 +91,20 @@ def clean_wikitext(string):
     return string
 
 
+def apply_template(conv, roles, source, index):
+    """the prompt of one conversation."""
+    if roles[source[0]["from"]] != conv.roles[0]:
+        # Skip the first one if it is not from human
+        source = source[1:]
+
+    conv.messages = []
+    for j, sentence in enumerate(source):
+        role = roles[sentence["from"]]
+        assert role == conv.roles[j % 2], f"{index}"
+        conv.append_message(role, sentence["value"])
+    return conv.get_prompt()
+
+
 def preprocess(sources, tokenizer, seq_length):
     """conversation preprocess."""
     conv = get_default_conv_template("vicuna").copy()
@@ -95,16 +113,7 @@ def preprocess(sources, tokenizer, seq_length):
     # Apply prompt templates
     conversations = []
     for i, source in enumerate(sources):
-        if roles[source[0]["from"]] != conv.roles[0]:
-            # Skip the first one if it is not from human
-            source = source[1:]
-
-        conv.messages = []
-        for j, sentence in enumerate(source):
-            role = roles[sentence["from"]]
-            assert role == conv.roles[j % 2], f"{i}"
-            conv.append_message(role, sentence["value"])
-        conversations.append(conv.get_prompt())
+        conversations.append(apply_template(conv, roles, source, i))
 
     sep = conv.sep + conv.roles[1] + ": "
     # Tokenize conversations
@@ -225,6 +234,227 @@ def tokenize_qa(tokenizer, file_path, seq_length):
         yield dataset_cls[i]
 
 
+def iter_json_array(file_path, chunk_size=1 << 20):
+    """yield the items of a json array file one by one, reading chunk_size chars at a time."""
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        while not buffer:
+            more = f.read(chunk_size)
+            if not more:
+                break
+            buffer = more.lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{file_path} is not a json array.")
+        pos = 1
+        eof = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer) and not eof:
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+                continue
+            if pos == len(buffer) or buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the item goes on in the next chunk
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield item
+            pos = end
+
+
+def tokenize_conversation(tokenizer, conv, source, seq_length, pad=True):
+    """the same record as tokenize_qa for one conversation, tokenizing every round once. Without pad, the record
+    keeps its length, at most seq_length."""
+    roles = {"human": conv.roles[0], "gpt": conv.roles[1]}
+    sep = conv.sep + conv.roles[1] + ": "
+    rounds = apply_template(conv, roles, source, 0).split(conv.sep2)
+    if "" in rounds:
+        rounds = rounds[:rounds.index("")]
+
+    # the ids of tokenizer(rou)['input_ids'][1:]
+    round_ids = [tokenizer.build_inputs_with_special_tokens(tokenizer.convert_tokens_to_ids(tokens))[1:]
+                 for tokens in tokenizer.tokenize_batch(rounds)]
+    ids = [tokenizer.bos_token_id]
+    for item in round_ids:
+        ids.extend(item)
+    d = {'input_ids': ids, 'attention_mask': [1] * len(ids)}
+    if pad:
+        # pylint: disable=W0212
+        d = tokenizer._pad(d, max_length=seq_length, padding_strategy='max_length')
+    truncated = len(d['input_ids']) > seq_length
+    if truncated:
+        d['input_ids'] = d['input_ids'][:seq_length - 1] + [2]
+
+    input_ids = np.array(d['input_ids'])
+    target = input_ids.copy()
+    total_len = int(np.not_equal(target, tokenizer.pad_token_id).sum())
+    cur_len = 1
+    target[:cur_len] = IGNORE_TOKEN_ID
+    for rou, item in zip(rounds, round_ids):
+        # the instruction is not masked, as in preprocess, so its length is not needed
+        if len(rou.split(sep)) != 2:
+            break
+        cur_len += len(item)
+    target[cur_len:] = IGNORE_TOKEN_ID
+    if cur_len < seq_length and cur_len != total_len:
+        target[:] = IGNORE_TOKEN_ID
+    record = dict(input_ids=input_ids, labels=target,
+                  molecular_mask=(input_ids[:-1] >= 32000).astype(np.float32))
+    return record, truncated
+
+
+_WORKER = {}
+
+
+def _init_worker(model_file, alphabet_file, seq_length, pad=True):
+    """build the tokenizer of a worker once."""
+    _WORKER["tokenizer"] = build_tokenizer(model_file, alphabet_file)
+    _WORKER["conv"] = get_default_conv_template("vicuna").copy()
+    _WORKER["seq_length"] = seq_length
+    _WORKER["pad"] = pad
+
+
+def _tokenize_chunk(examples):
+    """the records of a chunk of examples."""
+    return [tokenize_conversation(_WORKER["tokenizer"], _WORKER["conv"], example["conversation"],
+                                  _WORKER["seq_length"], _WORKER["pad"]) for example in examples]
+
+
+def _bounded(iterable, semaphore):
+    """yield the items of iterable, waiting for the semaphore before each one."""
+    for item in iterable:
+        semaphore.acquire()
+        yield item
+
+
+def tokenize_qa_parallel(file_path, model_file, alphabet_file, seq_length, workers, chunk_size=64, pad=True):
+    """
+    Yield the records of tokenize_qa in the same order, streaming the json file and tokenizing chunks of
+    conversations in a pool of workers. At most 2 * workers chunks are in flight, so the memory does not grow with
+    the file.
+    """
+    semaphore = threading.Semaphore(2 * workers)
+    chunks_iter = package_file(iter_json_array(file_path), chunk_size)
+    truncated_count = 0
+    with multiprocessing.Pool(workers, _init_worker, (model_file, alphabet_file, seq_length, pad)) as pool:
+        for records in pool.imap(_tokenize_chunk, _bounded(chunks_iter, semaphore)):
+            semaphore.release()
+            for record, truncated in records:
+                truncated_count += truncated
+                yield record
+    if truncated_count:
+        print(f"{truncated_count} records are longer than {seq_length}, truncated.")
+
+
+def tokenize_qa_unpadded(tokenizer, file_path, seq_length):
+    """yield the records of the conversations without padding, streaming the json file."""
+    conv = get_default_conv_template("vicuna").copy()
+    truncated_count = 0
+    for example in iter_json_array(file_path):
+        record, truncated = tokenize_conversation(tokenizer, conv, example["conversation"], seq_length, pad=False)
+        truncated_count += truncated
+        yield record
+    if truncated_count:
+        print(f"{truncated_count} records are longer than {seq_length}, truncated.")
+
+
+def first_fit_decreasing(lengths, capacity):
+    """
+    Pack the items into the least bins of capacity with first-fit-decreasing: from the longest, every item goes into
+    the first bin with room for it. A segment tree of the free room of the bins finds that bin in O(log n).
+
+    Returns:
+        The item indices of every bin.
+    """
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    size = 1
+    while size < max(len(order), 1):
+        size *= 2
+    # tree[size + b]: the free room of bin b, the unopened bins have the full capacity
+    tree = np.full(2 * size, capacity, dtype=np.int64)
+    bins = []
+    for index in order:
+        length = lengths[index]
+        node = 1
+        while node < size:
+            node = 2 * node if tree[2 * node] >= length else 2 * node + 1
+        bin_index = node - size
+        if bin_index == len(bins):
+            bins.append([])
+        bins[bin_index].append(index)
+        tree[node] -= length
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+    return bins
+
+
+def pack_records(records, seq_length, pad_token_id=0):
+    """
+    Pack the unpadded records of the conversations into records of seq_length with first-fit-decreasing.
+
+    The input ids and the labels of the conversations are concatenated, so every label stays aligned with its
+    token, the first token of a conversation is ignored in the labels as before. The packed records also get the
+    position ids of every token restarting at every conversation, from which the model builds the attention mask of
+    the conversations when eod_reset. The molecular mask and the position ids are of the seq_length - 1 input tokens.
+
+    Returns:
+        The packed records and the pad fraction.
+    """
+    bins = first_fit_decreasing([len(record["input_ids"]) for record in records], seq_length)
+    packed = []
+    for indices in bins:
+        input_ids = np.full(seq_length, pad_token_id, dtype=np.int32)
+        labels = np.full(seq_length, IGNORE_TOKEN_ID, dtype=np.int32)
+        position_ids = np.zeros(seq_length, dtype=np.int32)
+        start = 0
+        for index in sorted(indices):
+            length = len(records[index]["input_ids"])
+            input_ids[start:start + length] = records[index]["input_ids"]
+            labels[start:start + length] = records[index]["labels"]
+            position_ids[start:start + length] = np.arange(length)
+            start += length
+        packed.append(dict(input_ids=input_ids, labels=labels,
+                           molecular_mask=(input_ids[:-1] >= 32000).astype(np.float32),
+                           position_ids=position_ids[:-1]))
+    num_tokens = sum(len(record["input_ids"]) for record in records)
+    pad_fraction = 1 - num_tokens / (len(packed) * seq_length) if packed else 0.0
+    return packed, pad_fraction
+
+
+def build_tokenizer(model_file, alphabet_file):
+    """the llama tokenizer with the smiles tokens."""
+    if not os.path.exists(model_file):
+        raise FileNotFoundError(f"file {model_file} do not exists.")
+    word_tokenizer = LlamaTokenizer(vocab_file=model_file)
+    if hasattr(word_tokenizer, 'add_bos_token'):
+        word_tokenizer.add_bos_token = True
+    if hasattr(word_tokenizer, 'add_eos_token'):
+        word_tokenizer.add_eos_token = True
+
+    word_tokenizer.pad_token_id = 0
+    with open(alphabet_file, 'r') as f:
+        need_add_tokens = [x.strip() for x in f.readlines()]
+    word_tokenizer.add_tokens(need_add_tokens, special_tokens=True)
+    return word_tokenizer
+
+
+def peak_rss_mb():
+    """the peak rss of this process and of the largest worker in MB."""
+    main_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return main_rss, worker_rss
+
+
 if __name__ == '__main__':
     # import os
     # os.system("rm -rf /home/ma-user/work/r0.8_fangxt/htc_data/smiles_alpaca_test")
@@ -237,6 +467,14 @@ if __name__ == '__main__':
     parser.add_argument('--file_partition', type=int, default=2)
     parser.add_argument('--repeat', type=int, default=1)
     parser.add_argument('--seq_length', type=int, default=2048)
+    parser.add_argument('--alphabet_file', type=str,
+                        default='/home/ma-user/work/r0.8_fangxt/smiles_alphabet.txt')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Stream the qa json and tokenize it with this many processes. Default: 0, serial.')
+    parser.add_argument('--chunk_size', type=int, default=64,
+                        help='Conversations per task and per write in the parallel mode. Default: 64.')
+    parser.add_argument('--pack', action='store_true',
+                        help='Pack the qa conversations into the sequences with first-fit-decreasing.')
     args = parser.parse_args()
 
     out_dir, out_file = os.path.split(os.path.abspath(args.output_file))
@@ -249,26 +487,16 @@ if __name__ == '__main__':
                   'molecular_mask': {"type": "float32", "shape": [-1]},
                   'labels': {"type": "int32", "shape": [-1]}
                  }
+        if args.pack:
+            schema['position_ids'] = {"type": "int32", "shape": [-1]}
     writer = FileWriter(file_name=args.output_file,
                         shard_num=args.file_partition)
     writer.add_schema(schema, args.dataset_type)
     writer.open_and_set_header()
 
     # Start to load tokenizer
-    if not os.path.exists(args.model_file):
-        raise FileNotFoundError(f"file {args.model_file} do not exists.")
-
     transforms_count = 0
-    word_tokenizer = LlamaTokenizer(vocab_file=args.model_file)
-    if hasattr(word_tokenizer, 'add_bos_token'):
-        word_tokenizer.add_bos_token = True
-    if hasattr(word_tokenizer, 'add_eos_token'):
-        word_tokenizer.add_eos_token = True
-
-    word_tokenizer.pad_token_id = 0
-    need_add_tokens = open('/home/ma-user/work/r0.8_fangxt/smiles_alphabet.txt', 'r').readlines()
-    need_add_tokens=[x.strip()for x in need_add_tokens]
-    word_tokenizer.add_tokens(need_add_tokens, special_tokens=True)
+    word_tokenizer = build_tokenizer(args.model_file, args.alphabet_file)
     print(word_tokenizer)
     print('len(tokenizer)', len(word_tokenizer))
     print('xxxxxxxxxxxxxxxx', word_tokenizer.tokenize('{|C|}'))
@@ -284,6 +512,38 @@ if __name__ == '__main__':
             transforms_count += 1
             writer.write_raw_data([x])
         print("Transformed {} records.".format(transforms_count))
+    elif args.dataset_type == 'qa' and args.pack:
+        start = time.time()
+        if args.workers > 0:
+            records = list(tokenize_qa_parallel(args.input_glob, args.model_file, args.alphabet_file,
+                                                args.seq_length + 1, args.workers, args.chunk_size, pad=False))
+        else:
+            records = list(tokenize_qa_unpadded(word_tokenizer, args.input_glob, args.seq_length + 1))
+        packed, pad_fraction = pack_records(records, args.seq_length + 1, word_tokenizer.pad_token_id)
+        for batch in chunks(packed, args.chunk_size):
+            writer.write_raw_data(batch, parallel_writer=args.file_partition > 1)
+        transforms_count = len(packed)
+        num_tokens = sum(len(record["input_ids"]) for record in records)
+        unpacked_pad_fraction = 1 - num_tokens / (len(records) * (args.seq_length + 1)) if records else 0.0
+        print(f"Packed {len(records)} conversations into {transforms_count} records in {time.time() - start:.1f}s, "
+              f"pad fraction {pad_fraction:.2%} (unpacked {unpacked_pad_fraction:.2%}), "
+              f"{num_tokens / max(transforms_count, 1):.0f} tokens per record.")
+    elif args.dataset_type == 'qa' and args.workers > 0:
+        start = time.time()
+        batch = []
+        for x in tokenize_qa_parallel(args.input_glob, args.model_file, args.alphabet_file, args.seq_length + 1,
+                                      args.workers, args.chunk_size):
+            batch.append(x)
+            transforms_count += 1
+            if len(batch) == args.chunk_size:
+                writer.write_raw_data(batch, parallel_writer=args.file_partition > 1)
+                batch = []
+        if batch:
+            writer.write_raw_data(batch, parallel_writer=args.file_partition > 1)
+        cost = time.time() - start
+        main_rss, worker_rss = peak_rss_mb()
+        print(f"Transformed {transforms_count} records in {cost:.1f}s, {transforms_count / cost:.1f} records/s, "
+              f"peak rss {main_rss:.0f} MB, worker peak rss {worker_rss:.0f} MB.")
     elif args.dataset_type == 'qa':
         for x in tokenize_qa(word_tokenizer, args.input_glob, args.seq_length + 1):
             x["molecular_mask"] = (x["input_ids"][:-1] >= 32000).astype(np.float32)
@@ -0,0 +1,107 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Score the predictions of the LPM-24 text2smiles or smiles2text task against the references, such as
+LPM-24_test.json, with SmilesGenerationMetric or CaptionGenerationMetric, and report the samples/s.
+
+The references are a json list of the qa conversations, whose last answer is the reference, of the
+{"molecule": ..., "caption": ...} records, or of the strings. The predictions are a text file with one prediction
+per line, a json list or the result file of `run_mindformer.py --run_mode predict`, the text after the last
+"ASSISTANT:" of every prediction is scored.
+
+How to run this:
+python mindformers/tools/evaluate_lpm24.py --task smiles2text --predictions output_LPM_smiles2text.txt \
+    --references ../LPM-24-data/smiles2text/LPM-24_test.json --num_workers 8
+"""
+import ast
+import json
+import time
+import argparse
+
+from mindformers.core.metric import CaptionGenerationMetric, SmilesGenerationMetric
+
+ANSWER_SEP = "ASSISTANT:"
+
+
+def load_references(path, task):
+    """the reference of every sample."""
+    with open(path, "r", encoding="utf-8") as file:
+        records = json.load(file)
+    references = []
+    for record in records:
+        if isinstance(record, str):
+            references.append(record)
+        elif "conversations" in record:
+            references.append(record["conversations"][-1]["value"])
+        else:
+            references.append(record["molecule"] if task == "text2smiles" else record["caption"])
+    return references
+
+
+def _prediction_text(item):
+    if isinstance(item, dict):
+        item = item.get("text_generation_text", item.get("prediction", ""))
+    if isinstance(item, (list, tuple)):
+        item = item[0] if item else ""
+    return str(item).rsplit(ANSWER_SEP, 1)[-1].strip()
+
+
+def load_predictions(path):
+    """the prediction of every sample."""
+    with open(path, "r", encoding="utf-8") as file:
+        content = file.read()
+    if content.lstrip().startswith("["):
+        try:
+            items = json.loads(content)
+        except json.JSONDecodeError:
+            # the python literal written by the predict of the trainer
+            items = ast.literal_eval(content)
+    else:
+        items = content.splitlines()
+    return [_prediction_text(item) for item in items]
+
+
+def main(args):
+    """evaluate main."""
+    predictions = load_predictions(args.predictions)
+    references = load_references(args.references, args.task)
+    if len(predictions) != len(references):
+        raise ValueError(f"The number of the predictions {len(predictions)} is different from the number of the "
+                         f"references {len(references)}.")
+    metric_class = SmilesGenerationMetric if args.task == "text2smiles" else CaptionGenerationMetric
+    metric = metric_class(num_workers=args.num_workers, chunk_size=args.chunk_size)
+    start = time.perf_counter()
+    for i in range(0, len(predictions), args.batch_size):
+        metric.update(predictions[i:i + args.batch_size], references[i:i + args.batch_size])
+    result = metric.eval()
+    cost = time.perf_counter() - start
+    print(json.dumps(result, indent=2))
+    print(f"{len(predictions)} samples in {cost:.2f} s, {len(predictions) / cost:.1f} samples/s", flush=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--task', required=True, choices=['text2smiles', 'smiles2text'], help='The LPM-24 task.')
+    parser.add_argument('--predictions', required=True, type=str, help='The predictions file.')
+    parser.add_argument('--references', required=True, type=str, help='The references, such as LPM-24_test.json.')
+    parser.add_argument('--batch_size', default=256, type=int, help='Samples per metric update. Default: 256.')
+    parser.add_argument('--num_workers', default=0, type=int,
+                        help='Processes of the RDKit scores or METEOR, 0 for none. Default: 0.')
+    parser.add_argument('--chunk_size', default=64, type=int, help='Samples per process task. Default: 64.')
+    parser.add_argument('--output', default=None, type=str, help='Write the scores to this json file.')
+    main(parser.parse_args())
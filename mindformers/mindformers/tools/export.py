@@ -55,6 +55,13 @@ def get_llm_common_prefill_model_input(batch_size, seq_length):
     return (x,)
 
 
+def get_llama_prefill_model_input(batch_size, seq_length):
+    """get llama model input tuple, the molecular mask of the tokens is the second input."""
+    x = ms.Tensor(np.ones([batch_size, seq_length]).astype(np.int32))
+    molecular_mask = ms.Tensor(np.zeros([batch_size, seq_length]).astype(np.int32))
+    return x, molecular_mask
+
+
 def get_bloom_inc_model_input(batch_size, seq_length, prefill):
     """get bloom kv cache model input tuple."""
     if not prefill:
@@ -68,15 +75,17 @@ def get_bloom_inc_model_input(batch_size, seq_length, prefill):
 
 
 def get_llama_inc_model_input(batch_size, seq_length, prefill):
-    """get llama kv cache model input tuple."""
+    """get llama kv cache model input tuple, the molecular mask of the input tokens is the second input."""
     if not prefill:
         seq_length = 1
     init_reset = not prefill
     input_ids = ms.Tensor(np.ones((batch_size, seq_length)), mstype.int32)
+    molecular_mask = ms.Tensor(np.zeros((batch_size, seq_length)), mstype.int32)
     input_position = ms.Tensor([127] * batch_size, mstype.int32)
     init_reset = ms.Tensor([init_reset], mstype.bool_)
     batch_valid_length = ms.Tensor([128] * batch_size, mstype.int32)
-    return input_ids, None, input_position, None, None, None, init_reset, batch_valid_length
+    # labels, position_ids, attention_mask and input_embeds are not graph inputs
+    return input_ids, molecular_mask, None, input_position, None, None, None, init_reset, batch_valid_length
 
 
 def get_glm2_inc_model_input(batch_size, seq_length, prefill):
@@ -127,8 +136,9 @@ def get_baichuan2_inc_model_input(batch_size, seq_length, prefill):
 
 PREFILL_MODEL_INPUT_MAP = {
     "bloom": get_llm_common_prefill_model_input,
-    "llama": get_llm_common_prefill_model_input,
-    "llama2": get_llm_common_prefill_model_input,
+    "llama": get_llama_prefill_model_input,
+    "llama2": get_llama_prefill_model_input,
+    "scimind": get_llama_prefill_model_input,
     "glm": get_glm_prefill_model_input,
     "glm2": get_glm2_prefill_model_input,
     "baichuan2": get_llm_common_prefill_model_input
@@ -138,6 +148,7 @@ INCREMENT_MODEL_INPUT_MAP = {
     "bloom": get_bloom_inc_model_input,
     "llama": get_llama_inc_model_input,
     "llama2": get_llama_inc_model_input,
+    "scimind": get_llama_inc_model_input,
     "glm": get_glm_inc_model_input,
     "glm2": get_glm2_inc_model_input,
     "baichuan2": get_baichuan2_inc_model_input
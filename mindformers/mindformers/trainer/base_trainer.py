@@ -604,7 +604,10 @@ class BaseTrainer:
             "micro_batch_interleave_num": config.micro_batch_interleave_num,
             "micro_batch_num": config.parallel_config.micro_batch_num,
             "initial_epoch": config.runner_config.initial_epoch,
-            "global_batch_size": self.global_batch_size})
+            "global_batch_size": self.global_batch_size,
+            # the pad fraction measured by the dataset of the packed sequences, if any
+            "seq_length": config.model.model_config.seq_length if hasattr(dataset, "pad_fraction") else 0,
+            "pad_fraction": getattr(dataset, "pad_fraction", 0.0)})
         if callbacks is not None:
             if isinstance(callbacks, list):
                 default_callbacks.extend(callbacks)
@@ -14,12 +14,9 @@
 # ============================================================================
 """Causal Image Modeling Trainer."""
 import os
-import time
-import datetime
 from typing import Optional, List, Union
 from pprint import pprint
 
-import numpy as np
 from mindspore import Model
 from mindspore.train import Callback
 from mindspore.nn import TrainOneStepCell, Optimizer, Cell
@@ -37,8 +34,9 @@ from ..config_args import ConfigArguments
 from ..training_args import TrainingArguments
 from ..base_trainer import BaseTrainer
 from ..utils import transform_and_load_checkpoint
+from .generate_evaluator import GenerateEvaluator
 
-GENERATE_METRIC_NAMES = ['ADGENMetric', 'EmF1Metric']
+GENERATE_METRIC_NAMES = ['ADGENMetric', 'EmF1Metric', 'SmilesGenerationMetric', 'CaptionGenerationMetric']
 SUPPORT_MODEL_NAMES = MindFormerBook().get_model_name_support_list()
 
 
@@ -156,18 +154,9 @@ class CausalLanguageModelingTrainer(BaseTrainer):
                           tokenizer=None,
                           **kwargs):
         r"""Evaluate the text generate task. Return metrics with Rouge-1, Rouge-2, Rouge-l and BLEU. """
-        metric_name = kwargs.get("metric_name")
         is_full_config = kwargs.get("is_full_config", False)
         config = self.set_config(config, is_full_config)
 
-        enable_max_new_tokens = bool(config.model.model_config.max_new_tokens)
-        # it does not support max_new_tokens as input parameter in text_generate, so reset batch_size to 1 when the
-        # follow scenario happens
-        if metric_name == "EmF1Metric" and enable_max_new_tokens and config.runner_config.batch_size != 1:
-            logger.info("For metric %s, it only supports batch size equals 1, so reset batch size to 1 here.",
-                        metric_name)
-            config.runner_config.batch_size = 1
-
         # build dataset
         logger.info(".........Build Dataset For Evaluate..........")
         if dataset is None:
@@ -206,62 +195,15 @@ class CausalLanguageModelingTrainer(BaseTrainer):
         logger.info('.........Starting Evaluate Model..........')
         if int(os.getenv("RANK_ID", '0')) % 8 == 0:
             pprint(config)
-        # generate config
-        do_sample = config.model.model_config.do_sample
-        top_p = config.model.model_config.top_p
-        top_k = config.model.model_config.top_k
-        max_length = config.model.model_config.max_decode_length
-
-        total_tokens_num = 0
-        total_time = 0.0001
-        pad_token_id = tokenizer.pad_token_id
-        len_dataset = dataset.get_dataset_size()
-        for i, inputs in enumerate(dataset.create_dict_iterator()):
-            input_ids = inputs['input_ids'].asnumpy()
-            labels = inputs['labels'].asnumpy()
-
-            valid_length_each_example = []
-            for j in range(input_ids.shape[0]):
-                # As the nonzero returns the index and we need length
-                valid_length_each_example.append(np.max(np.argwhere(input_ids[j] != pad_token_id)) + 1)
-            valid_length_each_example = np.array(valid_length_each_example)
-
-            if enable_max_new_tokens:
-                # When we act as it, the batch_size is 1. it will be replaced when text_generator supports batch_size
-                # inference quickly or text_generator supports max_new_tokens as the input parameter.
-                max_length = valid_length_each_example[0] + self.config.model.model_config.max_new_tokens
-
-            start_time = time.time()
-            outputs = model.predict_network.generate(input_ids, do_sample=do_sample, max_length=max_length,
-                                                     top_p=top_p, top_k=top_k)
-            output_ids = []
-            for j in range(input_ids.shape[0]):
-                output_ids.append(outputs[j][int(valid_length_each_example[j]):])
-            end_time = time.time()
-            avg_cost_time = (end_time - start_time) / input_ids.shape[0]
-
-            tokens_num = 0
-            for batch_index in range(len(output_ids)):
-                tokens_num += output_ids[batch_index].shape[0]
-            if i != 0:
-                total_tokens_num += tokens_num
-                total_time += end_time - start_time
-
-            # compute time remaining
-            avg_time = total_time / (i + 1)
-            remain_time = (len_dataset - i - 1) * avg_time
-            logger.info(f"Step[{i+1}/{len_dataset}], cost time {end_time-start_time:.4f}s, "+
-                        f"every example cost time is {avg_cost_time:.4f}, "+
-                        f"generate speed: {tokens_num/(end_time-start_time):.4f} tokens/s, "+
-                        f"avg speed: {total_tokens_num/total_time:.4f} tokens/s, "
-                        f"remaining time: {datetime.timedelta(seconds=int(remain_time))}")
-
-            # decode input_id and label to string
-            pres_str = tokenizer.decode(output_ids, skip_special_tokens=True)
-            labels_str = tokenizer.decode(labels, skip_special_tokens=True)
-
-            compute_metrics.update(pres_str, labels_str)
-
+        # the examples are generated in batches bucketed by length, while the metric of the last batch is updated
+        evaluator = GenerateEvaluator(model.predict_network, tokenizer, compute_metrics,
+                                      batch_size=config.runner_config.batch_size,
+                                      max_new_tokens=config.model.model_config.max_new_tokens,
+                                      max_length=config.model.model_config.max_decode_length,
+                                      do_sample=config.model.model_config.do_sample,
+                                      top_p=config.model.model_config.top_p,
+                                      top_k=config.model.model_config.top_k)
+        evaluator.evaluate(dataset)
         compute_metrics.eval()
 
         logger.info('...........Evaluate Over!...............')
@@ -330,7 +272,6 @@ class CausalLanguageModelingTrainer(BaseTrainer):
             config = self.config
             dataset = eval_dataset
             model = model.eval_network
-            enable_max_new_tokens = bool(config.model.model_config.max_new_tokens)
 
             # build metric
 
@@ -345,60 +286,14 @@ class CausalLanguageModelingTrainer(BaseTrainer):
 
             self.set_network(model, is_train=False)
 
-            # generate config
-            do_sample = config.model.model_config.do_sample
-            top_p = config.model.model_config.top_p
-            top_k = config.model.model_config.top_k
-            max_length = config.model.model_config.max_decode_length
-
-            total_tokens_num = 0
-            total_time = 0.0001
-            pad_token_id = self.tokenizer.pad_token_id
-            len_dataset = dataset.get_dataset_size()
-            for i, inputs in enumerate(dataset.create_dict_iterator()):
-                input_ids = inputs['input_ids'].asnumpy()
-                labels = inputs['labels'].asnumpy()
-
-                valid_length_each_example = []
-                for j in range(input_ids.shape[0]):
-                    # As the nonzero returns the index and we need length
-                    valid_length_each_example.append(np.max(np.argwhere(input_ids[j] != pad_token_id)) + 1)
-                valid_length_each_example = np.array(valid_length_each_example)
-
-                if enable_max_new_tokens:
-                    # When we act as it, the batch_size is 1. it will be replaced when text_generator supports batch_size
-                    # inference quickly or text_generator supports max_new_tokens as the input parameter.
-                    max_length = valid_length_each_example[0] + self.config.model.model_config.max_new_tokens
-
-                start_time = time.time()
-                outputs = model.generate(input_ids, do_sample=do_sample, max_length=max_length,
-                                         top_p=top_p, top_k=top_k)
-                output_ids = []
-                for j in range(input_ids.shape[0]):
-                    output_ids.append(outputs[j][int(valid_length_each_example[j]):])
-                end_time = time.time()
-                avg_cost_time = (end_time - start_time) / input_ids.shape[0]
-
-                tokens_num = 0
-                for batch_index in range(len(output_ids)):
-                    tokens_num += output_ids[batch_index].shape[0]
-                if i != 0:
-                    total_tokens_num += tokens_num
-                    total_time += end_time - start_time
-
-                # compute time remaining
-                avg_time = total_time / (i + 1)
-                remain_time = (len_dataset - i - 1) * avg_time
-                logger.info(f"Step[{i+1}/{len_dataset}], cost time {end_time-start_time:.4f}s, "+
-                            f"every example cost time is {avg_cost_time:.4f}, "+
-                            f"generate speed: {tokens_num/(end_time-start_time):.4f} tokens/s, "+
-                            f"avg speed: {total_tokens_num/total_time:.4f} tokens/s, "
-                            f"remaining time: {datetime.timedelta(seconds=int(remain_time))}")
-
-                # decode input_id and label to string
-                pres_str = self.tokenizer.decode(output_ids, skip_special_tokens=True)
-                labels_str = self.tokenizer.decode(labels, skip_special_tokens=True)
-                compute_metrics.update(pres_str, labels_str)
+            evaluator = GenerateEvaluator(model, self.tokenizer, compute_metrics,
+                                          batch_size=dataset.get_batch_size(),
+                                          max_new_tokens=config.model.model_config.max_new_tokens,
+                                          max_length=config.model.model_config.max_decode_length,
+                                          do_sample=config.model.model_config.do_sample,
+                                          top_p=config.model.model_config.top_p,
+                                          top_k=config.model.model_config.top_k)
+            evaluator.evaluate(dataset)
 
             score_dict = compute_metrics.eval()
 
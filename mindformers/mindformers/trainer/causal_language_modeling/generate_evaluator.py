@@ -0,0 +1,135 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Batched evaluation of the text generation."""
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from mindformers.generation.utils import get_valid_length
+from mindformers.tools.logger import logger
+
+__all__ = ['GenerateEvaluator']
+
+
+class GenerateEvaluator:
+    r"""
+    Generate the prompts of an evaluation dataset in batches and update the metric with the decoded outputs.
+
+    The prompts are sorted by length and generated in buckets of `batch_size`, so that the examples of a batch
+    finish at close steps. Every example gets `max_new_tokens` new tokens whatever the length of the other prompts
+    of its batch. The outputs of a bucket are decoded and given to the metric by a worker thread while the next
+    bucket is generated. The metric is updated bucket by bucket in the order of the lengths.
+
+    Args:
+        network: The model with the `generate` method, such as LlamaForCausalLM.
+        tokenizer: The tokenizer decoding the outputs and the labels.
+        compute_metrics: The metric updated with the lists of the decoded outputs and labels.
+        batch_size (int): The number of prompts generated at once.
+        pad_token_id (int): The pad token of the input ids of the dataset. Default: the one of the tokenizer.
+        max_new_tokens (int): The maximum number of new tokens of every example. Default None.
+        max_length (int): The maximum length of the examples if `max_new_tokens` is None. Default None.
+        max_pending (int): The maximum number of buckets generated and waiting for the metric. Default 2.
+        generate_kwargs: The other arguments of `generate`, such as do_sample, top_k and top_p.
+
+    Examples:
+        >>> from mindformers.trainer.causal_language_modeling.generate_evaluator import GenerateEvaluator
+        >>> evaluator = GenerateEvaluator(network, tokenizer, metric, batch_size=8, max_new_tokens=256)
+        >>> evaluator.evaluate(dataset)
+        >>> metric.eval()
+    """
+    def __init__(self, network, tokenizer, compute_metrics, batch_size, pad_token_id=None, max_new_tokens=None,
+                 max_length=None, max_pending=2, **generate_kwargs):
+        self.network = network
+        self.tokenizer = tokenizer
+        self.compute_metrics = compute_metrics
+        self.batch_size = batch_size
+        self.pad_token_id = tokenizer.pad_token_id if pad_token_id is None else pad_token_id
+        self.max_new_tokens = max_new_tokens
+        self.max_length = max_length
+        self.max_pending = max_pending
+        self.generate_kwargs = generate_kwargs
+
+    def collect(self, dataset):
+        """Get the unpadded prompts and the labels of every example of the dataset."""
+        prompts = []
+        labels = []
+        for inputs in dataset.create_dict_iterator():
+            input_ids = inputs['input_ids'].asnumpy()
+            valid_length = get_valid_length(input_ids, self.pad_token_id)
+            prompts.extend(ids[:length] for ids, length in zip(input_ids, valid_length))
+            labels.extend(inputs['labels'].asnumpy())
+        return prompts, labels
+
+    def buckets(self, prompts):
+        """The example indices of every batch, sorted by the prompt lengths."""
+        order = np.argsort([len(prompt) for prompt in prompts], kind="stable")
+        return [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+
+    def generate(self, prompts):
+        """Generate a batch of prompts, return the new tokens of every prompt."""
+        num_prompts = len(prompts)
+        # the last batch is filled with its last prompt, keeping the batch size of the compiled graphs
+        prompts = list(prompts) + [prompts[-1]] * (self.batch_size - num_prompts)
+        input_ids = np.full((len(prompts), max(len(prompt) for prompt in prompts)), self.pad_token_id, np.int32)
+        for i, prompt in enumerate(prompts):
+            input_ids[i, :len(prompt)] = prompt
+        kwargs = dict(self.generate_kwargs)
+        if self.max_new_tokens:
+            kwargs["max_new_tokens"] = [self.max_new_tokens] * len(prompts)
+        else:
+            kwargs["max_length"] = self.max_length
+        outputs = self.network.generate(input_ids, pad_token_id=self.pad_token_id, **kwargs)
+        return [np.asarray(output[len(prompt):]) for output, prompt in zip(outputs[:num_prompts], prompts)]
+
+    def update(self, output_ids, labels):
+        """Decode the outputs and the labels of a batch, and update the metric."""
+        preds_str = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        labels_str = self.tokenizer.decode(labels, skip_special_tokens=True)
+        self.compute_metrics.update(preds_str, labels_str)
+
+    def evaluate(self, dataset):
+        """Generate every example of the dataset and update the metric, return the number of examples."""
+        prompts, labels = self.collect(dataset)
+        buckets = self.buckets(prompts)
+        total_tokens_num = 0
+        total_time = 0.0001
+        pending = []
+        # the metric is updated in order by a single worker, the graphs run without the GIL meanwhile
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for i, indices in enumerate(buckets):
+                start_time = time.time()
+                output_ids = self.generate([prompts[index] for index in indices])
+                end_time = time.time()
+
+                tokens_num = sum(output.shape[0] for output in output_ids)
+                if i != 0:
+                    total_tokens_num += tokens_num
+                    total_time += end_time - start_time
+                avg_time = total_time / (i + 1)
+                remain_time = (len(buckets) - i - 1) * avg_time
+                logger.info(f"Step[{i+1}/{len(buckets)}], cost time {end_time-start_time:.4f}s, "
+                            f"every example cost time is {(end_time - start_time) / len(indices):.4f}, "
+                            f"generate speed: {tokens_num/(end_time-start_time):.4f} tokens/s, "
+                            f"avg speed: {total_tokens_num/total_time:.4f} tokens/s, "
+                            f"remaining time: {datetime.timedelta(seconds=int(remain_time))}")
+
+                pending.append(executor.submit(self.update, output_ids, [labels[index] for index in indices]))
+                while len(pending) > self.max_pending:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+        return len(prompts)
@@ -23,6 +23,7 @@ import mindspore as ms
 import gradio as gr
 
 from mindformers import AutoModel, AutoTokenizer, TextIteratorStreamer, AutoConfig, logger
+from mindformers.generation import ContinuousBatchingEngine, ModelRunner
 from mindformers.tools.utils import str2bool
 
 
@@ -41,6 +42,11 @@ parser.add_argument('--checkpoint_path', type=str, default=None, help='The path
 parser.add_argument('--seq_length', default="512", type=int, help="Sequence length of the model. Default: 512.")
 parser.add_argument('--use_past', default=False, type=str2bool,
                     help='Whether to enable incremental inference. Default: False.')
+parser.add_argument('--continuous_batching', default=False, type=str2bool,
+                    help='Whether to serve the concurrent requests with continuous batching, '
+                         'which needs use_past. Default: False.')
+parser.add_argument('--max_batch_size', default=8, type=int,
+                    help='The number of requests decoded together with continuous batching. Default: 8.')
 parser.add_argument('--host', default="127.0.0.1", type=str,
                     help="Which host ip to run the service. Default: 127.0.0.1.")
 parser.add_argument('--port', default=None, type=int, help='Which port to run the service. Default: None.')
@@ -50,6 +56,10 @@ ms.set_context(mode=ms.GRAPH_MODE, device_target=args.device_target, device_id=a
 config = AutoConfig.from_pretrained(args.model)
 config.seq_length = args.seq_length
 config.use_past = args.use_past
+if args.continuous_batching:
+    if not args.use_past:
+        raise ValueError("Continuous batching needs the incremental inference, please set --use_past True.")
+    config.batch_size = args.max_batch_size
 if args.checkpoint_path:
     config.checkpoint_name_or_path = args.checkpoint_path
 logger.info("Config: %s", config)
@@ -58,7 +68,15 @@ streamer = TextIteratorStreamer(tokenizer=tokenizer, skip_prompt=True, skip_spec
 
 # pre-build the network
 sample_input = tokenizer("hello")
-sample_output = model.generate(sample_input["input_ids"], max_length=10)
+engine = None
+if args.continuous_batching:
+    engine = ContinuousBatchingEngine(ModelRunner(model), eos_token_id=config.eos_token_id,
+                                      pad_token_id=config.pad_token_id)
+    engine.submit(sample_input["input_ids"], max_new_tokens=2)
+    engine.run_until_complete()
+    engine.start()
+else:
+    sample_output = model.generate(sample_input["input_ids"], max_length=10)
 
 prompt_examples = [["Below is an instruction that describes a task. "
                     "Write a response that appropriately completes the request.\n\n"
@@ -181,24 +199,37 @@ def predict(inputs, bot, history, do_sample, top_k, top_p, temperature, repetiti
     if max_length <= len(input_tokens["input_ids"]):
         raise gr.Error("Max length must be larger than the length of input tokens! The current length of input "
                        "tokens is {}.".format(len(input_tokens["input_ids"])))
-    generation_kwargs = dict(model=model,
-                             input_ids=input_tokens["input_ids"],
-                             streamer=streamer,
-                             do_sample=do_sample,
-                             top_k=top_k,
-                             top_p=top_p,
-                             temperature=temperature,
-                             repetition_penalty=repetition_penalty,
-                             max_length=max_length)
-    thread = Thread(target=generate, kwargs=generation_kwargs)
     logger.info("Start to generate text. Generate args: {input_ids: %s, do_sample: %s, top_k: %s, top_p: %s, "
                 "temperature: %s, repetition_penalty: %s, max_length: %s}",
                 input_tokens["input_ids"], do_sample, top_k, top_p, temperature, repetition_penalty, max_length)
-    thread.start()
+    if engine is not None:
+        # every request has its own streamer, the engine decodes it together with the other users' requests
+        request_streamer = TextIteratorStreamer(tokenizer=tokenizer, skip_prompt=True, skip_special_tokens=True)
+        request = engine.submit(input_tokens["input_ids"],
+                                max_new_tokens=int(max_length) - len(input_tokens["input_ids"]),
+                                do_sample=do_sample,
+                                top_k=top_k,
+                                top_p=top_p,
+                                temperature=temperature,
+                                repetition_penalty=repetition_penalty,
+                                streamer=request_streamer)
+    else:
+        request, request_streamer = None, streamer
+        generation_kwargs = dict(model=model,
+                                 input_ids=input_tokens["input_ids"],
+                                 streamer=streamer,
+                                 do_sample=do_sample,
+                                 top_k=top_k,
+                                 top_p=top_p,
+                                 temperature=temperature,
+                                 repetition_penalty=repetition_penalty,
+                                 max_length=max_length)
+        thread = Thread(target=generate, kwargs=generation_kwargs)
+        thread.start()
 
     interval_time = 0.
     output = ""
-    for response in streamer:
+    for response in request_streamer:
         if response == "<ERROR>":
             raise gr.Error("An error occurred! Please make sure all the settings are correct!")
         output += response
@@ -211,6 +242,8 @@ def predict(inputs, bot, history, do_sample, top_k, top_p, temperature, repetiti
         interval_end = time.time()
         interval_time = interval_time + interval_end - interval_start
 
+    if request is not None and request.error is not None:
+        raise gr.Error("An error occurred! Please make sure all the settings are correct!")
     logger.info("Generate output: %s", output)
     logger.info("Web communication time: %.2f s", interval_time)
 
@@ -26,7 +26,7 @@ from mindformers.models.base_tokenizer import Tokenizer
 from mindformers.models import BloomTokenizer, LlamaTokenizer
 from mindformers.models import ChatGLMTokenizer, ChatGLM2Tokenizer
 from mindformers.pipeline import pipeline
-from mindformers.generation import TextIteratorStreamer
+from mindformers.generation import ContinuousBatchingEngine, LiteModelRunner, TextIteratorStreamer
 from mindformers.tools.utils import str2bool
 from mindformers.inference import InferConfig, InferTask
 from research.baichuan2.baichuan2_tokenizer import Baichuan2Tokenizer
@@ -185,6 +185,35 @@ def infer_stream_main(args_):
         print(output)
 
 
+def infer_continuous_batching_main(args_):
+    """lite infer main with continuous batching, the prompts are read from the input file, one per line."""
+    tokenizer = get_tokenizer(args_.model_name.lower(), args_.tokenizer_path)
+    lite_pipeline = pipeline_from_infer_config(
+        args_, tokenizer
+    )
+    engine = ContinuousBatchingEngine(LiteModelRunner(lite_pipeline, args_.batch_size),
+                                      eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    with open(args_.input_file, 'r', encoding='utf-8') as f:
+        prompts = [line.rstrip("\n") for line in f if line.strip()]
+    requests = []
+    for prompt in prompts:
+        input_ids = tokenizer(build_prompt(prompt, args_.model_name.lower(), args_.prompt),
+                              add_special_tokens=args_.add_special_tokens)["input_ids"]
+        requests.append(engine.submit(input_ids,
+                                      max_new_tokens=args_.max_length - len(input_ids),
+                                      do_sample=args_.do_sample,
+                                      top_k=args_.top_k,
+                                      top_p=args_.top_p,
+                                      temperature=args_.temperature,
+                                      repetition_penalty=args_.repetition_penalty))
+    engine.run_until_complete()
+    for request in requests:
+        try:
+            print(tokenizer.decode(request.result(), skip_special_tokens=True))
+        except ValueError as e:
+            print(f"Failed to generate: {e}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -263,9 +292,24 @@ if __name__ == "__main__":
         '--prompt', default=None, type=str,
         help="The content of prompt."
              "Default: None")
+    parser.add_argument(
+        '--continuous_batching', default=False, type=str2bool,
+        help="Whether to generate the prompts of input_file with continuous batching, "
+             "which needs both the prefill and the increment model."
+             "Default: False")
+    parser.add_argument(
+        '--batch_size', default=1, type=int,
+        help="The batch size the models are exported with, used as the continuous batching slots."
+             "Default: 1")
+    parser.add_argument(
+        '--input_file', default=None, type=str,
+        help="The prompts to generate with continuous batching, one per line."
+             "Default: None")
 
     args = parser.parse_args()
-    if args.stream:
+    if args.continuous_batching:
+        infer_continuous_batching_main(args)
+    elif args.stream:
         infer_stream_main(args)
     else:
         infer_main(args)
@@ -0,0 +1,166 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test beam search."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers.generation import BeamHypotheses, LogitsProcessor, LogitsProcessorList, SmilesGrammarLogitsProcessor, \
+    log_softmax
+
+from .utils import copy_weights, tiny_llama
+
+
+class SuppressPadLogitsProcessor(LogitsProcessor):
+    """never generate the pad token 0, which is out of the attention of the model without the kv cache."""
+    def __call__(self, input_ids, scores):
+        scores[:, 0] = -np.inf
+        return scores
+
+
+class PreferSmilesLogitsProcessor(LogitsProcessor):
+    """prefer the SMILES tokens 40 to 53, so the beams are long SMILES."""
+    def __call__(self, input_ids, scores):
+        scores[:, 40:54] += 8
+        return scores
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_beam_hypotheses():
+    """
+    Feature: Test BeamHypotheses
+    Description: Add finished hypotheses of different lengths and get the n-best with and without a dedupe key
+    Expectation: The best num_beams are kept by their length normalized scores, the duplicates are returned last
+    """
+    hypotheses = BeamHypotheses(num_beams=3, length_penalty=1.0)
+    hypotheses.add([1, 2], -2.0)
+    hypotheses.add([3, 4, 5, 6], -2.0)
+    hypotheses.add([7], -3.0)
+    hypotheses.add([8, 9], -4.0)
+    assert len(hypotheses) == 3
+    assert [list(ids) for _, ids in hypotheses.nbest(3)] == [[3, 4, 5, 6], [1, 2], [8, 9]]
+    assert hypotheses.worst_score == -2.0
+    hypotheses.add([10], -2.5)
+    assert len(hypotheses) == 3 and hypotheses.worst_score == -2.0
+    assert not hypotheses.is_done(-3.0, 2)
+    assert hypotheses.is_done(-6.0, 3)
+
+    # 3 and 8 are the same modulo 5
+    nbest = hypotheses.nbest(3, dedupe_key=lambda ids: int(ids[0]) % 5)
+    assert [list(ids) for _, ids in nbest] == [[3, 4, 5, 6], [1, 2], [8, 9]]
+    nbest = hypotheses.nbest(2, dedupe_key=lambda ids: int(ids[0]) % 5)
+    assert [list(ids) for _, ids in nbest] == [[3, 4, 5, 6], [1, 2]]
+    nbest = hypotheses.nbest(3, dedupe_key=lambda ids: int(ids[0]) % 2)
+    assert [list(ids) for _, ids in nbest] == [[3, 4, 5, 6], [8, 9], [1, 2]]
+
+
+def _sequence_logprob(model, sequence, prompt_length, seq_length):
+    """the sum of the log probabilities of the generated tokens of a sequence."""
+    input_ids = np.zeros((1, seq_length), np.int32)
+    input_ids[0, :len(sequence)] = sequence
+    logits = model(Tensor(input_ids), Tensor(np.zeros_like(input_ids)))[0].asnumpy().reshape(seq_length, -1)
+    log_probs = log_softmax(logits)
+    return sum(log_probs[position - 1, sequence[position]] for position in range(prompt_length, len(sequence)))
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_beam_search_generate(tmp_path):
+    """
+    Feature: Test beam search of LlamaForCausalLM
+    Description: Beam search a batch of prompts with the kv cache and by recomputing the full sequences
+    Expectation: The outputs are the same, the sequences of an example are different and sorted by their length
+        normalized log probabilities, sampling the beams raises a ValueError
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    num_beams = 3
+    model = tiny_llama(tmp_path, batch_size=2 * num_beams, use_past=True)
+    full_model = copy_weights(model, tiny_llama(tmp_path, batch_size=1))
+
+    np.random.seed(0)
+    # the prompts are padded with the pad token 0 to the same length
+    prompts = [np.random.randint(3, 64, 9).tolist(), np.random.randint(3, 64, 5).tolist() + [0] * 4]
+    generate_kwargs = dict(max_new_tokens=10, num_beams=num_beams, num_return_sequences=num_beams, eos_token_id=5,
+                           do_sample=False, logits_processor=LogitsProcessorList([SuppressPadLogitsProcessor()]))
+    outputs = model.generate(prompts, **generate_kwargs)
+    full_outputs = full_model.generate(prompts, use_past=False, **generate_kwargs)
+    assert len(outputs) == 2 * num_beams
+    full_model.set_train(False)
+    for output, full_output in zip(outputs, full_outputs):
+        assert list(output) == list(full_output)
+
+    for i, prompt_length in enumerate([9, 5]):
+        sequences = [list(output) for output in outputs[i * num_beams:(i + 1) * num_beams]]
+        assert all(sequence[:prompt_length] == prompts[i][:prompt_length] for sequence in sequences)
+        assert len({tuple(sequence) for sequence in sequences}) == num_beams
+        scores = [_sequence_logprob(full_model, sequence, prompt_length, 32) / (len(sequence) - prompt_length)
+                  for sequence in sequences]
+        # the scores recomputed without the kv cache differ slightly from the accumulated ones
+        assert all(score >= next_score - 1e-3 for score, next_score in zip(scores, scores[1:]))
+
+    # the 2-best of every example preferring different first generated tokens
+    generate_kwargs = dict(max_new_tokens=[10, 10], num_beams=num_beams, eos_token_id=-1, do_sample=False)
+    outputs = model.generate(prompts, num_return_sequences=num_beams, **generate_kwargs)
+    dedupe_outputs = model.generate(prompts, num_return_sequences=2, dedupe_key=lambda ids: int(ids[0]),
+                                    **generate_kwargs)
+    assert len(dedupe_outputs) == 4
+    for i, prompt_length in enumerate([9, 5]):
+        sequences = [list(output) for output in outputs[i * num_beams:(i + 1) * num_beams]]
+        assert all(len(sequence) == prompt_length + 10 for sequence in sequences)
+        first_tokens = [sequence[prompt_length] for sequence in sequences]
+        expected = [sequence for j, sequence in enumerate(sequences) if first_tokens[j] not in first_tokens[:j]]
+        expected += [sequence for sequence in sequences if sequence not in expected]
+        assert [list(output) for output in dedupe_outputs[i * 2:(i + 1) * 2]] == expected[:2]
+    with pytest.raises(ValueError):
+        model.generate(prompts, num_return_sequences=num_beams, **dict(generate_kwargs, do_sample=True))
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_beam_search_smiles_grammar(tmp_path):
+    """
+    Feature: Test beam search of LlamaForCausalLM with SmilesGrammarLogitsProcessor
+    Description: Beam search a batch of prompts preferring the SMILES tokens, whose beams are reordered every step
+    Expectation: Every generated token of every beam is allowed by the grammar of the SMILES it continues
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    num_beams = 3
+    model = tiny_llama(tmp_path, batch_size=2 * num_beams, use_past=True)
+    smiles_vocab = {"{|" + char + "|}": 40 + index for index, char in enumerate("C1(O)c=N2[H]+-")}
+    np.random.seed(0)
+    prompts = [np.random.randint(3, 40, 9).tolist(), np.random.randint(3, 40, 5).tolist() + [0] * 4]
+    processors = LogitsProcessorList([SuppressPadLogitsProcessor(), PreferSmilesLogitsProcessor(),
+                                      SmilesGrammarLogitsProcessor(smiles_vocab)])
+    outputs = model.generate(prompts, max_new_tokens=[20, 20], num_beams=num_beams, num_return_sequences=num_beams,
+                             eos_token_id=-1, do_sample=False, logits_processor=processors)
+    assert len(outputs) == 2 * num_beams
+
+    for i, output in enumerate(outputs):
+        prompt_length = [9, 5][i // num_beams]
+        assert len(output) == prompt_length + 20
+        # replay the sequence token by token through a new grammar
+        grammar = SmilesGrammarLogitsProcessor(smiles_vocab)
+        input_ids = np.zeros((1, 32), np.int32)
+        input_ids[0, :prompt_length] = output[:prompt_length]
+        for position in range(prompt_length, len(output)):
+            scores = grammar(input_ids, np.zeros((1, 64), np.float32))
+            assert scores[0, output[position]] == 0, f"{list(output)} at {position}"
+            input_ids[0, position] = output[position]
@@ -0,0 +1,135 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test continuous batching."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+
+from mindformers.generation import ContinuousBatchingEngine, ModelRunner
+
+from .utils import VOCAB_SIZE, copy_weights, reference, tiny_llama
+
+
+class CacheRunner:
+    """
+    a runner whose next token is the sum of the cached tokens, so a lost or stale cache changes the output. The
+    decoded tokens are added to the cache like the keys of the dense kv cache.
+    """
+    def __init__(self, batch_size=3, seq_length=32):
+        self.batch_size = batch_size
+        self.seq_length = seq_length
+        self.cache = np.zeros((batch_size, seq_length), np.int64)
+
+    def prefill(self, input_ids, molecular_mask, valid_length):
+        _ = molecular_mask
+        logits = np.zeros((self.batch_size, VOCAB_SIZE), np.float32)
+        for row in np.flatnonzero(valid_length):
+            self.cache[row] = 0
+            self.cache[row, :valid_length[row]] = input_ids[row, :valid_length[row]]
+            logits[row, self.cache[row].sum() % VOCAB_SIZE] = 1
+        return logits
+
+    def decode(self, input_ids, molecular_mask, valid_length):
+        _ = molecular_mask
+        logits = np.zeros((self.batch_size, VOCAB_SIZE), np.float32)
+        for row in range(self.batch_size):
+            self.cache[row, valid_length[row] - 1] += input_ids[row, 0]
+            logits[row, self.cache[row, :valid_length[row]].sum() % VOCAB_SIZE] = 1
+        return logits
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_continuous_batching_schedule():
+    """
+    Feature: Test ContinuousBatchingEngine
+    Description: Serve more requests of different lengths than slots
+    Expectation: Every request gets the output of running it alone
+    """
+    engine = ContinuousBatchingEngine(CacheRunner(), eos_token_id=-1)
+    requests = [engine.submit([i + 1, i + 2], max_new_tokens=3 + i * 2) for i in range(7)]
+    engine.run_until_complete()
+    for i, request in enumerate(requests):
+        assert request.result().tolist() == reference([i + 1, i + 2], 3 + i * 2)
+    assert engine.generated_tokens == sum(3 + i * 2 for i in range(7))
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_continuous_batching_seed():
+    """
+    Feature: Test ContinuousBatchingEngine
+    Description: Sample a seeded request alone and in a batch of other sampled requests
+    Expectation: The request gets the same tokens, which do not depend on the other requests and np.random
+    """
+    engine = ContinuousBatchingEngine(CacheRunner(), eos_token_id=-1)
+    request = engine.submit([1, 2], max_new_tokens=12, do_sample=True, top_k=5, seed=7)
+    engine.run_until_complete()
+    expected = request.result().tolist()
+
+    np.random.seed(1)
+    engine = ContinuousBatchingEngine(CacheRunner(), eos_token_id=-1)
+    others = [engine.submit([i + 3, i + 4], max_new_tokens=9, do_sample=True) for i in range(3)]
+    request = engine.submit([1, 2], max_new_tokens=12, do_sample=True, top_k=5, seed=7)
+    engine.run_until_complete()
+    assert request.result().tolist() == expected
+    assert all(other.done() for other in others)
+    assert expected[2:] != reference([1, 2], 12)[2:]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_continuous_batching_errors():
+    """
+    Feature: Test ContinuousBatchingEngine
+    Description: Submit a prompt longer than seq_length and finish with the eos token
+    Expectation: The long prompt fails alone, the other request stops at eos
+    """
+    engine = ContinuousBatchingEngine(CacheRunner(), eos_token_id=reference([1, 2], 3)[-1])
+    long_request = engine.submit(list(range(1, 40)), max_new_tokens=4)
+    request = engine.submit([1, 2], max_new_tokens=10)
+    engine.run_until_complete()
+    with pytest.raises(ValueError):
+        long_request.result()
+    assert request.result().tolist() == reference([1, 2], 3)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_continuous_batching_llama(tmp_path):
+    """
+    Feature: Test ContinuousBatchingEngine with LlamaForCausalLM
+    Description: Greedy decode prompts of different lengths with 2 slots
+    Expectation: The outputs are the same as generate with batch size 1
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, batch_size=1, use_past=True)
+    batch_model = copy_weights(model, tiny_llama(tmp_path, batch_size=2, use_past=True))
+
+    np.random.seed(0)
+    prompts = [np.random.randint(3, 64, length).tolist() for length in (5, 9, 3, 7)]
+    max_new_tokens = [6, 3, 10, 4]
+    engine = ContinuousBatchingEngine(ModelRunner(batch_model), eos_token_id=-1)
+    requests = [engine.submit(prompt, max_new_tokens=new_tokens)
+                for prompt, new_tokens in zip(prompts, max_new_tokens)]
+    engine.run_until_complete()
+    for prompt, new_tokens, request in zip(prompts, max_new_tokens, requests):
+        expected = model.generate(prompt, max_new_tokens=new_tokens, do_sample=False, eos_token_id=-1)[0]
+        assert request.result().tolist() == list(expected)
@@ -0,0 +1,83 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test packed expert pattern store."""
+import os
+
+import numpy as np
+import pytest
+
+import mindspore as ms
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.models.llama.expert_patterns import ExpertPatternStore, save_expert_patterns, \
+    save_random_expert_patterns
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+@pytest.mark.parametrize("disjoint", [True, False])
+def test_expert_patterns_round_trip(tmp_path, disjoint):
+    """
+    Feature: Test ExpertPatternStore
+    Description: Pack the expert patterns of several layers and read them back memory-mapped
+    Expectation: The patterns are identical, disjoint experts use the label encoding
+    """
+    np.random.seed(0)
+    if disjoint:
+        patterns_list = [np.random.permutation(np.arange(64) % 4)[None, :] == np.arange(4)[:, None]
+                         for _ in range(3)]
+    else:
+        patterns_list = [np.random.rand(4, 61) < 0.4 for _ in range(3)]
+    path = os.path.join(tmp_path, "expert_patterns.bin")
+    save_expert_patterns(patterns_list, path)
+
+    store = ExpertPatternStore(path)
+    assert store.num_layers == 3
+    assert store.encoding == ("label" if disjoint else "bitmask")
+    for layer_id, patterns in enumerate(patterns_list):
+        assert np.array_equal(store.get_patterns(layer_id), patterns)
+    with pytest.raises(ValueError):
+        store.get_patterns(3)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_llama_expert_patterns_source(tmp_path):
+    """
+    Feature: Test the source of the expert patterns of LlamaForCausalLM
+    Description: Build a llama without expert patterns, with a packed store and from a checkpoint saved with the
+        expert patterns
+    Expectation: The model without expert patterns raises an error, the checkpoint gives the patterns of the store
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    kwargs = dict(batch_size=1, seq_length=16, vocab_size=64, hidden_size=64, num_layers=2, num_heads=4,
+                  multiple_of=16)
+    with pytest.raises(ValueError):
+        LlamaForCausalLM(LlamaConfig(**kwargs))
+    with pytest.raises(ValueError):
+        # the feed forward of hidden size 32 has 96 neurons
+        LlamaForCausalLM(LlamaConfig(expert_patterns_path=save_random_expert_patterns(
+            os.path.join(tmp_path, "expert_patterns_32.bin"), 2, 32, 16), **kwargs))
+
+    patterns_path = save_random_expert_patterns(os.path.join(tmp_path, "expert_patterns.bin"), 2, 64, 16)
+    model = LlamaForCausalLM(LlamaConfig(expert_patterns_path=patterns_path, **kwargs))
+    ckpt_file = os.path.join(tmp_path, "llama.ckpt")
+    ms.save_checkpoint(model, ckpt_file)
+    checkpoint_model = LlamaForCausalLM(LlamaConfig(checkpoint_name_or_path=ckpt_file, **kwargs))
+    store = ExpertPatternStore(patterns_path)
+    for layer_id, layer in enumerate(checkpoint_model.model.layers):
+        assert np.array_equal(layer.feed_forward.patterns.asnumpy() > 0, store.get_patterns(layer_id))
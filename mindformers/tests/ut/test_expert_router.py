@@ -0,0 +1,193 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test the distilled expert router of the llama feed forward."""
+import os
+
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore import Tensor
+from mindspore.mindrecord import FileWriter
+
+from mindformers.models.llama.expert_router import capture_ffn_inputs, fit_router, flops_reduction, \
+    load_calibration_data, load_ffn_inputs, teacher_score, topk_agreement
+from mindformers.models.llama.llama_layer import LlamaFeedForward
+
+from .utils import tiny_llama
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_fit_router():
+    """
+    Feature: Test fit_router and topk_agreement
+    Description: Fit a router on synthetic hidden states whose expert scores are linear in them, and on the
+        teacher scores of random feed forward weights
+    Expectation: The router selects the top-k experts of the linear scores on held out inputs, the agreement of
+        the scores with themselves is 1 and with random scores is about k / expert_num
+    """
+    rng = np.random.RandomState(0)
+    x = rng.randn(4096, 32).astype(np.float32)
+    weight = rng.randn(16, 32).astype(np.float32)
+    score = x @ weight.T + 1e-3 * rng.randn(4096, 16).astype(np.float32)
+    router = fit_router(x[:3072], score[:3072], ridge=1e-6)
+    assert router.shape == (16, 32)
+    assert np.allclose(router, weight, atol=1e-2)
+    for k in (2, 14):
+        assert topk_agreement(x[3072:] @ router.T, score[3072:], k) > 0.99
+        assert topk_agreement(score, score, k) == 1.0
+    assert abs(topk_agreement(rng.randn(4096, 16), score, 2) - 2 / 16) < 0.02
+
+    # the teacher scores sum the hidden neurons of every expert
+    patterns = np.random.RandomState(1).permutation(np.arange(64) % 16)[None, :] == np.arange(16)[:, None]
+    w1, w3 = rng.randn(64, 32).astype(np.float32), rng.randn(64, 32).astype(np.float32)
+    hidden_states = (x @ w1.T) / (1 + np.exp(-(x @ w1.T))) * (x @ w3.T)
+    score = teacher_score(x, w1, w3, patterns)
+    assert np.allclose(score[:, 3], hidden_states[:, patterns[3]].sum(-1), rtol=1e-4, atol=1e-4)
+    router = fit_router(x[:3072], score[:3072], ridge=1e-3)
+    assert topk_agreement(x[3072:] @ router.T, score[3072:], 2) > 2 / 16
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_flops_reduction():
+    """
+    Feature: Test flops_reduction
+    Description: Count the FLOPs of the routed feed forward of the llama2 7b sizes with 16 experts
+    Expectation: Routing k experts saves about 1 - k / expert_num of the FLOPs, routing all of them only saves the
+        scoring of the hidden states by the router
+    """
+    dense_flops = 6 * 4096 * 11008 + 2 * 11008 * 16
+    routed_flops = 2 * 4096 * 16 + 6 * 4096 * 11008
+    assert flops_reduction(4096, 11008, 16, 16) == pytest.approx(1 - routed_flops / dense_flops)
+    assert 0 < flops_reduction(4096, 11008, 16, 16) < 1e-3
+    assert flops_reduction(4096, 11008, 16, 2) == pytest.approx(1 - 2 / 16, abs=1e-3)
+    reductions = [flops_reduction(4096, 11008, 16, k) for k in range(1, 17)]
+    assert reductions == sorted(reductions, reverse=True)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+@pytest.mark.parametrize("exclusive_expert_routing", [False, True])
+def test_expert_router_forward(exclusive_expert_routing):
+    """
+    Feature: Test LlamaFeedForward with use_expert_router
+    Description: Select the experts of molecular and text tokens by the router scores of the input
+    Expectation: The tokens select the top-k experts of the router, the output is the one of the selected neurons
+    """
+    ms.set_context(mode=ms.PYNATIVE_MODE, device_target="CPU")
+    np.random.seed(0)
+    # 176 hidden neurons in 16 experts of 11 scattered neurons
+    patterns = np.random.permutation(np.arange(176) % 16)[None, :] == np.arange(16)[:, None]
+    feed_forward = LlamaFeedForward(dim=64, hidden_dim=256, multiple_of=16, compute_dtype=ms.float32,
+                                    param_init_type=ms.float32, layer_id=0, patterns=patterns,
+                                    use_expert_router=True, exclusive_expert_routing=exclusive_expert_routing)
+    router_weight = np.random.randn(16, 64).astype(np.float32)
+    feed_forward.router.weight.set_data(Tensor(router_weight))
+    x = np.random.randn(2, 8, 64).astype(np.float32)
+    molecular_mask = np.random.randint(0, 2, (2, 8))
+    output = feed_forward(Tensor(x), Tensor(molecular_mask, ms.int32))
+    assert output.shape == (2, 8, 64)
+
+    x2d, is_molecular = x.reshape(-1, 64), molecular_mask.reshape(-1).astype(np.bool_)
+    # pylint: disable=W0212
+    selection = feed_forward._route(Tensor(x2d @ router_weight.T), Tensor(molecular_mask, ms.int32)).asnumpy()
+    order = np.argsort(-(x2d @ router_weight.T), axis=-1)
+    for row, token_selection in enumerate(selection):
+        k = 2 if is_molecular[row] else 14
+        assert token_selection[order[row, :k]].all()
+        if exclusive_expert_routing:
+            assert token_selection.sum() == k
+
+    w1, w3 = feed_forward.w1.weight.asnumpy(), feed_forward.w3.weight.asnumpy()
+    hidden_states = (x2d @ w1.T) / (1 + np.exp(-(x2d @ w1.T))) * (x2d @ w3.T)
+    cur_mask = selection.astype(np.float32) @ patterns.astype(np.float32) > 0
+    expected = (hidden_states * cur_mask) @ feed_forward.w2.weight.asnumpy().T
+    assert np.allclose(output.asnumpy().reshape(-1, 64), expected, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_llama_expert_router(tmp_path):
+    """
+    Feature: Test LlamaForCausalLM with use_expert_router
+    Description: Run the forward of a tiny llama whose feed forwards select the experts by the router
+    Expectation: Every feed forward has a router of the experts, the logits have the shape of the vocabulary
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, seq_length=16, use_expert_router=True)
+    model.set_train(False)
+    names = [name for name, _ in model.parameters_and_names() if name.endswith("feed_forward.router.weight")]
+    assert len(names) == 2
+    input_ids = Tensor(np.random.randint(1, 64, (2, 16)), ms.int32)
+    logits = model(input_ids, Tensor(np.random.randint(0, 2, (2, 16)), ms.float32))[0]
+    assert logits.shape[-1] == 64 and logits.asnumpy().size == 2 * 16 * 64
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_capture_ffn_inputs(tmp_path):
+    """
+    Feature: Test capture_ffn_inputs, load_calibration_data and load_ffn_inputs
+    Description: Capture the feed forward inputs of a tiny llama on three padded calibration sequences of a MindRecord
+        dataset with a batch size of two, save and load them
+    Expectation: Every layer has the inputs of the non pad tokens, which are normalized by ffn_norm and do not depend
+        on the batch of the sequence, the model is restored, missing inputs raise a FileNotFoundError
+    """
+    ms.set_context(mode=ms.PYNATIVE_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, seq_length=16)
+    names = [name for name, _ in model.parameters_and_names()]
+
+    # the records have one more token than seq_length, as the training dataset
+    np.random.seed(0)
+    input_ids = np.random.randint(1, 64, (3, 17)).astype(np.int32)
+    input_ids[1, 9:] = 0
+    molecular_mask = (input_ids[:, :-1] >= 40).astype(np.float32)
+    dataset_path = os.path.join(tmp_path, "calibration.mindrecord")
+    writer = FileWriter(file_name=dataset_path, shard_num=1)
+    writer.add_schema({"input_ids": {"type": "int32", "shape": [-1]},
+                       "molecular_mask": {"type": "float32", "shape": [-1]}}, "qa")
+    writer.write_raw_data([{"input_ids": ids, "molecular_mask": mask}
+                           for ids, mask in zip(input_ids, molecular_mask)])
+    writer.commit()
+    calibration_ids, calibration_mask = load_calibration_data(dataset_path, 16, 3)
+    assert np.array_equal(calibration_ids, input_ids[:, :16])
+    assert np.array_equal(calibration_mask, molecular_mask)
+
+    ffn_inputs = capture_ffn_inputs(model, calibration_ids, calibration_mask)
+    assert [ffn_input.shape for ffn_input in ffn_inputs] == [(16 + 9 + 16, 64)] * 2
+    # the weights of ffn_norm are ones, the root mean squares are below one by the eps of the small hidden states
+    for ffn_input in ffn_inputs:
+        rms = np.sqrt((ffn_input ** 2).mean(-1))
+        assert (rms > 0.8).all() and (rms < 1.01).all()
+    # the third sequence is in the batch of the padding rows
+    last_inputs = capture_ffn_inputs(model, calibration_ids[[2, 0]], calibration_mask[[2, 0]])
+    assert np.allclose(last_inputs[1][:16], ffn_inputs[1][-16:], atol=1e-5)
+    assert [name for name, _ in model.parameters_and_names()] == names
+
+    for layer_id, ffn_input in enumerate(ffn_inputs):
+        np.save(os.path.join(tmp_path, f"ffn_input_{layer_id}.npy"), ffn_input)
+    assert np.array_equal(load_ffn_inputs(str(tmp_path), 1, 64), ffn_inputs[1])
+    with pytest.raises(FileNotFoundError):
+        load_ffn_inputs(str(tmp_path), 2, 64)
+    ms.set_context(mode=ms.GRAPH_MODE)
+    with pytest.raises(ValueError):
+        capture_ffn_inputs(model, calibration_ids, calibration_mask)
@@ -0,0 +1,120 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test batched generate evaluation."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore.dataset import NumpySlicesDataset
+
+from mindformers.trainer.causal_language_modeling.generate_evaluator import GenerateEvaluator
+
+from .utils import tiny_llama
+
+PAD = 0
+
+
+class SumNetwork:
+    """a network generating the sum of the sequence modulo 50 as the next token, stopping at 0."""
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.batches = []
+
+    def generate(self, input_ids, pad_token_id, max_new_tokens):
+        assert input_ids.shape[0] == self.batch_size
+        self.batches.append(input_ids.shape[1])
+        outputs = []
+        for ids, new_tokens in zip(input_ids, max_new_tokens):
+            sequence = list(ids[:np.flatnonzero(ids != pad_token_id)[-1] + 1])
+            for _ in range(new_tokens):
+                sequence.append(sum(sequence) % 50)
+                if sequence[-1] == 0:
+                    break
+            outputs.append(np.array(sequence))
+        return outputs
+
+
+class JoinTokenizer:
+    """a tokenizer decoding the ids to the string of the ids."""
+    pad_token_id = PAD
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        _ = skip_special_tokens
+        return [" ".join(str(i) for i in ids if i != PAD) for ids in token_ids]
+
+
+class PairMetric:
+    """a metric keeping the decoded pairs."""
+    def __init__(self):
+        self.pairs = []
+
+    def update(self, preds, labels):
+        self.pairs.extend(zip(preds, labels))
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_generate_evaluator():
+    """
+    Feature: Test GenerateEvaluator
+    Description: Evaluate a dataset of prompts of random lengths in length buckets, more examples than batches
+    Expectation: Every example gets the output of generating it alone, the batches hold prompts of close lengths
+    """
+    np.random.seed(0)
+    lengths = np.random.randint(1, 12, 11)
+    input_ids = np.zeros((11, 16), np.int32)
+    for row, length in zip(input_ids, lengths):
+        row[:length] = np.random.randint(1, 50, length)
+    labels = np.random.randint(1, 50, (11, 4)).astype(np.int32)
+    dataset = NumpySlicesDataset({"input_ids": input_ids, "labels": labels}, shuffle=False).batch(3)
+
+    network = SumNetwork(batch_size=3)
+    metric = PairMetric()
+    evaluator = GenerateEvaluator(network, JoinTokenizer(), metric, batch_size=3, max_new_tokens=5)
+    assert evaluator.evaluate(dataset) == 11
+
+    expected = []
+    for ids, length, label in zip(input_ids, lengths, labels):
+        output = SumNetwork(batch_size=1).generate(ids[None], PAD, [5])[0]
+        expected.append((" ".join(str(i) for i in output[length:] if i), " ".join(map(str, label))))
+    assert sorted(metric.pairs) == sorted(expected)
+    # the prompts are generated from the shortest
+    assert network.batches == [max(lengths[i] for i in bucket) for bucket in evaluator.buckets(
+        [ids[:length] for ids, length in zip(input_ids, lengths)])]
+    assert network.batches == sorted(network.batches)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_generate_max_new_tokens_per_example(tmp_path):
+    """
+    Feature: Test generate with the max_new_tokens of every example
+    Description: Greedy generate a batch of prompts of different lengths with different max_new_tokens
+    Expectation: Every example gets the output of generating it alone with its max_new_tokens
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, use_past=True)
+    np.random.seed(0)
+    prompts = [np.random.randint(3, 64, 4).tolist(), np.random.randint(3, 64, 11).tolist()]
+    # the prompts are padded with the pad token 0 to the same length
+    outputs = model.generate([prompts[0] + [0] * 7, prompts[1]], max_new_tokens=[9, 3], do_sample=False,
+                             eos_token_id=-1)
+    assert [len(output) for output in outputs] == [13, 14]
+    for prompt, max_new_tokens, output in zip(prompts, [9, 3], outputs):
+        single_output = model.generate([prompt, prompt], max_new_tokens=max_new_tokens, do_sample=False,
+                                       eos_token_id=-1)[0]
+        assert list(output) == list(single_output)
@@ -0,0 +1,153 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test the export and the lite infer inputs of the SciMind llama models."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore import Tensor
+
+from .utils import tiny_llama
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../.."))
+
+
+def _build_model(tmp_path, **kwargs):
+    model = tiny_llama(tmp_path, seq_length=128, **kwargs)
+    model.set_train(False)
+    return model
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_llama_export_inputs(tmp_path):
+    """
+    Feature: The export inputs of the llama models
+    Description: Run the model with the input tuples of the prefill, the increment and the full models
+    Expectation: The molecular mask is the second input, the models output the logits of the input tokens
+    """
+    # pylint: disable=C0415
+    from mindformers.tools.export import INCREMENT_MODEL_INPUT_MAP, PREFILL_MODEL_INPUT_MAP
+
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    assert INCREMENT_MODEL_INPUT_MAP["scimind"] is INCREMENT_MODEL_INPUT_MAP["llama2"]
+    model = _build_model(tmp_path, use_past=True)
+    inputs = INCREMENT_MODEL_INPUT_MAP["scimind"](2, 128, True)
+    assert inputs[1].shape == (2, 128)
+    model.add_flags_recursive(is_first_iteration=True)
+    logits = model(*inputs)[0]
+    assert logits.shape[-1] == 64
+    inputs = INCREMENT_MODEL_INPUT_MAP["scimind"](2, 128, False)
+    assert inputs[1].shape == (2, 1)
+    model.add_flags_recursive(is_first_iteration=False)
+    assert model(*inputs)[0].asnumpy().reshape(2, -1).shape == (2, 64)
+
+    model = _build_model(tmp_path)
+    logits = model(*PREFILL_MODEL_INPUT_MAP["scimind"](2, 128))[0]
+    assert logits.shape[-1] == 64
+
+
+class _LiteTensor:
+    """the data of a lite tensor."""
+    def __init__(self, data=None):
+        self.data = data
+
+    def set_data_from_numpy(self, data):
+        self.data = data
+
+    def get_data_to_numpy(self):
+        return self.data
+
+
+class _LiteModel:
+    """a lite model of the graph of a LlamaForCausalLM with the kv cache, the inputs are the ones of the export."""
+    def __init__(self, model, is_first_iteration):
+        self.model = model
+        self.is_first_iteration = is_first_iteration
+        self.inputs = None
+
+    def get_inputs(self):
+        self.inputs = [_LiteTensor() for _ in range(5)]
+        return self.inputs
+
+    def predict(self, inputs):
+        input_ids, molecular_mask, input_position, init_reset, valid_length = [Tensor(item.data) for item in inputs]
+        self.model.add_flags_recursive(is_first_iteration=self.is_first_iteration)
+        logits = self.model(input_ids, molecular_mask, None, input_position, None, None, None, init_reset,
+                            valid_length)[0]
+        return [_LiteTensor(logits.asnumpy())]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_scimind_lite_generate(tmp_path):
+    """
+    Feature: SciMindInputsOfInfer and TextGeneratorInfer.generate
+    Description: Get the lite inputs of the prefill and the increment iterations, and generate with the lite models
+        of a LlamaForCausalLM
+    Expectation: The molecular mask of the prompts and of the current tokens is the second input, the outputs are
+        the greedy ones of the model, the timing metrics count the steps
+    """
+    pytest.importorskip("mindspore_lite")
+    # pylint: disable=C0415
+    from mindformers.inference.infers.text_generator_infer import InputOfInfer, TextGeneratorInfer
+
+    input_ids = np.zeros((2, 8), np.int32)
+    input_ids[0, :5] = [3, 40, 41, 4, 50]
+    input_ids[1, :3] = [45, 5, 6]
+    lite_model = _LiteModel(None, True)
+    inputs = InputOfInfer.get_inputs("scimind_moe_7b", lite_model, input_ids=input_ids,
+                                     current_index=np.array([4, 10], np.int32), valid_length=np.array([5, 3]),
+                                     init_reset=np.array([False]), is_first_iteration=True,
+                                     modality_ranges=[[40, 64]])
+    assert np.array_equal(inputs[0].data, input_ids)
+    assert inputs[1].data.tolist() == [[0, 1, 1, 0, 1, 0, 0, 0], [1, 0, 0, 0, 0, 0, 0, 0]]
+    inputs = InputOfInfer.get_inputs("llama2_7b", lite_model, input_ids=input_ids,
+                                     current_index=np.array([4, 10], np.int32), valid_length=np.array([5, 3]),
+                                     init_reset=np.array([True]), is_first_iteration=False,
+                                     modality_ranges=[[40, 64]])
+    assert inputs[0].data.tolist() == [[50], [6]]
+    assert inputs[1].data.tolist() == [[1], [0]]
+    assert inputs[2].data.tolist() == [4, 10]
+    # the given mask of the sequences is sliced at the current tokens
+    inputs = InputOfInfer.get_inputs("llama2_7b", lite_model, input_ids=input_ids,
+                                     current_index=np.array([4, 10], np.int32), valid_length=np.array([5, 3]),
+                                     init_reset=np.array([True]), is_first_iteration=False,
+                                     molecular_mask=np.ones((2, 8), np.int32))
+    assert inputs[1].data.tolist() == [[1], [1]]
+
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = _build_model(tmp_path, use_past=True)
+    infer = TextGeneratorInfer.__new__(TextGeneratorInfer)
+    infer.model_name = "scimind_moe_7b"
+    infer.seq_length = 128
+    infer.tokenizer = None
+    infer.full_model = _LiteModel(model, True)
+    infer.cache_model = _LiteModel(model, False)
+    # the prompts of TextGeneratorInfer are not padded
+    prompts = [[3, 40, 41, 4, 50], [45, 5, 6]]
+    outputs = infer.generate(prompts, False, 1, 1.0, 1.0, 1.0, -1, 0, 12, False, None, modality_ranges=[[40, 64]])
+    expected = model.generate([prompts[0], prompts[1] + [0, 0]], do_sample=False, max_length=12, eos_token_id=-1,
+                              modality_ranges=[[40, 64]])
+    assert [list(output) for output in outputs] == [list(output) for output in expected]
+    metrics = infer.timing_metrics
+    assert metrics["generated_tokens"] == 16
+    # the prefill and 8 decode steps generate the 9 tokens of the second prompt, one more step finishes it
+    assert metrics["decode_steps"] == 9 and metrics["prefill_time"] > 0
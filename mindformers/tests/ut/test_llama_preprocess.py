@@ -0,0 +1,112 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+""" test the streaming and parallel preprocess of the SciMind conversations """
+import functools
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../mindformers/tools/dataset_preprocess/llama"))
+# pylint: disable=C0413
+import llama_preprocess_2
+from llama_preprocess_2 import IGNORE_TOKEN_ID, build_tokenizer, iter_json_array, tokenize_qa, \
+    tokenize_qa_parallel, tokenize_qa_unpadded
+
+MODEL_FILE = os.path.join(os.path.dirname(__file__), "../../checkpoint_download/llama2/tokenizer.model")
+SEQ_LENGTH = 65
+
+
+def _conversations():
+    """conversations of one or more rounds with SMILES tokens, escaped characters and a truncated one."""
+    smiles = "{|C|}{|C|}{|(|}{|=|}{|O|}{|)|}{|O|}"
+    return [
+        {"conversation": [{"from": "human", "value": "What is " + smiles + "?"},
+                          {"from": "gpt", "value": "Acetic acid, \"CC(=O)O\"."}]},
+        {"conversation": [{"from": "human", "value": "Hi"}, {"from": "gpt", "value": "Hello [1] {ok}"},
+                          {"from": "human", "value": "Draw it"}, {"from": "gpt", "value": smiles}]},
+        {"conversation": [{"from": "gpt", "value": "skipped"}, {"from": "human", "value": "Name {|c|}{|1|}"},
+                          {"from": "gpt", "value": "Benzene\nring, 苯"}]},
+        {"conversation": [{"from": "human", "value": "Describe " + smiles * 8},
+                          {"from": "gpt", "value": "A long molecule. " * 10}]},
+    ]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_iter_json_array(tmp_path):
+    """
+    Feature: iter_json_array.
+    Description: Stream the items of a json array read a few characters at a time.
+    Expectation: The items are the ones of json.load, an item split over the chunks is read whole.
+    """
+    path = os.path.join(tmp_path, "conversations.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_conversations(), f, indent=1, ensure_ascii=False)
+    expected = _conversations()
+    for chunk_size in (1, 7, 64, 1 << 20):
+        assert list(iter_json_array(path, chunk_size=chunk_size)) == expected
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("  []")
+    assert not list(iter_json_array(path, chunk_size=2))
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_tokenize_qa_paths(tmp_path, monkeypatch):
+    """
+    Feature: tokenize_qa_parallel and tokenize_qa_unpadded.
+    Description: Tokenize a small json file of conversations serially with preprocess, in a pool of workers with
+        chunks of two conversations and without padding, the file being read 7 characters at a time.
+    Expectation: The parallel records are the serial ones, the unpadded records are the serial ones without the
+        padding.
+    """
+    path = os.path.join(tmp_path, "conversations.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_conversations(), f, ensure_ascii=False)
+    alphabet_file = os.path.join(tmp_path, "smiles_alphabet.txt")
+    with open(alphabet_file, "w", encoding="utf-8") as f:
+        f.write("\n".join("{|" + char + "|}" for char in "C1(O)c=N"))
+    tokenizer = build_tokenizer(MODEL_FILE, alphabet_file)
+    monkeypatch.setattr(llama_preprocess_2, "iter_json_array", functools.partial(iter_json_array, chunk_size=7))
+
+    expected = list(tokenize_qa(tokenizer, path, SEQ_LENGTH))
+    for record in expected:
+        record["molecular_mask"] = (record["input_ids"][:-1] >= 32000).astype(np.float32)
+    assert len(expected) == 4
+    assert all(record["molecular_mask"].any() for record in expected)
+    # the last conversation is truncated, it ends with the eos token
+    assert expected[3]["input_ids"][-1] == 2 and (expected[3]["input_ids"] != tokenizer.pad_token_id).all()
+    assert (expected[0]["labels"] != IGNORE_TOKEN_ID).any()
+
+    records = list(tokenize_qa_parallel(path, MODEL_FILE, alphabet_file, SEQ_LENGTH, workers=2, chunk_size=2))
+    assert len(records) == len(expected)
+    for record, expected_record in zip(records, expected):
+        for name in ("input_ids", "labels", "molecular_mask"):
+            assert np.array_equal(record[name], expected_record[name]), name
+
+    records = list(tokenize_qa_unpadded(tokenizer, path, SEQ_LENGTH))
+    assert len(records) == len(expected)
+    for record, expected_record in zip(records, expected):
+        length = len(record["input_ids"])
+        assert np.array_equal(record["input_ids"], expected_record["input_ids"][:length])
+        assert np.array_equal(record["labels"], expected_record["labels"][:length])
+        assert np.array_equal(record["molecular_mask"], expected_record["molecular_mask"][:length - 1])
+        assert (expected_record["input_ids"][length:] == tokenizer.pad_token_id).all()
+        assert (expected_record["labels"][length:] == IGNORE_TOKEN_ID).all()
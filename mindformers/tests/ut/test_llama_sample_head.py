@@ -0,0 +1,71 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test the in-graph sample head of llama."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers.generation import CandidateLogitsWarper
+from mindformers.models.llama.llama_layer import LlamaSampleHead
+
+from .utils import copy_weights, tiny_llama
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_llama_sample_head():
+    """
+    Feature: Test LlamaSampleHead
+    Description: Post process random logits in graph with temperature, top-k and top-p, and with greedy search
+    Expectation: The candidates are the ones of CandidateLogitsWarper, greedy search returns the argmax tokens
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    np.random.seed(0)
+    logits = (np.random.randn(3, 1000) * 3).astype(np.float32)
+    for temperature, top_k, top_p in [(1.0, 50, 1.0), (0.7, 50, 0.9), (1.3, 0, 0.8), (0.5, 300, 0.6)]:
+        scores, token_ids = LlamaSampleHead(True, temperature, top_k, top_p)(Tensor(logits))
+        expected_scores, expected_ids = CandidateLogitsWarper(temperature, top_k, top_p).candidates(logits.copy())
+        assert (token_ids.asnumpy() == expected_ids).all()
+        assert np.allclose(scores.asnumpy(), expected_scores, atol=1e-5)
+
+    scores, token_ids = LlamaSampleHead(False)(Tensor(logits))
+    assert token_ids.asnumpy().reshape(-1).tolist() == logits.argmax(-1).tolist()
+    assert (scores.asnumpy() == 1).all()
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_llama_sample_acceleration_generate(tmp_path):
+    """
+    Feature: Test LlamaForCausalLM with is_sample_acceleration
+    Description: Greedy generate with the logits post processed on the host and in graph
+    Expectation: The outputs are the same
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, use_past=True, do_sample=False)
+    sample_model = copy_weights(model, tiny_llama(tmp_path, use_past=True, do_sample=False,
+                                                  is_sample_acceleration=True))
+
+    np.random.seed(0)
+    # the prompts are padded with the pad token 0 to the same length
+    prompts = [np.random.randint(3, 64, 5).tolist() + [0] * 4, np.random.randint(3, 64, 9).tolist()]
+    outputs = model.generate(prompts, max_new_tokens=10, do_sample=False, eos_token_id=-1)
+    sample_outputs = sample_model.generate(prompts, max_new_tokens=10, do_sample=False, eos_token_id=-1)
+    for output, sample_output in zip(outputs, sample_outputs):
+        assert list(output) == list(sample_output)
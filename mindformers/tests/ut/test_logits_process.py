@@ -0,0 +1,195 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test logits processors."""
+import numpy as np
+import pytest
+
+from mindformers.generation import (CandidateLogitsWarper, LogitsProcessorList, RepetitionPenaltyLogitsProcessor,
+                                    SmilesGrammarLogitsProcessor, TemperatureLogitsWarper, TopKLogitsWarper,
+                                    TopPLogitsWarper)
+from mindformers.generation.utils import softmax
+
+ALPHABET = "C1(Oc2)N=#3.ln-sS[@H]/\\o+456BrIM0dFGeiTPa7K89ugURh%tWDyZbELfYVXpm"
+START_ID = 100
+EOS_TOKEN_ID = 2
+VOCAB_SIZE = START_ID + len(ALPHABET)
+
+
+def token_id(char):
+    return START_ID + ALPHABET.index(char)
+
+
+def build_processor():
+    vocab = {"{|" + char + "|}": START_ID + index for index, char in enumerate(ALPHABET)}
+    return SmilesGrammarLogitsProcessor(vocab, eos_token_id=EOS_TOKEN_ID)
+
+
+class SmilesDecoder:
+    """append the characters of a batch of SMILES in place, as the generation does."""
+    def __init__(self, processor, batch_size, prompt_length=3, seq_length=64):
+        self.processor = processor
+        self.input_ids = np.zeros((batch_size, seq_length), np.int32)
+        self.input_ids[:, :prompt_length] = 5
+        self.lengths = np.full(batch_size, prompt_length)
+
+    def allowed(self):
+        scores = np.zeros((self.input_ids.shape[0], VOCAB_SIZE), np.float32)
+        return self.processor(self.input_ids, scores) > -50000
+
+    def append(self, row, char):
+        self.input_ids[row, self.lengths[row]] = token_id(char)
+        self.lengths[row] += 1
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_smiles_grammar_valid_smiles():
+    """
+    Feature: Test SmilesGrammarLogitsProcessor
+    Description: Decode valid SMILES character by character in a batch
+    Expectation: Every character of the SMILES is allowed, eos is allowed at the end only
+    """
+    smiles = ["CC(=O)Oc1ccccc1C(=O)O", "C1CC[C@H](N)CC1", "[13CH4]", "Cl/C=C/Br", "C%12CC%12", "[Na+].[Cl-]",
+              "O=C1NC(C(C)=O)C=C1", "c1ccc2c(c1)cccc2", "C12CC1CC2", "Br1CCCl1", "[CH2]1CC1"]
+    decoder = SmilesDecoder(build_processor(), len(smiles))
+    for step in range(max(len(item) for item in smiles) + 1):
+        allowed = decoder.allowed()
+        for row, item in enumerate(smiles):
+            if step < len(item):
+                assert allowed[row, token_id(item[step])], (item, step)
+            elif step == len(item):
+                assert allowed[row, EOS_TOKEN_ID], item
+        for row, item in enumerate(smiles):
+            if step < len(item):
+                decoder.append(row, item[step])
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_smiles_grammar_invalid_tokens():
+    """
+    Feature: Test SmilesGrammarLogitsProcessor
+    Description: Check the tokens masked after SMILES prefixes
+    Expectation: The tokens that make the SMILES invalid are masked, such as the second letter of an element other
+        than Cl and Br, or a ring bond closed on the atom it is opened on, the other tokens are kept
+    """
+    cases = [("", ")1=(]l"), ("C(", ")1]"), ("C1CC", ")"), ("N", "lr"), ("[", "]+@"), ("[13", "]"),
+             ("C=", ")(=."), ("C(C)", "1%"), ("C%", "CN(["), ("[NH", "[(="), ("C", "r"), ("B", "l"), ("C1", "1"),
+             ("C12=", "12"), ("C%12%1", "2"), ("Br1", "1")]
+    decoder = SmilesDecoder(build_processor(), len(cases))
+    for step in range(max(len(prefix) for prefix, _ in cases)):
+        decoder.allowed()
+        for row, (prefix, _) in enumerate(cases):
+            if step < len(prefix):
+                decoder.append(row, prefix[step])
+    allowed = decoder.allowed()
+    for row, (prefix, masked) in enumerate(cases):
+        for char in masked:
+            assert not allowed[row, token_id(char)], (prefix, char)
+        # the text tokens are not masked
+        assert allowed[row, 5]
+    # unclosed ring bonds and branches
+    assert not allowed[2, EOS_TOKEN_ID] and not allowed[1, EOS_TOKEN_ID]
+    assert allowed[3, token_id("C")] and allowed[6, token_id("1")] and allowed[7, token_id("(")]
+    # Cl and Br only, the ring bonds are closed on another atom
+    assert allowed[10, token_id("l")] and allowed[11, token_id("r")]
+    assert allowed[12, token_id("2")] and allowed[13, token_id("3")] and allowed[14, token_id("3")]
+    assert allowed[15, token_id("C")]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_smiles_grammar_reset_reorder():
+    """
+    Feature: Test SmilesGrammarLogitsProcessor.reset and reorder
+    Description: Reorder the rows of SMILES prefixes in place as the beams, then start a new generation in the same
+        input_ids buffer
+    Expectation: The parser states follow the reordered rows, reset starts new SMILES, another batch size without
+        reset is rejected
+    """
+    decoder = SmilesDecoder(build_processor(), 2)
+    processors = LogitsProcessorList([RepetitionPenaltyLogitsProcessor(1.2), decoder.processor])
+    processors.reset(decoder.input_ids)
+    for chars in zip("C(C", "C1C"):
+        decoder.allowed()
+        for row, char in enumerate(chars):
+            decoder.append(row, char)
+    allowed = decoder.allowed()
+    assert allowed[0, token_id(")")] and not allowed[1, token_id(")")]
+
+    # both rows continue the second one
+    decoder.input_ids[:] = decoder.input_ids[[1, 1]]
+    decoder.lengths = decoder.lengths[[1, 1]]
+    processors.reorder(np.array([1, 1]))
+    decoder.append(0, "C")
+    decoder.append(1, "1")
+    allowed = decoder.allowed()
+    assert not allowed[:, token_id(")")].any()
+    assert not allowed[0, EOS_TOKEN_ID] and allowed[1, EOS_TOKEN_ID]
+
+    # a new generation in the same buffer starts new SMILES after the prompts
+    processors.reset(decoder.input_ids)
+    allowed = decoder.allowed()
+    assert not allowed[:, token_id(")")].any() and allowed[:, EOS_TOKEN_ID].all()
+    with pytest.raises(ValueError):
+        SmilesDecoder(decoder.processor, 3).allowed()
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_candidate_logits_warper():
+    """
+    Feature: Test CandidateLogitsWarper
+    Description: Warp the scores with temperature, top k and top p on the candidates and with the separate warpers
+    Expectation: The candidates hold the same probabilities as the separately warped scores
+    """
+    np.random.seed(0)
+    for temperature, top_k, top_p in [(1.0, 50, 1.0), (0.7, 50, 0.9), (1.3, 0, 0.8), (0.5, 300, 0.6)]:
+        scores = np.random.randn(1, 32000).astype(np.float32) * 3
+        warpers = LogitsProcessorList([TemperatureLogitsWarper(temperature)])
+        if top_k:
+            warpers.append(TopKLogitsWarper(top_k))
+        if top_p < 1.0:
+            warpers.append(TopPLogitsWarper(top_p))
+        expected = softmax(warpers(None, scores.copy()), axis=-1)
+
+        candidate_scores, token_ids = CandidateLogitsWarper(temperature, top_k, top_p).candidates(scores.copy())
+        assert candidate_scores.shape == (1, max(top_k, 200 if top_p < 1.0 else 0))
+        probs = np.zeros_like(expected)
+        np.put_along_axis(probs, token_ids, softmax(candidate_scores, axis=-1), axis=-1)
+        assert np.allclose(probs, expected, atol=1e-6)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_repetition_penalty_valid_length():
+    """
+    Feature: Test RepetitionPenaltyLogitsProcessor with valid_length
+    Description: Penalize the tokens of padded input_ids with and without the valid lengths
+    Expectation: The padding tokens are not penalized with the valid lengths, a repeated token is penalized once
+    """
+    input_ids = np.array([[5, 6, 5, 0, 0], [1, 2, 3, 4, 0]])
+    scores = np.random.randn(2, 10).astype(np.float32)
+    expected = scores.copy()
+    expected[0, [5, 6]] = np.where(scores[0, [5, 6]] < 0, scores[0, [5, 6]] * 2, scores[0, [5, 6]] / 2)
+    expected[1, 1:5] = np.where(scores[1, 1:5] < 0, scores[1, 1:5] * 2, scores[1, 1:5] / 2)
+    processors = LogitsProcessorList([RepetitionPenaltyLogitsProcessor(2.0)])
+    assert np.allclose(processors(input_ids, scores.copy(), valid_length=np.array([3, 4])), expected)
+    assert processors(input_ids, scores.copy())[0, 0] != scores[0, 0]
@@ -19,7 +19,8 @@ import numpy as np
 import mindspore as ms
 from mindspore import Tensor
 
-from mindformers.core.metric import PromptAccMetric, EmF1Metric
+from mindformers.core.metric import PromptAccMetric, EmF1Metric, SmilesGenerationMetric, CaptionGenerationMetric
+from mindformers.core.metric.molecule_metric import is_valid_smiles, levenshtein
 
 
 @pytest.mark.level0
@@ -73,3 +74,62 @@ def test_emf1_metric():
     error = 1e-8
     f1_score, em_score = 75.0, 50.0
     assert abs(result.get("F1", 0) - f1_score) < error and abs(result.get("Em", 0) - em_score) < error
+
+
+def _levenshtein(source, target):
+    """the edit distance by the dynamic programming of every cell."""
+    row = list(range(len(target) + 1))
+    for i, item in enumerate(source, 1):
+        new_row = [i]
+        for j, target_item in enumerate(target, 1):
+            new_row.append(min(row[j] + 1, new_row[j - 1] + 1, row[j - 1] + (item != target_item)))
+        row = new_row
+    return row[-1]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_smiles_generation_metric():
+    """
+    Feature: Test SmilesGenerationMetric
+    Description: Score generated SMILES, some wrapped in the {|X|} tokens, in batches
+    Expectation: The vectorized Levenshtein distances are the ones of the dynamic programming, the scores are right
+    """
+    np.random.seed(0)
+    sources = ["".join(np.random.choice(list("CNO()=1c"), np.random.randint(0, 30))) for _ in range(300)]
+    targets = ["".join(np.random.choice(list("CNO()=1c"), np.random.randint(0, 30))) for _ in range(300)]
+    assert levenshtein(sources, targets, chunk_size=64).tolist() == \
+        [_levenshtein(source, target) for source, target in zip(sources, targets)]
+    assert is_valid_smiles("c1ccccc1C(=O)O") and not is_valid_smiles("c1ccccc1C(=O") and not is_valid_smiles("")
+
+    metric = SmilesGenerationMetric()
+    metric.clear()
+    metric.update(["CCO", "{|c|}{|1|}{|c|}{|c|}{|c|}{|c|}{|c|}{|1|}"], ["CCO", "c1ccncc1"])
+    metric.update(["CC(=O"], ["CC(=O)O"])
+    result = metric.eval()
+    assert result["exact_match"] == 1 / 3
+    assert result["levenshtein"] == 1
+    assert result["token_levenshtein"] == 1
+    assert result["validity"] == 2 / 3
+    assert result["ngram_fts"] > 1 / 3
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_caption_generation_metric():
+    """
+    Feature: Test CaptionGenerationMetric
+    Description: Score generated captions in batches, with an empty caption
+    Expectation: An exact caption scores 1, the empty caption scores 0
+    """
+    metric = CaptionGenerationMetric()
+    metric.clear()
+    captions = ["The molecule is a primary alcohol.", "The molecule is an aromatic amine."]
+    metric.update(captions[:1], captions[:1])
+    metric.update(["", captions[1]], captions)
+    result = metric.eval()
+    for key in ("rouge-1", "rouge-2", "rouge-l"):
+        assert abs(result[key] - 2 / 3) < 1e-6
+    assert 0 < result["bleu-4"] < 1
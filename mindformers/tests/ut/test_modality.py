@@ -0,0 +1,41 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test generation modality tracker."""
+import numpy as np
+import pytest
+
+from mindformers.generation.modality import ModalityTracker
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_modality_tracker():
+    """
+    Feature: Test ModalityTracker
+    Description: Prefill the prompt mask with two molecular vocabularies then append sampled tokens
+    Expectation: The mask is the same as recomputing it over the full sequences
+    """
+    tracker = ModalityTracker([[32000, 32100], [40000, None]])
+    input_ids = np.array([[1, 32000, 32099, 0, 0], [32100, 40000, 0, 0, 0]])
+    assert np.array_equal(tracker.prefill(input_ids), [[0, 1, 1, 0, 0], [0, 1, 0, 0, 0]])
+
+    tracker.append(0, 3, 32050)
+    tracker.append(1, 2, 31999)
+    input_ids[0, 3], input_ids[1, 2] = 32050, 31999
+    assert np.array_equal(tracker.mask, tracker.is_molecular(input_ids))
+    assert np.array_equal(tracker.last_mask, [[1], [0]])
+    with pytest.raises(ValueError):
+        ModalityTracker([[100, 100]])
@@ -0,0 +1,92 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test paged kv cache."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+
+from mindformers.generation import BlockManager, ContinuousBatchingEngine
+
+from .utils import PagedCacheRunner, copy_weights, reference, tiny_llama
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_block_manager():
+    """
+    Feature: Test BlockManager
+    Description: Allocate, grow and free the blocks of two sequences
+    Expectation: The block tables are bucketed, the slots follow the tables, the padding goes to block 0
+    """
+    block_manager = BlockManager(num_blocks=6, block_size=4, batch_size=2, seq_length=32)
+    assert block_manager.allocate(0, 5)
+    assert block_manager.allocate(1, 3)
+    assert block_manager.tables == [[1, 2], [3]]
+    assert block_manager.block_tables().tolist() == [[1, 2], [3, 0]]
+    assert block_manager.slot_mapping(np.array([4, 2])).tolist() == [8, 14]
+    assert block_manager.prefill_slot_mapping([5, 3], 8).tolist() == [4, 5, 6, 7, 8, 0, 0, 0,
+                                                                      12, 13, 14, 0, 0, 0, 0, 0]
+    assert block_manager.ensure(0, 9)
+    assert block_manager.block_tables().shape == (2, 4)
+    assert not block_manager.ensure(1, 9)
+    assert not block_manager.can_allocate(9, 1)
+    block_manager.free(0)
+    assert block_manager.num_free_blocks == 4
+    assert block_manager.ensure(1, 9)
+    assert block_manager.slot_mapping(np.array([0, 20])).tolist() == [0, 0]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_paged_continuous_batching_preemption():
+    """
+    Feature: Test ContinuousBatchingEngine with a paged kv cache
+    Description: Serve requests whose caches do not fit in the blocks at the same time
+    Expectation: The latest requests are preempted and resumed, every request gets the output of running it alone
+    """
+    runner = PagedCacheRunner(num_blocks=7)
+    engine = ContinuousBatchingEngine(runner, eos_token_id=-1)
+    requests = [engine.submit([i + 1, i + 2, i + 3], max_new_tokens=8 + i * 2) for i in range(6)]
+    engine.run_until_complete()
+    for i, request in enumerate(requests):
+        assert request.result().tolist() == reference([i + 1, i + 2, i + 3], 8 + i * 2)
+    assert any(request.num_preemptions for request in requests)
+    assert runner.block_manager.num_free_blocks == 6
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_paged_kv_cache_generate(tmp_path):
+    """
+    Feature: Test LlamaForCausalLM with use_paged_kv_cache
+    Description: Greedy generate a batch of prompts with the dense and the paged kv cache
+    Expectation: The outputs are the same
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, seq_length=64, use_past=True)
+    paged_model = copy_weights(model, tiny_llama(tmp_path, seq_length=64, use_past=True, use_paged_kv_cache=True,
+                                                 kv_block_size=8, kv_num_blocks=9))
+
+    np.random.seed(0)
+    # the prompts are padded with the pad token 0 to the same length
+    prompts = [np.random.randint(3, 64, 11).tolist(), np.random.randint(3, 64, 5).tolist() + [0] * 6]
+    outputs = model.generate(prompts, max_new_tokens=20, do_sample=False, eos_token_id=-1)
+    paged_outputs = paged_model.generate(prompts, max_new_tokens=20, do_sample=False, eos_token_id=-1)
+    for output, paged_output in zip(outputs, paged_outputs):
+        assert list(output) == list(paged_output)
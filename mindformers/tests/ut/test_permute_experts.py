@@ -0,0 +1,73 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test expert-block-contiguous feed forward layout."""
+import os
+
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.models.llama.expert_patterns import ExpertPatternStore, save_expert_patterns
+from mindformers.models.llama.permute_experts import permute_checkpoint
+
+
+def build_model(expert_patterns_path, use_sparse_ffn):
+    config = LlamaConfig(batch_size=1, seq_length=16, vocab_size=64, hidden_size=64, num_layers=2, num_heads=4,
+                         multiple_of=16, compute_dtype="float32", layernorm_compute_type="float32",
+                         softmax_compute_type="float32", rotary_dtype="float32", param_init_type="float32",
+                         use_sparse_ffn=use_sparse_ffn, expert_patterns_path=expert_patterns_path)
+    return LlamaForCausalLM(config)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+@pytest.mark.parametrize("use_sparse_ffn", [True, False])
+def test_permuted_experts_logits(tmp_path, use_sparse_ffn):
+    """
+    Feature: Test permute_experts
+    Description: Permute the feed forward neurons of a tiny llama so that the experts are contiguous
+    Expectation: The sparse logits are bit-identical, the masked logits only differ by the summation order
+    """
+    ms.set_context(mode=ms.PYNATIVE_MODE, device_target="CPU")
+    np.random.seed(0)
+    hidden_dim, expert_num = 176, 16
+    patterns_list = [np.random.permutation(np.arange(hidden_dim) % expert_num)[None, :] ==
+                     np.arange(expert_num)[:, None] for _ in range(2)]
+    patterns_path = os.path.join(tmp_path, "expert_patterns.bin")
+    save_expert_patterns(patterns_list, patterns_path)
+    model = build_model(patterns_path, use_sparse_ffn)
+
+    params = {name: param.asnumpy() for name, param in model.parameters_and_names()}
+    params, permuted_list = permute_checkpoint(params, patterns_list)
+    permuted_path = os.path.join(tmp_path, "expert_patterns_permuted.bin")
+    save_expert_patterns(permuted_list, permuted_path)
+    assert ExpertPatternStore(permuted_path).encoding == "block"
+    permuted_model = build_model(permuted_path, use_sparse_ffn)
+    assert permuted_model.model.layers[0].feed_forward.expert_blocks is not None
+    ms.load_param_into_net(permuted_model, {name: ms.Parameter(Tensor(value), name=name)
+                                            for name, value in params.items()})
+
+    input_ids = Tensor(np.random.randint(0, 64, (1, 16)), ms.int32)
+    molecular_mask = Tensor(np.random.randint(0, 2, (1, 16)), ms.int32)
+    logits = model(input_ids, molecular_mask)[0].asnumpy()
+    permuted_logits = permuted_model(input_ids, molecular_mask)[0].asnumpy()
+    if use_sparse_ffn:
+        assert np.array_equal(logits, permuted_logits)
+    else:
+        assert np.allclose(logits, permuted_logits, rtol=1e-5, atol=1e-5)
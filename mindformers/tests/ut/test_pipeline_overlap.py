@@ -0,0 +1,93 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test the overlapped preprocess, forward and postprocess of a pipeline."""
+import collections
+import threading
+import time
+
+import pytest
+from mindspore import Model, nn
+
+from mindformers.pipeline.base_pipeline import BasePipeline
+
+
+class _RecordPipeline(BasePipeline):
+    """a pipeline of batches of ints, recording the order of its stages."""
+    def __init__(self, wait_overlap=False, **kwargs):
+        self.wait_overlap = wait_overlap
+        self.started = collections.defaultdict(threading.Event)
+        self.overlapped = []
+        self.lock = threading.Lock()
+        self.prefetched = 0
+        self.max_prefetched = 0
+        super().__init__(Model(nn.Dense(2, 2)), **kwargs)
+
+    def _sanitize_parameters(self, **pipeline_parameters):
+        return {}, {}, {"scale": pipeline_parameters.pop("scale", 10)}
+
+    def preprocess(self, inputs, **preprocess_params):
+        batch = inputs[0] // len(inputs)
+        self.started["preprocess", batch].set()
+        with self.lock:
+            self.prefetched += 1
+            self.max_prefetched = max(self.max_prefetched, self.prefetched)
+        return {"batch": batch, "values": list(inputs)}
+
+    def forward(self, model_inputs, **forward_params):
+        batch = model_inputs["batch"]
+        with self.lock:
+            self.prefetched -= 1
+        if self.wait_overlap:
+            # the next batch is preprocessed and the previous one postprocessed during the forward
+            if batch + 1 < 6:
+                self.overlapped.append(self.started["preprocess", batch + 1].wait(10))
+            if batch > 0:
+                self.overlapped.append(self.started["postprocess", batch - 1].wait(10))
+        return model_inputs
+
+    def postprocess(self, model_outputs, **postprocess_params):
+        batch = model_outputs["batch"]
+        self.started["postprocess", batch].set()
+        # the batches finish out of order
+        time.sleep(0.01 * (2 - batch % 3))
+        return [value * postprocess_params["scale"] for value in model_outputs["values"]]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_overlapped_run_multi():
+    """
+    Feature: BasePipeline.run_multi with num_workers
+    Description: Run 6 batches of a list input serially and with the preprocess and the postprocess in thread pools
+    Expectation: The outputs are the same and in order, the next batch is preprocessed and the previous batch is
+        postprocessed during the forward of a batch, at most prefetch_size batches are preprocessed ahead
+    """
+    inputs = list(range(12))
+    expected = [value * 10 for value in inputs]
+    assert _RecordPipeline()(inputs, batch_size=2) == expected
+
+    pipeline = _RecordPipeline(wait_overlap=True, num_workers=2, prefetch_size=1, max_pending=3)
+    assert pipeline.execution_params == {"num_workers": 2, "prefetch_size": 1, "max_pending": 3}
+    assert pipeline(inputs, batch_size=2) == expected
+    assert len(pipeline.overlapped) == 10 and all(pipeline.overlapped)
+    assert pipeline.max_prefetched == 1
+
+    # the parameters of a call override the ones of the pipeline
+    pipeline = _RecordPipeline(num_workers=2)
+    assert pipeline(inputs, batch_size=3, num_workers=1, prefetch_size=3, scale=2) == [value * 2 for value in inputs]
+    assert pipeline.max_prefetched <= 3
+    with pytest.raises(ValueError):
+        pipeline(inputs, batch_size=2, prefetch_size=0)
@@ -0,0 +1,161 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test shared prefix cache."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+
+from mindformers.generation import BlockManager, ContinuousBatchingEngine, PrefixCache
+
+from .utils import PagedCacheRunner, copy_weights, reference, tiny_llama
+
+
+class PrefixCacheRunner(PagedCacheRunner):
+    """a paged cache runner with a prefix cache, the tokens of the cached prefixes are not prefilled again."""
+    def __init__(self, num_blocks, block_size=4, batch_size=3, seq_length=32):
+        super().__init__(num_blocks, block_size, batch_size, seq_length)
+        self.prefix_cache = PrefixCache(self.block_manager, max_bytes=num_blocks, block_bytes=1)
+        self.prefilled_tokens = 0
+
+    def prefill(self, input_ids, molecular_mask, valid_length):
+        _ = molecular_mask
+        positions = self.block_manager.prefill_positions(valid_length, self.seq_length)
+        self.prefilled_tokens += int((positions >= 0).sum())
+        # the tokens of the cached prefixes are not written again
+        self.cache[self.block_manager.slot_mapping(positions)] = \
+            self.block_manager.skip_prefixes(input_ids).reshape(-1)
+        for row in np.flatnonzero(valid_length):
+            self.prefix_cache.insert(input_ids[row, :valid_length[row]], self.block_manager.tables[row])
+        return self._logits(np.flatnonzero(valid_length), valid_length)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_prefix_cache():
+    """
+    Feature: Test PrefixCache
+    Description: Insert and match prompts sharing a prefix under a byte budget
+    Expectation: The full blocks of the longest cached prefix are matched, the least recently used are evicted
+    """
+    block_manager = BlockManager(num_blocks=8, block_size=4, batch_size=2, seq_length=32)
+    prefix_cache = PrefixCache(block_manager, max_bytes=3 * 16, block_bytes=16)
+    template = list(range(1, 9))
+    assert block_manager.allocate(0, 10, prefix_cache.match(template + [20, 21]))
+    prefix_cache.insert(template + [20, 21], block_manager.tables[0])
+    assert prefix_cache.stats()["cached_blocks"] == 2
+    block_manager.free(0)
+    # the cached blocks are kept after the sequence is freed
+    assert block_manager.num_free_blocks == 5
+
+    prefix_blocks = prefix_cache.match(template + [30])
+    assert prefix_blocks == [1, 2]
+    assert block_manager.allocate(1, 9, prefix_blocks)
+    assert block_manager.prefix_lengths.tolist() == [0, 8]
+    assert block_manager.prefill_positions([0, 9], 4).tolist() == [[-1, -1, -1, -1], [8, -1, -1, -1]]
+    assert block_manager.skip_prefixes(np.arange(20).reshape(2, 10))[1].tolist() == [18, 19] + [0] * 8
+    # the last token is always prefilled
+    assert prefix_cache.match(template) == [1]
+    assert prefix_cache.match([9] + template) == []
+    assert prefix_cache.num_queries == 4 and prefix_cache.num_hits == 2
+    assert prefix_cache.saved_prefill_tokens == 12
+
+    # over the budget, the least recently used block not used by a sequence is evicted
+    block_manager.free(1)
+    assert block_manager.allocate(0, 8, prefix_cache.match([40] * 8))
+    prefix_cache.insert([40] * 8, block_manager.tables[0])
+    assert {block for block, _ in prefix_cache.blocks.values()} == {1, *block_manager.tables[0]}
+    # out of blocks, the cached blocks are reclaimed
+    assert block_manager.allocate(1, 20)
+    assert {block for block, _ in prefix_cache.blocks.values()} == set(block_manager.tables[0])
+    block_manager.free(0)
+    block_manager.free(1)
+    prefix_cache.clear()
+    assert block_manager.num_free_blocks == 7
+    assert prefix_cache.cached_bytes == 0
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_prefix_cache_hash_collision(monkeypatch):
+    """
+    Feature: Test PrefixCache
+    Description: Insert and match prompts whose prefix hashes all collide
+    Expectation: Only the blocks with the tokens of the prompt are matched, a colliding block is not cached
+    """
+    monkeypatch.setattr("mindformers.generation.prefix_cache.hash", lambda key: 0, raising=False)
+    block_manager = BlockManager(num_blocks=8, block_size=4, batch_size=2, seq_length=32)
+    prefix_cache = PrefixCache(block_manager, max_bytes=4 * 16, block_bytes=16)
+    template = list(range(1, 9))
+    assert block_manager.allocate(0, 9, prefix_cache.match(template + [20]))
+    prefix_cache.insert(template + [20], block_manager.tables[0])
+    # the second block has the hash of the first one
+    assert prefix_cache.stats()["cached_blocks"] == 1
+    assert prefix_cache.match(template + [30]) == [block_manager.tables[0][0]]
+    assert prefix_cache.match(list(range(11, 19)) + [30]) == []
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_prefix_cache_continuous_batching():
+    """
+    Feature: Test ContinuousBatchingEngine with a prefix cache
+    Description: Serve requests sharing a template, more requests than slots
+    Expectation: Every request gets the output of running it alone, the cached template is not prefilled again
+    """
+    runner = PrefixCacheRunner(num_blocks=13)
+    engine = ContinuousBatchingEngine(runner, eos_token_id=-1)
+    template = [3, 1, 4, 1, 5, 9, 2, 6]
+    prompts = [template + [i + 1, i + 2] for i in range(6)]
+    requests = [engine.submit(prompt, max_new_tokens=6) for prompt in prompts]
+    engine.run_until_complete()
+    for prompt, request in zip(prompts, requests):
+        assert request.result().tolist() == reference(prompt, 6)
+    # the first slots are admitted together before the template is cached
+    assert runner.prefix_cache.num_hits == 3
+    assert runner.prefilled_tokens == 60 - 3 * 8
+    runner.prefix_cache.clear()
+    assert runner.block_manager.num_free_blocks == 12
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_prefix_cache_generate(tmp_path):
+    """
+    Feature: Test LlamaForCausalLM with prefix_cache_bytes
+    Description: Greedy generate prompts sharing a template with the dense kv cache and the prefix cache
+    Expectation: The outputs are the same, the second batch starts from the cached template
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, seq_length=64, use_past=True)
+    prefix_model = copy_weights(model, tiny_llama(tmp_path, seq_length=64, use_past=True, use_paged_kv_cache=True,
+                                                  kv_block_size=8, kv_num_blocks=17, prefix_cache_bytes=1 << 20))
+
+    np.random.seed(0)
+    template = np.random.randint(3, 64, 19).tolist()
+    for _ in range(2):
+        # the prompts are padded with the pad token 0 to the same length
+        prompts = [template + np.random.randint(3, 64, 4).tolist() + [0] * 3,
+                   template + np.random.randint(3, 64, 7).tolist()]
+        outputs = model.generate(prompts, max_new_tokens=12, do_sample=False, eos_token_id=-1)
+        prefix_outputs = prefix_model.generate(prompts, max_new_tokens=12, do_sample=False, eos_token_id=-1)
+        for output, prefix_output in zip(outputs, prefix_outputs):
+            assert list(output) == list(prefix_output)
+    # the template is cached by the first round, both prompts of the second round hit it
+    assert prefix_model.prefix_cache.num_hits == 2
@@ -0,0 +1,52 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test batch sampler."""
+import numpy as np
+import pytest
+
+from mindformers.generation import BatchSampler
+from mindformers.generation.utils import softmax
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_batch_sampler():
+    """
+    Feature: Test BatchSampler
+    Description: Sample a batch of scores greedily and from the softmax, with token ids and a subset of the rows
+    Expectation: Greedy is the argmax, the samples follow the softmax, a row does not depend on the other rows
+    """
+    np.random.seed(0)
+    scores = np.random.randn(4, 50).astype(np.float32) * 2
+    scores[:, 10:20] = -np.inf
+    sampler = BatchSampler(batch_size=4, seed=1)
+    assert sampler.sample(scores, do_sample=False).tolist() == np.argmax(scores, axis=-1).tolist()
+    token_ids = np.argsort(-scores, axis=-1)[:, :5]
+    candidates = np.take_along_axis(scores, token_ids, axis=-1)
+    assert sampler.sample(candidates, False, np.array([1, 3]), token_ids).tolist() == \
+        np.argmax(scores, axis=-1)[[1, 3]].tolist()
+
+    samples = np.stack([sampler.sample(scores, do_sample=True) for _ in range(4000)])
+    assert not np.isin(samples, np.arange(10, 20)).any()
+    for row in range(4):
+        frequency = np.bincount(samples[:, row], minlength=50) / len(samples)
+        assert np.abs(frequency - softmax(scores[row])).max() < 0.03
+
+    batch_sampler = BatchSampler(batch_size=4, seed=7)
+    row_sampler = BatchSampler(batch_size=4, seed=7)
+    for _ in range(20):
+        batch = batch_sampler.sample(scores, do_sample=True)
+        assert row_sampler.sample(scores, True, np.array([2])).tolist() == batch[[2]].tolist()
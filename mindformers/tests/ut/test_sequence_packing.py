@@ -0,0 +1,201 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+""" test the packing of the sequences """
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore import Tensor
+from mindspore.mindrecord import FileWriter
+
+from mindformers.dataset import CausalLanguageModelDataset
+from mindformers.dataset.causal_language_model_dataset import get_compact_data_batch_slice_map, \
+    get_input_data_batch_slice_map
+from mindformers.tools.register import MindFormerConfig
+
+from .utils import tiny_llama
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../mindformers/tools/dataset_preprocess/llama"))
+# pylint: disable=C0413
+from llama_preprocess_2 import IGNORE_TOKEN_ID, first_fit_decreasing, pack_records
+
+# the columns of the packed records in the README
+PACKED_COLUMNS = ["input_ids", "molecular_mask", "labels", "position_ids"]
+
+
+def _record(length, start):
+    input_ids = np.arange(start, start + length, dtype=np.int32)
+    labels = input_ids.copy()
+    labels[:2] = IGNORE_TOKEN_ID
+    return dict(input_ids=input_ids, labels=labels)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_first_fit_decreasing():
+    """
+    Feature: first_fit_decreasing.
+    Description: Pack items into bins of a capacity.
+    Expectation: Every item is in one bin, the bins are not overfull and are the ones of first-fit-decreasing.
+    """
+    rng = np.random.RandomState(0)
+    lengths = list(rng.randint(1, 11, size=200))
+    bins = first_fit_decreasing(lengths, 10)
+    assert sorted(index for indices in bins for index in indices) == list(range(200))
+    assert all(sum(lengths[index] for index in indices) <= 10 for indices in bins)
+
+    expected = []
+    for index in np.argsort(-np.asarray(lengths), kind="stable"):
+        for indices in expected:
+            if sum(lengths[i] for i in indices) + lengths[index] <= 10:
+                indices.append(index)
+                break
+        else:
+            expected.append([index])
+    assert bins == expected
+    assert first_fit_decreasing([7, 4, 3, 6], 10) == [[0, 2], [3, 1]]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_pack_records():
+    """
+    Feature: pack_records and get_compact_data_batch_slice_map.
+    Description: Pack conversations into sequences and get the columns of the packed sequences.
+    Expectation: The labels and position ids are aligned with the tokens of every conversation, the columns are
+        the packed ones.
+    """
+    records = [_record(6, 100), _record(3, 200), _record(4, 300), _record(2, 400)]
+    packed, pad_fraction = pack_records(records, 9, pad_token_id=0)
+    assert len(packed) == 2
+    assert pad_fraction == pytest.approx(1 - 15 / 18)
+
+    # [6, 3] and [4, 2]
+    first = packed[0]
+    assert first["input_ids"].tolist() == list(range(100, 106)) + list(range(200, 203))
+    assert first["labels"].tolist() == records[0]["labels"].tolist() + records[1]["labels"].tolist()
+    assert first["position_ids"].tolist() == [0, 1, 2, 3, 4, 5, 0, 1]
+    second = packed[1]
+    assert second["input_ids"].tolist() == list(range(300, 304)) + [400, 401, 0, 0, 0]
+    assert second["labels"][6:].tolist() == [IGNORE_TOKEN_ID] * 3
+    assert second["position_ids"].tolist() == [0, 1, 2, 3, 0, 1, 0, 0]
+    assert second["molecular_mask"].shape == (8,)
+
+    columns = [np.stack([record[name] for record in packed]) for name in PACKED_COLUMNS]
+    outputs = get_compact_data_batch_slice_map(*columns, input_columns=PACKED_COLUMNS, output_columns=PACKED_COLUMNS,
+                                               eod_token_id=2, dis=2)
+    assert all(np.array_equal(output, column) for output, column in zip(outputs, columns))
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_compact_eod_reset():
+    """
+    Feature: get_compact_data_batch_slice_map.
+    Description: Get the position ids of the documents separated by <EOD> without the attention mask.
+    Expectation: The position ids are the ones of get_input_data_batch_slice_map, whose attention mask is the
+        causal mask of the documents.
+    """
+    rng = np.random.RandomState(0)
+    input_ids = rng.randint(0, 6, size=(4, 33))
+    _, position_ids, attention_mask = get_input_data_batch_slice_map(input_ids, eod_token_id=5, dis=2, rank_id=1)
+    ids, compact_position_ids = get_compact_data_batch_slice_map(
+        input_ids, input_columns=["input_ids"], output_columns=["input_ids", "position_ids"], eod_token_id=5,
+        dis=2, rank_id=1)
+    assert np.array_equal(ids, input_ids[2:])
+    assert compact_position_ids.dtype == np.int32 and compact_position_ids.shape == (2, 32)
+    assert np.array_equal(compact_position_ids, position_ids)
+    for mask, positions in zip(attention_mask, position_ids):
+        starts = np.flatnonzero(positions == 0).tolist() + [32]
+        expected = np.zeros((32, 32))
+        for start, end in zip(starts[:-1], starts[1:]):
+            expected[start:end, start:end] = np.tril(np.ones((end - start, end - start)))
+        assert np.array_equal(mask, expected)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_packed_training_loss(tmp_path):
+    """
+    Feature: LlamaForCausalLM with the position ids of the packed documents.
+    Description: Compute the training loss of two documents packed in a sequence, fed by the packed dataset
+        columns, and of every document alone.
+    Expectation: The documents do not attend to each other, the loss of the packed sequence is the average of the
+        losses of the documents weighted by their labels.
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, batch_size=1, seq_length=16)
+    model.set_train(True)
+    molecular_mask = Tensor(np.zeros((1, 16), np.float32))
+    rng = np.random.RandomState(0)
+    records = [_record(7, 0), _record(6, 0)]
+    for record in records:
+        record["input_ids"] = rng.randint(3, 64, len(record["input_ids"])).astype(np.int32)
+        record["labels"] = record["input_ids"].copy()
+        record["labels"][0] = IGNORE_TOKEN_ID
+    packed, _ = pack_records(records, 17)
+    assert len(packed) == 1
+    # the output columns of the dataset are the inputs of the model in order
+    columns = get_compact_data_batch_slice_map(*[packed[0][name][None] for name in PACKED_COLUMNS],
+                                               input_columns=PACKED_COLUMNS, output_columns=PACKED_COLUMNS,
+                                               eod_token_id=2, dis=1)
+    loss = model(*[Tensor(column) for column in columns])
+
+    expected = 0
+    for record in records:
+        single, _ = pack_records([record], 17)
+        single_loss = model(Tensor(single[0]["input_ids"][None]), molecular_mask,
+                            Tensor(single[0]["labels"][None]))
+        expected += single_loss.asnumpy() * (len(record["input_ids"]) - 1) / 11
+    assert np.allclose(loss.asnumpy(), expected, atol=1e-5)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_packed_dataset_pad_fraction(tmp_path):
+    """
+    Feature: CausalLanguageModelDataset with eod_reset.
+    Description: Build the dataset of the packed sequences of a MindRecord file.
+    Expectation: The pad fraction of the dataset is the one of pack_records, all the batches are still produced.
+    """
+    rng = np.random.RandomState(0)
+    records = [_record(length, 3) for length in rng.randint(3, 10, size=12)]
+    packed, pad_fraction = pack_records(records, 17)
+    dataset_path = os.path.join(tmp_path, "packed.mindrecord")
+    writer = FileWriter(file_name=dataset_path, shard_num=1)
+    writer.add_schema({name: {"type": "float32" if name == "molecular_mask" else "int32", "shape": [-1]}
+                       for name in PACKED_COLUMNS}, "packed")
+    writer.write_raw_data(packed)
+    writer.commit()
+
+    config = MindFormerConfig(data_loader=dict(type="MindDataset", dataset_dir=dataset_path, shuffle=False),
+                              input_columns=PACKED_COLUMNS, output_columns=PACKED_COLUMNS, batch_size=2,
+                              drop_remainder=False, repeat=1, eod_reset=True, eod_token_id=2, pad_token_id=0,
+                              seed=0, prefetch_size=1, numa_enable=False)
+    dataset = CausalLanguageModelDataset(config)
+    # the pad fraction of the input tokens, the last token of every sequence is only a label
+    expected = np.mean([record["input_ids"][:-1] == 0 for record in packed])
+    assert dataset.pad_fraction == pytest.approx(expected)
+    assert dataset.pad_fraction == pytest.approx(pad_fraction, abs=1 / 17)
+    batches = list(dataset.create_tuple_iterator(num_epochs=1, output_numpy=True))
+    assert sum(len(batch[0]) for batch in batches) == len(packed)
@@ -0,0 +1,77 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test the sparse expert execution of the llama feed forward."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+from mindspore import Tensor, ops
+
+from mindformers.models.llama.llama_layer import LlamaFeedForward
+
+
+def build_feed_forward(patterns, **kwargs):
+    return LlamaFeedForward(dim=64, hidden_dim=256, multiple_of=16, compute_dtype=ms.float32,
+                            param_init_type=ms.float32, layer_id=0, patterns=patterns, **kwargs)
+
+
+def copy_params(source, target):
+    target_params = dict(target.parameters_and_names())
+    for name, param in source.parameters_and_names():
+        target_params[name].set_data(param.data)
+
+
+def union_routing_output(feed_forward, x, molecular_mask):
+    """the feed forward of the union routing of the baseline, with the top-k of the layer."""
+    x2d = x.reshape(-1, 64)
+    hidden_states = (feed_forward.w3(x2d) * feed_forward.w1(x2d)).asnumpy()
+    patterns = feed_forward.patterns.asnumpy()
+    mask = molecular_mask.asnumpy().reshape(-1, 1).astype(np.float32)
+    score = Tensor(hidden_states @ patterns.T)
+    topk_molecular = ops.TopK()(score * Tensor(mask), 2)[1].asnumpy()
+    topk_text = ops.TopK()(score * Tensor(1 - mask), 14)[1].asnumpy()
+    cur_mask = (patterns[topk_molecular].sum(-2) + patterns[topk_text].sum(-2)) > 0
+    return (hidden_states * cur_mask) @ feed_forward.w2.weight.asnumpy().T
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+@pytest.mark.parametrize("use_expert_router", [False, True])
+@pytest.mark.parametrize("exclusive_expert_routing", [False, True])
+def test_sparse_ffn_scattered_patterns(use_expert_router, exclusive_expert_routing):
+    """
+    Feature: Test the sparse expert execution of LlamaFeedForward
+    Description: Run the masked and the sparse feed forward with the same weights over experts whose neurons are
+        scattered over the hidden dim, with the dense scores or the router, with the union or the exclusive routing
+    Expectation: The sparse output is the masked output, the default masked output is the one of the union routing
+    """
+    ms.set_context(mode=ms.PYNATIVE_MODE, device_target="CPU")
+    np.random.seed(0)
+    # 176 hidden neurons in 16 experts of 11 scattered neurons
+    patterns = np.random.permutation(np.arange(176) % 16)[None, :] == np.arange(16)[:, None]
+    kwargs = dict(use_expert_router=use_expert_router, exclusive_expert_routing=exclusive_expert_routing)
+    masked = build_feed_forward(patterns, **kwargs)
+    sparse = build_feed_forward(patterns, use_sparse_ffn=True, **kwargs)
+    assert sparse.expert_blocks is None
+    copy_params(masked, sparse)
+
+    x = Tensor(np.random.randn(2, 8, 64).astype(np.float32))
+    molecular_mask = Tensor(np.random.randint(0, 2, (2, 8)), ms.int32)
+    masked_output = masked(x, molecular_mask).asnumpy()
+    assert np.allclose(sparse(x, molecular_mask).asnumpy(), masked_output, rtol=1e-5, atol=1e-5)
+    if not use_expert_router and not exclusive_expert_routing:
+        expected = union_routing_output(masked, x, molecular_mask)
+        assert np.allclose(masked_output.reshape(-1, 64), expected, rtol=1e-5, atol=1e-5)
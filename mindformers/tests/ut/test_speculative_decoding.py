@@ -0,0 +1,151 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""test speculative decoding."""
+import numpy as np
+import pytest
+
+import mindspore as ms
+
+from mindformers.generation import LogitsProcessorList, PromptLookupProposer, SmilesGrammarLogitsProcessor, \
+    SpeculativeStats
+
+from .utils import copy_weights, tiny_llama
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_speculative_stats():
+    """
+    Feature: Test SpeculativeStats
+    Description: Count the draft tokens of two verification steps
+    Expectation: The acceptance rate and the tokens per step are the ones of the counted tokens
+    """
+    stats = SpeculativeStats()
+    stats.update(8, 6, 8)
+    stats.update(8, 1, 3)
+    assert stats.stats() == {"steps": 2, "proposed_tokens": 16, "accepted_tokens": 7,
+                             "acceptance_rate": 7 / 16, "tokens_per_step": 5.5}
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_speculative_generate(tmp_path):
+    """
+    Feature: Test speculative decoding of LlamaForCausalLM
+    Description: Generate a batch of prompts with a draft model of one layer and with a draft model having the
+        weights of the model, with the molecular mask and the SMILES grammar of a molecular token range
+    Expectation: The outputs are the ones of greedy decoding, all the tokens of the same draft model are accepted,
+        sampling with a draft model raises a ValueError
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, use_past=True)
+    draft_model = tiny_llama(tmp_path, num_layers=1, use_past=True)
+    same_draft_model = copy_weights(model, tiny_llama(tmp_path, use_past=True))
+
+    np.random.seed(0)
+    # the prompts are padded with the pad token 0 to the same length
+    prompts = [np.random.randint(3, 64, 9).tolist(), np.random.randint(3, 64, 5).tolist() + [0] * 4]
+    smiles_vocab = {"{|" + char + "|}": 40 + index for index, char in enumerate("C1(O)c=N2[H]+-")}
+    # the grammar processor keeps the parser states of the tokens it has seen, the rejected drafts are not seen
+    generate_kwargs = dict(max_new_tokens=[12, 20], eos_token_id=-1, modality_ranges=[[40, 64]],
+                           logits_processor=LogitsProcessorList([SmilesGrammarLogitsProcessor(smiles_vocab)]))
+    expected = model.generate(prompts, do_sample=False, **generate_kwargs)
+    assert [len(output) for output in expected] == [21, 25]
+
+    for num_draft_tokens in (1, 3):
+        outputs = model.generate(prompts, draft_model=draft_model, num_draft_tokens=num_draft_tokens,
+                                 do_sample=False, **generate_kwargs)
+        assert [list(output) for output in outputs] == [list(output) for output in expected]
+        stats = model.speculative_stats.stats()
+        assert stats["steps"] > 0 and stats["accepted_tokens"] <= stats["proposed_tokens"]
+
+    # the drafts are not masked by the grammar, the drafts of the same model are the greedy tokens without it
+    generate_kwargs.pop("logits_processor")
+    expected = model.generate(prompts, do_sample=False, **generate_kwargs)
+    outputs = model.generate(prompts, draft_model=same_draft_model, num_draft_tokens=3, do_sample=False,
+                             **generate_kwargs)
+    assert [list(output) for output in outputs] == [list(output) for output in expected]
+    stats = model.speculative_stats.stats()
+    assert stats["acceptance_rate"] == 1.0 and stats["tokens_per_step"] > 3
+    # the drafts are only verified against the greedy tokens
+    with pytest.raises(ValueError):
+        model.generate(prompts, draft_model=draft_model, do_sample=True, **generate_kwargs)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_prompt_lookup_proposer():
+    """
+    Feature: Test PromptLookupProposer
+    Description: Propose the tokens of sequences whose suffixes are in their prompts, in their generated tokens or
+        nowhere
+    Expectation: The tokens after the longest suffix found are proposed, first in the prompt then in the generated
+        tokens
+    """
+    input_ids = np.zeros((3, 16), np.int32)
+    input_ids[0, :10] = [5, 6, 7, 8, 9, 6, 7, 10, 11, 6]
+    input_ids[1, :6] = [3, 4, 5, 6, 7, 8]
+    input_ids[2, :4] = [3, 4, 5, 6]
+    proposer = PromptLookupProposer(num_tokens=3, max_ngram_size=2)
+    proposer.prefill(input_ids, np.array([10, 6, 4]))
+
+    # 6 7 is in the prompt at 1 and 5, 7 follows 6 first
+    input_ids[0, 10] = 7
+    input_ids[1, 6:10] = [9, 12, 9, 12]
+    input_ids[2, 4] = 13
+    proposals, num_proposed = proposer.propose(input_ids, np.array([11, 10, 5]))
+    assert num_proposed.tolist() == [3, 2, 0]
+    assert proposals[0].tolist() == [8, 9, 6]
+    # 9 12 is generated at 6
+    assert proposals[1, :2].tolist() == [9, 12]
+
+    # 14 9 is not found, the last 9 generated before is followed by 14 9
+    input_ids[1, 10:13] = [9, 14, 9]
+    proposals, num_proposed = proposer.propose(input_ids, np.array([11, 13, 5]))
+    assert num_proposed[1] == 2 and proposals[1, :2].tolist() == [14, 9]
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_prompt_lookup_generate(tmp_path):
+    """
+    Feature: Test speculative decoding of LlamaForCausalLM without a draft model
+    Description: Generate a batch of prompts with repeated spans by copying the tokens after the suffixes found in
+        the prompts and the generated tokens, with the SMILES grammar of a molecular token range
+    Expectation: The outputs are the ones of greedy decoding, some of the copied tokens are accepted, sampling
+        raises a ValueError
+    """
+    ms.set_context(mode=ms.GRAPH_MODE, device_target="CPU")
+    model = tiny_llama(tmp_path, seq_length=48, use_past=True)
+    np.random.seed(1)
+    span = np.random.randint(3, 64, 6).tolist()
+    prompts = [span + np.random.randint(3, 64, 3).tolist() + span[:2],
+               np.random.randint(3, 64, 5).tolist() + span[:3] + [0] * 3]
+    smiles_vocab = {"{|" + char + "|}": 40 + index for index, char in enumerate("C1(O)c=N2[H]+-")}
+    for max_ngram_size in (1, 3):
+        generate_kwargs = dict(max_new_tokens=[24, 30], eos_token_id=-1, modality_ranges=[[40, 64]],
+                               logits_processor=LogitsProcessorList([SmilesGrammarLogitsProcessor(smiles_vocab)]))
+        expected = model.generate(prompts, do_sample=False, **generate_kwargs)
+        outputs = model.generate(prompts, prompt_lookup_num_tokens=4, max_matching_ngram_size=max_ngram_size,
+                                 do_sample=False, **generate_kwargs)
+        assert [list(output) for output in outputs] == [list(output) for output in expected]
+        stats = model.speculative_stats.stats()
+        assert stats["steps"] > 0 and 0 < stats["accepted_tokens"] <= stats["proposed_tokens"]
+    with pytest.raises(ValueError):
+        model.generate(prompts, prompt_lookup_num_tokens=4, do_sample=True, **generate_kwargs)
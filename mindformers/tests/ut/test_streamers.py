@@ -15,8 +15,10 @@
 """test generation.streamer schedule."""
 
 from threading import Thread
+import numpy as np
 import pytest
 from mindformers import GPT2LMHeadModel, GPT2Tokenizer, TextStreamer, TextIteratorStreamer
+from mindformers.generation import IncrementalDetokenizer
 
 
 @pytest.mark.level0
@@ -66,3 +68,39 @@ def test_text_iterator_streamer_schedule():
         generated_text = "".join([generated_text, new_text])
 
     assert generated_text == "An increasing sequence: one, two, three, four, five, six, seven, eight,"
+
+
+class CollectStreamer(TextStreamer):
+    """a text streamer keeping the new text of every step."""
+    def __init__(self, tokenizer, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.texts = []
+
+    def on_finalized_text(self, text, stream_end=False):
+        self.texts.append(text)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_text_streamer_batch():
+    """
+    Feature: Test TextStreamer with a batch
+    Description: Stream the tokens of two sequences of different lengths, token by token
+    Expectation: The text streamed for every sequence is the decoded sequence, the window of tokens stays small
+    """
+    tok = GPT2Tokenizer.from_pretrained("gpt2")
+    sequences = [tok("An increasing sequence: one, two, three, four, five.")["input_ids"],
+                 tok("Ethanol is a primary alcohol, 乙醇 in Chinese.")["input_ids"]]
+    streamer = CollectStreamer(tok, skip_prompt=True)
+    streamer.put([np.array([0]), np.array([0])])
+    for step in range(max(len(sequence) for sequence in sequences)):
+        streamer.put([np.array(sequence[step:step + 1]) for sequence in sequences])
+        assert max(len(detokenizer.tokens) for detokenizer in streamer.detokenizers) <= 8
+    streamer.end()
+    for row, sequence in enumerate(sequences):
+        assert "".join(texts[row] for texts in streamer.texts) == tok.decode(sequence)
+
+    detokenizer = IncrementalDetokenizer(tok)
+    text = "".join(detokenizer.put([token]) for token in sequences[1])
+    assert text + detokenizer.end() == tok.decode(sequences[1])
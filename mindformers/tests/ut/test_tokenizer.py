@@ -15,8 +15,10 @@
 """ test tokenizer """
 
 # import os
+import random
 import pytest
 from mindformers import AutoTokenizer
+from mindformers.models.base_tokenizer import TokenMatcher, Trie
 
 
 @pytest.mark.level0
@@ -86,3 +88,29 @@ def test_all_tokenizers():
         # if not os.path.exists(path):
         #     os.mkdir(path)
         # tokenizer.save_vocabulary(path, tokenizer_item)
+
+
+@pytest.mark.level0
+@pytest.mark.platform_x86_cpu
+@pytest.mark.env_onecard
+def test_token_matcher():
+    """
+    Feature: Test TokenMatcher.
+    Description: Split random texts on random added tokens, and SMILES written with the {|X|} tokens
+    Expectation: The splits are the same as Trie.split
+    """
+    random.seed(0)
+    for _ in range(2000):
+        alphabet = "abc d"[:random.randint(2, 5)]
+        words = ["".join(random.choice(alphabet) for _ in range(random.randint(1, 4)))
+                 for _ in range(random.randint(0, 6))]
+        text = "".join(random.choice(alphabet) for _ in range(random.randint(0, 20)))
+        trie = Trie()
+        for word in words:
+            trie.add(word)
+        assert TokenMatcher(words).split(text) == trie.split(text), (words, text)
+
+    matcher = TokenMatcher(["{|C|}", "{|(|}", "{|=|}", "{|O|}", "{|)|}", "<s>"])
+    assert matcher.split("<s>{|C|}{|(|}{|=|}{|O|}{|)|}{|O|} is acetic acid") == \
+        ["<s>", "{|C|}", "{|(|}", "{|=|}", "{|O|}", "{|)|}", "{|O|}", " is acetic acid"]
+    assert matcher.split_batch(["CC{|C|}", "", "{|N|}"]) == [["CC", "{|C|}"], [], ["{|N|}"]]
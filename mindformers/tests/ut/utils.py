@@ -0,0 +1,90 @@
+# Copyright 2023 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""helpers shared by the UT."""
+import os
+
+import numpy as np
+
+import mindspore as ms
+from mindspore import Tensor
+
+from mindformers import LlamaConfig, LlamaForCausalLM
+from mindformers.generation import BlockManager
+from mindformers.models.llama.expert_patterns import save_random_expert_patterns
+
+VOCAB_SIZE = 50
+
+
+def tiny_llama(tmp_path, **overrides):
+    """
+    a float32 LlamaForCausalLM of 2 layers, 64 hidden units and 64 tokens, whose random expert patterns of 16 experts
+    are saved in `tmp_path`. `overrides` update the LlamaConfig arguments.
+    """
+    kwargs = dict(batch_size=2, seq_length=32, vocab_size=64, hidden_size=64, num_layers=2, num_heads=4, multiple_of=16,
+                  compute_dtype="float32", layernorm_compute_type="float32", softmax_compute_type="float32",
+                  rotary_dtype="float32", param_init_type="float32")
+    kwargs.update(overrides)
+    if "expert_patterns_path" not in kwargs:
+        num_layers, hidden_size = kwargs["num_layers"], kwargs["hidden_size"]
+        patterns_path = os.path.join(tmp_path, f"expert_patterns_{num_layers}_{hidden_size}.bin")
+        # the models of a test share the patterns
+        if not os.path.exists(patterns_path):
+            save_random_expert_patterns(patterns_path, num_layers, hidden_size, 16)
+        kwargs["expert_patterns_path"] = patterns_path
+    return LlamaForCausalLM(LlamaConfig(**kwargs))
+
+
+def copy_weights(src_model, dst_model):
+    """load the weights of `src_model` into `dst_model`, the kv caches are not copied."""
+    ms.load_param_into_net(dst_model, {name: ms.Parameter(Tensor(param.asnumpy()), name=name)
+                                       for name, param in src_model.parameters_and_names() if "_past" not in name})
+    return dst_model
+
+
+def reference(prompt, max_new_tokens):
+    """the output of the cache runners, every next token is the sum of the sequence."""
+    sequence = list(prompt)
+    while len(sequence) < len(prompt) + max_new_tokens:
+        sequence.append(sum(sequence) % VOCAB_SIZE)
+    return sequence
+
+
+class PagedCacheRunner:
+    """a runner keeping the tokens in a paged cache, the next token is the sum of the cached tokens."""
+    def __init__(self, num_blocks, block_size=4, batch_size=3, seq_length=32):
+        self.batch_size = batch_size
+        self.seq_length = seq_length
+        self.block_manager = BlockManager(num_blocks, block_size, batch_size, seq_length)
+        self.cache = np.zeros(num_blocks * block_size, np.int64)
+
+    def _logits(self, rows, valid_length):
+        block_size = self.block_manager.block_size
+        block_tables = self.block_manager.block_tables()
+        logits = np.zeros((self.batch_size, VOCAB_SIZE), np.float32)
+        for row in rows:
+            slots = (block_tables[row][:, None] * block_size + np.arange(block_size)).reshape(-1)
+            logits[row, self.cache[slots][:valid_length[row]].sum() % VOCAB_SIZE] = 1
+        return logits
+
+    def prefill(self, input_ids, molecular_mask, valid_length):
+        _ = molecular_mask
+        self.cache[self.block_manager.prefill_slot_mapping(valid_length, self.seq_length)] = input_ids.reshape(-1)
+        return self._logits(np.flatnonzero(valid_length), valid_length)
+
+    def decode(self, input_ids, molecular_mask, valid_length):
+        _ = molecular_mask
+        self.cache[self.block_manager.slot_mapping(valid_length - 1)] = input_ids[:, 0]
+        rows = [row for row, table in enumerate(self.block_manager.tables) if table]
+        return self._logits(rows, valid_length)